@@ -0,0 +1,135 @@
+"""
+Asynchronous activity-log writer.
+
+record() stamps an entry with the current local time and queues it. It
+returns without touching SQLite. A background thread writes queued entries
+to activity_logs in batches, one transaction per batch, at most
+FLUSH_INTERVAL seconds after the first entry of the batch arrived, so
+write requests no longer pay for a second commit.
+
+Readers that must see everything recorded so far (the admin activity log and
+user stats) call flush(), which asks the writer to write immediately and waits
+for it. The queue is drained on interpreter shutdown.
+"""
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+
+from database import get_db
+
+FLUSH_INTERVAL = 1.0
+MAX_BATCH = 500
+
+_INSERT = '''INSERT INTO activity_logs (user_id, action, entity_type, entity_id, description, ip_address, created_at)
+             VALUES (?,?,?,?,?,?,?)'''
+
+_FLUSH = object()
+_STOP = object()
+
+_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def record(user_id, action, entity_type='', entity_id=None, description='', ip_address=''):
+    """Queue one activity_logs row; created_at is taken now, not when it is written."""
+    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    _ensure_writer()
+    _queue.put((user_id, action, entity_type or '', entity_id, description or '', ip_address or '', created_at))
+
+
+def flush(timeout=5.0):
+    """Write everything queued so far. Returns False if the writer did not finish within timeout."""
+    if _writer is None:
+        return True
+    done = threading.Event()
+    _queue.put((_FLUSH, done))
+    return done.wait(timeout)
+
+
+def shutdown(timeout=5.0):
+    """Drain the queue and stop the writer thread."""
+    global _writer
+    with _writer_lock:
+        writer = _writer
+        _writer = None
+    if writer is not None and writer.is_alive():
+        _queue.put((_STOP, None))
+        writer.join(timeout)
+
+
+atexit.register(shutdown)
+
+
+# ─── Writer thread ──────────────────────────────────────────────
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run, name='activity-log-writer', daemon=True)
+            _writer.start()
+
+
+def _write(batch):
+    for attempt in (1, 2):
+        try:
+            conn = get_db()
+            try:
+                conn.executemany(_INSERT, batch)
+                conn.commit()
+            finally:
+                conn.close()
+            return
+        except Exception as e:
+            if attempt == 2:
+                print(f"Activity log: dropped {len(batch)} entries: {e}")
+            else:
+                time.sleep(0.5)
+
+
+def _run():
+    while True:
+        batch, waiters, stop = [], [], False
+        item = _queue.get()
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while True:
+            if item[0] is _FLUSH:
+                waiters.append(item[1])
+                break
+            if item[0] is _STOP:
+                stop = True
+                break
+            batch.append(item)
+            if len(batch) >= MAX_BATCH:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = _queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        if stop or waiters:
+            # Take everything else already queued so flush/stop cover it too
+            while True:
+                try:
+                    item = _queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item[0] is _FLUSH:
+                    waiters.append(item[1])
+                elif item[0] is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+        if batch:
+            _write(batch)
+        for w in waiters:
+            w.set()
+        if stop:
+            return
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for, g
+from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for, g, Response, stream_with_context
 from functools import wraps
 import json
 import os
@@ -12,11 +12,26 @@ from email import encoders
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 load_dotenv()
-from database import init_db, get_db, build_snapshot, save_snapshot, restore_snapshot, get_job_data
+from database import init_db, get_db, build_snapshot, restore_snapshot, get_job_data, load_job_bundle, release_request_db, request_db_stats
+from job_versions import save_snapshot, load_version, diff_versions
 from chatbot_engine import generate_bot_response
-from claude_chatbot import generate_claude_response
+from claude_chatbot import generate_claude_response, invalidate_tool_cache
 from duplicate_detector import check_duplicate
 from tax_rates import lookup_tax
+import event_bus
+from notifications import notify_many, notify_batch
+import activity_log
+import job_queue
+import plan_index
+import plan_render
+import weather
+import scheduling
+import schedule_notifications
+import search_index
+import invoice_lines
+import pay_app_rollups
+import pdf_render
+import photo_derivatives
 from werkzeug.security import check_password_hash, generate_password_hash
 import subprocess, tempfile
 try:
@@ -28,27 +43,14 @@ app = Flask(__name__)
 app.config['JSON_SORT_KEYS'] = False
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 app.secret_key = os.environ.get('SECRET_KEY', 'construction-mgmt-secret-key-change-in-prod')
+# Set DB_STATS_HEADERS=1 to report per-request connection/query counts in response headers
+app.config['DB_STATS_HEADERS'] = os.environ.get('DB_STATS_HEADERS') == '1'
 
-# Initialize DB on import (needed for gunicorn)
-init_db()
+# One pooled SQLite connection per request (see database.get_db)
+app.teardown_appcontext(release_request_db)
 
-# One-time backfill: set tax rates from zip codes for existing projects
-def _backfill_tax_rates():
-    conn = get_db()
-    jobs = conn.execute("SELECT id, zip_code FROM jobs WHERE (tax_rate IS NULL OR tax_rate = 0) AND zip_code IS NOT NULL AND zip_code != ''").fetchall()
-    updated = 0
-    for job in jobs:
-        try:
-            info = lookup_tax(job['zip_code'])
-            if info.get('tax_rate'):
-                conn.execute('UPDATE jobs SET tax_rate = ? WHERE id = ?', (info['tax_rate'], job['id']))
-                updated += 1
-        except Exception:
-            pass
-    if updated:
-        conn.commit()
-    conn.close()
-_backfill_tax_rates()
+# Initialize DB on import (needed for gunicorn): pending migrations and changed seeds only
+init_db()
 
 @app.after_request
 def add_no_cache_headers(response):
@@ -58,6 +60,17 @@ def add_no_cache_headers(response):
         response.headers['Expires'] = '0'
     return response
 
+@app.after_request
+def add_db_stats_headers(response):
+    # Registered before _auto_log_activity so its query is included in the counts
+    if app.config['DB_STATS_HEADERS']:
+        stats = request_db_stats()
+        if stats:
+            response.headers['X-DB-Connections'] = str(stats['connections_opened'])
+            response.headers['X-DB-Get-Calls'] = str(stats['get_db_calls'])
+            response.headers['X-DB-Queries'] = str(stats['queries'])
+    return response
+
 # Cache-busting version for static files — changes on each server restart
 import time as _time
 _static_version = str(int(_time.time()))
@@ -148,6 +161,42 @@ _ROUTE_ENTITY_MAP = {
 
 _SKIP_PREFIXES = ('/api/heartbeat', '/api/notifications', '/static', '/api/chat', '/login', '/logout', '/change-password')
 
+def _route_entity(path):
+    """(entity_type, entity_id) for an API path, from _ROUTE_ENTITY_MAP; ('', None) if unmapped."""
+    for prefix, etype in _ROUTE_ENTITY_MAP.items():
+        if path.startswith(prefix):
+            remainder = path[len(prefix):].strip('/')
+            first_segment = remainder.split('/')[0] if remainder else ''
+            return etype, int(first_segment) if first_segment.isdigit() else None
+    return '', None
+
+# Sub-routes whose chatbot tool entity is narrower than their activity-log type
+_CHAT_ENTITY_MAP = {
+    '/api/accounting/expenses': 'expense', '/api/accounting/payments': 'payment',
+    '/api/accounting/invoices': 'invoice', '/api/expenses/recurring': 'recurring_expense',
+}
+
+def _chat_cache_entity(path):
+    """Entity type a write to path is confined to, or None when it may touch others.
+
+    Only plain CRUD on a mapped collection (/prefix or /prefix/<id>) counts;
+    actions such as /api/bids/<id>/award write other tables too.
+    """
+    for prefix, etype in list(_CHAT_ENTITY_MAP.items()) + list(_ROUTE_ENTITY_MAP.items()):
+        if path.startswith(prefix):
+            remainder = path[len(prefix):].strip('/')
+            return etype if not remainder or remainder.isdigit() else None
+    return None
+
+@app.after_request
+def _invalidate_chat_tool_cache(response):
+    """A successful write may change what the chatbot's cached tool results say."""
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400 \
+            and not any(request.path.startswith(p) for p in _SKIP_PREFIXES):
+        # None drops the whole cache
+        invalidate_tool_cache(_chat_cache_entity(request.path))
+    return response
+
 @app.after_request
 def _auto_log_activity(response):
     if request.method not in ('POST', 'PUT', 'DELETE'):
@@ -167,32 +216,11 @@ def _auto_log_activity(response):
         if suffix in parts:
             action = act
             break
-    # Determine entity_type and entity_id
-    entity_type, entity_id = '', None
-    for prefix, etype in _ROUTE_ENTITY_MAP.items():
-        if path.startswith(prefix):
-            entity_type = etype
-            remainder = path[len(prefix):].strip('/')
-            if remainder:
-                first_segment = remainder.split('/')[0]
-                if first_segment.isdigit():
-                    entity_id = int(first_segment)
-            break
+    entity_type, entity_id = _route_entity(path)
     desc = f"{action.replace('_', ' ').title()} {entity_type.replace('_', ' ')}"
     if entity_id:
         desc += f" #{entity_id}"
-    try:
-        from database import get_db as _gdb
-        conn = _gdb()
-        conn.execute(
-            '''INSERT INTO activity_logs (user_id, action, entity_type, entity_id, description, ip_address)
-               VALUES (?,?,?,?,?,?)''',
-            (session['user_id'], action, entity_type, entity_id, desc, request.remote_addr or '')
-        )
-        conn.commit()
-        conn.close()
-    except Exception:
-        pass
+    activity_log.record(session['user_id'], action, entity_type, entity_id, desc, request.remote_addr or '')
     return response
 
 # ─── PWA / Icon Routes ────────────────────────────────────────────
@@ -295,18 +323,10 @@ def api_dashboard():
     total_invoiced = conn.execute("SELECT COALESCE(SUM(amount), 0) FROM client_invoices WHERE status = 'Paid'").fetchone()[0]
     total_outstanding = conn.execute("SELECT COALESCE(SUM(amount), 0) FROM client_invoices WHERE status IN ('Sent','Overdue','Partial')").fetchone()[0]
 
-    # Estimated material costs (from bids/line_items)
-    estimated_material_cost = 0
-    for job in jobs:
-        items = conn.execute(
-            'SELECT total_net_price, qty_ordered, price_per FROM line_items WHERE job_id = ?',
-            (job['id'],)
-        ).fetchall()
-        estimated_material_cost += sum(
-            (row['total_net_price'] or 0) if (row['total_net_price'] or 0)
-            else (row['qty_ordered'] or 0) * (row['price_per'] or 0)
-            for row in items
-        )
+    # Estimated material costs (from bids/line_items, via job_rollups)
+    estimated_material_cost = conn.execute(
+        'SELECT COALESCE(SUM(material_cents), 0) / 100.0 FROM job_rollups'
+    ).fetchone()[0]
 
     # Actual material costs (from supplier invoices)
     actual_material_cost = conn.execute(
@@ -366,32 +386,30 @@ def api_dashboard():
     ).fetchall()
 
     # ─── Active Projects with progress ──────────────────────────
+    # One grouped query per metric instead of three queries per active job
+    contract_by_job = {r['job_id']: r['total'] or 0 for r in conn.execute(
+        'SELECT job_id, SUM(original_contract_sum) AS total FROM pay_app_contracts GROUP BY job_id'
+    ).fetchall()}
+    billed_by_job = {r['job_id']: r['total'] or 0 for r in conn.execute('''
+        SELECT pac.job_id, SUM(r.billed_to_date) AS total
+        FROM pay_app_contract_rollups r
+        JOIN pay_app_contracts pac ON r.contract_id = pac.id
+        GROUP BY pac.job_id
+    ''').fetchall()}
+    pct_by_job = {r['job_id']: r['avg_pct'] for r in conn.execute(
+        "SELECT job_id, AVG(pct_complete) AS avg_pct FROM job_schedule_events WHERE status != 'Cancelled' GROUP BY job_id"
+    ).fetchall()}
     active_project_list = []
     for j in jobs:
         if j['status'] != 'In Progress':
             continue
         jid = j['id']
         # Billing progress from pay apps
-        contract_row = conn.execute(
-            'SELECT COALESCE(SUM(original_contract_sum), 0) as total_contract FROM pay_app_contracts WHERE job_id = ?',
-            (jid,)
-        ).fetchone()
-        billed_row = conn.execute('''
-            SELECT COALESCE(SUM(ple.work_this_period + ple.materials_stored), 0) as total_billed
-            FROM pay_app_line_entries ple
-            JOIN pay_applications pa ON ple.pay_app_id = pa.id
-            JOIN pay_app_contracts pac ON pa.contract_id = pac.id
-            WHERE pac.job_id = ?
-        ''', (jid,)).fetchone()
-        contract_val = contract_row['total_contract'] or 0
-        billed_val = billed_row['total_billed'] or 0
+        contract_val = contract_by_job.get(jid, 0)
+        billed_val = billed_by_job.get(jid, 0)
         pct = round(billed_val / contract_val * 100) if contract_val > 0 else 0
         # Completion % from schedule phases
-        comp_row = conn.execute(
-            "SELECT AVG(pct_complete) as avg_pct FROM job_schedule_events WHERE job_id = ? AND status != 'Cancelled'",
-            (jid,)
-        ).fetchone()
-        pct_complete = round(comp_row['avg_pct'] or 0) if comp_row and comp_row['avg_pct'] else 0
+        pct_complete = round(pct_by_job.get(jid) or 0)
 
         active_project_list.append({
             'id': jid, 'name': j['name'],
@@ -450,8 +468,13 @@ def api_dashboard():
 @app.route('/api/materials/import', methods=['POST'])
 @api_role_required('owner', 'admin', 'project_manager', 'warehouse')
 def api_materials_import():
-    """Import an Excel workbook into line_items (and tracking entries) for a job."""
-    from openpyxl import load_workbook
+    """Import an Excel workbook into line_items (and tracking entries) for a job.
+
+    With form field background=1 the upload is spooled to disk and imported by a
+    'materials_import' background job; the response carries its job_id for
+    /api/background-jobs/<id>.
+    """
+    from materials_import import import_workbook, MaterialsImportError
 
     file = request.files.get('file')
     job_id = request.form.get('job_id')
@@ -464,11 +487,6 @@ def api_materials_import():
     if ext not in ('xlsx', 'xls'):
         return jsonify({'error': 'Please upload an Excel file (.xlsx)'}), 400
 
-    try:
-        wb = load_workbook(file, data_only=True)
-    except Exception as e:
-        return jsonify({'error': f'Could not read Excel file: {str(e)[:200]}'}), 400
-
     conn = get_db()
 
     # Verify job exists
@@ -477,284 +495,25 @@ def api_materials_import():
         conn.close()
         return jsonify({'error': 'Job not found'}), 404
 
-    # Find the master list sheet (try common names, then fall back to first non-tracking sheet)
-    master_sheet = None
-    tracking_names_lower = ['received', 'shipped', 'shipped to site', 'invoiced']
-    for name in ['Master List', 'master list', 'Sheet1', 'Materials', 'Line Items']:
-        if name in wb.sheetnames:
-            master_sheet = wb[name]
-            break
-    if not master_sheet:
-        # Use first sheet that isn't a tracking sheet
-        for name in wb.sheetnames:
-            if name.lower().strip() not in tracking_names_lower:
-                master_sheet = wb[name]
-                break
-    if not master_sheet:
-        master_sheet = wb.active
-
-    # Map header names to DB fields
-    header_aliases = {
-        'line_number': ['line #', 'line', 'line number', 'line no', '#', 'ln', 'no', 'no.'],
-        'stock_ns': ['stock/ns', 'stock', 'stock ns', 'type', 's/ns', 'non-stock', 'nonstock', 'ns'],
-        'sku': ['sku', 'part number', 'part #', 'part no', 'product code', 'item', 'item #',
-                'item no', 'item number', 'catalog', 'catalog #', 'cat #', 'cat no', 'code',
-                'material', 'mat', 'product #', 'product no', 'product number', 'part',
-                'product'],
-        'description': ['description', 'desc', 'item description', 'product', 'product description',
-                        'material description', 'name', 'item name', 'material name',
-                        'desc.', 'descriptions', 'comments'],
-        'quote_qty': ['quote qty', 'quote quantity', 'qty quoted', 'est qty', 'estimated qty',
-                      'est quantity', 'bid qty'],
-        'qty_ordered': ['qty ordered', 'quantity ordered', 'ordered', 'qty', 'quantity',
-                        'order qty', 'order quantity', 'qty.', 'qty on order', 'ship qty',
-                        'qty to ship', 'pieces', 'pcs', 'count', 'units', 'order'],
-        'price_per': ['price per', 'unit price', 'price', 'cost', 'unit cost', 'rate',
-                      'price each', 'each', 'price/unit', 'cost/unit', 'unit', 'sell price',
-                      'sell', 'net price each', 'net each', 'per'],
-        'total_net_price': ['total net price', 'total price', 'order total', 'net price', 'extended',
-                            'ext price', 'amount', 'ext.', 'ext', 'extension', 'line total',
-                            'extended price', 'total cost', 'net total', 'net amount', 'net',
-                            'total', 'quote total'],
-        'notes': ['notes', 'note', 'remarks', 'comments', 'memo'],
-    }
-
-    # Scan first 10 rows for a header row (some files have title rows before headers)
-    header_row = 1
-    headers = {}
-    col_map = {}
-    for try_row in range(1, min(11, master_sheet.max_row + 1)):
-        trial_headers = {}
-        for col in range(1, master_sheet.max_column + 1):
-            val = master_sheet.cell(row=try_row, column=col).value
-            if val:
-                trial_headers[str(val).strip().lower()] = col
-
-        # Check if this row has at least description or sku
-        trial_map = {}
-        for field, aliases in header_aliases.items():
-            for alias in aliases:
-                if alias in trial_headers:
-                    trial_map[field] = trial_headers[alias]
-                    break
-        if 'description' in trial_map or 'sku' in trial_map:
-            headers = trial_headers
-            col_map = trial_map
-            header_row = try_row
-            break
-
-    # Must have at least description or sku to be useful
-    if 'description' not in col_map and 'sku' not in col_map:
-        # Show what headers we found to help debug
-        row1_headers = []
-        for r in range(1, min(4, master_sheet.max_row + 1)):
-            vals = [str(master_sheet.cell(row=r, column=c).value or '') for c in range(1, min(master_sheet.max_column + 1, 15))]
-            row1_headers.append(f'Row {r}: {", ".join(v for v in vals if v)}')
-        found_str = ' | '.join(row1_headers)
+    if request.form.get('background') in ('1', 'true'):
         conn.close()
-        return jsonify({'error': f'Could not find a Description or SKU column. '
-                        f'Found in your file: {found_str}. '
-                        f'Expected headers like: Line #, SKU, Description, Qty, Price Per, Total'}), 400
-
-    # Clear existing line_items for this job (full re-import)
-    existing = conn.execute('SELECT id FROM line_items WHERE job_id = ?', (job_id,)).fetchall()
-    if existing:
-        ids = [str(r['id']) for r in existing]
-        id_list = ','.join(ids)
-        conn.execute(f'DELETE FROM received_entries WHERE line_item_id IN ({id_list})')
-        conn.execute(f'DELETE FROM shipped_entries WHERE line_item_id IN ({id_list})')
-        conn.execute(f'DELETE FROM invoiced_entries WHERE line_item_id IN ({id_list})')
-        conn.execute('DELETE FROM line_items WHERE job_id = ?', (job_id,))
-
-    def safe_num(val):
-        if val is None:
-            return 0
-        if isinstance(val, (int, float)):
-            return val
-        try:
-            return float(str(val).replace('$', '').replace(',', ''))
-        except (ValueError, TypeError):
-            return 0
-
-    # Import line items (start after the header row we found)
-    imported = 0
-    line_id_map = {}  # line_number -> new line_item id
-    for row in range(header_row + 1, master_sheet.max_row + 1):
-        desc = master_sheet.cell(row=row, column=col_map.get('description', 0)).value if 'description' in col_map else ''
-        sku = master_sheet.cell(row=row, column=col_map.get('sku', 0)).value if 'sku' in col_map else ''
-
-        # Skip empty rows
-        if not desc and not sku:
-            continue
-
-        line_num = safe_num(master_sheet.cell(row=row, column=col_map.get('line_number', 0)).value) if 'line_number' in col_map else (imported + 1)
-        if line_num == 0:
-            line_num = imported + 1
-
-        stock_ns = str(master_sheet.cell(row=row, column=col_map.get('stock_ns', 0)).value or '') if 'stock_ns' in col_map else ''
-        quote_qty = safe_num(master_sheet.cell(row=row, column=col_map.get('quote_qty', 0)).value) if 'quote_qty' in col_map else 0
-        qty_ordered = safe_num(master_sheet.cell(row=row, column=col_map.get('qty_ordered', 0)).value) if 'qty_ordered' in col_map else 0
-        price_per = safe_num(master_sheet.cell(row=row, column=col_map.get('price_per', 0)).value) if 'price_per' in col_map else 0
-        total_net = safe_num(master_sheet.cell(row=row, column=col_map.get('total_net_price', 0)).value) if 'total_net_price' in col_map else 0
-        notes = str(master_sheet.cell(row=row, column=col_map.get('notes', 0)).value or '') if 'notes' in col_map else ''
-
-        # Detect per-C or per-M pricing by comparing total to qty * price
-        pricing_type = 'each'
-        qty_for_calc = qty_ordered if qty_ordered > 0 else quote_qty
-        if total_net and price_per and qty_for_calc:
-            simple = qty_for_calc * price_per
-            if simple > 0:
-                ratio = total_net / simple
-                if abs(ratio - 0.01) < 0.003:
-                    pricing_type = 'per_c'
-                elif abs(ratio - 0.001) < 0.0003:
-                    pricing_type = 'per_m'
-
-        # Auto-calc total if missing, using detected pricing type
-        if total_net == 0 and qty_for_calc > 0 and price_per > 0:
-            if pricing_type == 'per_c':
-                total_net = qty_for_calc * price_per / 100
-            elif pricing_type == 'per_m':
-                total_net = qty_for_calc * price_per / 1000
-            else:
-                total_net = qty_for_calc * price_per
-
-        cursor = conn.execute(
-            '''INSERT INTO line_items (job_id, line_number, stock_ns, sku, description,
-               quote_qty, qty_ordered, price_per, total_net_price, pricing_type, notes)
-               VALUES (?,?,?,?,?,?,?,?,?,?,?)''',
-            (job_id, int(line_num), stock_ns, str(sku or ''), str(desc or ''),
-             quote_qty, qty_ordered, price_per, total_net, pricing_type, notes)
-        )
-        line_id_map[int(line_num)] = cursor.lastrowid
-        # Also map by description (normalized) for tracking sheets that don't have line numbers
-        desc_key = str(desc or '').strip().lower()
-        if desc_key:
-            line_id_map['desc:' + desc_key] = cursor.lastrowid
-        imported += 1
-
-    # Import tracking entries from Received/Shipped/Invoiced sheets
-    tracking_sheets = {
-        'Received': 'received_entries',
-        'Shipped to Site': 'shipped_entries',
-        'Shipped': 'shipped_entries',
-        'Invoiced': 'invoiced_entries',
-    }
-    for sheet_name, table_name in tracking_sheets.items():
-        if sheet_name not in wb.sheetnames:
-            continue
-        ws = wb[sheet_name]
-
-        # Find the header row (scan first 10 rows for one with known column names)
-        t_header_row = 1
-        t_data_start = 2
-        known_headers = ['description', 'desc', 'line #', 'line', 'sku', 'product',
-                         'qty', 'quantity', 'total', 'item', 'name', 'material']
-        for try_r in range(1, min(11, ws.max_row + 1)):
-            row_vals = [str(ws.cell(row=try_r, column=c).value or '').strip().lower()
-                       for c in range(1, min(ws.max_column + 1, 20))]
-            matches = sum(1 for v in row_vals if v in known_headers or
-                         any(kw in v for kw in ['description', 'qty', 'received', 'shipped', 'invoiced']))
-            if matches >= 2:
-                t_header_row = try_r
-                t_data_start = try_r + 1
-                break
-
-        # Find which column has line numbers and which has descriptions
-        t_headers = {}
-        for c in range(1, min(ws.max_column + 1, 50)):
-            val = ws.cell(row=t_header_row, column=c).value
-            if val:
-                t_headers[str(val).strip().lower()] = c
-
-        line_col = None
-        desc_col = None
-        for alias in ['line #', 'line', 'line number', '#']:
-            if alias in t_headers:
-                line_col = t_headers[alias]
-                break
-        for alias in ['description', 'desc', 'item description', 'product', 'product description', 'name']:
-            if alias in t_headers:
-                desc_col = t_headers[alias]
-                break
-
-        # Find where quantity columns start (after description/totals)
-        qty_start_col = None
-        for c in range(1, min(ws.max_column + 1, 50)):
-            hdr = str(ws.cell(row=t_header_row, column=c).value or '').strip().lower()
-            # Skip "total" summary columns — we want the first actual entry column
-            if 'total' in hdr:
-                continue
-            if any(kw in hdr for kw in ['qty received', 'qty shipped', 'invoice', 'qty 1']):
-                qty_start_col = c
-                break
-        if qty_start_col is None:
-            # Fall back: first column after "total" columns
-            for c in range(3, min(ws.max_column + 1, 50)):
-                hdr = str(ws.cell(row=t_header_row, column=c).value or '').strip().lower()
-                if hdr and ('1' in hdr or 'date' in hdr.lower()):
-                    qty_start_col = c
-                    break
-        if qty_start_col is None:
-            qty_start_col = 3  # default fallback
-
-        # Check row above header for dates (some files put dates in a separate row)
-        date_headers = {}
-        date_row = t_header_row - 1 if t_header_row > 1 else None
-        for col in range(qty_start_col, min(ws.max_column + 1, qty_start_col + 200)):
-            # Check header row first, then row above
-            val = ws.cell(row=t_header_row, column=col).value
-            if date_row and not val:
-                val = ws.cell(row=date_row, column=col).value
-            # Also check row below header for dates
-            if not val and t_data_start <= ws.max_row:
-                check_val = ws.cell(row=t_data_start, column=col).value
-                if hasattr(check_val, 'strftime'):
-                    val = check_val
-                    t_data_start = t_data_start + 1  # dates row, data starts after
-            if val:
-                if hasattr(val, 'strftime'):
-                    date_headers[col] = val.strftime('%Y-%m-%d')
-                else:
-                    date_headers[col] = str(val)
-
-        for row in range(t_data_start, ws.max_row + 1):
-            # Try to match by line number first, then by description
-            line_item_id = None
-            if line_col:
-                line_num_val = safe_num(ws.cell(row=row, column=line_col).value)
-                if line_num_val > 0:
-                    line_item_id = line_id_map.get(int(line_num_val))
-
-            if not line_item_id and desc_col:
-                desc_val = str(ws.cell(row=row, column=desc_col).value or '').strip().lower()
-                if desc_val:
-                    line_item_id = line_id_map.get('desc:' + desc_val)
-
-            # Also try column 1 as description if no line_col/desc_col matched
-            if not line_item_id:
-                desc_val = str(ws.cell(row=row, column=1).value or '').strip().lower()
-                if desc_val:
-                    line_item_id = line_id_map.get('desc:' + desc_val)
-
-            if not line_item_id:
-                continue
-
-            for col in range(qty_start_col, min(ws.max_column + 1, qty_start_col + 200)):
-                qty = safe_num(ws.cell(row=row, column=col).value)
-                if qty == 0:
-                    continue
-                col_number = col - qty_start_col + 1
-                if col_number < 1 or col_number > 200:
-                    continue
-                entry_date = date_headers.get(col, '')
-                conn.execute(
-                    f'''INSERT OR REPLACE INTO {table_name}
-                        (line_item_id, column_number, quantity, entry_date)
-                        VALUES (?,?,?,?)''',
-                    (line_item_id, col_number, qty, entry_date)
-                )
+        fd, tmp_path = tempfile.mkstemp(suffix='.xlsx')
+        with os.fdopen(fd, 'wb') as out:
+            file.save(out)
+        bg_id = job_queue.enqueue('materials_import', {'path': tmp_path, 'job_name': job['name']},
+                                  ref_id=job['id'], created_by=session.get('user_id'), dedupe=False)
+        return jsonify({'ok': True, 'status': 'started', 'job_id': bg_id}), 202
 
+    try:
+        imported = import_workbook(conn, job['id'], file.stream)
+    except MaterialsImportError as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': f'Import failed: {str(e)[:200]}'}), 500
     conn.commit()
     conn.close()
 
@@ -765,6 +524,40 @@ def api_materials_import():
     }), 201
 
 
+def _remove_import_upload(job, _error=None):
+    try:
+        os.remove(job.payload['path'])
+    except (OSError, KeyError, TypeError):
+        pass
+
+
+@job_queue.handler('materials_import', on_fail=_remove_import_upload)
+def _materials_import_job(job):
+    """Background materials import queued by api_materials_import."""
+    from materials_import import import_workbook, MaterialsImportError
+
+    def update(pct, message):
+        job.progress(message=message, pct=pct)
+
+    conn = get_db()
+    try:
+        imported = import_workbook(conn, job.ref_id, job.payload['path'], progress=update)
+        conn.commit()
+    except job_queue.JobCancelled:
+        conn.rollback()
+        raise
+    except MaterialsImportError as e:
+        conn.rollback()
+        raise job_queue.JobFailed(str(e)[:300])
+    except Exception as e:
+        conn.rollback()
+        raise job_queue.JobFailed(f'Import failed: {str(e)[:200]}')
+    finally:
+        conn.close()
+        _remove_import_upload(job)
+    return {'imported': imported, 'message': f"{imported} line items imported for {job.payload['job_name']}"}
+
+
 @app.route('/materials')
 @role_required('owner', 'admin', 'project_manager', 'warehouse', 'supplier')
 def materials_list():
@@ -892,7 +685,11 @@ def delete_job(job_id):
 @api_role_required('owner', 'admin')
 def get_analytics():
     conn = get_db()
-    jobs = conn.execute('SELECT * FROM jobs ORDER BY name').fetchall()
+    jobs = conn.execute('''
+        SELECT j.*, COALESCE(r.material_cents, 0) / 100.0 AS material_subtotal
+        FROM jobs j LEFT JOIN job_rollups r ON r.job_id = j.id
+        ORDER BY j.name
+    ''').fetchall()
 
     stages = ['Needs Bid', 'Bid Complete', 'In Progress', 'Complete']
     result = {}
@@ -905,11 +702,7 @@ def get_analytics():
 
     for job in jobs:
         stage = job['status'] if job['status'] in stages else 'Needs Bid'
-        items = conn.execute(
-            'SELECT total_net_price, qty_ordered, price_per FROM line_items WHERE job_id = ?',
-            (job['id'],)
-        ).fetchall()
-        subtotal = sum((row['total_net_price'] or 0) if (row['total_net_price'] or 0) else (row['qty_ordered'] or 0) * (row['price_per'] or 0) for row in items)
+        subtotal = job['material_subtotal']
         tax_rate = job['tax_rate'] or 0
         tax_amount = round(subtotal * tax_rate / 100, 2)
 
@@ -957,18 +750,18 @@ def get_analytics():
 @api_role_required('owner', 'admin', 'project_manager', 'warehouse')
 def save_line_items(job_id):
     conn = get_db()
-    job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
-    if not job:
+    # One load of the pre-save state serves the job check, the version snapshot and the id list
+    bundle = load_job_bundle(conn, job_id)
+    if not bundle:
         conn.close()
         return jsonify({'error': 'Job not found'}), 404
 
-    save_snapshot(conn, job_id, 'Before master list update')
+    save_snapshot(conn, job_id, 'Before master list update', bundle=bundle)
 
     data = request.get_json()
     items = data.get('line_items', [])
 
-    existing = conn.execute('SELECT id, line_number FROM line_items WHERE job_id = ?', (job_id,)).fetchall()
-    existing_ids = {row['id'] for row in existing}
+    existing_ids = {row['id'] for row in bundle['line_items']}
 
     incoming_ids = set()
     for item in items:
@@ -1042,18 +835,20 @@ def detect_pricing_types(job_id):
 
 def _save_entries(job_id, table_name, data):
     conn = get_db()
-    job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
-    if not job:
+    # One load of the pre-save state serves the job check, the version snapshot
+    # and the existing cells, so each entry costs one write and no lookup
+    bundle = load_job_bundle(conn, job_id)
+    if not bundle:
         conn.close()
         return jsonify({'error': 'Job not found'}), 404
 
     tab_label = table_name.replace('_entries', '')
-    save_snapshot(conn, job_id, f'Before {tab_label} update')
+    save_snapshot(conn, job_id, f'Before {tab_label} update', bundle=bundle)
 
     entries = data.get('entries', [])
 
-    valid_items = conn.execute('SELECT id FROM line_items WHERE job_id = ?', (job_id,)).fetchall()
-    valid_ids = {row['id'] for row in valid_items}
+    valid_ids = {row['id'] for row in bundle['line_items']}
+    existing_cells = {(li_id, col) for li_id, cells in bundle['entries'][tab_label].items() for col in cells}
 
     for entry in entries:
         line_item_id = entry.get('line_item_id')
@@ -1061,29 +856,26 @@ def _save_entries(job_id, table_name, data):
             continue
         column_number = entry.get('column_number')
         quantity = entry.get('quantity', 0) or 0
+        cell = (line_item_id, str(column_number))
 
         if quantity == 0:
             conn.execute(
                 f'DELETE FROM {table_name} WHERE line_item_id = ? AND column_number = ?',
                 (line_item_id, column_number)
             )
+            existing_cells.discard(cell)
+        elif cell in existing_cells:
+            conn.execute(
+                f'UPDATE {table_name} SET quantity = ? WHERE line_item_id = ? AND column_number = ?',
+                (quantity, line_item_id, column_number)
+            )
         else:
-            existing = conn.execute(
-                f'SELECT id, entry_date FROM {table_name} WHERE line_item_id = ? AND column_number = ?',
-                (line_item_id, column_number)
-            ).fetchone()
-
-            if existing:
-                conn.execute(
-                    f'UPDATE {table_name} SET quantity = ? WHERE id = ?',
-                    (quantity, existing['id'])
-                )
-            else:
-                entry_date = datetime.now().strftime('%Y-%m-%d')
-                conn.execute(
-                    f'INSERT INTO {table_name} (line_item_id, column_number, quantity, entry_date) VALUES (?, ?, ?, ?)',
-                    (line_item_id, column_number, quantity, entry_date)
-                )
+            entry_date = datetime.now().strftime('%Y-%m-%d')
+            conn.execute(
+                f'INSERT INTO {table_name} (line_item_id, column_number, quantity, entry_date) VALUES (?, ?, ?, ?)',
+                (line_item_id, column_number, quantity, entry_date)
+            )
+            existing_cells.add(cell)
 
     # Save custom column headers and dates if provided
     tab = table_name.replace('_entries', '')
@@ -1147,7 +939,6 @@ def delete_entry_column(job_id, tab_type, col_num):
         conn.close()
         return jsonify({'error': 'Job not found'}), 404
 
-    from database import save_snapshot
     save_snapshot(conn, job_id, f'Before delete {tab_type} column {col_num}')
 
     # Get all line_item_ids for this job
@@ -1230,32 +1021,51 @@ def list_versions(job_id):
 def get_version(job_id, vid):
     conn = get_db()
     version = conn.execute(
-        'SELECT * FROM versions WHERE id = ? AND job_id = ?', (vid, job_id)
+        'SELECT id, description, created_at FROM versions WHERE id = ? AND job_id = ?', (vid, job_id)
     ).fetchone()
-    conn.close()
     if not version:
+        conn.close()
         return jsonify({'error': 'Version not found'}), 404
+    snapshot = load_version(conn, job_id, vid)
+    conn.close()
     return jsonify({
         'id': version['id'],
         'description': version['description'],
         'created_at': version['created_at'],
-        'snapshot': json.loads(version['snapshot']),
+        'snapshot': snapshot,
     })
 
+@app.route('/api/job/<int:job_id>/versions/<int:vid>/diff')
+@api_login_required
+def diff_version(job_id, vid):
+    """Diff a version against ?against=<vid> (defaults to the version before it)."""
+    conn = get_db()
+    against = request.args.get('against', type=int)
+    if against is None:
+        prev = conn.execute(
+            'SELECT id FROM versions WHERE job_id = ? AND id < ? ORDER BY id DESC LIMIT 1', (job_id, vid)
+        ).fetchone()
+        if not prev:
+            conn.close()
+            return jsonify({'error': 'No earlier version to compare against'}), 404
+        against = prev['id']
+    result = diff_versions(conn, job_id, against, vid)
+    conn.close()
+    if result is None:
+        return jsonify({'error': 'Version not found'}), 404
+    return jsonify(result)
+
 @app.route('/api/job/<int:job_id>/versions/<int:vid>/revert', methods=['POST'])
 @api_role_required('owner', 'admin', 'project_manager')
 def revert_version(job_id, vid):
     conn = get_db()
-    version = conn.execute(
-        'SELECT * FROM versions WHERE id = ? AND job_id = ?', (vid, job_id)
-    ).fetchone()
-    if not version:
+    snapshot_data = load_version(conn, job_id, vid)
+    if snapshot_data is None:
         conn.close()
         return jsonify({'error': 'Version not found'}), 404
 
     save_snapshot(conn, job_id, f'Before revert to version {vid}')
 
-    snapshot_data = json.loads(version['snapshot'])
     restore_snapshot(conn, job_id, snapshot_data)
     conn.commit()
 
@@ -1335,9 +1145,7 @@ def import_pdf(job_id):
 @app.route('/api/job/<int:job_id>/export')
 @api_role_required('owner', 'admin', 'project_manager', 'warehouse', 'supplier')
 def export_excel(job_id):
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
+    from excel_export import build_job_workbook, safe_filename, XLSX_MIMETYPE
 
     conn = get_db()
     data = get_job_data(conn, job_id)
@@ -1345,184 +1153,9 @@ def export_excel(job_id):
     if not data:
         return 'Job not found', 404
 
-    wb = Workbook()
-    thin_border = Border(
-        left=Side(style='thin'), right=Side(style='thin'),
-        top=Side(style='thin'), bottom=Side(style='thin')
-    )
-    header_fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
-    header_font = Font(color='FFFFFF', bold=True, size=11)
-    editable_fill = PatternFill(start_color='D6E4F0', end_color='D6E4F0', fill_type='solid')
-    computed_fill = PatternFill(start_color='D9D9D9', end_color='D9D9D9', fill_type='solid')
-    green_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
-    amber_fill = PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid')
-    money_format = '#,##0.00'
-
-    items = data['line_items']
-
-    ws1 = wb.active
-    ws1.title = 'Master List'
-    headers1 = ['Line #', 'Non-Stock', 'Product', 'Description', 'Quote QTY',
-                 'Order QTY', 'Price', 'Unit', 'Quote Total', 'Order Total',
-                 'QTY Received', 'Missing', 'QTY Shipped', 'QTY Invoiced', 'Notes']
-    for c, h in enumerate(headers1, 1):
-        cell = ws1.cell(row=1, column=c, value=h)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center')
-        cell.border = thin_border
-
-    for r, item in enumerate(items, 2):
-        pricing_type = item.get('pricing_type', 'each')
-        unit_label = 'Each' if pricing_type == 'each' else ('Per C' if pricing_type == 'per_c' else 'Per M')
-        vals = [
-            item['line_number'], item['stock_ns'], item['sku'], item['description'],
-            item['quote_qty'], item['qty_ordered'], item['price_per'], unit_label,
-        ]
-        for c, v in enumerate(vals, 1):
-            cell = ws1.cell(row=r, column=c, value=v)
-            cell.fill = editable_fill
-            cell.border = thin_border
-            if c in (5, 6):
-                cell.number_format = '#,##0'
-            elif c == 7:
-                cell.number_format = money_format
-
-        # Quote Total (col 9)
-        cell = ws1.cell(row=r, column=9)
-        cell.value = item.get('quote_total', 0)
-        cell.fill = computed_fill
-        cell.border = thin_border
-        cell.number_format = money_format
-
-        # Order Total (col 10)
-        cell = ws1.cell(row=r, column=10)
-        cell.value = item['total_net_price']
-        cell.fill = computed_fill
-        cell.border = thin_border
-        cell.number_format = money_format
-
-        # Received (col 11)
-        cell = ws1.cell(row=r, column=11)
-        cell.value = f"='Received'!D{r}"
-        cell.fill = green_fill
-        cell.border = thin_border
-        cell.number_format = '#,##0'
-
-        # Missing (col 12) = Order QTY - Received
-        cell = ws1.cell(row=r, column=12)
-        missing = max(0, (item['qty_ordered'] or 0) - (item['total_received'] or 0))
-        cell.value = missing
-        cell.fill = amber_fill if missing > 0 else green_fill
-        cell.border = thin_border
-        cell.number_format = '#,##0'
-
-        # Shipped (col 13)
-        cell = ws1.cell(row=r, column=13)
-        cell.value = f"='Shipped to Site'!D{r}"
-        cell.fill = green_fill
-        cell.border = thin_border
-        cell.number_format = '#,##0'
-
-        # Invoiced (col 14)
-        cell = ws1.cell(row=r, column=14)
-        cell.value = f"='Invoiced'!D{r}"
-        cell.fill = green_fill
-        cell.border = thin_border
-        cell.number_format = '#,##0'
-
-        # Notes (col 15)
-        cell = ws1.cell(row=r, column=15)
-        cell.value = item.get('notes', '')
-        cell.border = thin_border
-
-    widths1 = [8, 10, 15, 35, 12, 12, 12, 8, 14, 14, 12, 10, 12, 12, 20]
-    for i, w in enumerate(widths1, 1):
-        ws1.column_dimensions[get_column_letter(i)].width = w
-
-    tab_configs = [
-        ('Received', 'received_entries'),
-        ('Shipped to Site', 'shipped_entries'),
-        ('Invoiced', 'invoiced_entries'),
-    ]
-
-    for tab_name, entry_key in tab_configs:
-        ws = wb.create_sheet(title=tab_name)
-        headers = ['Line #', 'Description', 'Total Ordered', 'Total']
-        date_headers = {}
-        for item in items:
-            entries = item.get(entry_key, {})
-            for col_num, entry in entries.items():
-                if entry.get('entry_date') and col_num not in date_headers:
-                    date_headers[col_num] = entry['entry_date']
-
-        for c in range(1, 16):
-            headers.append(date_headers.get(str(c), f'Col {c}'))
-
-        for c, h in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=c, value=h)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center')
-            cell.border = thin_border
-
-        for r, item in enumerate(items, 2):
-            cell = ws.cell(row=r, column=1, value=item['line_number'])
-            cell.fill = computed_fill
-            cell.border = thin_border
-
-            cell = ws.cell(row=r, column=2, value=item['description'])
-            cell.fill = computed_fill
-            cell.border = thin_border
-
-            cell = ws.cell(row=r, column=3)
-            cell.value = f"='Master List'!F{r}"
-            cell.fill = computed_fill
-            cell.border = thin_border
-
-            cell = ws.cell(row=r, column=4)
-            cell.value = f'=SUM(E{r}:S{r})'
-            cell.border = thin_border
-            cell.number_format = '#,##0'
-
-            total_val = sum(
-                (item.get(entry_key, {}).get(str(c), {}).get('quantity', 0) or 0)
-                for c in range(1, 16)
-            )
-            ordered_val = item['qty_ordered']
-            if ordered_val > 0 and total_val >= ordered_val:
-                cell.fill = green_fill
-            elif total_val > 0:
-                cell.fill = amber_fill
-            else:
-                cell.fill = computed_fill
-
-            entries = item.get(entry_key, {})
-            for col in range(1, 16):
-                cell = ws.cell(row=r, column=col + 4)
-                entry = entries.get(str(col), {})
-                qty = entry.get('quantity', 0) or 0
-                if qty:
-                    cell.value = qty
-                cell.fill = editable_fill
-                cell.border = thin_border
-
-        ws.column_dimensions['A'].width = 8
-        ws.column_dimensions['B'].width = 35
-        ws.column_dimensions['C'].width = 14
-        ws.column_dimensions['D'].width = 10
-        for col in range(5, 20):
-            ws.column_dimensions[get_column_letter(col)].width = 12
-
-    export_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
-    os.makedirs(export_dir, exist_ok=True)
-    safe_name = "".join(c if c.isalnum() or c in ' -_' else '' for c in data['job']['name'])
-    filepath = os.path.join(export_dir, f'{safe_name}.xlsx')
-    wb.save(filepath)
-
-    return send_file(filepath, as_attachment=True,
-                     download_name=f"{safe_name}.xlsx",
-                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    safe_name = safe_filename(data['job']['name'])
+    return send_file(build_job_workbook(data), as_attachment=True,
+                     download_name=f"{safe_name}.xlsx", mimetype=XLSX_MIMETYPE)
 
 # ─── Accounting ─────────────────────────────────────────────────
 
@@ -1619,13 +1252,10 @@ def create_payment():
             job_label = job_row['name'] if job_row else f'Job #{job_id_val}'
             users_to_notify = conn2.execute("SELECT id FROM users WHERE role IN ('owner','admin','project_manager') AND is_active = 1").fetchall()
             conn2.close()
-            for u in users_to_notify:
-                create_notification(
-                    u['id'], 'system',
-                    f'Lien Waiver Needed: {job_label}',
-                    f'Payment received for {job_label}. Please create a lien waiver.',
-                    f'/lien-waivers'
-                )
+            notify_many([u['id'] for u in users_to_notify], 'system',
+                        f'Lien Waiver Needed: {job_label}',
+                        f'Payment received for {job_label}. Please create a lien waiver.',
+                        '/lien-waivers')
         else:
             conn2.close()
     # Team Pay auto-prompt: if job has a team pay schedule, notify owners
@@ -3586,24 +3216,23 @@ def api_codebook_search():
     if not q:
         return jsonify([])
     conn = get_db()
-    if book_id:
-        sections = conn.execute(
-            '''SELECT cs.*, cb.code as book_code, cb.name as book_name
-               FROM code_sections cs JOIN code_books cb ON cs.book_id = cb.id
-               WHERE cs.book_id = ? AND (cs.section_number LIKE ? OR cs.title LIKE ? OR cs.content LIKE ?)
-               ORDER BY cs.sort_order LIMIT 50''',
-            (book_id, f'%{q}%', f'%{q}%', f'%{q}%')
-        ).fetchall()
-    else:
-        sections = conn.execute(
-            '''SELECT cs.*, cb.code as book_code, cb.name as book_name
-               FROM code_sections cs JOIN code_books cb ON cs.book_id = cb.id
-               WHERE cs.section_number LIKE ? OR cs.title LIKE ? OR cs.content LIKE ?
-               ORDER BY cb.code, cs.sort_order LIMIT 50''',
-            (f'%{q}%', f'%{q}%', f'%{q}%')
-        ).fetchall()
+    sections = search_index.search_code(conn, q, book_id=book_id, limit=50)
     conn.close()
-    return jsonify([dict(s) for s in sections])
+    return jsonify(sections)
+
+@app.route('/api/search/knowledge')
+@api_login_required
+def api_knowledge_search():
+    """Ranked search across code books, how-tos and manuals. ?types=code,howto,manual narrows it."""
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'query': q, 'results': []})
+    kinds = [k for k in request.args.get('types', ','.join(search_index.KINDS)).split(',') if k in search_index.KINDS]
+    limit = min(request.args.get('limit', 30, type=int), 100)
+    conn = get_db()
+    results = search_index.search(conn, q, kinds=kinds, limit=limit, book_id=request.args.get('book_id', type=int))
+    conn.close()
+    return jsonify({'query': q, 'results': results})
 
 @app.route('/api/codebooks/bookmarks')
 @api_login_required
@@ -4020,60 +3649,36 @@ def projects_detail(job_id):
 @api_role_required('owner', 'admin', 'project_manager')
 def api_projects():
     conn = get_db()
-    jobs = conn.execute('SELECT * FROM jobs ORDER BY updated_at DESC').fetchall()
+    jobs = conn.execute('''
+        SELECT j.*, c.company_name AS customer_name, r.*
+        FROM jobs j
+        LEFT JOIN job_rollups r ON r.job_id = j.id
+        LEFT JOIN customers c ON c.id = j.customer_id
+        ORDER BY j.updated_at DESC
+    ''').fetchall()
     result = []
     for job in jobs:
-        items = conn.execute(
-            'SELECT total_net_price, qty_ordered, price_per FROM line_items WHERE job_id = ?',
-            (job['id'],)
-        ).fetchall()
-        material_cost = sum(
-            (row['total_net_price'] or 0) if (row['total_net_price'] or 0)
-            else (row['qty_ordered'] or 0) * (row['price_per'] or 0)
-            for row in items
-        )
-        expenses = conn.execute('SELECT COALESCE(SUM(amount),0) FROM expenses WHERE job_id = ?', (job['id'],)).fetchone()[0]
-        service_count = conn.execute("SELECT COUNT(*) FROM service_calls WHERE job_id = ? AND status NOT IN ('Resolved','Closed')", (job['id'],)).fetchone()[0]
-        warranty_count = conn.execute('SELECT COUNT(*) FROM warranty_items WHERE job_id = ?', (job['id'],)).fetchone()[0]
-
-        customer_name = None
-        customer_id = job['customer_id']
-        if customer_id:
-            cust = conn.execute('SELECT company_name FROM customers WHERE id = ?', (customer_id,)).fetchone()
-            if cust:
-                customer_name = cust['company_name']
-
-        jid = job['id']
-        co_count = conn.execute('SELECT COUNT(*) FROM change_orders WHERE job_id = ?', (jid,)).fetchone()[0]
-        rfi_count = conn.execute('SELECT COUNT(*) FROM rfis WHERE job_id = ?', (jid,)).fetchone()[0]
-        submittal_count = conn.execute('SELECT COUNT(*) FROM submittals WHERE job_id = ?', (jid,)).fetchone()[0]
-        lw_count = conn.execute('SELECT COUNT(*) FROM lien_waivers WHERE job_id = ?', (jid,)).fetchone()[0]
-        payapp_count = conn.execute('SELECT COUNT(*) FROM pay_applications pa JOIN pay_app_contracts pac ON pa.contract_id = pac.id WHERE pac.job_id = ?', (jid,)).fetchone()[0]
-        plan_count = conn.execute('SELECT COUNT(*) FROM plans WHERE job_id = ?', (jid,)).fetchone()[0]
-        contract_count = conn.execute('SELECT COUNT(*) FROM contracts WHERE job_id = ?', (jid,)).fetchone()[0]
-        permit_count = conn.execute('SELECT COUNT(*) FROM permits WHERE job_id = ?', (jid,)).fetchone()[0]
-
         result.append({
-            'id': jid,
+            'id': job['id'],
             'name': job['name'],
             'status': job['status'],
             'location': f"{job['city'] or ''} {job['state'] or ''}".strip() or '-',
             'tax_rate': job['tax_rate'] or 0,
-            'material_cost': round(material_cost, 2),
-            'expenses': round(expenses, 2),
-            'open_service_calls': service_count,
-            'warranty_items': warranty_count,
+            'material_cost': (job['material_cents'] or 0) / 100,
+            'expenses': (job['expense_cents'] or 0) / 100,
+            'open_service_calls': job['open_service_calls'] or 0,
+            'warranty_items': job['warranty_items'] or 0,
             'updated_at': job['updated_at'],
-            'customer_id': customer_id,
-            'customer_name': customer_name,
-            'co_count': co_count,
-            'rfi_count': rfi_count,
-            'submittal_count': submittal_count,
-            'lw_count': lw_count,
-            'payapp_count': payapp_count,
-            'plan_count': plan_count,
-            'contract_count': contract_count,
-            'permit_count': permit_count,
+            'customer_id': job['customer_id'],
+            'customer_name': job['customer_name'] if job['customer_id'] else None,
+            'co_count': job['change_orders'] or 0,
+            'rfi_count': job['rfis'] or 0,
+            'submittal_count': job['submittals'] or 0,
+            'lw_count': job['lien_waivers'] or 0,
+            'payapp_count': job['pay_apps'] or 0,
+            'plan_count': job['plans'] or 0,
+            'contract_count': job['contracts'] or 0,
+            'permit_count': job['permits'] or 0,
         })
     conn.close()
     return jsonify(result)
@@ -4260,21 +3865,7 @@ def api_heartbeat():
             (session['user_id'], today)
         )
         conn.commit()
-        # Check schedule notifications once per user per day
-        sched_key = f'sched_notif_{session["user_id"]}_{today}'
-        if not session.get(sched_key):
-            try:
-                events = [dict(r) for r in conn.execute(
-                    "SELECT * FROM job_schedule_events WHERE status NOT IN ('Complete','Cancelled')"
-                ).fetchall()]
-                conn.close()
-                if events:
-                    _check_schedule_notifications(events)
-                session[sched_key] = True
-            except Exception:
-                pass
-        else:
-            conn.close()
+        conn.close()
     except Exception:
         pass
     return jsonify({'ok': True, '_noToast': True})
@@ -4314,6 +3905,7 @@ def api_admin_activity_log():
         where.append('a.created_at <= ?'); params.append(date_to + ' 23:59:59')
     params.append(limit)
 
+    activity_log.flush()
     conn = get_db()
     rows = conn.execute(
         f'''SELECT a.*, u.display_name, u.username
@@ -4330,6 +3922,7 @@ def api_admin_activity_log():
 @app.route('/api/admin/user-stats')
 @api_role_required('owner')
 def api_admin_user_stats():
+    activity_log.flush()
     conn = get_db()
     today = datetime.now().strftime('%Y-%m-%d')
     week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
@@ -4419,18 +4012,8 @@ def api_jobs_list():
 # ─── Activity Logging ────────────────────────────────────────
 
 def log_activity(user_id, action, entity_type='', entity_id=None, description=''):
-    """Log a user action to the activity_logs table."""
-    try:
-        conn = get_db()
-        conn.execute(
-            '''INSERT INTO activity_logs (user_id, action, entity_type, entity_id, description, ip_address)
-               VALUES (?,?,?,?,?,?)''',
-            (user_id, action, entity_type, entity_id, description, request.remote_addr or '')
-        )
-        conn.commit()
-        conn.close()
-    except Exception:
-        pass
+    """Log a user action to the activity_logs table (written asynchronously, see activity_log.py)."""
+    activity_log.record(user_id, action, entity_type, entity_id, description, request.remote_addr or '')
 
 # ─── Email Autocomplete ─────────────────────────────────────
 
@@ -4465,14 +4048,8 @@ def api_email_autocomplete():
 # ─── Notifications ──────────────────────────────────────────
 
 def create_notification(user_id, ntype, title, message='', link=''):
-    """Helper to create a notification for a user."""
-    conn = get_db()
-    conn.execute(
-        'INSERT INTO notifications (user_id, type, title, message, link) VALUES (?,?,?,?,?)',
-        (user_id, ntype, title, message, link)
-    )
-    conn.commit()
-    conn.close()
+    """Helper to create a notification for a user (see notify_many for several recipients)."""
+    notify_many([user_id], ntype, title, message, link)
 
 @app.route('/api/notifications')
 @api_login_required
@@ -4501,12 +4078,14 @@ def api_notifications_unread_count():
 @api_login_required
 def api_notification_read(nid):
     conn = get_db()
-    conn.execute(
-        'UPDATE notifications SET is_read = 1 WHERE id = ? AND user_id = ?',
+    cur = conn.execute(
+        'UPDATE notifications SET is_read = 1 WHERE id = ? AND user_id = ? AND is_read = 0',
         (nid, session['user_id'])
     )
     conn.commit()
     conn.close()
+    if cur.rowcount:
+        event_bus.publish(session['user_id'], 'notification', {'delta': -1})
     return jsonify({'ok': True})
 
 @app.route('/api/notifications/mark-all-read', methods=['POST'])
@@ -4519,8 +4098,43 @@ def api_notifications_mark_all_read():
     )
     conn.commit()
     conn.close()
+    event_bus.publish(session['user_id'], 'notification', {'count': 0})
     return jsonify({'ok': True})
 
+# ─── Live Events (SSE) ──────────────────────────────────────
+
+@app.route('/api/events/stream')
+@api_login_required
+def api_events_stream():
+    """Server-Sent-Events stream of notification and team chat updates for the current user."""
+    uid = session['user_id']
+    try:
+        sub = event_bus.subscribe(uid)
+    except event_bus.StreamLimitReached:
+        return jsonify({'error': 'Too many live connections'}), 503
+
+    conn = get_db()
+    try:
+        hello = {
+            'notifications': conn.execute(
+                'SELECT COUNT(*) FROM notifications WHERE user_id = ? AND is_read = 0', (uid,)
+            ).fetchone()[0],
+            'tc_unread': _tc_unread_total(conn, uid),
+        }
+    except Exception:
+        event_bus.unsubscribe(sub)
+        raise
+    finally:
+        conn.close()
+
+    resp = Response(stream_with_context(event_bus.iter_stream(sub, hello)), mimetype='text/event-stream')
+    # The generator's finally never runs if the response is closed before it
+    # is first iterated; this runs on every close and keeps the cap honest
+    resp.call_on_close(lambda: event_bus.unsubscribe(sub))
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
 # ─── Bids ───────────────────────────────────────────────────
 
 def calculate_bid(data):
@@ -4972,8 +4586,7 @@ def api_generate_proposal(bid_id):
     filepath = os.path.join(proposals_dir, filename)
 
     try:
-        wp = weasyprint.HTML(string=html, base_url=os.path.dirname(__file__))
-        wp.write_pdf(filepath)
+        pdf_render.render(html, filepath, base_url=os.path.dirname(__file__))
     except Exception as e:
         return jsonify({'error': f'PDF generation failed: {str(e)[:200]}'}), 500
 
@@ -5311,9 +4924,8 @@ def api_award_bid(bid_id):
     job = conn.execute('SELECT name FROM jobs WHERE id = ?', (job_id,)).fetchone()
     conn.commit()
     conn.close()
-    for u in users:
-        create_notification(u['id'], 'bid', f'Bid Awarded: {bid["bid_name"]}',
-                          f'Job "{job["name"]}" has been awarded.', f'/projects/{job_id}')
+    notify_many([u['id'] for u in users], 'bid', f'Bid Awarded: {bid["bid_name"]}',
+                f'Job "{job["name"]}" has been awarded.', f'/projects/{job_id}')
     return jsonify({'ok': True, 'job_id': job_id})
 
 # ─── Bid Takeoff ──────────────────────────────────────────────────
@@ -5826,8 +5438,7 @@ def api_takeoff_generate_pdf(bid_id):
     filepath = os.path.join(takeoffs_dir, filename)
 
     try:
-        wp = weasyprint.HTML(string=html, base_url=os.path.dirname(__file__))
-        wp.write_pdf(filepath)
+        pdf_render.render(html, filepath, base_url=os.path.dirname(__file__))
     except Exception as e:
         return jsonify({'error': f'PDF generation failed: {str(e)[:200]}'}), 500
 
@@ -7353,18 +6964,36 @@ def api_payapps_generate_pdf(aid):
         return jsonify({'error': 'PDF generation is not available. WeasyPrint is not installed on the server. Please contact your administrator.'}), 500
 
     try:
-        wp = weasyprint.HTML(string=html, base_url=os.path.dirname(__file__))
-        wp.write_pdf(filepath)
+        # Long G702/G703 sets render in the background; the client polls the job
+        job_id = pdf_render.render_or_submit(html, filepath, base_url=os.path.dirname(__file__),
+                                             ref_id=aid, created_by=session.get('user_id'),
+                                             then='payapp_pdf', then_args={'aid': aid, 'filename': filename})
     except Exception as e:
         conn.close()
         return jsonify({'error': f'PDF generation failed: {str(e)[:200]}'}), 500
 
-    # Save filename to DB
-    conn.execute('UPDATE pay_applications SET pdf_file = ? WHERE id = ?', (filename, aid))
-    conn.commit()
+    # Save filename to DB; a queued render records it itself once the file exists
+    if not job_id:
+        conn.execute('UPDATE pay_applications SET pdf_file = ? WHERE id = ?', (filename, aid))
+        conn.commit()
     conn.close()
 
-    return jsonify({'ok': True, 'filename': filename, 'path': f'/api/payapps/applications/{aid}/pdf/{filename}'})
+    result = {'ok': True, 'filename': filename, 'path': f'/api/payapps/applications/{aid}/pdf/{filename}'}
+    if job_id:
+        result['job_id'] = job_id
+        return jsonify(result), 202
+    return jsonify(result)
+
+
+@pdf_render.on_done('payapp_pdf')
+def _record_payapp_pdf(args, _dest):
+    """A queued G702/G703 render finished: point the pay application at the new file."""
+    conn = get_db()
+    try:
+        conn.execute('UPDATE pay_applications SET pdf_file = ? WHERE id = ?', (args['filename'], args['aid']))
+        conn.commit()
+    finally:
+        conn.close()
 
 
 @app.route('/api/payapps/applications/<int:aid>/pdf/<filename>')
@@ -7570,12 +7199,8 @@ def payapps_analytics_page():
 def api_payapps_analytics():
     """Return analytics data for all pay app contracts."""
     conn = get_db()
-    contracts = conn.execute('''
-        SELECT c.*, j.name as job_name
-        FROM pay_app_contracts c
-        LEFT JOIN jobs j ON c.job_id = j.id
-        ORDER BY c.created_at DESC
-    ''').fetchall()
+    # Contract totals are maintained by pay_app_rollups
+    contracts = pay_app_rollups.contract_rows(conn)
 
     projects = []
     agg = {'total_contract_value': 0, 'total_billed': 0, 'total_retainage': 0, 'total_balance': 0}
@@ -7584,76 +7209,18 @@ def api_payapps_analytics():
     for c in contracts:
         cid = c['id']
         original = c['original_contract_sum'] or 0
-
-        # Latest application
-        latest_app = conn.execute(
-            'SELECT * FROM pay_applications WHERE contract_id = ? ORDER BY application_number DESC LIMIT 1',
-            (cid,)
-        ).fetchone()
-
-        # Sum COs from all applications
-        co_row = conn.execute(
-            'SELECT SUM(co_additions) as adds, SUM(co_deductions) as deds FROM pay_applications WHERE contract_id = ?',
-            (cid,)
-        ).fetchone()
-        co_additions = (co_row['adds'] or 0) if co_row else 0
-        co_deductions = (co_row['deds'] or 0) if co_row else 0
+        co_additions = c['co_additions']
+        co_deductions = c['co_deductions']
         net_co = co_additions - co_deductions
         contract_sum_to_date = original + net_co
 
-        # Totals from all SOV items + all entries
-        sov_items = conn.execute(
-            'SELECT * FROM pay_app_sov_items WHERE contract_id = ? AND is_header = 0',
-            (cid,)
-        ).fetchall()
-
-        all_apps = conn.execute(
-            'SELECT id, application_number FROM pay_applications WHERE contract_id = ? ORDER BY application_number',
-            (cid,)
-        ).fetchall()
-        all_app_ids = [a['id'] for a in all_apps]
-
-        total_work = 0
-        total_stored = 0
-        total_retainage = 0
-
-        if all_app_ids:
-            ph = ','.join('?' * len(all_app_ids))
-            # Sum work_this_period across all apps per SOV item
-            work_sums = {}
-            for row in conn.execute(
-                f'SELECT sov_item_id, SUM(work_this_period) as tw FROM pay_app_line_entries WHERE pay_app_id IN ({ph}) GROUP BY sov_item_id',
-                all_app_ids
-            ).fetchall():
-                work_sums[row['sov_item_id']] = row['tw'] or 0
-
-            # Get latest app's materials_stored
-            latest_id = all_app_ids[-1] if all_app_ids else None
-            mat_sums = {}
-            if latest_id:
-                for row in conn.execute(
-                    'SELECT sov_item_id, materials_stored FROM pay_app_line_entries WHERE pay_app_id = ?',
-                    (latest_id,)
-                ).fetchall():
-                    mat_sums[row['sov_item_id']] = row['materials_stored'] or 0
-
-            for item in sov_items:
-                sid = item['id']
-                work = work_sums.get(sid, 0)
-                mats = mat_sums.get(sid, 0)
-                total_work += work
-                total_stored += mats
-                if not item['retainage_exempt'] and (item['scheduled_value'] or 0) > 0:
-                    total_retainage += (c['retainage_work_pct'] / 100) * work
-                    total_retainage += (c['retainage_stored_pct'] / 100) * mats
-
-        total_retainage = round(total_retainage, 2)
-        total_completed = total_work + total_stored
+        total_retainage = round(c['retainage'], 2)
+        total_completed = c['completed_to_date']
         total_billed = total_completed - total_retainage
         balance = contract_sum_to_date - total_billed
         pct = (total_completed / contract_sum_to_date * 100) if contract_sum_to_date else 0
 
-        latest_status = latest_app['status'] if latest_app else None
+        latest_status = c['latest_status']
         if latest_status:
             status_counts[latest_status] = status_counts.get(latest_status, 0) + 1
 
@@ -7672,9 +7239,9 @@ def api_payapps_analytics():
             'total_billed': round(total_billed, 2),
             'balance_to_finish': round(balance, 2),
             'pct_complete': round(pct, 1),
-            'latest_app_number': latest_app['application_number'] if latest_app else None,
+            'latest_app_number': c['latest_app_number'],
             'latest_status': latest_status,
-            'latest_period_to': latest_app['period_to'] if latest_app else None,
+            'latest_period_to': c['latest_period_to'],
         })
 
         agg['total_contract_value'] += contract_sum_to_date
@@ -7803,18 +7370,18 @@ def api_manuals_list():
     q = request.args.get('q', '').strip()
     mfg = request.args.get('manufacturer', '').strip()
     conn = get_db()
-    sql = 'SELECT * FROM equipment_manuals WHERE 1=1'
-    params = []
     if q:
-        sql += ' AND (model_number LIKE ? OR title LIKE ? OR manufacturer LIKE ?)'
-        params += [f'%{q}%', f'%{q}%', f'%{q}%']
-    if mfg:
-        sql += ' AND manufacturer = ?'
-        params.append(mfg)
-    sql += ' ORDER BY manufacturer, model_number'
-    rows = conn.execute(sql, params).fetchall()
+        rows = search_index.search_manuals(conn, q, manufacturer=mfg or None)
+    else:
+        sql = 'SELECT * FROM equipment_manuals'
+        params = []
+        if mfg:
+            sql += ' WHERE manufacturer = ?'
+            params.append(mfg)
+        sql += ' ORDER BY manufacturer, model_number'
+        rows = [dict(r) for r in conn.execute(sql, params).fetchall()]
     conn.close()
-    return jsonify([dict(r) for r in rows])
+    return jsonify(rows)
 
 @app.route('/api/manuals', methods=['POST'])
 @api_role_required('owner', 'admin', 'project_manager')
@@ -7923,22 +7490,24 @@ def api_manuals_search():
     q = request.args.get('q', '').strip()
     brand = request.args.get('brand', '')
     etype = request.args.get('type', '')
-    clauses = []
-    params = []
+    conn = get_db()
     if q:
-        clauses.append("(manufacturer LIKE ? OR model_number LIKE ? OR title LIKE ? OR tags LIKE ?)")
-        params.extend([f'%{q}%'] * 4)
-    if brand:
-        clauses.append("brand = ?")
-        params.append(brand)
-    if etype:
-        clauses.append("equipment_type = ?")
-        params.append(etype)
-    where = ' AND '.join(clauses) if clauses else '1=1'
-    conn = get_db()
-    results = conn.execute(f'SELECT * FROM equipment_manuals WHERE {where} ORDER BY manufacturer, model_number', params).fetchall()
+        results = search_index.search_manuals(conn, q, brand=brand or None, equipment_type=etype or None)
+    else:
+        clauses = []
+        params = []
+        if brand:
+            clauses.append("brand = ?")
+            params.append(brand)
+        if etype:
+            clauses.append("equipment_type = ?")
+            params.append(etype)
+        where = ' AND '.join(clauses) if clauses else '1=1'
+        results = [dict(r) for r in conn.execute(
+            f'SELECT * FROM equipment_manuals WHERE {where} ORDER BY manufacturer, model_number', params
+        ).fetchall()]
     conn.close()
-    return jsonify([dict(r) for r in results])
+    return jsonify(results)
 
 @app.route('/api/codebooks/<int:book_id>/sections/<int:sid>/content', methods=['POST'])
 @api_role_required('owner', 'admin')
@@ -7982,129 +7551,26 @@ def schedule_page():
 
 @app.route('/schedule/job/<int:job_id>')
 @login_required
-def schedule_job_page(job_id):
-    return render_template('schedule/job.html', job_id=job_id)
-
-@app.route('/api/schedule/events')
-@api_login_required
-def api_schedule_events():
-    job_id = request.args.get('job_id', '')
-    conn = get_db()
-    if job_id:
-        rows = conn.execute(
-            'SELECT * FROM job_schedule_events WHERE job_id = ? ORDER BY sort_order, id',
-            (job_id,)
-        ).fetchall()
-    else:
-        rows = conn.execute(
-            'SELECT * FROM job_schedule_events ORDER BY job_id, sort_order, id'
-        ).fetchall()
-    result = [dict(r) for r in rows]
-    conn.close()
-    return jsonify(result)
-
-def _check_schedule_notifications(events):
-    """Create notifications for schedule benchmarks: due soon, starting soon, overdue, missed start."""
-    from datetime import timedelta
-    now = datetime.now()
-    today = now.date()
-    today_str = now.strftime('%Y-%m-%d')
-    two_days = now + timedelta(hours=48)
-    conn = get_db()
-    try:
-        _do_schedule_notifications(conn, events, now, today, today_str, two_days)
-        conn.commit()
-    except Exception:
-        pass
-    finally:
-        conn.close()
-
-def _do_schedule_notifications(conn, events, now, today, today_str, two_days):
-    from datetime import timedelta
-    # Get all owner user IDs for escalation
-    owner_ids = [r['id'] for r in conn.execute("SELECT id FROM users WHERE role = 'owner'").fetchall()]
-
-    def _already_notified(user_id, event_id, ntype_suffix):
-        return conn.execute(
-            '''SELECT id FROM notifications WHERE user_id = ? AND type = 'schedule'
-               AND message LIKE ? AND created_at >= ?''',
-            (user_id, f'%event #{event_id}%{ntype_suffix}%', today_str)
-        ).fetchone()
-
-    def _get_job_name(job_id):
-        job = conn.execute('SELECT name FROM jobs WHERE id = ?', (job_id,)).fetchone()
-        return job['name'] if job else f'Job #{job_id}'
-
-    for e in events:
-        if e['status'] in ('Complete', 'Cancelled'):
-            continue
-        link = f'/schedule/job/{e["job_id"]}'
-        job_name = _get_job_name(e['job_id'])
-        assigned = e.get('assigned_to')
-
-        # 1. End date within 24h (existing behavior)
-        if e.get('end_date') and assigned:
-            try:
-                end_dt = datetime.strptime(e['end_date'], '%Y-%m-%d')
-            except (ValueError, TypeError):
-                end_dt = None
-            if end_dt and now <= end_dt <= now + timedelta(hours=24):
-                if not _already_notified(assigned, e['id'], 'due_soon'):
-                    conn.execute(
-                        'INSERT INTO notifications (user_id, type, title, message, link) VALUES (?,?,?,?,?)',
-                        (assigned, 'schedule', 'Schedule: Due Soon',
-                         f'{e["phase_name"]} on {job_name} due {e["end_date"]} (event #{e["id"]}) due_soon', link)
-                    )
-
-        # 2. Start date within 48 hours - notify assigned user
-        if e.get('start_date') and assigned and e['status'] == 'Pending':
-            try:
-                start_dt = datetime.strptime(e['start_date'], '%Y-%m-%d')
-            except (ValueError, TypeError):
-                start_dt = None
-            if start_dt and now <= start_dt <= two_days:
-                if not _already_notified(assigned, e['id'], 'start_soon'):
-                    conn.execute(
-                        'INSERT INTO notifications (user_id, type, title, message, link) VALUES (?,?,?,?,?)',
-                        (assigned, 'schedule', 'Schedule: Starting Soon',
-                         f'{e["phase_name"]} on {job_name} starts in 2 days (event #{e["id"]}) start_soon', link)
-                    )
-
-        # 3. Overdue: In Progress phase past end_date
-        if e.get('end_date') and e['status'] == 'In Progress':
-            try:
-                end_dt = datetime.strptime(e['end_date'], '%Y-%m-%d').date()
-            except (ValueError, TypeError):
-                end_dt = None
-            if end_dt and today > end_dt:
-                notify_users = set(owner_ids)
-                if assigned:
-                    notify_users.add(assigned)
-                for uid in notify_users:
-                    if not _already_notified(uid, e['id'], 'overdue'):
-                        conn.execute(
-                            'INSERT INTO notifications (user_id, type, title, message, link) VALUES (?,?,?,?,?)',
-                            (uid, 'schedule', 'Schedule: Phase Overdue',
-                             f'{e["phase_name"]} on {job_name} is overdue (was due {e["end_date"]}) (event #{e["id"]}) overdue', link)
-                        )
-
-        # 4. Missed start: Pending phase past start_date
-        if e.get('start_date') and e['status'] == 'Pending':
-            try:
-                start_dt = datetime.strptime(e['start_date'], '%Y-%m-%d').date()
-            except (ValueError, TypeError):
-                start_dt = None
-            if start_dt and today > start_dt:
-                notify_users = set(owner_ids)
-                if assigned:
-                    notify_users.add(assigned)
-                for uid in notify_users:
-                    if not _already_notified(uid, e['id'], 'missed_start'):
-                        conn.execute(
-                            'INSERT INTO notifications (user_id, type, title, message, link) VALUES (?,?,?,?,?)',
-                            (uid, 'schedule', 'Schedule: Missed Start',
-                             f'{e["phase_name"]} on {job_name} was scheduled to start {e["start_date"]} but hasn\'t begun (event #{e["id"]}) missed_start', link)
-                        )
+def schedule_job_page(job_id):
+    return render_template('schedule/job.html', job_id=job_id)
+
+@app.route('/api/schedule/events')
+@api_login_required
+def api_schedule_events():
+    job_id = request.args.get('job_id', '')
+    conn = get_db()
+    if job_id:
+        rows = conn.execute(
+            'SELECT * FROM job_schedule_events WHERE job_id = ? ORDER BY sort_order, id',
+            (job_id,)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            'SELECT * FROM job_schedule_events ORDER BY job_id, sort_order, id'
+        ).fetchall()
+    result = [dict(r) for r in rows]
+    conn.close()
+    return jsonify(result)
 
 @app.route('/api/schedule/events', methods=['POST'])
 @api_role_required('owner', 'admin', 'project_manager')
@@ -8297,8 +7763,7 @@ def api_bid_labor(job_id):
 @app.route('/api/weather/forecast')
 @api_login_required
 def api_weather_forecast():
-    """Proxy to Open-Meteo for weather forecast / historical data with delay risk flags."""
-    import urllib.request, urllib.error
+    """Weather forecast / historical data with delay risk flags (Open-Meteo, cached in weather.py)."""
     lat = request.args.get('lat', type=float)
     lng = request.args.get('lng', type=float)
     start = request.args.get('start')
@@ -8316,18 +7781,8 @@ def api_weather_forecast():
     # Split into forecast range and historical-estimate range
     if start_dt <= forecast_limit:
         fc_end = min(end_dt, forecast_limit)
-        fc_url = (
-            f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lng}"
-            f"&daily=precipitation_probability_max,precipitation_sum,temperature_2m_min,"
-            f"temperature_2m_max,wind_gusts_10m_max,weather_code"
-            f"&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch"
-            f"&timezone=America/Chicago&start_date={start_dt.strftime('%Y-%m-%d')}&end_date={fc_end.strftime('%Y-%m-%d')}"
-        )
         try:
-            req = urllib.request.Request(fc_url, headers={'User-Agent': 'JobTracker/1.0'})
-            with urllib.request.urlopen(req, timeout=10) as resp:
-                fc_data = json.loads(resp.read().decode())
-            daily = fc_data.get('daily', {})
+            daily = weather.forecast_daily(lat, lng, start_dt, fc_end)
             dates = daily.get('time', [])
             for i, d in enumerate(dates):
                 precip_prob = (daily.get('precipitation_probability_max') or [])[i] if i < len(daily.get('precipitation_probability_max') or []) else 0
@@ -8370,17 +7825,8 @@ def api_weather_forecast():
             hist_start_ly = hist_start.replace(year=hist_start.year - 1, day=28)
             hist_end_ly = end_dt.replace(year=end_dt.year - 1, day=28)
 
-        hist_url = (
-            f"https://archive-api.open-meteo.com/v1/archive?latitude={lat}&longitude={lng}"
-            f"&daily=precipitation_sum,temperature_2m_min,temperature_2m_max,wind_gusts_10m_max,weather_code"
-            f"&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch"
-            f"&timezone=America/Chicago&start_date={hist_start_ly.strftime('%Y-%m-%d')}&end_date={hist_end_ly.strftime('%Y-%m-%d')}"
-        )
         try:
-            req = urllib.request.Request(hist_url, headers={'User-Agent': 'JobTracker/1.0'})
-            with urllib.request.urlopen(req, timeout=10) as resp:
-                hist_data = json.loads(resp.read().decode())
-            daily = hist_data.get('daily', {})
+            daily = weather.archive_daily(lat, lng, hist_start_ly, hist_end_ly)
             dates = daily.get('time', [])
             # Map historical dates back to current year
             day_offset = 0
@@ -8421,20 +7867,14 @@ def api_weather_forecast():
 @app.route('/api/geocode')
 @api_login_required
 def api_geocode():
-    """Geocode a location string using Open-Meteo geocoding API."""
-    import urllib.request, urllib.error, urllib.parse
+    """Geocode a location string using Open-Meteo geocoding API (cached, see weather.py)."""
     q = request.args.get('q', '')
     if not q:
         return jsonify({'lat': 35.6528, 'lng': -97.4781})  # Default: Edmond, OK
     try:
-        encoded_q = urllib.parse.quote(q)
-        url = f"https://geocoding-api.open-meteo.com/v1/search?name={encoded_q}&count=1&language=en&format=json"
-        req = urllib.request.Request(url, headers={'User-Agent': 'JobTracker/1.0'})
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            data = json.loads(resp.read().decode())
-        results = data.get('results', [])
-        if results:
-            return jsonify({'lat': results[0]['latitude'], 'lng': results[0]['longitude']})
+        found = weather.geocode(q)
+        if found:
+            return jsonify({'lat': found[0], 'lng': found[1]})
     except Exception:
         pass
     return jsonify({'lat': 35.6528, 'lng': -97.4781})
@@ -8444,7 +7884,7 @@ def api_geocode():
 @api_login_required
 def api_schedule_backwards_plan():
     """Smart backwards planning: bid-driven, weather-aware, crew calculator."""
-    import math, urllib.request, urllib.error, urllib.parse
+    import math
     data = request.get_json(force=True)
     job_id = data.get('job_id')
     deadline_date = data.get('deadline_date')
@@ -8591,14 +8031,7 @@ def api_schedule_backwards_plan():
         loc_str = ' '.join(filter(None, [job['city'] if job['city'] else None, job['state'] if job['state'] else None, job['zip_code'] if job['zip_code'] else None]))
         if loc_str.strip():
             try:
-                encoded_q = urllib.parse.quote(loc_str.strip())
-                geo_url = f"https://geocoding-api.open-meteo.com/v1/search?name={encoded_q}&count=1&language=en&format=json"
-                req = urllib.request.Request(geo_url, headers={'User-Agent': 'JobTracker/1.0'})
-                with urllib.request.urlopen(req, timeout=5) as resp:
-                    geo_data = json.loads(resp.read().decode())
-                results = geo_data.get('results', [])
-                if results:
-                    lat, lng = results[0]['latitude'], results[0]['longitude']
+                lat, lng = weather.geocode(loc_str) or (lat, lng)
             except Exception:
                 pass
 
@@ -8612,18 +8045,8 @@ def api_schedule_backwards_plan():
     # Forecast portion
     if plan_start <= forecast_limit:
         fc_end = min(deadline, forecast_limit)
-        fc_url = (
-            f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lng}"
-            f"&daily=precipitation_probability_max,precipitation_sum,temperature_2m_min,"
-            f"temperature_2m_max,wind_gusts_10m_max,weather_code"
-            f"&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch"
-            f"&timezone=America/Chicago&start_date={plan_start.strftime('%Y-%m-%d')}&end_date={fc_end.strftime('%Y-%m-%d')}"
-        )
         try:
-            req = urllib.request.Request(fc_url, headers={'User-Agent': 'JobTracker/1.0'})
-            with urllib.request.urlopen(req, timeout=10) as resp:
-                fc_data = json.loads(resp.read().decode())
-            daily = fc_data.get('daily', {})
+            daily = weather.forecast_daily(lat, lng, plan_start, fc_end)
             dates = daily.get('time', [])
             for i, d in enumerate(dates):
                 pp = (daily.get('precipitation_probability_max') or [])[i] if i < len(daily.get('precipitation_probability_max') or []) else 0
@@ -8655,17 +8078,8 @@ def api_schedule_backwards_plan():
         except ValueError:
             hist_start_ly = hist_start.replace(year=hist_start.year - 1, day=28)
             hist_end_ly = deadline.replace(year=deadline.year - 1, day=28)
-        hist_url = (
-            f"https://archive-api.open-meteo.com/v1/archive?latitude={lat}&longitude={lng}"
-            f"&daily=precipitation_sum,temperature_2m_min,temperature_2m_max,wind_gusts_10m_max,weather_code"
-            f"&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch"
-            f"&timezone=America/Chicago&start_date={hist_start_ly.strftime('%Y-%m-%d')}&end_date={hist_end_ly.strftime('%Y-%m-%d')}"
-        )
         try:
-            req = urllib.request.Request(hist_url, headers={'User-Agent': 'JobTracker/1.0'})
-            with urllib.request.urlopen(req, timeout=10) as resp:
-                hist_data = json.loads(resp.read().decode())
-            daily = hist_data.get('daily', {})
+            daily = weather.archive_daily(lat, lng, hist_start_ly, hist_end_ly)
             dates = daily.get('time', [])
             current_date = hist_start
             for i, d in enumerate(dates):
@@ -8698,172 +8112,14 @@ def api_schedule_backwards_plan():
             if d.weekday() < 5:
                 weather_risk_dates.add(d)
 
-    # 7. Build dependency graph + topological sort (leaf-first for backwards planning)
-    by_id = {p['id']: p for p in phases}
-    successors = {p['id']: [] for p in phases}
-    has_any_deps = any(p.get('depends_on') and p['depends_on'] in by_id for p in phases)
-
-    if has_any_deps:
-        # Use explicit dependencies
-        for p in phases:
-            if p.get('depends_on') and p['depends_on'] in by_id:
-                successors[p['depends_on']].append(p['id'])
-    else:
-        # No explicit dependencies — auto-chain phases sequentially (sort order).
-        # Each phase must finish before the next one starts.
-        for i in range(len(phases) - 1):
-            successors[phases[i]['id']].append(phases[i + 1]['id'])
-
-    from collections import deque
-    # For backwards planning: process phases with no successors first (they end at deadline),
-    # then work backwards to phases that must finish before those start.
-    # "Leaves" = phases with empty successor lists = end of the chain.
-    successor_count = {p['id']: len(successors[p['id']]) for p in phases}
-    queue = deque([pid for pid, cnt in successor_count.items() if cnt == 0])
-    topo_order = []
-    visited = set()
-    while queue:
-        pid = queue.popleft()
-        if pid in visited:
-            continue
-        visited.add(pid)
-        topo_order.append(pid)
-        # Find predecessors: phases whose successor list includes this pid
-        for p in phases:
-            if pid in successors.get(p['id'], []):
-                successor_count[p['id']] -= 1
-                if successor_count[p['id']] == 0:
-                    queue.append(p['id'])
-    # If any phases weren't reached (orphans), add them
-    for p in phases:
-        if p['id'] not in visited:
-            topo_order.append(p['id'])
-
-    # 8. Compute dates backwards from deadline
-    def count_work_days(start_d, end_d, skip_weather=True):
-        """Count available work days between two dates (inclusive), skipping weekends and weather risk days."""
-        count = 0
-        d = start_d
-        while d <= end_d:
-            if d.weekday() < 5 and (not skip_weather or d not in weather_risk_dates):
-                count += 1
-            d += timedelta(days=1)
-        return count
-
-    def walk_back(end_d, work_days_needed):
-        """Walk backwards from end_d to find start_d, skipping weekends and weather risk days."""
-        current = end_d
-        remaining = work_days_needed
-        # First ensure end_d itself is a valid work day
-        while current.weekday() >= 5 or current in weather_risk_dates:
-            current -= timedelta(days=1)
-        end_d = current
-        remaining -= 1  # end_d counts as 1 work day
-        while remaining > 0:
-            current -= timedelta(days=1)
-            if current.weekday() < 5 and current not in weather_risk_dates:
-                remaining -= 1
-        return current, end_d
-
-    # ── Auto mode: pre-calculate a consistent crew size that fits all phases sequentially ──
-    if not crew_override:
-        total_active_hrs = sum(p['_remaining_hours'] for p in phases if p['_remaining_hours'] > 0)
-        total_avail = count_work_days(today, deadline)
-        if total_avail > 0 and total_active_hrs > 0:
-            auto_crew = max(1, math.ceil(total_active_hrs / (total_avail * hours_per_day)))
-            # Verify: total days at this crew must fit in available window
-            total_days_at_crew = sum(
-                max(1, math.ceil(p['_remaining_hours'] / (auto_crew * hours_per_day)))
-                for p in phases if p['_remaining_hours'] > 0
-            )
-            while total_days_at_crew > total_avail and auto_crew < 50:
-                auto_crew += 1
-                total_days_at_crew = sum(
-                    max(1, math.ceil(p['_remaining_hours'] / (auto_crew * hours_per_day)))
-                    for p in phases if p['_remaining_hours'] > 0
-                )
-        else:
-            auto_crew = max(1, math.ceil(total_active_hrs / hours_per_day)) if total_active_hrs > 0 else 1
-        effective_crew = auto_crew
-    else:
-        effective_crew = crew_override
-
-    computed_end = {}
-    computed_start = {}
-    phase_results = {}
-
-    for pid in topo_order:
-        p = by_id[pid]
-        remaining_hrs = p['_remaining_hours']
-
-        # Determine end date boundary
-        succ_ids = successors[pid]
-        if not succ_ids:
-            boundary_end = deadline
-        else:
-            valid_succ_starts = [computed_start[s] for s in succ_ids if s in computed_start]
-            if valid_succ_starts:
-                boundary_end = min(valid_succ_starts) - timedelta(days=1)
-                while boundary_end.weekday() >= 5:
-                    boundary_end -= timedelta(days=1)
-            else:
-                boundary_end = deadline
-
-        if remaining_hrs <= 0:
-            # Phase already done — don't consume any calendar time.
-            # Set start=end=boundary so the next phase upstream can use boundary_end directly.
-            computed_start[pid] = boundary_end
-            computed_end[pid] = boundary_end
-            phase_results[pid] = {
-                'work_days': 0, 'crew_needed': 0, 'remaining_hours': 0,
-                'total_hours': p['_total_hours'],
-                'weather_risk_days': 0, 'hours_per_day_needed': 0,
-                'warning': 'Complete',
-            }
-            continue
+    calendar = scheduling.WorkCalendar(weather_risk_dates)
 
-        # Count available work days from today to boundary
-        avail_work_days = count_work_days(today, boundary_end)
-
-        # Calculate days needed with the effective crew
-        work_days_needed = max(1, math.ceil(remaining_hrs / (effective_crew * hours_per_day)))
-        crew_needed = effective_crew
-        hrs_per_day_needed = hours_per_day
-        warning = None
-        if work_days_needed > avail_work_days:
-            # Can't fit — calculate extended hours per day needed
-            if avail_work_days > 0:
-                hrs_per_day_needed = round(remaining_hrs / (effective_crew * avail_work_days), 1)
-                work_days_needed = avail_work_days
-                if hrs_per_day_needed > 14:
-                    warning = f'Requires {hrs_per_day_needed}hr days — consider more crew or extending deadline'
-                else:
-                    warning = f'Extended to {hrs_per_day_needed}hr days to meet deadline'
-            else:
-                warning = 'No available work days before deadline'
-                work_days_needed = 1
-
-        start_d, end_d = walk_back(boundary_end, work_days_needed)
-        computed_start[pid] = start_d
-        computed_end[pid] = end_d
-
-        # Count weather risk days in this phase's window
-        phase_weather_risks = 0
-        d = start_d
-        while d <= end_d:
-            if d.weekday() < 5 and d in weather_risk_dates:
-                phase_weather_risks += 1
-            d += timedelta(days=1)
-
-        phase_results[pid] = {
-            'work_days': work_days_needed,
-            'crew_needed': crew_needed,
-            'remaining_hours': remaining_hrs,
-            'total_hours': p['_total_hours'],
-            'weather_risk_days': phase_weather_risks,
-            'hours_per_day_needed': hrs_per_day_needed,
-            'warning': warning,
-        }
+    # 7-8. Dependency graph (explicit depends_on, else auto-chained in sort order),
+    # leaf-first ordering, crew size, then dates computed backwards from the deadline
+    plan = scheduling.plan_backwards(phases, deadline, today, calendar, hours_per_day, crew_override)
+    computed_start = plan['start']
+    computed_end = plan['end']
+    phase_results = plan['results']
 
     # 9. Update DB — only update estimated_hours and crew_size, NOT dates
     # Dates are calculated for display only. User manually sets/applies dates.
@@ -8900,9 +8156,9 @@ def api_schedule_backwards_plan():
     # Summary stats
     total_remaining = sum(pr.get('remaining_hours', 0) for pr in phase_results.values())
     calendar_days = (deadline - today).days
-    total_weather_risk = len([d for d in weather_risk_dates if today <= d <= deadline])
-    total_biz_days = count_work_days(today, deadline, skip_weather=False)
-    total_avail_days = count_work_days(today, deadline, skip_weather=True)
+    total_weather_risk = calendar.blocked_days(today, deadline)
+    total_biz_days = calendar.work_days(today, deadline, skip_weather=False)
+    total_avail_days = calendar.work_days(today, deadline)
 
     # Phase detail for results table — use computed dates for plan display
     phase_detail = []
@@ -9187,12 +8443,7 @@ def api_schedule_backwards_plan():
                 continue
 
             # Calculate cumulative progress at end of this week
-            elapsed_work_days = 0
-            d = p_start
-            while d <= week_end:
-                if d.weekday() < 5 and d not in weather_risk_dates:
-                    elapsed_work_days += 1
-                d += timedelta(days=1)
+            elapsed_work_days = calendar.work_days(p_start, week_end)
             pct_elapsed = round((elapsed_work_days / max(work_days, 1)) * 100, 0) if work_days > 0 else 100
             # Overall completion = existing progress + proportion of remaining work done
             cumulative_pct = min(100, round(existing_pct + pct_elapsed * (100 - existing_pct) / 100, 0))
@@ -9415,8 +8666,7 @@ def api_schedule_plan_pdf():
     filepath = os.path.join(proposals_dir, filename)
 
     try:
-        wp = weasyprint.HTML(string=html, base_url=os.path.dirname(__file__))
-        wp.write_pdf(filepath)
+        pdf_render.render(html, filepath, base_url=os.path.dirname(__file__))
     except Exception as e:
         return jsonify({'error': f'PDF generation failed: {str(e)[:200]}'}), 500
 
@@ -10110,8 +9360,7 @@ def api_generate_co_proposal(coid):
     filepath = os.path.join(proposals_dir, filename)
 
     try:
-        wp = weasyprint.HTML(string=html, base_url=os.path.dirname(__file__))
-        wp.write_pdf(filepath)
+        pdf_render.render(html, filepath, base_url=os.path.dirname(__file__))
     except Exception as e:
         return jsonify({'error': f'PDF generation failed: {str(e)[:200]}'}), 500
 
@@ -10673,8 +9922,7 @@ def api_generate_transmittal(tid):
     filepath = os.path.join(proposals_dir, filename)
 
     try:
-        wp = weasyprint.HTML(string=html, base_url=os.path.dirname(__file__))
-        wp.write_pdf(filepath)
+        pdf_render.render(html, filepath, base_url=os.path.dirname(__file__))
     except Exception as e:
         return jsonify({'error': f'PDF generation failed: {str(e)[:200]}'}), 500
 
@@ -11291,8 +10539,7 @@ def api_lien_waivers_generate(wid):
     filepath = os.path.join(proposals_dir, filename)
 
     try:
-        wp = weasyprint.HTML(string=html, base_url=os.path.dirname(__file__))
-        wp.write_pdf(filepath)
+        pdf_render.render(html, filepath, base_url=os.path.dirname(__file__))
     except Exception as e:
         return jsonify({'error': f'PDF generation failed: {str(e)[:200]}'}), 500
 
@@ -11700,13 +10947,12 @@ def api_billtrust_import():
         ).fetchall()
         conn.close()
 
-        for admin in admins:
-            create_notification(
-                admin['id'], 'invoice',
-                f'BillTrust Import: {stats.get("new",0)} new, {stats.get("updated",0)} updated',
-                f'{supplier_name} — {stats.get("total",0)} invoices imported via CSV/PDF',
-                '/invoices'
-            )
+        notify_many(
+            [admin['id'] for admin in admins], 'invoice',
+            f'BillTrust Import: {stats.get("new",0)} new, {stats.get("updated",0)} updated',
+            f'{supplier_name} — {stats.get("total",0)} invoices imported via CSV/PDF',
+            '/invoices'
+        )
 
         return jsonify(result)
     except Exception as e:
@@ -12168,6 +11414,9 @@ def api_plans_create():
     conn.commit()
     new_id = cursor.lastrowid
     conn.close()
+    if file_path:
+        # Classify the pages now so the estimate and review find them cached
+        job_queue.enqueue('plan_index', {}, ref_id=new_id, created_by=session.get('user_id'))
     return jsonify({'ok': True, 'id': new_id}), 201
 
 
@@ -12253,6 +11502,8 @@ def api_plans_update(pid):
         )
     conn.commit()
     conn.close()
+    if file_path_update:
+        job_queue.enqueue('plan_index', {}, ref_id=pid, created_by=session.get('user_id'))
     return jsonify({'ok': True})
 
 
@@ -12285,9 +11536,6 @@ def api_plans_file(pid):
     return send_file(fpath, mimetype='application/pdf')
 
 
-_review_progress = {}  # pid -> {step, message, pct, done, error, result}
-
-
 @app.route('/api/plans/<int:pid>/review-estimate', methods=['GET'])
 @api_role_required('owner', 'admin', 'project_manager')
 def api_plans_review_estimate(pid):
@@ -12305,63 +11553,27 @@ def api_plans_review_estimate(pid):
     if not os.path.exists(fpath):
         conn.close()
         return jsonify({'error': 'File not found'}), 404
-    conn.close()
 
     try:
-        import fitz
+        index = plan_index.get_index(conn, fpath)
     except ImportError:
         return jsonify({'error': 'PyMuPDF not installed'}), 500
-
-    import re as _re
-    from collections import Counter
-
-    doc = fitz.open(fpath)
-    page_count = len(doc)
-
-    # Quick two-pass sheet identification (same logic as review)
-    id_freq = Counter()
-    raw = []
-    for page in doc:
-        text = (page.get_text() or '').strip()
-        ids = set()
-        for line in text.split('\n'):
-            t = line.strip()
-            if 2 <= len(t) <= 5:
-                if _re.match(r'^ME\d{1,2}$', t): ids.add(t)
-                elif _re.match(r'^M\d{1,2}$', t): ids.add(t)
-                elif _re.match(r'^[PSEGAC]\d{1,3}$', t): ids.add(t)
-        for s in ids:
-            id_freq[s] += 1
-        raw.append({'text': text, 'ids': ids, 'chars': len(text)})
-    doc.close()
-
-    noise = {s for s, c in id_freq.items() if c > 4}
-
-    HVAC_KW = ['hvac plan','hvac equipment','mechanical plan','unit hvac',
-        'condensing unit','fan coil','mini split','duct siz','equipment schedule',
-        'grille','register schedule','fire damper schedule','exhaust fan','hvac',
-        'refrigerant','tonnage','btu','seer','cfm','mep plan','mep','roof hvac',
-        'roof mep','mechanical schedule','condensing','unit plan']
+    finally:
+        conn.close()
+    page_count = index['page_count']
+    pages = plan_index.classify(index)
 
     mech_sheets = []
     hvac_pages = []
     spec_chars = 0
 
-    for i, r in enumerate(raw):
-        clean_ids = r['ids'] - noise
-        text_lower = r['text'].lower()
-        m_ids = [s for s in clean_ids if s.startswith('M')]
-        non_m_ids = [s for s in clean_ids if not s.startswith('M')]
-        is_mech = len(m_ids) > 0 and len(non_m_ids) == 0
-        is_drawing = r['chars'] < 2000
-        hvac_strong = any(kw in text_lower for kw in HVAC_KW)
-
-        if is_mech:
-            mech_sheets.append({'page': i+1, 'ids': sorted(clean_ids)})
-        elif hvac_strong and is_drawing:
-            hvac_pages.append(i+1)
-        elif r['chars'] > 500 and not is_drawing:
-            spec_chars += r['chars']
+    for p in pages:
+        if p['is_mech_sheet']:
+            mech_sheets.append({'page': p['num'], 'ids': sorted(p['sheet_ids'])})
+        elif p['hvac_strong'] and p['is_drawing']:
+            hvac_pages.append(p['num'])
+        elif p['char_count'] > 500 and not p['is_drawing']:
+            spec_chars += p['char_count']
 
     image_count = min(len(mech_sheets) + len(hvac_pages), 25)
     # Cost estimate: ~1600 tokens per image, ~1 token per 4 chars of spec text
@@ -12376,30 +11588,58 @@ def api_plans_review_estimate(pid):
         'mech_sheet_list': [f"Page {s['page']} ({', '.join(s['ids'])})" for s in mech_sheets],
         'hvac_keyword_pages': len(hvac_pages),
         'total_images': image_count,
-        'spec_pages': sum(1 for r in raw if r['chars'] > 500 and r['chars'] >= 2000),
+        'spec_pages': sum(1 for p in pages if p['char_count'] > 500 and not p['is_drawing']),
         'spec_chars': spec_chars,
         'estimated_input_tokens': input_tokens,
         'estimated_cost': round(est_cost, 2)
     })
 
 
+@job_queue.handler('plan_index')
+def _build_plan_index(job):
+    """Background job: build (or confirm) the cached page index for a plan's file."""
+    conn = get_db()
+    try:
+        plan = conn.execute('SELECT file_path FROM plans WHERE id = ?', (job.ref_id,)).fetchone()
+        if not plan or not plan['file_path']:
+            raise job_queue.JobFailed('Plan has no file')
+        fpath = os.path.join(PLANS_DIR, plan['file_path'])
+        if not os.path.exists(fpath):
+            raise job_queue.JobFailed('Plan file not found on disk')
+        try:
+            index = plan_index.get_index(
+                conn, fpath, lambda done, total: job.progress(1, f'Scanning page {done+1} of {total}...',
+                                                              int(100 * done / max(total, 1))))
+        except ImportError:
+            raise job_queue.JobFailed('PyMuPDF not installed')
+    finally:
+        conn.close()
+    pages = plan_index.classify(index)
+    return {'page_count': index['page_count'], 'mech_sheets': sum(1 for p in pages if p['is_mech_sheet'])}
+
+
 @app.route('/api/plans/<int:pid>/review-status', methods=['GET'])
 @api_role_required('owner', 'admin', 'project_manager')
 def api_plans_review_status(pid):
-    """Poll endpoint for review progress."""
-    prog = _review_progress.get(pid)
-    if not prog:
+    """Poll endpoint for review progress (read from the background_jobs row)."""
+    st = job_queue.latest('plan_review', pid)
+    if not st:
         return jsonify({'step': 0, 'message': 'Not started', 'pct': 0, 'done': False})
+    prog = {'job_id': st['id'], 'step': st['step'], 'message': st['message'], 'pct': st['pct'], 'done': st['done']}
+    if st['status'] == 'queued':
+        prog['message'] = st['message'] or 'Waiting for a free worker...'
+    if st['status'] in ('error', 'cancelled'):
+        prog['error'] = st['error'] or 'Review failed'
+    elif st['status'] == 'done':
+        prog['message'] = 'Review complete!'
+        prog['result'] = st['result']
     return jsonify(prog)
 
 @app.route('/api/plans/<int:pid>/review', methods=['POST'])
 @api_role_required('owner', 'admin', 'project_manager')
 def api_plans_review(pid):
-    """Kick off AI HVAC review in background thread. Returns immediately."""
-    import anthropic
-
-    api_key = os.environ.get('ANTHROPIC_API_KEY', '')
-    if not api_key:
+    """Queue an AI HVAC review on the background job queue. Returns immediately."""
+    if not os.environ.get('ANTHROPIC_API_KEY', ''):
         return jsonify({'error': 'ANTHROPIC_API_KEY not configured. Add it to your .env file.'}), 500
 
     conn = get_db()
@@ -12417,13 +11657,12 @@ def api_plans_review(pid):
         conn.close()
         return jsonify({'error': 'Plan file not found on disk.'}), 404
 
-    # Check if already running
-    prog = _review_progress.get(pid)
-    if prog and not prog.get('done') and not prog.get('error'):
+    # Check if already running (in any worker process)
+    prog = job_queue.latest('plan_review', pid)
+    if prog and not prog['done']:
         conn.close()
-        return jsonify({'status': 'already_running', 'message': 'Review already in progress.'})
+        return jsonify({'status': 'already_running', 'job_id': prog['id'], 'message': 'Review already in progress.'})
 
-    # Get job context before closing conn
     job = conn.execute('SELECT name, address, city, state FROM jobs WHERE id = ?', (plan['job_id'],)).fetchone()
     job_context = f"Job: {job['name']}" if job else ""
     if job and job['city']:
@@ -12434,110 +11673,68 @@ def api_plans_review(pid):
     conn.commit()
     conn.close()
 
-    # Initialize progress
-    _review_progress[pid] = {'step': 1, 'message': 'Opening PDF...', 'pct': 5, 'done': False}
+    # A single attempt: a retry would send the plan set to Claude (and bill it) again
+    job_id = job_queue.enqueue('plan_review', {
+        'pid': pid, 'fpath': fpath, 'plan_data': plan_data, 'job_context': job_context,
+    }, ref_id=pid, created_by=session.get('user_id'))
+
+    return jsonify({'status': 'started', 'job_id': job_id,
+                    'message': 'Review started. Poll /review-status for progress.'})
 
-    import threading
-    def run_review():
-        _do_plan_review(pid, fpath, plan_data, job_context, api_key)
-    t = threading.Thread(target=run_review, daemon=True)
-    t.start()
 
-    return jsonify({'status': 'started', 'message': 'Review started. Poll /review-status for progress.'})
+def _reset_plan_status(job, error):
+    """on_fail hook: a failed or cancelled review puts the plan back to 'Uploaded'."""
+    conn = get_db()
+    conn.execute("UPDATE plans SET status='Uploaded', updated_at=datetime('now','localtime') WHERE id=? AND status='Reviewing'",
+                 (job.ref_id,))
+    conn.commit()
+    conn.close()
 
 
-def _do_plan_review(pid, fpath, plan_data, job_context, api_key):
-    """Background worker for plan review."""
+@job_queue.handler('plan_review', on_fail=_reset_plan_status)
+def _do_plan_review(job):
+    """Background job: render the plan, send it to Claude and save the review."""
     import anthropic, base64
-    prog = _review_progress[pid]
+    pid = job.ref_id
+    fpath = job.payload['fpath']
+    plan_data = job.payload['plan_data']
+    job_context = job.payload['job_context']
+    api_key = os.environ.get('ANTHROPIC_API_KEY', '')
+    if not api_key:
+        raise job_queue.JobFailed('ANTHROPIC_API_KEY not configured')
+
+    last_step = [0]
 
     def update(step, msg, pct):
-        prog['step'] = step
-        prog['message'] = msg
-        prog['pct'] = pct
+        # Always write when a new phase starts; within a phase writes are throttled
+        job.progress(step, msg, pct, force=step != last_step[0])
+        last_step[0] = step
+
+    update(1, 'Opening PDF...', 5)
 
     try:
         import fitz
     except ImportError:
-        prog.update({'error': 'PyMuPDF not installed', 'done': True})
-        return
+        raise job_queue.JobFailed('PyMuPDF not installed')
 
     try:
         doc = fitz.open(fpath)
     except Exception as e:
-        prog.update({'error': f'Could not open PDF: {e}', 'done': True})
-        return
+        raise job_queue.JobFailed(f'Could not open PDF: {e}')
 
     page_count = len(doc)
+    doc.close()
     update(1, f'Scanning {page_count} pages...', 10)
 
-    # ── Phase 1: Two-pass page classification ─────────────────────
-    # Pass 1: Extract all potential sheet IDs and count frequency
-    # Pass 2: Filter out building names and section totals (appear on many pages)
-    import re as _re
-    from collections import Counter
-
-    raw_page_data = []
-    id_frequency = Counter()
-
-    for i, page in enumerate(doc):
-        if i % 20 == 0:
-            update(1, f'Scanning page {i+1} of {page_count}...', 10 + int(20 * i / max(page_count, 1)))
-        text = page.get_text() or ''
-        clean = text.strip()
-
-        # Extract all potential sheet IDs
-        potential_ids = set()
-        for line in clean.split('\n'):
-            token = line.strip()
-            if 2 <= len(token) <= 5:
-                if _re.match(r'^ME\d{1,2}$', token):
-                    potential_ids.add(token)
-                elif _re.match(r'^M\d{1,2}$', token):
-                    potential_ids.add(token)
-                elif _re.match(r'^[PSEGAC]\d{1,3}$', token):
-                    potential_ids.add(token)
-
-        for sid in potential_ids:
-            id_frequency[sid] += 1
-
-        raw_page_data.append({'text': clean, 'potential_ids': potential_ids})
-
-    # Pass 2: IDs appearing on >4 pages are building names or section totals, not sheet IDs
-    # e.g. "M8" = building name (all pages), "M7" = "sheet X of 7" (many pages)
-    noise_ids = {sid for sid, count in id_frequency.items() if count > 4}
-
-    page_info = []
-    for i, rpd in enumerate(raw_page_data):
-        clean = rpd['text']
-        char_count = len(clean)
-        text_lower = clean.lower()
-        is_drawing = char_count < 2000
-
-        # Filter to real sheet IDs (low frequency = actual sheet identifier)
-        sheet_ids = rpd['potential_ids'] - noise_ids
-
-        # Determine if this page IS a mechanical sheet
-        # Must have M/ME IDs and NOT have non-mechanical IDs (A, S, P, E, G)
-        # to avoid false positives from cross-reference pages
-        m_ids = [s for s in sheet_ids if (s.startswith('M') and not s.startswith('ME')) or s.startswith('ME')]
-        non_m_ids = [s for s in sheet_ids if not s.startswith('M')]
-        is_mech_sheet = len(m_ids) > 0 and len(non_m_ids) == 0
-
-        # Check text content for strong HVAC signals
-        hvac_strong = any(kw in text_lower for kw in [
-            'hvac plan', 'hvac equipment', 'mechanical plan', 'unit hvac',
-            'condensing unit', 'fan coil', 'mini split', 'duct siz',
-            'equipment schedule', 'grille', 'register schedule', 'fire damper schedule',
-            'exhaust fan', 'hvac', 'refrigerant', 'tonnage', 'btu', 'seer', 'cfm',
-            'mep plan', 'mep', 'roof hvac', 'roof mep', 'mechanical schedule',
-            'condensing', 'unit plan'])
-
-        page_info.append({
-            'num': i + 1, 'text': clean, 'char_count': char_count,
-            'is_drawing': is_drawing, 'sheet_ids': sheet_ids,
-            'is_mech_sheet': is_mech_sheet, 'hvac_strong': hvac_strong
-        })
+    # ── Phase 1: Page classification (cached per file, see plan_index.py) ──
+    def scan_progress(done, total):
+        update(1, f'Scanning page {done+1} of {total}...', 10 + int(20 * done / max(total, 1)))
+
+    conn = get_db()
+    try:
+        page_info = plan_index.classify(plan_index.get_index(conn, fpath, scan_progress))
+    finally:
+        conn.close()
 
     update(2, 'Identifying mechanical sheets...', 30)
 
@@ -12578,31 +11775,24 @@ def _do_plan_review(pid, fpath, plan_data, job_context, api_key):
 
     update(3, f'Rendering {len(image_pages)} drawing pages as images...', 35)
 
-    # ── Phase 3: Render pages as JPEG images ──────────────────────
-    MAX_PX = 1999
+    # ── Phase 3: Render pages as JPEG images (cached, see plan_render.py) ──
+    def render_progress(done, total):
+        update(3, f'Rendering drawing pages ({done}/{total})...', 35 + int(30 * done / max(total, 1)))
+
+    rendered = plan_render.render_pages(fpath, plan_index.file_hash(fpath),
+                                        [pi['num'] for pi in image_pages], progress=render_progress)
     images_b64 = []
-    for idx, pi in enumerate(image_pages):
-        update(3, f'Rendering page {pi["num"]} ({idx+1}/{len(image_pages)})...', 35 + int(30 * idx / max(len(image_pages), 1)))
-        try:
-            page = doc[pi['num'] - 1]
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            if pix.width > MAX_PX or pix.height > MAX_PX:
-                scale = min(MAX_PX / pix.width, MAX_PX / pix.height)
-                zoom = 2.0 * scale
-                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
-            img_bytes = pix.tobytes("jpeg")
-            b64 = base64.standard_b64encode(img_bytes).decode('ascii')
-            sheet_label = ', '.join(sorted(pi.get('sheet_ids', set()))) or ''
-            label = f"Page {pi['num']}"
-            if sheet_label:
-                label += f" — Sheet {sheet_label}"
-            images_b64.append({
-                'page_num': pi['num'], 'b64': b64, 'label': label
-            })
-        except Exception:
+    for pi in image_pages:
+        if pi['num'] not in rendered:
             continue
-
-    doc.close()
+        b64 = base64.standard_b64encode(rendered[pi['num']]).decode('ascii')
+        sheet_label = ', '.join(sorted(pi.get('sheet_ids', set()))) or ''
+        label = f"Page {pi['num']}"
+        if sheet_label:
+            label += f" — Sheet {sheet_label}"
+        images_b64.append({
+            'page_num': pi['num'], 'b64': b64, 'label': label
+        })
 
     # ── Phase 4: Build spec text ──────────────────────────────────
     update(4, 'Preparing specification text...', 65)
@@ -12617,13 +11807,7 @@ def _do_plan_review(pid, fpath, plan_data, job_context, api_key):
         spec_text += entry
 
     if not images_b64 and not spec_text.strip():
-        prog['error'] = 'Could not extract any content from this PDF.'
-        prog['done'] = True
-        conn2 = get_db()
-        conn2.execute("UPDATE plans SET status='Uploaded', updated_at=datetime('now','localtime') WHERE id=?", (pid,))
-        conn2.commit()
-        conn2.close()
-        return
+        raise job_queue.JobFailed('Could not extract any content from this PDF.')
 
     # ── Phase 5: Send to Claude Vision ────────────────────────────
     update(5, f'Sending {len(images_b64)} images to AI for analysis...', 70)
@@ -12706,6 +11890,7 @@ CRITICAL RULES:
         "text": "\nNow analyze all the images and text above. Return your findings as JSON."
     })
 
+    response_text = ''
     try:
         client = anthropic.Anthropic(api_key=api_key)
         update(5, 'Extracting data from plans (this takes 30-90 seconds)...', 75)
@@ -12766,14 +11951,7 @@ CRITICAL RULES:
             "electrical": [], "notes_and_details": [], "sheets_analyzed": [],
             "findings": [{"type": "info", "category": "Review", "message": "AI review completed — see summary for details."}],
         }
-    except Exception as e:
-        prog['error'] = str(e)
-        prog['done'] = True
-        conn2 = get_db()
-        conn2.execute("UPDATE plans SET status='Uploaded', updated_at=datetime('now','localtime') WHERE id=?", (pid,))
-        conn2.commit()
-        conn2.close()
-        return
+    # Other API errors propagate: the queue retries once, then on_fail resets the plan
 
     # Save to DB
     update(6, 'Saving review...', 95)
@@ -12785,10 +11963,7 @@ CRITICAL RULES:
     conn2.commit()
     conn2.close()
 
-    prog['pct'] = 100
-    prog['message'] = 'Review complete!'
-    prog['done'] = True
-    prog['result'] = review
+    return review
 
 
 def _resolve_takeoff_prices(conn, job_id):
@@ -12861,34 +12036,20 @@ def _resolve_takeoff_prices(conn, job_id):
 
     # ── Tier 2b: Historical from invoices ──
     try:
-        inv_rows = conn.execute('''
-            SELECT si.line_items, si.invoice_date,
-                   bc.supplier_name
-            FROM supplier_invoices si
-            JOIN billtrust_config bc ON si.supplier_config_id = bc.id
-            ORDER BY si.invoice_date DESC
-        ''').fetchall()
-        import json as _json
-        for inv in inv_rows:
-            try:
-                items = _json.loads(inv['line_items'] or '[]')
-            except (ValueError, TypeError):
+        for r in invoice_lines.latest_by_code(conn):
+            pc = r['product_code']
+            if pc in prices:
                 continue
-            for li in items:
-                pc = (li.get('product_code') or li.get('sku') or '').strip()
-                if not pc or pc in prices:
-                    continue
-                unit_price = float(li.get('unit_price', 0) or 0)
-                uom = (li.get('uom') or li.get('unit_of_measure') or '').upper()
-                if uom in ('C', 'PER C', 'PERC'):
-                    unit_price = unit_price / 100.0
-                elif uom in ('M', 'PER M', 'PERM'):
-                    unit_price = unit_price / 1000.0
-                prices[pc] = {
-                    'price': round(unit_price, 4),
-                    'source': f"{inv['supplier_name']} Inv ({inv['invoice_date']})",
-                    'source_type': 'historical',
-                }
+            unit_price = r['unit_price']
+            if r['uom'] in ('C', 'PER C', 'PERC'):
+                unit_price = unit_price / 100.0
+            elif r['uom'] in ('M', 'PER M', 'PERM'):
+                unit_price = unit_price / 1000.0
+            prices[pc] = {
+                'price': round(unit_price, 4),
+                'source': f"{r['supplier_name']} Inv ({r['invoice_date']})",
+                'source_type': 'historical',
+            }
     except Exception:
         pass  # invoices table may not have data
 
@@ -12898,6 +12059,28 @@ def _resolve_takeoff_prices(conn, job_id):
 @app.route('/api/plans/<int:pid>/takeoff', methods=['POST'])
 @api_role_required('owner', 'admin', 'project_manager')
 def api_plans_takeoff(pid):
+    """Queue a material takeoff from calculator questions.
+
+    Returns 202 with the background job id; poll /api/background-jobs/<id>
+    for the finished takeoff (see _run_plan_takeoff).
+    """
+    conn = get_db()
+    plan = conn.execute('SELECT id FROM plans WHERE id = ?', (pid,)).fetchone()
+    conn.close()
+    if not plan:
+        return jsonify({'error': 'Plan not found'}), 404
+
+    data = request.get_json() or {}
+    if not data.get('unit_types'):
+        return jsonify({'error': 'No unit types provided'}), 400
+
+    job_id = job_queue.enqueue('plan_takeoff', {'data': data}, ref_id=pid,
+                               created_by=session.get('user_id'), dedupe=False)
+    return jsonify({'status': 'queued', 'job_id': job_id}), 202
+
+
+@job_queue.handler('plan_takeoff')
+def _run_plan_takeoff(job):
     """Generate material takeoff from calculator questions (multi-unit-type).
 
     Comprehensive HVAC material calculation engine.
@@ -12908,19 +12091,18 @@ def api_plans_takeoff(pid):
     """
     import copy, math
 
+    pid = job.ref_id
     conn = get_db()
     plan = conn.execute('SELECT * FROM plans WHERE id = ?', (pid,)).fetchone()
     if not plan:
         conn.close()
-        return jsonify({'error': 'Plan not found'}), 404
+        raise job_queue.JobFailed('Plan not found')
 
-    data = request.get_json() or {}
+    data = job.payload['data']
 
     # ── Read unit types array ──
     unit_types = data.get('unit_types', [])
-    if not unit_types:
-        conn.close()
-        return jsonify({'error': 'No unit types provided'}), 400
+    job.progress(1, 'Calculating materials...', 10)
 
     # ── Read building-level inputs ──
     system_type      = data.get('system_type', 'heat_pump')
@@ -12954,8 +12136,8 @@ def api_plans_takeoff(pid):
     corridor_units   = int(data.get('corridor_units', 0))         # separate HVAC for corridors/common areas
 
     # Job tax rate
-    job = conn.execute('SELECT tax_rate FROM jobs WHERE id = ?', (plan['job_id'],)).fetchone()
-    job_tax_rate = (job['tax_rate'] / 100.0) if job and job['tax_rate'] else 0.0885
+    job_row = conn.execute('SELECT tax_rate FROM jobs WHERE id = ?', (plan['job_id'],)).fetchone()
+    job_tax_rate = (job_row['tax_rate'] / 100.0) if job_row and job_row['tax_rate'] else 0.0885
 
     # ── Build takeoff ──
     takeoff = copy.deepcopy(TAKEOFF_TEMPLATE)
@@ -13569,7 +12751,7 @@ def api_plans_takeoff(pid):
     )
     conn.commit()
     conn.close()
-    return jsonify(takeoff)
+    return takeoff
 
 
 # ─── Supplier Quotes (Phase 2) ──────────────────────────────────
@@ -13950,16 +13132,31 @@ def api_generate_submittals_from_quote(qid):
 @app.route('/api/supplier-quotes/<int:qid>/parse', methods=['POST'])
 @api_role_required('owner', 'admin', 'project_manager')
 def api_parse_supplier_quote(qid):
+    """Queue parsing of a supplier quote PDF. Returns 202 with the background job id."""
+    conn = get_db()
+    q = conn.execute('SELECT file_path FROM supplier_quotes WHERE id = ?', (qid,)).fetchone()
+    conn.close()
+    if not q or not q['file_path']:
+        return jsonify({'error': 'No PDF file found for this quote'}), 404
+    if not os.path.exists(os.path.join(SUPPLIER_QUOTES_DIR, q['file_path'])):
+        return jsonify({'error': 'PDF file not found on disk'}), 404
+    job_id = job_queue.enqueue('supplier_quote_parse', {}, ref_id=qid, created_by=session.get('user_id'))
+    return jsonify({'status': 'queued', 'job_id': job_id}), 202
+
+
+@job_queue.handler('supplier_quote_parse')
+def _parse_supplier_quote(job):
     """Parse line items from a Locke Supply PDF quote using pdfplumber."""
+    qid = job.ref_id
     conn = get_db()
     q = conn.execute('SELECT file_path, supplier_name FROM supplier_quotes WHERE id = ?', (qid,)).fetchone()
     if not q or not q['file_path']:
         conn.close()
-        return jsonify({'error': 'No PDF file found for this quote'}), 404
+        raise job_queue.JobFailed('No PDF file found for this quote')
     fpath = os.path.join(SUPPLIER_QUOTES_DIR, q['file_path'])
     if not os.path.exists(fpath):
         conn.close()
-        return jsonify({'error': 'PDF file not found on disk'}), 404
+        raise job_queue.JobFailed('PDF file not found on disk')
     try:
         import pdfplumber
         import re
@@ -13971,7 +13168,8 @@ def api_parse_supplier_quote(qid):
             r'^(\d+)\s+(.+?)\s+(\d[\d,]*)\s+\d+\s+\d+\s+\w+\s+([\d,.]+)\s+([\d,.]+)\s*$'
         )
         with pdfplumber.open(fpath) as pdf:
-            for page in pdf.pages:
+            for pno, page in enumerate(pdf.pages):
+                job.progress(1, f'Reading page {pno + 1} of {len(pdf.pages)}...', int(90 * pno / len(pdf.pages)))
                 tables = page.extract_tables()
                 if not tables:
                     continue
@@ -14036,14 +13234,11 @@ def api_parse_supplier_quote(qid):
             (subtotal, qid)
         )
         conn.commit()
-        conn.close()
-        return jsonify({'ok': True, 'items_parsed': len(items), 'subtotal': subtotal})
+        return {'ok': True, 'items_parsed': len(items), 'subtotal': subtotal}
     except ImportError:
+        raise job_queue.JobFailed('pdfplumber not installed')
+    finally:
         conn.close()
-        return jsonify({'error': 'pdfplumber not installed'}), 500
-    except Exception as e:
-        conn.close()
-        return jsonify({'error': str(e)}), 500
 
 
 # ─── AI Price Check Helpers ─────────────────────────────────────
@@ -14125,43 +13320,23 @@ def _build_historical_prices(conn, items):
                         'job': r['job_name'] or '', 'ref': f"Quote #{r['quote_id']} (prefix match)"
                     })
 
-        # Source 2: supplier_invoices line_items JSON
+        # Source 2: supplier invoice lines (see invoice_lines.py)
         if sku and len(sku) >= 3:
-            inv_rows = conn.execute('''
-                SELECT si.line_items, si.invoice_number, si.invoice_date,
-                       bc.supplier_name, j.name as job_name
-                FROM supplier_invoices si
-                JOIN billtrust_config bc ON bc.id = si.supplier_config_id
-                LEFT JOIN jobs j ON j.id = si.job_id
-                WHERE si.line_items IS NOT NULL AND si.line_items != '[]'
-                ORDER BY si.invoice_date DESC LIMIT 200
-            ''').fetchall()
-            for inv in inv_rows:
-                try:
-                    inv_items = json.loads(inv['line_items'] or '[]')
-                except (json.JSONDecodeError, TypeError):
-                    continue
-                for li in inv_items:
-                    li_code = (li.get('product_code') or '').strip().upper()
-                    li_desc = (li.get('description') or '').upper()
-                    # Check product_code match or SKU in description
-                    if li_code == sku or (len(sku) >= 6 and li_code and li_code.startswith(sku[:6])) or sku in li_desc:
-                        up = float(li.get('unit_price') or 0)
-                        qty = float(li.get('qty_shipped') or li.get('qty_ordered') or li.get('quantity') or 0)
-                        ext = float(li.get('extended_price') or 0)
-                        norm_price = up
-                        pricing_unit = 'each'
-                        if qty > 0 and ext > 0 and up > 0:
-                            each_ext = qty * up
-                            per_c_ext = qty * up / 100
-                            if abs(per_c_ext - ext) < abs(each_ext - ext) * 0.5:
-                                norm_price = up / 100
-                                pricing_unit = 'per-C'
-                        sources.append({
-                            'type': 'invoice', 'price': norm_price, 'pricing_unit': pricing_unit,
-                            'supplier': inv['supplier_name'], 'date': inv['invoice_date'] or '',
-                            'job': inv['job_name'] or '', 'ref': f"Invoice {inv['invoice_number']}"
-                        })
+            for li in invoice_lines.sku_history(conn, sku):
+                up, qty, ext = li['unit_price'], li['quantity'], li['extended_price']
+                norm_price = up
+                pricing_unit = 'each'
+                if qty > 0 and ext > 0 and up > 0:
+                    each_ext = qty * up
+                    per_c_ext = qty * up / 100
+                    if abs(per_c_ext - ext) < abs(each_ext - ext) * 0.5:
+                        norm_price = up / 100
+                        pricing_unit = 'per-C'
+                sources.append({
+                    'type': 'invoice', 'price': norm_price, 'pricing_unit': pricing_unit,
+                    'supplier': li['supplier_name'], 'date': li['invoice_date'] or '',
+                    'job': li['job_name'] or '', 'ref': f"Invoice {li['invoice_number']}"
+                })
 
         # Description word overlap fallback
         if not sources and desc and len(desc) >= 10:
@@ -15291,12 +14466,10 @@ def api_create_material_request():
     job = conn.execute('SELECT name FROM jobs WHERE id = ?', (job_id,)).fetchone()
     requester = conn.execute('SELECT display_name FROM users WHERE id = ?', (session.get('user_id'),)).fetchone()
     pms = conn.execute("SELECT id FROM users WHERE role IN ('owner','admin','project_manager') AND is_active = 1").fetchall()
-    for pm in pms:
-        if pm['id'] != session.get('user_id'):
-            create_notification(pm['id'], 'material_request',
-                f"New Material Request for {job['name'] if job else 'Unknown'}",
-                f"{requester['display_name'] if requester else 'Someone'} requested materials ({len(items)} items)",
-                f"/material-requests")
+    notify_many([pm['id'] for pm in pms if pm['id'] != session.get('user_id')], 'material_request',
+        f"New Material Request for {job['name'] if job else 'Unknown'}",
+        f"{requester['display_name'] if requester else 'Someone'} requested materials ({len(items)} items)",
+        "/material-requests", conn=conn)
     conn.close()
     return jsonify({'ok': True, 'id': rid}), 201
 
@@ -15676,10 +14849,9 @@ def api_submit_order(oid):
 
     # Notify owners/admins
     users = conn.execute("SELECT id FROM users WHERE role IN ('owner','admin') AND is_active = 1").fetchall()
-    for u in users:
-        create_notification(u['id'], 'order', 'Order Submitted',
-            f"Order {order['order_number'] or 'ORD-'+str(oid)} has been submitted.",
-            f"/orders/{oid}")
+    notify_many([u['id'] for u in users], 'order', 'Order Submitted',
+        f"Order {order['order_number'] or 'ORD-'+str(oid)} has been submitted.",
+        f"/orders/{oid}", conn=conn)
     conn.close()
     return jsonify({'ok': True})
 
@@ -15773,9 +14945,7 @@ def api_check_duplicate():
 @app.route('/api/export/excel', methods=['POST'])
 @api_login_required
 def api_export_excel():
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
+    from excel_export import build_table_workbook, safe_filename, XLSX_MIMETYPE
 
     payload = request.get_json(force=True)
     title = payload.get('title', 'Export')
@@ -15783,59 +14953,9 @@ def api_export_excel():
     rows = payload.get('rows', [])
     filename = payload.get('filename', title)
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = title[:31]  # Excel sheet name limit
-
-    thin_border = Border(
-        left=Side(style='thin'), right=Side(style='thin'),
-        top=Side(style='thin'), bottom=Side(style='thin')
-    )
-    header_fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
-    header_font = Font(color='FFFFFF', bold=True, size=11)
-    money_format = '#,##0.00'
-
-    # Header row
-    for c, h in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=c, value=h)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center')
-        cell.border = thin_border
-
-    # Data rows
-    for r, row in enumerate(rows, 2):
-        for c, val in enumerate(row, 1):
-            # Try to convert money strings to numbers
-            clean = val
-            is_money = False
-            if isinstance(val, str) and val.startswith('$'):
-                is_money = True
-                try:
-                    clean = float(val.replace('$', '').replace(',', ''))
-                except ValueError:
-                    clean = val
-            cell = ws.cell(row=r, column=c, value=clean)
-            cell.border = thin_border
-            if is_money and isinstance(clean, float):
-                cell.number_format = money_format
-
-    # Auto-width
-    for c in range(1, len(headers) + 1):
-        max_len = len(str(headers[c - 1]))
-        for r in range(2, len(rows) + 2):
-            val = ws.cell(row=r, column=c).value
-            if val:
-                max_len = max(max_len, len(str(val)))
-        ws.column_dimensions[get_column_letter(c)].width = min(max_len + 3, 50)
-
-    export_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'exports')
-    os.makedirs(export_dir, exist_ok=True)
-    safe = "".join(ch if ch.isalnum() or ch in ' -_' else '' for ch in filename)
-    filepath = os.path.join(export_dir, f'{safe}.xlsx')
-    wb.save(filepath)
-    return send_file(filepath, as_attachment=True, download_name=f'{safe}.xlsx',
-                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    safe = safe_filename(filename)
+    return send_file(build_table_workbook(title, headers, rows), as_attachment=True,
+                     download_name=f'{safe}.xlsx', mimetype=XLSX_MIMETYPE)
 
 
 @app.route('/api/export/pdf', methods=['POST'])
@@ -15851,14 +14971,24 @@ def api_export_pdf():
     html = render_template('export_table_pdf.html', title=title, headers=headers,
                            rows=rows, generated_at=generated_at)
 
-    export_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'exports')
+    export_dir = pdf_render.EXPORT_DIR
     os.makedirs(export_dir, exist_ok=True)
     safe = "".join(ch if ch.isalnum() or ch in ' -_' else '' for ch in filename)
-    filepath = os.path.join(export_dir, f'{safe}.pdf')
+    base_url = os.path.dirname(os.path.abspath(__file__))
 
+    if len(html) > pdf_render.ASYNC_HTML_BYTES and not pdf_render.cached(html, base_url):
+        # Large tables render in the background into their own directory; the
+        # client polls the job, then downloads from the returned path
+        import uuid
+        token = uuid.uuid4().hex[:16]
+        os.makedirs(os.path.join(export_dir, token), exist_ok=True)
+        job_id = pdf_render.submit(html, os.path.join(export_dir, token, f'{safe}.pdf'), base_url,
+                                   created_by=session.get('user_id'))
+        return jsonify({'ok': True, 'job_id': job_id, 'path': f'/api/export/pdf/{token}/{safe}.pdf'}), 202
+
+    filepath = os.path.join(export_dir, f'{safe}.pdf')
     try:
-        wp = weasyprint.HTML(string=html, base_url=os.path.dirname(os.path.abspath(__file__)))
-        wp.write_pdf(filepath)
+        pdf_render.render(html, filepath, base_url=base_url)
     except Exception as e:
         return jsonify({'error': f'PDF generation failed: {str(e)[:200]}'}), 500
 
@@ -15866,6 +14996,20 @@ def api_export_pdf():
                      mimetype='application/pdf')
 
 
+@app.route('/api/export/pdf/<token>/<filename>')
+@api_login_required
+def api_export_pdf_download(token, filename):
+    """Download a table export rendered in the background by /api/export/pdf."""
+    import re
+    export_dir = pdf_render.EXPORT_DIR
+    if not re.fullmatch(r'[0-9a-f]{16}', token) or os.path.basename(filename) != filename:
+        return jsonify({'error': 'File not found'}), 404
+    filepath = os.path.join(export_dir, token, filename)
+    if not os.path.exists(filepath):
+        return jsonify({'error': 'File not found'}), 404
+    return send_file(filepath, as_attachment=True, download_name=filename, mimetype='application/pdf')
+
+
 # ─── Submittal AI Analysis + Duplicate Detection ────────────────
 
 @app.route('/api/submittals/analyze', methods=['POST'])
@@ -16023,11 +15167,8 @@ def api_feedback_create():
     conn.commit()
     # Notify all owners
     owners = conn.execute("SELECT id FROM users WHERE role = 'owner'").fetchall()
-    for owner in owners:
-        create_notification(
-            owner['id'], 'feedback', 'New Feedback Request',
-            f'{title}', '/feedback'
-        )
+    notify_many([owner['id'] for owner in owners], 'feedback', 'New Feedback Request',
+                f'{title}', '/feedback', conn=conn)
     conn.close()
     return jsonify({'ok': True, 'id': fb_id})
 
@@ -16493,21 +15634,16 @@ def check_reorder_alerts(conn):
     if not low_items:
         return
     # Notify warehouse + admin users
-    users = conn.execute("SELECT id FROM users WHERE role IN ('owner','admin','warehouse') AND is_active = 1").fetchall()
-    for item in low_items:
-        for u in users:
-            # Check if notification already exists (avoid duplicates)
-            existing = conn.execute(
-                "SELECT id FROM notifications WHERE user_id = ? AND type = 'inventory' AND title LIKE ? AND is_read = 0",
-                (u['id'], f'%{item["sku"]}%')
-            ).fetchone()
-            if not existing:
-                create_notification(
-                    u['id'], 'inventory',
-                    f'Low Stock: {item["sku"]}',
-                    f'{item["description"]} — {item["quantity_on_hand"]} on hand (reorder point: {item["reorder_point"]})',
-                    '/inventory'
-                )
+    user_ids = [u['id'] for u in conn.execute(
+        "SELECT id FROM users WHERE role IN ('owner','admin','warehouse') AND is_active = 1").fetchall()]
+    # dedupe_key skips users who still have an unread alert for the item
+    notify_batch([
+        (user_ids, 'inventory',
+         f'Low Stock: {item["sku"]}',
+         f'{item["description"]} — {item["quantity_on_hand"]} on hand (reorder point: {item["reorder_point"]})',
+         '/inventory', f'low_stock:{item["id"]}')
+        for item in low_items
+    ], conn=conn)
 
 # ─── Drag-Drop Invoice Upload ────────────────────────────────────
 
@@ -16644,9 +15780,16 @@ def api_list_photos():
         query += ' AND p.album_id = ?'
         params.append(int(album_id))
     query += ' ORDER BY p.created_at DESC'
-    photos = conn.execute(query, params).fetchall()
+    photos = [dict(p) for p in conn.execute(query, params).fetchall()]
+    # Grid and lightbox load the renditions; photos without them fall back to the original
+    renditions = photo_derivatives.urls(conn, [p['id'] for p in photos])
     conn.close()
-    return jsonify([dict(p) for p in photos])
+    for p in photos:
+        original = f"/api/photos/{p['id']}/file"
+        urls = renditions.get(p['id'], {})
+        p['thumb_url'] = urls.get('thumb', original)
+        p['medium_url'] = urls.get('medium', original)
+    return jsonify(photos)
 
 @app.route('/api/photos', methods=['POST'])
 @api_role_required('owner', 'admin', 'project_manager', 'warehouse')
@@ -16675,17 +15818,64 @@ def api_upload_photos():
         ids.append(cur.lastrowid)
     conn.commit()
     conn.close()
+    job_queue.enqueue('photo_derivatives', {'photo_ids': ids}, created_by=session.get('user_id'), dedupe=False)
     return jsonify({'ok': True, 'ids': ids})
 
+
+@job_queue.handler('photo_derivatives', pool='short')
+def _photo_derivatives_job(job):
+    """Thumbnail and medium renditions for uploaded photos (see photo_derivatives.py)."""
+    ids = job.payload.get('photo_ids') or []
+    conn = get_db()
+    done, failed = 0, []
+    try:
+        for n, pid in enumerate(ids):
+            job.progress(n, f'Resizing photo {n + 1} of {len(ids)}', int(100 * n / max(len(ids), 1)))
+            try:
+                photo_derivatives.generate(conn, pid)
+                conn.commit()
+                done += 1
+            except photo_derivatives.DerivativeError as e:
+                print(f"Photo derivatives: {e}")
+                failed.append(pid)
+    finally:
+        conn.close()
+    return {'generated': done, 'failed': failed}
+
 @app.route('/api/photos/<int:pid>/file')
 @api_login_required
 def api_photo_file(pid):
+    """The original, or with ?size=thumb|medium a rendition (WebP if accepted, else JPEG).
+
+    Renditions carry a strong ETag and honour Range requests; requested with
+    the ?v= from api_list_photos they are cached as immutable.
+    """
+    size = request.args.get('size')
     conn = get_db()
     photo = conn.execute('SELECT file_path FROM job_photos WHERE id = ?', (pid,)).fetchone()
+    rendition = version = None
+    fmt = request.args.get('fmt')
+    if photo and size:
+        if fmt in photo_derivatives.MIMETYPES:
+            rendition = photo_derivatives.get(conn, pid, size, fmt)
+            version = rendition['etag'][:16] if rendition else None
+        else:
+            rendition, version = photo_derivatives.negotiate(conn, pid, size, request.headers.get('Accept'))
     conn.close()
     if not photo:
         return jsonify({'error': 'Not found'}), 404
-    return send_file(os.path.join(app.root_path, photo['file_path']))
+    if rendition is None or not os.path.exists(os.path.join(app.root_path, rendition['file_path'])):
+        return send_file(os.path.join(app.root_path, photo['file_path']))
+    resp = send_file(os.path.join(app.root_path, rendition['file_path']),
+                     mimetype=photo_derivatives.MIMETYPES[rendition['format']],
+                     etag=rendition['etag'], conditional=True)
+    if request.args.get('v') == version:
+        resp.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        resp.headers['Cache-Control'] = 'private, no-cache'  # revalidate against the ETag
+    if fmt not in photo_derivatives.MIMETYPES:
+        resp.vary.add('Accept')
+    return resp
 
 @app.route('/api/photos/<int:pid>', methods=['DELETE'])
 @api_role_required('owner', 'admin', 'project_manager')
@@ -16696,6 +15886,7 @@ def api_delete_photo(pid):
         path = os.path.join(app.root_path, photo['file_path'])
         if os.path.exists(path):
             os.remove(path)
+        photo_derivatives.remove(conn, pid)
     conn.execute('DELETE FROM job_photos WHERE id = ?', (pid,))
     conn.commit()
     conn.close()
@@ -16896,52 +16087,36 @@ def api_available_materials(job_id):
 def api_job_pay_apps(job_id):
     """Get all pay apps for a job with billing totals."""
     conn = get_db()
-    contracts = conn.execute(
-        'SELECT id, contract_name, original_contract_sum, retainage_work_pct FROM pay_app_contracts WHERE job_id = ?',
-        (job_id,)
-    ).fetchall()
+    rows = pay_app_rollups.application_rows(conn, job_id)
+    conn.close()
     result = []
-    total_contract = 0
-    total_billed = 0
-    total_retainage = 0
+    contract_sums, billed_by_contract = {}, {}
     total_this_period = 0
-    for c in contracts:
-        cid = c['id']
-        apps = conn.execute(
-            'SELECT id, app_number, period_from, period_to, status FROM pay_applications WHERE contract_id = ? ORDER BY app_number',
-            (cid,)
-        ).fetchall()
-        for app in apps:
-            lines = conn.execute(
-                'SELECT COALESCE(SUM(work_this_period + materials_stored), 0) as this_period, COALESCE(SUM(total_completed), 0) as total_billed FROM pay_app_line_entries WHERE pay_app_id = ?',
-                (app['id'],)
-            ).fetchone()
-            this_period = lines['this_period'] or 0
-            billed = lines['total_billed'] or 0
-            ret_pct = c['retainage_work_pct'] or 0
-            retainage = round(billed * ret_pct / 100, 2)
-            total_this_period += this_period
-            total_billed += billed
-            total_retainage += retainage
-            result.append({
-                'id': app['id'], 'contract_id': cid,
-                'app_number': app['app_number'],
-                'period_from': app['period_from'], 'period_to': app['period_to'],
-                'contract_name': c['contract_name'],
-                'contract_sum': c['original_contract_sum'],
-                'this_period': round(this_period, 2),
-                'total_billed': round(billed, 2),
-                'retainage': retainage,
-                'status': app['status']
-            })
-        total_contract += c['original_contract_sum'] or 0
-    conn.close()
+    for r in rows:
+        ret_pct = r['retainage_work_pct'] or 0
+        contract_sums[r['contract_id']] = r['original_contract_sum'] or 0
+        if r['pay_app_id'] is None:
+            continue
+        # Rows are in application order, so the last one holds the contract's billing to date
+        billed_by_contract[r['contract_id']] = (r['billed_to_date'], ret_pct)
+        total_this_period += r['period_total']
+        result.append({
+            'id': r['pay_app_id'], 'contract_id': r['contract_id'],
+            'app_number': r['application_number'],
+            'period_to': r['period_to'],
+            'contract_name': r['project_name'],
+            'contract_sum': r['original_contract_sum'],
+            'this_period': round(r['period_total'], 2),
+            'total_billed': round(r['billed_to_date'], 2),
+            'retainage': round(r['billed_to_date'] * ret_pct / 100, 2),
+            'status': r['status']
+        })
     return jsonify({
         'apps': result,
         'totals': {
-            'contract': round(total_contract, 2),
-            'billed': round(total_billed, 2),
-            'retainage': round(total_retainage, 2),
+            'contract': round(sum(contract_sums.values()), 2),
+            'billed': round(sum(b for b, _ in billed_by_contract.values()), 2),
+            'retainage': round(sum(b * pct / 100 for b, pct in billed_by_contract.values()), 2),
             'this_period': round(total_this_period, 2),
         }
     })
@@ -17210,114 +16385,76 @@ def api_billing_summary():
     conn = get_db()
     today = datetime.now().strftime('%Y-%m-%d')
 
-    # Get all jobs
-    jobs = conn.execute("SELECT id, name, status FROM jobs ORDER BY name").fetchall()
-
     projects = []
     totals = {
         'total_contract': 0, 'total_billed': 0, 'total_paid': 0,
         'total_retained': 0, 'total_outstanding': 0, 'total_cos': 0
     }
 
-    for job in jobs:
-        job_id = job['id']
-
-        # Pay app contracts for this job
-        contracts = conn.execute(
-            'SELECT * FROM pay_app_contracts WHERE job_id = ?', (job_id,)
-        ).fetchall()
-
-        if not contracts:
+    # Every contract with its pay apps, application totals from pay_app_rollups
+    rows = pay_app_rollups.application_rows(conn)
+
+    by_contract = {}
+    for row in rows:
+        proj = by_contract.get(row['contract_id'])
+        if proj is None:
+            proj = by_contract[row['contract_id']] = {
+                'job_id': row['job_id'],
+                'job_name': row['job_name'],
+                'job_status': row['job_status'],
+                'contract_id': row['contract_id'],
+                'gc_name': row['gc_name'] or '',
+                'original_contract': row['original_contract_sum'] or 0,
+                'co_net': 0, 'total_billed': 0, 'total_paid': 0, 'total_retained': 0,
+                'pay_apps': [],
+                'retainage_pct': row['retainage_work_pct'] or 10,
+            }
+        if row['pay_app_id'] is None:
             continue
 
-        for contract in contracts:
-            cid = contract['id']
-            original_sum = contract['original_contract_sum'] or 0
-
-            # Get all pay apps for this contract
-            pay_apps = conn.execute(
-                '''SELECT pa.*, GROUP_CONCAT(
-                       COALESCE(ple.work_this_period, 0) + COALESCE(ple.materials_stored, 0)
-                   ) as line_totals
-                   FROM pay_applications pa
-                   LEFT JOIN pay_app_line_entries ple ON ple.pay_app_id = pa.id
-                   WHERE pa.contract_id = ?
-                   GROUP BY pa.id
-                   ORDER BY pa.application_number''',
-                (cid,)
-            ).fetchall()
-
-            # Calculate totals from SOV entries
-            total_billed = 0
-            total_paid = 0
-            total_retained = 0
-            co_net = 0
-
-            app_details = []
-            for pa in pay_apps:
-                # Sum work+materials for this pay app
-                entries = conn.execute(
-                    '''SELECT SUM(COALESCE(work_this_period, 0) + COALESCE(materials_stored, 0)) as period_total
-                       FROM pay_app_line_entries WHERE pay_app_id = ?''',
-                    (pa['id'],)
-                ).fetchone()
-                period_billed = entries['period_total'] or 0
-
-                ret_pct = contract['retainage_work_pct'] or 10
-                period_retained = round(period_billed * ret_pct / 100, 2)
-                period_paid_net = period_billed - period_retained if pa['status'] == 'Paid' else 0
-
-                # If approved but not paid, it's outstanding
-                if pa['status'] in ('Approved', 'Submitted'):
-                    period_paid_net = 0
-
-                total_billed += period_billed
-                if pa['status'] == 'Paid':
-                    total_paid += period_billed - period_retained
-                    total_retained += period_retained
-
-                co_net += (pa['co_additions'] or 0) - (pa['co_deductions'] or 0)
-
-                app_details.append({
-                    'id': pa['id'],
-                    'number': pa['application_number'],
-                    'period_to': pa['period_to'] or '',
-                    'date': pa['application_date'] or '',
-                    'billed': round(period_billed, 2),
-                    'retained': round(period_retained, 2),
-                    'paid': round(period_paid_net, 2),
-                    'status': pa['status'],
-                })
-
-            current_contract = original_sum + co_net
-            outstanding = total_billed - total_paid - total_retained
-
-            proj = {
-                'job_id': job_id,
-                'job_name': job['name'],
-                'job_status': job['status'],
-                'contract_id': cid,
-                'gc_name': contract['gc_name'] or '',
-                'original_contract': original_sum,
-                'co_net': round(co_net, 2),
-                'current_contract': round(current_contract, 2),
-                'total_billed': round(total_billed, 2),
-                'total_paid': round(total_paid, 2),
-                'total_retained': round(total_retained, 2),
-                'outstanding': round(outstanding, 2),
-                'pct_billed': round(total_billed / current_contract * 100, 1) if current_contract else 0,
-                'pct_collected': round(total_paid / total_billed * 100, 1) if total_billed else 0,
-                'pay_apps': app_details,
-                'retainage_pct': contract['retainage_work_pct'] or 10,
-            }
-            projects.append(proj)
+        period_billed = row['period_total'] or 0
+        period_retained = round(period_billed * proj['retainage_pct'] / 100, 2)
+        # Only paid applications count as collected; approved/submitted ones are outstanding
+        period_paid_net = period_billed - period_retained if row['status'] == 'Paid' else 0
+
+        proj['total_billed'] += period_billed
+        if row['status'] == 'Paid':
+            proj['total_paid'] += period_billed - period_retained
+            proj['total_retained'] += period_retained
+        proj['co_net'] += (row['co_additions'] or 0) - (row['co_deductions'] or 0)
+
+        proj['pay_apps'].append({
+            'id': row['pay_app_id'],
+            'number': row['application_number'],
+            'period_to': row['period_to'] or '',
+            'date': row['application_date'] or '',
+            'billed': round(period_billed, 2),
+            'retained': round(period_retained, 2),
+            'paid': round(period_paid_net, 2),
+            'status': row['status'],
+        })
 
-            totals['total_contract'] += current_contract
-            totals['total_billed'] += total_billed
-            totals['total_paid'] += total_paid
-            totals['total_retained'] += total_retained
-            totals['total_outstanding'] += outstanding
-            totals['total_cos'] += co_net
+    for proj in by_contract.values():
+        total_billed, total_paid, total_retained = proj['total_billed'], proj['total_paid'], proj['total_retained']
+        current_contract = proj['original_contract'] + proj['co_net']
+        outstanding = total_billed - total_paid - total_retained
+        totals['total_contract'] += current_contract
+        totals['total_billed'] += total_billed
+        totals['total_paid'] += total_paid
+        totals['total_retained'] += total_retained
+        totals['total_outstanding'] += outstanding
+        totals['total_cos'] += proj['co_net']
+        proj.update({
+            'co_net': round(proj['co_net'], 2),
+            'current_contract': round(current_contract, 2),
+            'total_billed': round(total_billed, 2),
+            'total_paid': round(total_paid, 2),
+            'total_retained': round(total_retained, 2),
+            'outstanding': round(outstanding, 2),
+            'pct_billed': round(total_billed / current_contract * 100, 1) if current_contract else 0,
+            'pct_collected': round(total_paid / total_billed * 100, 1) if total_billed else 0,
+        })
+        projects.append(proj)
 
     # Service invoices (non-pay-app billing)
     svc_invoices = conn.execute('''
@@ -18392,16 +17529,12 @@ def api_tc_channels():
     uid = session['user_id']
     conn = get_db()
     channels = conn.execute('''
-        SELECT c.*, (
-            SELECT COUNT(*) FROM tc_messages m
-            WHERE m.channel_id = c.id AND m.id > COALESCE(
-                (SELECT rs.last_read_message_id FROM tc_read_status rs
-                 WHERE rs.user_id = ? AND rs.channel_id = c.id), 0)
-        ) as unread_count
+        SELECT c.*, COALESCE(rs.unread_count, 0) as unread_count
         FROM tc_channels c
         JOIN tc_channel_members cm ON cm.channel_id = c.id AND cm.user_id = ?
+        LEFT JOIN tc_read_status rs ON rs.user_id = cm.user_id AND rs.channel_id = c.id
         ORDER BY c.name
-    ''', (uid, uid)).fetchall()
+    ''', (uid,)).fetchall()
     conn.close()
     return jsonify([dict(c) for c in channels])
 
@@ -18538,12 +17671,15 @@ def api_tc_send_channel_message(cid):
     conn.commit()
     conn.close()
 
-    # Notify other channel members (create_notification opens its own conn)
-    for mid in member_ids:
-        create_notification(mid, 'team_chat',
-            f'{sender_name} in #{ch_name}',
-            preview or '(file attachment)',
-            f'/team-chat?channel={cid}')
+    live = {'channel_id': cid, 'message_id': msg_id, 'sender_id': uid}
+    event_bus.publish(member_ids, 'tc_message', dict(live, unread_delta=1))
+    event_bus.publish(uid, 'tc_message', dict(live, unread_delta=0))
+
+    # Notify other channel members off the request path
+    notify_many(member_ids, 'team_chat',
+        f'{sender_name} in #{ch_name}',
+        preview or '(file attachment)',
+        f'/team-chat?channel={cid}', defer=True)
 
     return jsonify({'id': msg_id})
 
@@ -18561,7 +17697,9 @@ def api_tc_channel_read(cid):
             updated_at = datetime('now','localtime')''',
         (uid, cid, last_id, last_id))
     conn.commit()
+    total = _tc_unread_total(conn, uid)
     conn.close()
+    event_bus.publish(uid, 'tc_unread', {'total': total})
     return jsonify({'ok': True})
 
 # ─── Team Chat DMs ──────────────────────────────────────────
@@ -18571,33 +17709,15 @@ def api_tc_channel_read(cid):
 def api_tc_dm_conversations():
     uid = session['user_id']
     conn = get_db()
-    # Get unique DM peers
+    # Counters and last message are maintained on tc_read_status (team_chat_unread.py)
     rows = conn.execute('''
-        SELECT peer_id, u.display_name, u.username,
-            (SELECT MAX(m2.id) FROM tc_messages m2
-             WHERE m2.channel_id IS NULL
-             AND ((m2.sender_id = ? AND m2.dm_recipient_id = peer_id)
-               OR (m2.sender_id = peer_id AND m2.dm_recipient_id = ?))
-            ) as last_msg_id,
-            (SELECT m3.content FROM tc_messages m3 WHERE m3.id = (
-                SELECT MAX(m4.id) FROM tc_messages m4
-                WHERE m4.channel_id IS NULL
-                AND ((m4.sender_id = ? AND m4.dm_recipient_id = peer_id)
-                  OR (m4.sender_id = peer_id AND m4.dm_recipient_id = ?))
-            )) as last_message,
-            (SELECT COUNT(*) FROM tc_messages m5
-             WHERE m5.channel_id IS NULL AND m5.sender_id = peer_id AND m5.dm_recipient_id = ?
-             AND m5.id > COALESCE(
-                (SELECT rs.last_read_message_id FROM tc_read_status rs
-                 WHERE rs.user_id = ? AND rs.dm_peer_id = peer_id), 0)
-            ) as unread_count
-        FROM (
-            SELECT DISTINCT CASE WHEN sender_id = ? THEN dm_recipient_id ELSE sender_id END as peer_id
-            FROM tc_messages WHERE channel_id IS NULL AND (sender_id = ? OR dm_recipient_id = ?)
-        ) peers
-        JOIN users u ON u.id = peer_id
-        ORDER BY last_msg_id DESC
-    ''', (uid, uid, uid, uid, uid, uid, uid, uid, uid)).fetchall()
+        SELECT rs.dm_peer_id as peer_id, u.display_name, u.username,
+               rs.last_message, rs.unread_count
+        FROM tc_read_status rs
+        JOIN users u ON u.id = rs.dm_peer_id
+        WHERE rs.user_id = ? AND rs.dm_peer_id IS NOT NULL AND rs.last_message_id > 0
+        ORDER BY rs.last_message_id DESC
+    ''', (uid,)).fetchall()
     conn.close()
     return jsonify([{
         'peer_id': r['peer_id'],
@@ -18678,6 +17798,11 @@ def api_tc_send_dm(peer_id):
     conn.commit()
     conn.close()
 
+    event_bus.publish(peer_id, 'tc_message',
+                      {'dm_peer_id': uid, 'message_id': msg_id, 'sender_id': uid, 'unread_delta': 1})
+    event_bus.publish(uid, 'tc_message',
+                      {'dm_peer_id': peer_id, 'message_id': msg_id, 'sender_id': uid, 'unread_delta': 0})
+
     # Notify recipient (create_notification opens its own conn)
     create_notification(peer_id, 'team_chat',
         f'DM from {sender_name}',
@@ -18700,7 +17825,9 @@ def api_tc_dm_read(peer_id):
             updated_at = datetime('now','localtime')''',
         (uid, peer_id, last_id, last_id))
     conn.commit()
+    total = _tc_unread_total(conn, uid)
     conn.close()
+    event_bus.publish(uid, 'tc_unread', {'total': total})
     return jsonify({'ok': True})
 
 # ─── Team Chat Files & Unread ───────────────────────────────
@@ -18719,33 +17846,21 @@ def api_tc_file(msg_id):
     as_attachment = not (msg['file_type'] or '').startswith('image/')
     return send_file(fpath, download_name=msg['file_name'], as_attachment=as_attachment)
 
+def _tc_unread_total(conn, uid):
+    """Unread team chat messages for uid across channels and DMs."""
+    return conn.execute('''
+        SELECT COALESCE(SUM(rs.unread_count), 0) FROM tc_read_status rs
+        LEFT JOIN tc_channel_members cm ON cm.channel_id = rs.channel_id AND cm.user_id = rs.user_id
+        WHERE rs.user_id = ? AND (rs.dm_peer_id IS NOT NULL OR cm.id IS NOT NULL)
+    ''', (uid,)).fetchone()[0]
+
 @app.route('/api/team-chat/unread-total')
 @api_login_required
 def api_tc_unread_total():
-    uid = session['user_id']
     conn = get_db()
-    # Channel unreads
-    ch_unread = conn.execute('''
-        SELECT COALESCE(SUM(cnt), 0) as total FROM (
-            SELECT COUNT(*) as cnt FROM tc_messages m
-            JOIN tc_channel_members cm ON cm.channel_id = m.channel_id AND cm.user_id = ?
-            WHERE m.id > COALESCE(
-                (SELECT rs.last_read_message_id FROM tc_read_status rs
-                 WHERE rs.user_id = ? AND rs.channel_id = m.channel_id), 0)
-        )
-    ''', (uid, uid)).fetchone()['total']
-
-    # DM unreads
-    dm_unread = conn.execute('''
-        SELECT COUNT(*) as total FROM tc_messages m
-        WHERE m.channel_id IS NULL AND m.dm_recipient_id = ?
-        AND m.id > COALESCE(
-            (SELECT rs.last_read_message_id FROM tc_read_status rs
-             WHERE rs.user_id = ? AND rs.dm_peer_id = m.sender_id), 0)
-    ''', (uid, uid)).fetchone()['total']
-
+    total = _tc_unread_total(conn, session['user_id'])
     conn.close()
-    return jsonify({'total': ch_unread + dm_unread})
+    return jsonify({'total': total})
 
 # ─── Training ────────────────────────────────────────────────────
 
@@ -19307,8 +18422,7 @@ def api_service_invoice_generate_pdf(sid):
         return jsonify({'error': 'PDF generation not available. WeasyPrint is not installed.'}), 500
 
     try:
-        wp = weasyprint.HTML(string=html, base_url=os.path.dirname(__file__))
-        wp.write_pdf(filepath)
+        pdf_render.render(html, filepath, base_url=os.path.dirname(__file__))
     except Exception as e:
         conn.close()
         return jsonify({'error': f'PDF generation failed: {str(e)[:200]}'}), 500
@@ -19806,14 +18920,13 @@ def api_create_delivery():
     team = conn.execute(
         "SELECT id FROM users WHERE role != 'supplier' AND is_active = 1"
     ).fetchall()
-    for u in team:
-        create_notification(
-            u['id'], 'delivery',
-            f'Delivery for {job_name}',
-            f'{supplier_name or "Supplier"} — {delivery_date} at {delivery_time or "TBD"} — {len(matched_items)} items',
-            f'/deliveries/{delivery_id}'
-        )
     conn.close()
+    notify_many(
+        [u['id'] for u in team], 'delivery',
+        f'Delivery for {job_name}',
+        f'{supplier_name or "Supplier"} — {delivery_date} at {delivery_time or "TBD"} — {len(matched_items)} items',
+        f'/deliveries/{delivery_id}', defer=True
+    )
 
     # Send SMS
     time_str = f" at {delivery_time}" if delivery_time else ""
@@ -19895,7 +19008,6 @@ def api_verify_delivery(did):
     next_col = max_col + 1
 
     # Save snapshot before update
-    from database import save_snapshot
     save_snapshot(conn, job_id, f'Before delivery #{did} verification')
 
     received_count = 0
@@ -19943,14 +19055,13 @@ def api_verify_delivery(did):
     verifier = conn.execute('SELECT display_name FROM users WHERE id = ?', (session.get('user_id'),)).fetchone()
     verifier_name = verifier['display_name'] if verifier else 'Someone'
     team = conn.execute("SELECT id FROM users WHERE role != 'supplier' AND is_active = 1").fetchall()
-    for u in team:
-        create_notification(
-            u['id'], 'delivery',
-            f'Delivery Verified — {job_name}',
-            f'{verifier_name} verified {received_count} items from {supplier_name}',
-            f'/deliveries/{did}'
-        )
     conn.close()
+    notify_many(
+        [u['id'] for u in team], 'delivery',
+        f'Delivery Verified — {job_name}',
+        f'{verifier_name} verified {received_count} items from {supplier_name}',
+        f'/deliveries/{did}', defer=True
+    )
 
     # Send SMS
     sms_msg = f"✅ Delivery verified for {job_name} — {received_count} items received, verified by {verifier_name}"
@@ -20057,6 +19168,38 @@ def api_test_sms():
     return jsonify({'ok': True, 'sent_to': len(recipients)})
 
 
+# ─── Background Jobs ────────────────────────────────────────────
+
+def _can_see_job(st):
+    """Only the user who queued a job, or an owner/admin, may follow or cancel it."""
+    return st['created_by'] == session.get('user_id') or session.get('role') in ('owner', 'admin')
+
+
+@app.route('/api/background-jobs/<int:job_id>', methods=['GET'])
+@api_login_required
+def api_background_job_status(job_id):
+    """Status, progress and (when done) result of a queued job. Any worker can answer."""
+    st = job_queue.get(job_id)
+    if not st or not _can_see_job(st):
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(st)
+
+
+@app.route('/api/background-jobs/<int:job_id>/cancel', methods=['POST'])
+@api_login_required
+def api_background_job_cancel(job_id):
+    st = job_queue.get(job_id)
+    if not st or not _can_see_job(st):
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_queue.cancel(job_id))
+
+
+# Every handler is registered above; start this process's job workers
+job_queue.start()
+# Schedule due-soon / overdue notifications (see schedule_notifications.py)
+schedule_notifications.start()
+
+
 # ─── Startup ────────────────────────────────────────────────────
 
 def get_local_ip():
@@ -20070,7 +19213,6 @@ def get_local_ip():
         return '127.0.0.1'
 
 if __name__ == '__main__':
-    init_db()
     local_ip = get_local_ip()
     print(f'\n  Construction Management')
     print(f'  ────────────────────────────────')
@@ -0,0 +1,66 @@
+"""Shared helpers for the benchmark scripts in this directory.
+
+Each benchmark runs against a throwaway SQLite file so it never touches
+data/jobs.db. Run them from the repo root, e.g.:
+
+    python3 benchmarks/bench_job_loader.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import database  # noqa: E402
+
+
+def temp_database():
+    """Point database.DB_PATH at a fresh temp file, run init_db and return the path."""
+    tmpdir = tempfile.mkdtemp(prefix='jt-bench-')
+    database.DB_PATH = os.path.join(tmpdir, 'jobs.db')
+    database.init_db()
+    return database.DB_PATH
+
+
+class QueryCounter:
+    """Count statements executed on a connection via sqlite3's trace callback."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.count = 0
+
+    def _trace(self, _stmt):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        self.conn.set_trace_callback(self._trace)
+        return self
+
+    def __exit__(self, *exc):
+        self.conn.set_trace_callback(None)
+        return False
+
+
+def timed(fn, repeat=5):
+    """Return the best wall time in milliseconds over `repeat` runs of fn()."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - t0) * 1000
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    line = '  '.join(str(h).rjust(w) for h, w in zip(headers, widths))
+    print(line)
+    print('-' * len(line))
+    for r in rows:
+        print('  '.join(str(v).rjust(w) for v, w in zip(r, widths)))
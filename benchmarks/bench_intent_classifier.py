@@ -0,0 +1,114 @@
+"""Benchmark: chatbot_engine.classify_intent vs the previous per-pattern loop.
+
+The corpus is a set of typical chat messages (navigation, status questions,
+lookups, small talk that matches nothing) for every role, plus a sentence
+built around each intent keyword. With --db PATH, user messages stored in
+chat_messages in that database are added to the corpus.
+
+Three timings per role mix: the previous classifier (re.search per raw
+pattern string, NAV_MAP scan per navigate hit), the compiled classifier
+with its LRU cache cleared before every pass (cold), and with the cache warm.
+Every message must get the same intent from both.
+"""
+import re
+import sqlite3
+import sys
+
+from _common import print_table, timed
+
+import chatbot_engine as ce
+
+MESSAGES = [
+    'go to rfis', 'take me to the schedule', 'navigate to pay apps', 'pull up change orders',
+    'open submittals', 'switch to payroll', 'go to the moon', 'bring up code books', 'show me warranties',
+    'help', '?', '/help', 'hi', 'thanks!', 'what can you do', 'hello there',
+    'any overdue bills?', 'what do we owe this month', 'upcoming payments', 'expense summary please',
+    'which licenses are expiring', 'license status', 'cert renewals due',
+    'how many rfis are open', 'open rfis on Quail Creek', 'rfi status',
+    'pending change orders', 'co total for Smith Residence', 'how many change orders',
+    'rejected submittals', 'submittal status', 'documents missing for closeout',
+    'how many bids did we send this year', 'total bid value', "what's our win rate",
+    'top gcs by bids', 'bids sent in march', 'look up bid for Oak Ridge', 'list recent bids',
+    'profit on Quail Creek', 'how is the Smith job going', 'job status for Tower 2',
+    'open warranty claims', 'service calls today', 'my hours this week', 'how many hours did I work',
+    'employee hours last week', 'contract status', 'workflow summary', 'what needs my attention',
+    'search code fire protection', 'code for egress width', 'how to braze copper',
+    'how-to vacuum a line set', 'spend on Quail Creek', 'how much did we spend with Ferguson',
+    'overdue invoices', 'flagged invoices', 'compare invoices for Tower 2 vs Tower 3',
+    'price of 3 ton condenser', 'material pricing for flex duct',
+    'the crew showed up late again', 'can you remind me tomorrow', 'weather tomorrow?',
+    'R302.1 fire separation between units', 'where is the lift', 'ok', 'lol',
+    'I need the Trane XR14 install manual', 'what is the status of my timesheet',
+]
+
+
+def _legacy_nav_target(msg):
+    clean = re.sub(
+        r'^(go\s+to|take\s+me\s+to|open|navigate\s+to|show\s+me|bring\s+up|pull\s+up|switch\s+to)\s+',
+        '', msg.strip(), flags=re.IGNORECASE
+    ).strip().rstrip('?.,!')
+    lower = clean.lower()
+    if lower in ce.NAV_MAP:
+        return lower, ce.NAV_MAP[lower]
+    for key, url in ce.NAV_MAP.items():
+        if key in lower or lower in key:
+            return key, url
+    return None, None
+
+
+def _legacy_classify(msg, role):
+    msg_lower = msg.lower().strip()
+    best, best_priority = None, -1
+    for intent in ce.INTENTS:
+        if role not in intent['roles']:
+            continue
+        matched = any(re.search(p, msg_lower) for p in intent['patterns'])
+        if not matched:
+            matched = any(kw in msg_lower for kw in intent['keywords'])
+        if matched and intent['name'] == 'navigate' and not _legacy_nav_target(msg)[1]:
+            matched = False
+        if matched and intent['priority'] > best_priority:
+            best, best_priority = intent['name'], intent['priority']
+    return best
+
+
+def _corpus(db_path=None):
+    msgs = list(MESSAGES)
+    for intent in ce.INTENTS:
+        msgs += [f'hey can you tell me the {kw} for this week' for kw in intent['keywords']]
+    if db_path:
+        conn = sqlite3.connect(db_path)
+        msgs += [r[0] for r in conn.execute("SELECT content FROM chat_messages WHERE role = 'user'")]
+        conn.close()
+    return msgs
+
+
+def main():
+    db_path = sys.argv[sys.argv.index('--db') + 1] if '--db' in sys.argv else None
+    corpus = _corpus(db_path)
+    rows = []
+    for role in ce.ALL_ROLES:
+        mismatches = [m for m in corpus if _legacy_classify(m, role) != ce.classify_intent(m, role)]
+        matched = sum(1 for m in corpus if ce.classify_intent(m, role))
+
+        def cold():
+            ce._classify.cache_clear()
+            ce._nav_target.cache_clear()
+            for m in corpus:
+                ce.classify_intent(m, role)
+
+        legacy_ms = timed(lambda: [_legacy_classify(m, role) for m in corpus])
+        cold_ms = timed(cold)
+        ce._classify.cache_clear()
+        warm_ms = timed(lambda: [ce.classify_intent(m, role) for m in corpus])
+        per_msg = lambda ms: f'{ms * 1000 / len(corpus):.1f}'
+        rows.append([role, len(corpus), matched, per_msg(legacy_ms), per_msg(cold_ms), per_msg(warm_ms),
+                     f'{legacy_ms / max(cold_ms, 1e-6):.1f}x', 'yes' if not mismatches else f'NO ({len(mismatches)})'])
+        for m in mismatches[:5]:
+            print(f'  {role}: {m!r}: legacy={_legacy_classify(m, role)} new={ce.classify_intent(m, role)}')
+    print_table(['role', 'messages', 'matched', 'legacy us/msg', 'cold us/msg', 'cached us/msg',
+                 'cold speedup', 'identical'], rows)
+
+
+if __name__ == '__main__':
+    main()
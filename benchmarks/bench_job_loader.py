@@ -0,0 +1,81 @@
+"""Benchmark: query count and latency of get_job_data / build_snapshot vs line-item count.
+
+Compares the set-based loader (database.load_job_bundle) with the previous
+per-line-item N+1 access pattern, which is reproduced inline for reference.
+"""
+import random
+
+from _common import QueryCounter, database, print_table, temp_database, timed
+
+SIZES = [10, 100, 300, 600, 1200]
+ENTRY_COLS = 6
+
+
+def _seed_job(conn, n_items):
+    cur = conn.execute("INSERT INTO jobs (name, status) VALUES (?, 'In Progress')", (f'Bench {n_items}',))
+    job_id = cur.lastrowid
+    rng = random.Random(n_items)
+    for i in range(1, n_items + 1):
+        li_id = conn.execute(
+            '''INSERT INTO line_items (job_id, line_number, sku, description, quote_qty, qty_ordered, price_per)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            (job_id, i, f'SKU{i:05d}', f'Item {i}', 10, 10, rng.uniform(1, 200))
+        ).lastrowid
+        for tab in database.ENTRY_TABS:
+            conn.executemany(
+                f'INSERT INTO {tab}_entries (line_item_id, column_number, quantity, entry_date) VALUES (?, ?, ?, ?)',
+                [(li_id, c, rng.randint(1, 5), '2026-01-01') for c in range(1, ENTRY_COLS + 1)]
+            )
+    conn.commit()
+    return job_id
+
+
+def _legacy_load(conn, job_id):
+    """The pre-bundle access pattern: three entry queries per line item."""
+    conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    items = conn.execute('SELECT * FROM line_items WHERE job_id = ? ORDER BY line_number', (job_id,)).fetchall()
+    out = []
+    for li in items:
+        item = {'id': li['id'], 'line_number': li['line_number'], 'sku': li['sku']}
+        for tab in database.ENTRY_TABS:
+            rows = conn.execute(
+                f'SELECT column_number, quantity, entry_date FROM {tab}_entries WHERE line_item_id = ? ORDER BY column_number',
+                (li['id'],)
+            ).fetchall()
+            item[f'total_{tab}'] = sum(r['quantity'] or 0 for r in rows)
+            item[tab] = {str(r['column_number']): {'quantity': r['quantity'], 'entry_date': r['entry_date']} for r in rows}
+        out.append(item)
+    conn.execute('SELECT tab_type, column_number, header_name, header_date FROM column_headers WHERE job_id = ?',
+                 (job_id,)).fetchall()
+
+
+def main():
+    temp_database()
+    conn = database.get_db()
+    rows = []
+    for n in SIZES:
+        job_id = _seed_job(conn, n)
+
+        def save_cycle():
+            database.build_snapshot(conn, job_id)
+            database.get_job_data(conn, job_id)
+
+        def legacy_cycle():
+            _legacy_load(conn, job_id)
+            _legacy_load(conn, job_id)
+
+        with QueryCounter(conn) as qc_new:
+            save_cycle()
+        with QueryCounter(conn) as qc_old:
+            legacy_cycle()
+        rows.append((
+            n, qc_old.count, f'{timed(legacy_cycle):.1f}',
+            qc_new.count, f'{timed(save_cycle):.1f}',
+        ))
+    conn.close()
+    print('One save cycle = build_snapshot + get_job_data (what each grid save runs)\n')
+    print_table(['line_items', 'legacy_queries', 'legacy_ms', 'bundle_queries', 'bundle_ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Benchmark: billing summary, job pay-apps and pay-app analytics on pay_app_rollups.
+
+Seeds a few hundred pay-app contracts (SOV items with headers and retainage
+exempt lines, several applications each with an entry per line item) and
+compares the rollup readers the endpoints use (pay_app_rollups.application_rows
+and contract_rows) with the previous per-contract / per-application query
+loops, which are reproduced inline for reference. The endpoints' projects and
+totals must match the legacy figures; analytics retainage may differ by a cent
+where a half-cent total rounds the other way because the sum is taken in a
+different order. Also reports the cost the triggers add to an entry write and
+runs pay_app_rollups.verify().
+"""
+import random
+
+from _common import QueryCounter, database, print_table, temp_database, timed
+
+SIZES = [50, 200, 400]
+SOV_ITEMS = 12
+APPS = 6
+
+
+def _seed(conn, n_contracts, rng):
+    statuses = ['Paid', 'Paid', 'Approved', 'Submitted', 'Draft']
+    for _ in range(n_contracts):
+        job_id = conn.execute("INSERT INTO jobs (name, status) VALUES (?, 'In Progress')",
+                              (f'Bench job {rng.randint(1, 10**6)}',)).lastrowid
+        cid = conn.execute(
+            '''INSERT INTO pay_app_contracts (job_id, gc_name, project_name, original_contract_sum,
+                   retainage_work_pct, retainage_stored_pct) VALUES (?, ?, ?, ?, ?, ?)''',
+            (job_id, 'GC', 'Project', rng.uniform(1e5, 2e6), rng.choice([5, 10]), rng.choice([0, 5, 10]))
+        ).lastrowid
+        sov = [conn.execute(
+            '''INSERT INTO pay_app_sov_items (contract_id, item_number, description, scheduled_value,
+                   is_header, retainage_exempt, sort_order) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            (cid, i, f'Item {i}', 0 if i % 5 == 0 else rng.uniform(1e3, 1e5),
+             1 if i % 5 == 0 else 0, 1 if i % 7 == 0 else 0, i)
+        ).lastrowid for i in range(SOV_ITEMS)]
+        for n in range(1, rng.randint(1, APPS) + 1):
+            aid = conn.execute(
+                '''INSERT INTO pay_applications (contract_id, application_number, period_to, application_date,
+                       co_additions, co_deductions, status) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (cid, n, f'2026-{n:02d}-28', f'2026-{n:02d}-28', rng.choice([0, 0, 2500.0]),
+                 rng.choice([0, 0, 1000.0]), rng.choice(statuses))
+            ).lastrowid
+            conn.executemany(
+                'INSERT INTO pay_app_line_entries (pay_app_id, sov_item_id, work_this_period, materials_stored) VALUES (?,?,?,?)',
+                [(aid, s, round(rng.uniform(0, 5000), 2), rng.choice([0, 0, round(rng.uniform(0, 800), 2)]))
+                 for s in sov]
+            )
+    conn.commit()
+
+
+def _legacy_billing(conn):
+    """The pre-rollup billing summary loop (projects and totals only)."""
+    projects = []
+    totals = {'total_contract': 0, 'total_billed': 0, 'total_paid': 0,
+              'total_retained': 0, 'total_outstanding': 0, 'total_cos': 0}
+    for job in conn.execute('SELECT id, name, status FROM jobs ORDER BY name').fetchall():
+        for contract in conn.execute('SELECT * FROM pay_app_contracts WHERE job_id = ?', (job['id'],)).fetchall():
+            pay_apps = conn.execute(
+                'SELECT * FROM pay_applications WHERE contract_id = ? ORDER BY application_number',
+                (contract['id'],)).fetchall()
+            billed = paid = retained = co_net = 0
+            for pa in pay_apps:
+                period = conn.execute(
+                    '''SELECT SUM(COALESCE(work_this_period, 0) + COALESCE(materials_stored, 0)) AS t
+                       FROM pay_app_line_entries WHERE pay_app_id = ?''', (pa['id'],)).fetchone()['t'] or 0
+                ret = round(period * (contract['retainage_work_pct'] or 10) / 100, 2)
+                billed += period
+                if pa['status'] == 'Paid':
+                    paid += period - ret
+                    retained += ret
+                co_net += (pa['co_additions'] or 0) - (pa['co_deductions'] or 0)
+            current = (contract['original_contract_sum'] or 0) + co_net
+            outstanding = billed - paid - retained
+            projects.append((contract['id'], round(billed, 2), round(paid, 2), round(retained, 2),
+                             round(outstanding, 2), round(current, 2)))
+            for k, v in (('total_contract', current), ('total_billed', billed), ('total_paid', paid),
+                         ('total_retained', retained), ('total_outstanding', outstanding), ('total_cos', co_net)):
+                totals[k] += v
+    return projects, {k: round(v, 2) for k, v in totals.items()}
+
+
+def _legacy_analytics(conn):
+    """The pre-rollup analytics loop (per-contract billed / retainage / balance)."""
+    out = []
+    for c in conn.execute('SELECT * FROM pay_app_contracts ORDER BY created_at DESC').fetchall():
+        cid = c['id']
+        co = conn.execute('SELECT SUM(co_additions) AS a, SUM(co_deductions) AS d FROM pay_applications WHERE contract_id = ?',
+                          (cid,)).fetchone()
+        contract_sum = (c['original_contract_sum'] or 0) + (co['a'] or 0) - (co['d'] or 0)
+        sov = conn.execute('SELECT * FROM pay_app_sov_items WHERE contract_id = ? AND is_header = 0', (cid,)).fetchall()
+        app_ids = [a['id'] for a in conn.execute(
+            'SELECT id FROM pay_applications WHERE contract_id = ? ORDER BY application_number', (cid,)).fetchall()]
+        work = stored = ret = 0
+        if app_ids:
+            ph = ','.join('?' * len(app_ids))
+            ws = {r['sov_item_id']: r['tw'] or 0 for r in conn.execute(
+                f'SELECT sov_item_id, SUM(work_this_period) AS tw FROM pay_app_line_entries WHERE pay_app_id IN ({ph}) GROUP BY sov_item_id',
+                app_ids).fetchall()}
+            ms = {r['sov_item_id']: r['materials_stored'] or 0 for r in conn.execute(
+                'SELECT sov_item_id, materials_stored FROM pay_app_line_entries WHERE pay_app_id = ?', (app_ids[-1],)).fetchall()}
+            for item in sov:
+                w, m = ws.get(item['id'], 0), ms.get(item['id'], 0)
+                work += w
+                stored += m
+                if not item['retainage_exempt'] and (item['scheduled_value'] or 0) > 0:
+                    ret += c['retainage_work_pct'] / 100 * w + c['retainage_stored_pct'] / 100 * m
+        ret = round(ret, 2)
+        billed = work + stored - ret
+        out.append((cid, ret, round(billed, 2), round(contract_sum - billed, 2)))
+    return out
+
+
+def main():
+    temp_database()
+    from app import app
+    import pay_app_rollups
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['user_id'] = 1
+        s['role'] = 'owner'
+
+    conn = database.get_db()
+    rng = random.Random(21)
+    rows, seeded = [], 0
+    for n in SIZES:
+        _seed(conn, n - seeded, rng)
+        seeded = n
+
+        def billing():
+            return client.get('/api/billing-summary').get_json()
+
+        def analytics():
+            return client.get('/api/payapps/analytics').get_json()
+
+        new_billing, new_analytics = billing(), analytics()
+        old_projects, old_totals = _legacy_billing(conn)
+        analytics_diff = max((abs(a - b) for old, new in zip(
+            sorted(_legacy_analytics(conn)),
+            sorted((p['contract_id'], p['total_retainage'], p['total_billed'], p['balance_to_finish'])
+                   for p in new_analytics['projects']))
+            for a, b in zip(old, new)), default=0)
+        same = (
+            old_totals == new_billing['totals']
+            and sorted(old_projects) == sorted((p['contract_id'], p['total_billed'], p['total_paid'], p['total_retained'],
+                                                p['outstanding'], p['current_contract']) for p in new_billing['projects'])
+            and analytics_diff < 0.0101
+        )
+        with QueryCounter(conn) as qc_old:
+            _legacy_billing(conn)
+            _legacy_analytics(conn)
+        with QueryCounter(conn) as qc_new:
+            pay_app_rollups.application_rows(conn)
+            pay_app_rollups.contract_rows(conn)
+        rows.append((
+            n, qc_old.count, qc_new.count,
+            f'{timed(lambda: _legacy_billing(conn), 3):.1f}',
+            f'{timed(lambda: pay_app_rollups.application_rows(conn), 3):.1f}',
+            f'{timed(lambda: _legacy_analytics(conn), 3):.1f}',
+            f'{timed(lambda: pay_app_rollups.contract_rows(conn), 3):.1f}',
+            f'{timed(billing, 3):.1f}', f'{timed(analytics, 3):.1f}',
+            'yes' if same else 'NO',
+        ))
+
+    # Write overhead: one entry update = entry row + application row + contract row
+    entries = [r[0] for r in conn.execute('SELECT id FROM pay_app_line_entries').fetchall()]
+
+    def write_entries():
+        for eid in rng.sample(entries, 200):
+            conn.execute('UPDATE pay_app_line_entries SET work_this_period = ? WHERE id = ?',
+                         (round(rng.uniform(0, 5000), 2), eid))
+        conn.commit()
+
+    write_ms = timed(write_entries, 3) / 200
+    problems = pay_app_rollups.verify(conn)
+    conn.close()
+
+    print(f'{SOV_ITEMS} SOV items per contract, up to {APPS} applications each\n')
+    print('Data access: legacy loops vs rollup readers; endpoint columns are full GET requests\n')
+    print_table(['contracts', 'legacy_queries', 'rollup_queries', 'legacy_billing_ms', 'rollup_billing_ms',
+                 'legacy_analytics_ms', 'rollup_analytics_ms', 'GET billing_ms', 'GET analytics_ms', 'identical'], rows)
+    print(f'\nentry update with rollup triggers: {write_ms:.3f} ms')
+    print(f'pay_app_rollups.verify(): {len(problems)} mismatches')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Benchmark: backwards planning (scheduling.plan_backwards) vs phase count.
+
+Phase graphs are generated in two shapes: a plain chain (no depends_on, so
+phases are auto-chained in sort order) and a tree where each phase depends on
+a random earlier one. About 15% of weekdays are weather-risk days. The
+previous implementation (per-day loops, a phase scan per dequeued node, a
+linear crew search) is reproduced inline and must give identical results.
+"""
+import math
+import random
+from collections import deque
+from datetime import date, timedelta
+
+from _common import print_table, timed
+
+import scheduling
+
+SIZES = [10, 50, 200, 1000]
+HOURS_PER_DAY = 10
+TODAY = date(2026, 1, 5)
+
+
+def _make_phases(n, shape, rng):
+    phases = []
+    for i in range(1, n + 1):
+        total = rng.choice([0, 40, 80, 160, 320, 640])
+        remaining = total * rng.choice([0, 0.5, 1, 1, 1])
+        phases.append({
+            'id': i,
+            'depends_on': rng.randint(1, i - 1) if shape == 'tree' and i > 1 else None,
+            '_total_hours': total,
+            '_remaining_hours': remaining,
+        })
+    return phases
+
+
+def _risk_dates(deadline, rng):
+    out, d = set(), TODAY
+    while d <= deadline:
+        if d.weekday() < 5 and rng.random() < 0.15:
+            out.add(d)
+        d += timedelta(days=1)
+    return out
+
+
+def _legacy_plan(phases, deadline, today, weather_risk_dates, hours_per_day, crew_override=None):
+    """Steps 7-8 of the previous /api/schedule/backwards-plan."""
+    by_id = {p['id']: p for p in phases}
+    successors = {p['id']: [] for p in phases}
+    if any(p.get('depends_on') and p['depends_on'] in by_id for p in phases):
+        for p in phases:
+            if p.get('depends_on') and p['depends_on'] in by_id:
+                successors[p['depends_on']].append(p['id'])
+    else:
+        for i in range(len(phases) - 1):
+            successors[phases[i]['id']].append(phases[i + 1]['id'])
+
+    successor_count = {p['id']: len(successors[p['id']]) for p in phases}
+    queue = deque([pid for pid, cnt in successor_count.items() if cnt == 0])
+    topo_order, visited = [], set()
+    while queue:
+        pid = queue.popleft()
+        if pid in visited:
+            continue
+        visited.add(pid)
+        topo_order.append(pid)
+        for p in phases:
+            if pid in successors.get(p['id'], []):
+                successor_count[p['id']] -= 1
+                if successor_count[p['id']] == 0:
+                    queue.append(p['id'])
+    for p in phases:
+        if p['id'] not in visited:
+            topo_order.append(p['id'])
+
+    def count_work_days(start_d, end_d, skip_weather=True):
+        count, d = 0, start_d
+        while d <= end_d:
+            if d.weekday() < 5 and (not skip_weather or d not in weather_risk_dates):
+                count += 1
+            d += timedelta(days=1)
+        return count
+
+    def walk_back(end_d, work_days_needed):
+        current, remaining = end_d, work_days_needed
+        while current.weekday() >= 5 or current in weather_risk_dates:
+            current -= timedelta(days=1)
+        end_d = current
+        remaining -= 1
+        while remaining > 0:
+            current -= timedelta(days=1)
+            if current.weekday() < 5 and current not in weather_risk_dates:
+                remaining -= 1
+        return current, end_d
+
+    if not crew_override:
+        total_active_hrs = sum(p['_remaining_hours'] for p in phases if p['_remaining_hours'] > 0)
+        total_avail = count_work_days(today, deadline)
+        if total_avail > 0 and total_active_hrs > 0:
+            crew = max(1, math.ceil(total_active_hrs / (total_avail * hours_per_day)))
+            days_at = lambda c: sum(max(1, math.ceil(p['_remaining_hours'] / (c * hours_per_day)))
+                                    for p in phases if p['_remaining_hours'] > 0)
+            while days_at(crew) > total_avail and crew < 50:
+                crew += 1
+        else:
+            crew = max(1, math.ceil(total_active_hrs / hours_per_day)) if total_active_hrs > 0 else 1
+    else:
+        crew = crew_override
+
+    start, end, results = {}, {}, {}
+    for pid in topo_order:
+        p = by_id[pid]
+        remaining_hrs = p['_remaining_hours']
+        valid = [start[s] for s in successors[pid] if s in start]
+        if valid:
+            boundary_end = min(valid) - timedelta(days=1)
+            while boundary_end.weekday() >= 5:
+                boundary_end -= timedelta(days=1)
+        else:
+            boundary_end = deadline
+        if remaining_hrs <= 0:
+            start[pid] = end[pid] = boundary_end
+            results[pid] = {'work_days': 0, 'crew_needed': 0, 'remaining_hours': 0,
+                            'total_hours': p['_total_hours'], 'weather_risk_days': 0,
+                            'hours_per_day_needed': 0, 'warning': 'Complete'}
+            continue
+        avail = count_work_days(today, boundary_end)
+        needed = max(1, math.ceil(remaining_hrs / (crew * hours_per_day)))
+        hpd, warning = hours_per_day, None
+        if needed > avail:
+            if avail > 0:
+                hpd = round(remaining_hrs / (crew * avail), 1)
+                needed = avail
+                if hpd > 14:
+                    warning = f'Requires {hpd}hr days — consider more crew or extending deadline'
+                else:
+                    warning = f'Extended to {hpd}hr days to meet deadline'
+            else:
+                warning = 'No available work days before deadline'
+                needed = 1
+        s, e = walk_back(boundary_end, needed)
+        start[pid], end[pid] = s, e
+        risks, d = 0, s
+        while d <= e:
+            if d.weekday() < 5 and d in weather_risk_dates:
+                risks += 1
+            d += timedelta(days=1)
+        results[pid] = {'work_days': needed, 'crew_needed': crew, 'remaining_hours': remaining_hrs,
+                        'total_hours': p['_total_hours'], 'weather_risk_days': risks,
+                        'hours_per_day_needed': hpd, 'warning': warning}
+    return start, end, results, crew
+
+
+def _new_plan(phases, deadline, today, weather_risk_dates, hours_per_day, crew_override=None):
+    plan = scheduling.plan_backwards(phases, deadline, today, scheduling.WorkCalendar(weather_risk_dates),
+                                     hours_per_day, crew_override)
+    return plan['start'], plan['end'], plan['results'], plan['crew']
+
+
+def main():
+    rows = []
+    for shape in ('chain', 'tree'):
+        for n in SIZES:
+            rng = random.Random(n)
+            phases = _make_phases(n, shape, rng)
+            # A window of roughly two weeks per phase, so most plans fit
+            deadline = TODAY + timedelta(days=14 * n)
+            risks = _risk_dates(deadline, rng)
+            for crew_override in (None, 3):
+                args = (phases, deadline, TODAY, risks, HOURS_PER_DAY, crew_override)
+                same = _legacy_plan(*args) == _new_plan(*args)
+                repeat = 1 if n >= 1000 else 3
+                legacy_ms = timed(lambda: _legacy_plan(*args), repeat=repeat)
+                new_ms = timed(lambda: _new_plan(*args), repeat=repeat)
+                rows.append([shape, n, crew_override or 'auto', f'{legacy_ms:.1f}', f'{new_ms:.1f}',
+                             f'{legacy_ms / max(new_ms, 1e-6):.0f}x', 'yes' if same else 'NO'])
+    print_table(['shape', 'phases', 'crew', 'legacy ms', 'new ms', 'speedup', 'identical'], rows)
+
+
+if __name__ == '__main__':
+    main()
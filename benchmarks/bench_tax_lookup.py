@@ -0,0 +1,81 @@
+"""Benchmark: tax_rates.lookup_tax (compiled interval table) vs the previous state walk.
+
+The previous implementation, reproduced inline, called one prefix check per
+state until one matched and then looked the ZIP up in that state's rate
+table and the city table. The corpus is every 5-digit ZIP from 00000 to
+99999, every ZIP with its own rate or city, and some malformed input. Every
+input must get the same answer from both. Also times a _seed_job_tax_rates-style
+backfill over a few thousand jobs with lookup_tax per job and with
+lookup_tax_many.
+"""
+import random
+
+from _common import print_table, timed
+
+import tax_rates as tr
+
+_LEGACY_STATE_CHECKS = {
+    'OK': lambda z: z[:2] in ('73', '74'),
+    'AR': lambda z: z[:2] in ('71', '72'),
+    'MO': lambda z: z[:2] in ('63', '64', '65'),
+    'KS': lambda z: z[:2] in ('66', '67'),
+    'TX': lambda z: z[:2] in ('75', '76', '77', '78', '79'),
+}
+
+
+def legacy_lookup_tax(zip_code):
+    zip_code = (zip_code or '').strip()[:5]
+    if not zip_code or len(zip_code) < 5:
+        return {'state': '', 'city': '', 'tax_rate': 0, 'out_of_state': False}
+    matched_state = None
+    for state_abbr, check_fn in _LEGACY_STATE_CHECKS.items():
+        if check_fn(zip_code):
+            matched_state = state_abbr
+            break
+    if matched_state:
+        rates_dict, default_rate = tr.STATE_RATES[matched_state]
+        return {
+            'state': matched_state,
+            'city': tr.ZIP_CITY_MAP.get(zip_code, ''),
+            'tax_rate': rates_dict.get(zip_code, default_rate),
+            'out_of_state': matched_state != 'OK',
+        }
+    return {'state': '', 'city': '', 'tax_rate': 0, 'out_of_state': True}
+
+
+def main():
+    rng = random.Random(24)
+    every_zip = [f'{n:05d}' for n in range(100000)]
+    special = sorted(set(tr.ZIP_CITY_MAP).union(*(r for r, _d in tr.STATE_RATES.values())))
+    malformed = ['', None, '7310', ' 73102 ', '73102-1234', '7a123', '7:000', '79￿12', 'ABCDE',
+                 '73102\n', '6:123', '70999', '80000']
+    corpus = every_zip + special + malformed
+    mismatches = [z for z in corpus if tr.lookup_tax(z) != legacy_lookup_tax(z)]
+
+    # Realistic mix: mostly in-region ZIPs, a third with their own rate/city
+    in_region = [z for z in every_zip if legacy_lookup_tax(z)['state']]
+    mix = [rng.choice(special) if rng.random() < 0.33 else rng.choice(in_region) for _ in range(20000)]
+
+    rows = []
+    for label, zips in (('every ZIP 00000-99999', every_zip), ('regional mix', mix)):
+        legacy_ms = timed(lambda: [legacy_lookup_tax(z) for z in zips], 3)
+        new_ms = timed(lambda: [tr.lookup_tax(z) for z in zips], 3)
+        rows.append((label, len(zips), f'{legacy_ms:.1f}', f'{new_ms:.1f}',
+                     f'{legacy_ms * 1000 / len(zips):.2f}', f'{new_ms * 1000 / len(zips):.2f}',
+                     f'{legacy_ms / new_ms:.1f}x'))
+
+    # Backfill: a few thousand jobs, many sharing a ZIP
+    jobs = [rng.choice(mix[:800]) for _ in range(5000)]
+    rows.append(('backfill, per job', len(jobs),
+                 f'{timed(lambda: [legacy_lookup_tax(z) for z in jobs], 3):.1f}',
+                 f'{timed(lambda: tr.lookup_tax_many(jobs), 3):.1f}', '', '', ''))
+
+    print(f'{len(tr._BOUNDS)} compiled intervals\n')
+    print_table(['corpus', 'lookups', 'legacy_ms', 'compiled_ms', 'legacy_us', 'compiled_us', 'speedup'], rows)
+    print(f'\n{len(corpus)} inputs compared, {len(mismatches)} mismatches')
+    for z in mismatches[:10]:
+        print(f'  {z!r}: legacy={legacy_lookup_tax(z)} compiled={tr.lookup_tax(z)}')
+
+
+if __name__ == '__main__':
+    main()
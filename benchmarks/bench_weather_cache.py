@@ -0,0 +1,120 @@
+"""Benchmark and offline check: weather.py cache, request coalescing and expiry.
+
+Open-Meteo is replaced with a fake fetcher (weather.set_fetcher) that counts
+calls per URL and takes FAKE_LATENCY seconds to answer, so this runs without
+network access. Each scenario reports how many upstream calls it cost and how
+long it took, and checks the call count the cache promises:
+
+  * N threads asking for the same cold key share one fetch;
+  * a second round for the same key is served from weather_cache;
+  * a point within the rounding distance reuses the entry, and the URL that
+    was fetched carries the rounded coordinates;
+  * an expired forecast is fetched again; a failing refetch returns the
+    stale copy;
+  * archive ranges older than ARCHIVE_FINAL_DAYS never expire.
+"""
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+from _common import database, print_table, temp_database
+
+import weather
+
+FAKE_LATENCY = 0.05
+THREADS = 20
+LAT, LNG = 35.46761, -97.51641
+
+
+class FakeFetcher:
+    def __init__(self):
+        self.calls = Counter()
+        self.fail = False
+
+    def __call__(self, url, timeout):
+        self.calls[url] += 1
+        time.sleep(FAKE_LATENCY)
+        if self.fail:
+            raise OSError('upstream unavailable')
+        return {'daily': {'time': [], 'url': url}}
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+
+def _concurrently(fn, n=THREADS):
+    results = [None] * n
+
+    def run(i):
+        results[i] = fn()
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def _expire_all():
+    conn = database.get_db()
+    conn.execute('UPDATE weather_cache SET expires_at = ? WHERE expires_at IS NOT NULL', (time.time() - 1,))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    temp_database()
+    fake = FakeFetcher()
+    weather.set_fetcher(fake)
+    today = date.today()
+    start, end = today, today + timedelta(days=6)
+    old_start, old_end = today - timedelta(days=60), today - timedelta(days=30)
+
+    def forecast(lat=LAT, lng=LNG):
+        return weather.forecast_daily(lat, lng, start, end)
+
+    scenarios = [
+        ('cold key, concurrent', lambda: _concurrently(forecast), 1),
+        ('warm key, concurrent', lambda: _concurrently(forecast), 0),
+        ('nearby point, same 4-place cell', lambda: forecast(LAT + 0.00002, LNG - 0.00002), 0),
+        ('forecast expired', lambda: (_expire_all(), forecast()), 1),
+        ('expired, upstream failing', lambda: (_expire_all(), setattr(fake, 'fail', True), forecast()), 1),
+        ('archive, final range', lambda: (setattr(fake, 'fail', False),
+                                          weather.archive_daily(LAT, LNG, old_start, old_end)), 1),
+        ('archive, after expiry pass', lambda: (_expire_all(),
+                                                weather.archive_daily(LAT, LNG, old_start, old_end)), 0),
+    ]
+
+    rows, failures = [], []
+    for label, fn, expected in scenarios:
+        before = fake.total
+        t0 = time.perf_counter()
+        try:
+            fn()
+            outcome = 'ok'
+        except Exception as e:
+            outcome = f'raised {e.__class__.__name__}'
+        ms = (time.perf_counter() - t0) * 1000
+        calls = fake.total - before
+        if calls != expected or outcome != 'ok':
+            failures.append(f'{label}: {calls} upstream calls (expected {expected}), {outcome}')
+        rows.append((label, calls, expected, f'{ms:.1f}', outcome))
+
+    unrounded = [url for url in fake.calls if f'latitude={LAT}&' in url]
+    if unrounded:
+        failures.append(f'{len(unrounded)} request(s) used unrounded coordinates')
+    weather.set_fetcher(None)
+
+    print(f'Fake upstream latency {FAKE_LATENCY * 1000:.0f} ms, {THREADS} threads per concurrent scenario\n')
+    print_table(['scenario', 'upstream_calls', 'expected', 'ms', 'result'], rows)
+    print(f'\n{len(scenarios) + 1} checks, {len(failures)} failed')
+    for f in failures:
+        print(f'  {f}')
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,8 @@ import random
 import hashlib
 from datetime import datetime, timedelta
 
+import invoice_lines
+
 
 # ---------------------------------------------------------------------------
 # Real BillTrust API Client
@@ -522,6 +524,8 @@ def _upsert_invoice(db_conn, supplier_config_id, inv):
         supplier_config_id: FK to billtrust_config.id.
         inv: Invoice dict (from API or mock).
 
+    The normalized supplier_invoice_lines rows are rewritten as well.
+
     Returns:
         True if a new row was inserted, False if an existing row was updated.
     """
@@ -567,9 +571,10 @@ def _upsert_invoice(db_conn, supplier_config_id, inv):
             inv.get('job_id'),
             existing['id'],
         ))
+        invoice_lines.sync(db_conn, existing['id'])
         return False
     else:
-        db_conn.execute('''
+        cur = db_conn.execute('''
             INSERT INTO supplier_invoices
                 (supplier_config_id, billtrust_id, invoice_number, invoice_date,
                  due_date, status, po_number, subtotal, tax_amount, total,
@@ -594,6 +599,7 @@ def _upsert_invoice(db_conn, supplier_config_id, inv):
             line_items_json,
             inv.get('job_id'),
         ))
+        invoice_lines.sync(db_conn, cur.lastrowid)
         return True
 
 
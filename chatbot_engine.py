@@ -1,8 +1,11 @@
 """Smart chatbot engine with intent classification, entity extraction, and role-based permissions."""
 
-import json
 import re
 from datetime import datetime, timedelta
+from functools import lru_cache
+
+import search_index
+import invoice_lines
 
 
 # ─── Navigation Map ─────────────────────────────────────────────
@@ -537,17 +540,22 @@ def extract_howto_query(msg):
     return clean.strip()
 
 
+_NAV_PREFIX = re.compile(
+    r'^(go\s+to|take\s+me\s+to|open|navigate\s+to|show\s+me|bring\s+up|pull\s+up|switch\s+to)\s+',
+    re.IGNORECASE
+)
+
+
 def extract_nav_target(msg):
     """Extract navigation destination from message."""
-    clean = re.sub(
-        r'^(go\s+to|take\s+me\s+to|open|navigate\s+to|show\s+me|bring\s+up|pull\s+up|switch\s+to)\s+',
-        '', msg.strip(), flags=re.IGNORECASE
-    ).strip().rstrip('?.,!')
+    return _nav_target(_NAV_PREFIX.sub('', msg.strip()).strip().rstrip('?.,!').lower())
+
+
+@lru_cache(maxsize=1024)
+def _nav_target(lower):
     # Try exact match first, then partial
-    lower = clean.lower()
     if lower in NAV_MAP:
         return lower, NAV_MAP[lower]
-    # Partial match
     for key, url in NAV_MAP.items():
         if key in lower or lower in key:
             return key, url
@@ -556,39 +564,75 @@ def extract_nav_target(msg):
 
 # ─── Intent Classification ───────────────────────────────────────
 
-def classify_intent(msg, role):
-    """Match message to best intent the user's role allows."""
-    msg_lower = msg.lower().strip()
-    best = None
-    best_priority = -1
+# Intents that only count when a check on the raw message also passes
+_INTENT_CHECKS = {
+    'navigate': lambda msg: extract_nav_target(msg)[1] is not None,
+}
 
-    for intent in INTENTS:
-        if role not in intent['roles']:
-            continue
 
-        matched = False
-        for pattern in intent['patterns']:
-            if re.search(pattern, msg_lower):
-                matched = True
-                break
+def _intent_branch(intent):
+    """One regex alternative that matches wherever any of the intent's patterns or keywords would."""
+    alts = [f'(?:{p})' for p in intent['patterns']] + [re.escape(kw) for kw in intent['keywords']]
+    # A lookahead from position 0 acts like re.search for each alternative; (?s:.*?)
+    # lets it start anywhere without changing what '.' means inside the patterns
+    return f"(?=(?s:.*?)(?:{'|'.join(alts)}))" if alts else None
+
+
+def _build_classifier(intents):
+    """Per role, the stages classify_intent tries in priority order.
+
+    A stage is (regex, names): runs of intents without a check are fused into
+    one alternation whose branches are ordered by priority, so the first
+    branch that matches is the winning intent. Checked intents get a stage
+    of their own. Equal priorities keep INTENTS order, as before.
+    """
+    ranked = sorted(intents, key=lambda i: -i['priority'])
+    roles = {r for i in intents for r in i['roles']}
+    stages_by_role = {}
+    for role in roles:
+        stages, run = [], []
+
+        def flush():
+            if run:
+                rx = '^(?:' + '|'.join(f'{b}(?P<i{n}>)' for n, (b, _) in enumerate(run)) + ')'
+                stages.append((re.compile(rx), [name for _, name in run]))
+                run.clear()
+
+        for intent in ranked:
+            if role not in intent['roles']:
+                continue
+            branch = _intent_branch(intent)
+            if branch is None:
+                continue
+            if intent['name'] in _INTENT_CHECKS:
+                flush()
+                stages.append((re.compile(branch), [intent['name']]))
+            else:
+                run.append((branch, intent['name']))
+        flush()
+        stages_by_role[role] = stages
+    return stages_by_role
+
+
+_CLASSIFIER = _build_classifier(INTENTS)
 
-        if not matched:
-            for kw in intent['keywords']:
-                if kw in msg_lower:
-                    matched = True
-                    break
 
-        # For navigation, only match if the target resolves to a known section
-        if matched and intent['name'] == 'navigate':
-            _, url = extract_nav_target(msg)
-            if not url:
-                matched = False
+def classify_intent(msg, role):
+    """Match message to best intent the user's role allows."""
+    return _classify(msg.lower().strip(), role)
 
-        if matched and intent['priority'] > best_priority:
-            best = intent['name']
-            best_priority = intent['priority']
 
-    return best
+@lru_cache(maxsize=4096)
+def _classify(msg_lower, role):
+    for rx, names in _CLASSIFIER.get(role, ()):
+        m = rx.match(msg_lower)
+        if not m:
+            continue
+        name = names[0] if len(names) == 1 else names[int(m.lastgroup[1:])]
+        check = _INTENT_CHECKS.get(name)
+        if check is None or check(msg_lower):
+            return name
+    return None
 
 
 # ─── Query Handlers ──────────────────────────────────────────────
@@ -1307,20 +1351,14 @@ def handle_code_search(conn, msg, role, user_id):
     if not query:
         return "Please provide a search term. Example: **search code fire protection**"
 
-    sections = conn.execute(
-        """SELECT cs.section_number, cs.title, cb.code FROM code_sections cs
-           JOIN code_books cb ON cs.book_id = cb.id
-           WHERE cs.section_number LIKE ? OR cs.title LIKE ?
-           ORDER BY cb.code, cs.sort_order LIMIT 10""",
-        (f'%{query}%', f'%{query}%')
-    ).fetchall()
+    sections = search_index.search_code(conn, query, limit=10)
 
     if not sections:
         return f"No code sections found matching **{query}**."
 
     lines = [f"Found **{len(sections)}** matching section(s):"]
     for s in sections:
-        lines.append(f"- **[{s['code']}]** {s['section_number']}: {s['title']}")
+        lines.append(f"- **[{s['book_code']}]** {s['section_number']}: {s['title']}")
     return '\n'.join(lines)
 
 
@@ -1331,11 +1369,7 @@ def handle_howto(conn, msg, role, user_id):
             'SELECT id, title, category FROM howto_articles ORDER BY updated_at DESC LIMIT 10'
         ).fetchall()
     else:
-        articles = conn.execute(
-            """SELECT id, title, category FROM howto_articles
-               WHERE title LIKE ? OR content LIKE ? ORDER BY updated_at DESC LIMIT 10""",
-            (f'%{query}%', f'%{query}%')
-        ).fetchall()
+        articles = search_index.search_howtos(conn, query, limit=10)
 
     if not articles:
         return "No how-to articles found." + (f" matching **{query}**" if query else "")
@@ -1537,36 +1571,15 @@ def handle_material_pricing(conn, msg, role, user_id):
 
     query = m.group(1).strip().rstrip('?.,!')
 
-    # Search in line_items JSON of supplier_invoices
-    rows = conn.execute('''
-        SELECT si.invoice_number, si.invoice_date, si.line_items,
-               bc.supplier_name
-        FROM supplier_invoices si
-        LEFT JOIN billtrust_config bc ON si.supplier_config_id = bc.id
-        WHERE si.line_items LIKE ? AND si.is_duplicate = 0
-        ORDER BY si.invoice_date DESC LIMIT 20
-    ''', (f'%{query}%',)).fetchall()
-
-    found = []
-    for r in rows:
-        try:
-            items = json.loads(r['line_items']) if r['line_items'] else []
-        except Exception:
-            continue
-        for item in items:
-            code = item.get('product_code', '') or ''
-            desc = item.get('description', '') or ''
-            if query.lower() in code.lower() or query.lower() in desc.lower():
-                found.append({
-                    'code': code,
-                    'desc': desc,
-                    'price': item.get('unit_price', 0),
-                    'date': r['invoice_date'],
-                    'supplier': r['supplier_name'],
-                    'invoice': r['invoice_number'],
-                })
-        if len(found) >= 10:
-            break
+    # Newest matching supplier invoice lines (see invoice_lines.py)
+    found = [{
+        'code': r['product_code'],
+        'desc': r['description'],
+        'price': r['unit_price'],
+        'date': r['invoice_date'],
+        'supplier': r['supplier_name'],
+        'invoice': r['invoice_number'],
+    } for r in invoice_lines.search_prices(conn, query, limit=10)]
 
     if not found:
         return f"No pricing found for **{query}**. Try a product code like **L0100** or a description keyword."
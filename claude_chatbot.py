@@ -2,9 +2,18 @@
 
 import json
 import os
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from database import get_db
 
+MODEL = "claude-haiku-4-5-20251001"
+HISTORY_MESSAGES = 20
+TOOL_WORKERS = 4
+TOOL_CACHE_TTL = 60
+TOOL_CACHE_MAX = 512
+
 # ─── Role-Based Tool Access ─────────────────────────────────────
 
 TOOL_ACCESS = {
@@ -357,20 +366,178 @@ def _resolve_job_id(conn, job_name):
     return row['id'] if row else None
 
 
-def execute_tool(tool_name, tool_input, role, user_id):
-    """Execute a tool call and return the result as a JSON string."""
+def execute_tool(tool_name, tool_input, role, user_id, conn=None):
+    """Execute a tool call and return the result as a JSON string.
+
+    Read-only tool results are cached for TOOL_CACHE_TTL seconds (see
+    invalidate_tool_cache). conn: run on the caller's connection instead of
+    opening one.
+    """
     # Check role access
     if role not in TOOL_ACCESS.get(tool_name, []):
         return json.dumps({"error": f"Access denied: {tool_name} is not available for your role."})
 
-    conn = get_db()
+    key = _cache_key(tool_name, tool_input, role, user_id)
+    if key is not None:
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached
+
+    own = conn is None
+    if own:
+        conn = get_db()
+    started = _cache_generation
     try:
-        result = _run_query(conn, tool_name, tool_input, user_id)
-        return json.dumps(result, default=str)
+        result = json.dumps(_run_query(conn, tool_name, tool_input, user_id), default=str)
     except Exception as e:
         return json.dumps({"error": f"Query failed: {str(e)}"})
     finally:
-        conn.close()
+        if own:
+            conn.close()
+    if key is not None:
+        _cache_put(key, result, started)
+    return result
+
+
+# ─── Tool Result Cache ───────────────────────────────────────────
+# Every query_* tool is read-only. Results are cached per (tool, input, role)
+# (plus user for tools that default to the caller) and dropped after
+# TOOL_CACHE_TTL, or sooner by invalidate_tool_cache() when the app writes
+# to an entity the tool reads.
+
+_JOB = 'job'
+_TIME = {_JOB, 'user', 'payroll', 'team_pay'}
+
+TOOL_ENTITIES = {
+    'query_jobs':            {_JOB},
+    'query_schedule':        {_JOB, 'schedule'},
+    'query_warranty':        {_JOB, 'warranty'},
+    'query_service_calls':   {_JOB, 'service_call'},
+    'query_my_hours':        _TIME,
+    'query_inventory':       {_JOB, 'inventory', 'material_request', 'material_shipment', 'receiving'},
+    'query_bids':            {_JOB, 'bid'},
+    'query_submittals':      {_JOB, 'submittal'},
+    'query_rfis':            {_JOB, 'rfi'},
+    'query_change_orders':   {_JOB, 'change_order'},
+    'query_documents':       {_JOB, 'document'},
+    'query_contracts':       {_JOB, 'contract'},
+    'query_licenses':        {'license'},
+    'query_pay_apps':        {_JOB, 'pay_app'},
+    'query_customers':       {'customer'},
+    'query_supplier_quotes': {_JOB, 'supplier_quote'},
+    'query_expenses':        {_JOB, 'expense', 'recurring_expense'},
+    'query_payroll':         _TIME,
+    'query_time_entries':    _TIME,
+}
+
+# Tools whose result depends on the calling user, not just the role
+_PER_USER_TOOLS = {'query_my_hours'}
+
+_tool_cache = {}  # key -> (expires_at, result json)
+_tool_cache_lock = threading.Lock()
+_cache_generation = 0  # bumped on every invalidation; results computed across one are not stored
+
+
+def _cache_key(tool_name, tool_input, role, user_id):
+    if tool_name not in TOOL_ENTITIES:
+        return None
+    try:
+        inp = json.dumps(tool_input, sort_keys=True, default=str)
+    except (TypeError, ValueError):
+        return None
+    return (tool_name, inp, role, user_id if tool_name in _PER_USER_TOOLS else None)
+
+
+def _cache_get(key):
+    with _tool_cache_lock:
+        hit = _tool_cache.get(key)
+        if hit and hit[0] > time.monotonic():
+            return hit[1]
+        return None
+
+
+def _cache_put(key, result, generation):
+    now = time.monotonic()
+    with _tool_cache_lock:
+        if generation != _cache_generation:
+            return
+        if len(_tool_cache) >= TOOL_CACHE_MAX:
+            for k in [k for k, (exp, _) in _tool_cache.items() if exp <= now] or list(_tool_cache)[:TOOL_CACHE_MAX // 4]:
+                del _tool_cache[k]
+        _tool_cache[key] = (now + TOOL_CACHE_TTL, result)
+
+
+def invalidate_tool_cache(entity_type=None):
+    """Drop cached results of tools that read entity_type ('job', 'rfi', ...); None drops everything."""
+    global _cache_generation
+    with _tool_cache_lock:
+        _cache_generation += 1
+        if entity_type is None:
+            _tool_cache.clear()
+            return
+        for k in [k for k in _tool_cache if entity_type in TOOL_ENTITIES[k[0]]]:
+            del _tool_cache[k]
+
+
+# ─── Parallel Tool Runtime ───────────────────────────────────────
+
+_tool_pool = None
+_tool_pool_lock = threading.Lock()
+_worker_local = threading.local()
+
+
+def _pool():
+    global _tool_pool
+    with _tool_pool_lock:
+        if _tool_pool is None:
+            _tool_pool = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix='chat-tool')
+        return _tool_pool
+
+
+def _worker_conn():
+    """This pool thread's own connection, opened on first use and kept for later turns."""
+    conn = getattr(_worker_local, 'conn', None)
+    if conn is None:
+        conn = _worker_local.conn = get_db()
+    return conn
+
+
+def _execute_in_worker(block, role, user_id):
+    try:
+        return execute_tool(block.name, block.input, role, user_id, conn=_worker_conn())
+    except Exception:
+        # A broken connection: drop it so the next call reconnects
+        _worker_local.conn = None
+        raise
+
+
+def run_tools(blocks, role, user_id, conn=None):
+    """tool_result blocks for the tool_use blocks of one assistant turn, in order.
+
+    Calls in one turn are independent reads, so when more than one needs
+    the database they run concurrently on the tool pool. A single call runs
+    inline on conn.
+    """
+    results = [None] * len(blocks)
+    pending = []
+    for i, block in enumerate(blocks):
+        key = _cache_key(block.name, block.input, role, user_id)
+        if key is not None and role in TOOL_ACCESS.get(block.name, []) and _cache_get(key) is None:
+            pending.append(i)
+        else:
+            # Cache hit, access denied or navigate: no query to run
+            results[i] = execute_tool(block.name, block.input, role, user_id, conn=conn)
+    if len(pending) == 1:
+        i = pending[0]
+        results[i] = execute_tool(blocks[i].name, blocks[i].input, role, user_id, conn=conn)
+    elif pending:
+        futures = {i: _pool().submit(_execute_in_worker, blocks[i], role, user_id) for i in pending}
+        for i, fut in futures.items():
+            try:
+                results[i] = fut.result()
+            except Exception as e:
+                results[i] = json.dumps({"error": f"Query failed: {str(e)}"})
+    return [{"type": "tool_result", "tool_use_id": b.id, "content": r} for b, r in zip(blocks, results)]
 
 
 def _run_query(conn, tool_name, inp, user_id):
@@ -778,6 +945,44 @@ def _run_query(conn, tool_name, inp, user_id):
 
 # ─── Main Response Generator ────────────────────────────────────
 
+def _default_client():
+    api_key = os.environ.get('ANTHROPIC_API_KEY', '')
+    if not api_key:
+        return None
+    try:
+        import anthropic
+    except ImportError:
+        return None
+    return anthropic.Anthropic(api_key=api_key)
+
+
+_client_factory = _default_client
+
+
+def set_client_factory(fn):
+    """Replace the Claude client factory (fn() -> client with .messages.create, or None to
+    use the fallback engine); None restores the default. Returns the old one."""
+    global _client_factory
+    old = _client_factory
+    _client_factory = fn or _default_client
+    return old
+
+
+def load_history(conn, session_id, limit=HISTORY_MESSAGES):
+    """The last `limit` messages of a chat session, oldest first, as Claude message dicts."""
+    rows = conn.execute(
+        '''SELECT role, content FROM (
+               SELECT id, role, content, created_at FROM chat_messages WHERE session_id = ?
+               ORDER BY created_at DESC, id DESC LIMIT ?
+           ) ORDER BY created_at ASC, id ASC''',
+        (session_id, limit)
+    ).fetchall()
+    return [{
+        "role": r['role'] if r['role'] in ('user', 'assistant') else 'user',
+        "content": r['content']
+    } for r in rows]
+
+
 def generate_claude_response(conn, user_msg, role='employee', user_id=None, session_id=None):
     """Generate a response using Claude API with tool use.
 
@@ -789,30 +994,14 @@ def generate_claude_response(conn, user_msg, role='employee', user_id=None, sess
         session_id: Chat session ID for loading history
 
     Returns:
-        String response text
+        String response text, or None when Claude is unavailable
     """
-    api_key = os.environ.get('ANTHROPIC_API_KEY', '')
-    if not api_key:
+    client = _client_factory()
+    if client is None:
         return None  # Signal to caller to use fallback
 
-    try:
-        import anthropic
-    except ImportError:
-        return None
-
     # Build conversation history from DB
-    messages = []
-    if session_id:
-        history = conn.execute(
-            'SELECT role, content FROM chat_messages WHERE session_id = ? ORDER BY created_at ASC',
-            (session_id,)
-        ).fetchall()
-        # Load last 20 messages for context
-        for msg in history[-20:]:
-            messages.append({
-                "role": msg['role'] if msg['role'] in ('user', 'assistant') else 'user',
-                "content": msg['content']
-            })
+    messages = load_history(conn, session_id) if session_id else []
 
     # Add current user message
     messages.append({"role": "user", "content": user_msg})
@@ -823,14 +1012,14 @@ def generate_claude_response(conn, user_msg, role='employee', user_id=None, sess
 
     # Filter tools by role
     available_tools = [t for t in TOOL_DEFINITIONS if role in TOOL_ACCESS.get(t['name'], [])]
+    system = build_system_prompt(role, display_name)
 
     # Call Claude
     try:
-        client = anthropic.Anthropic(api_key=api_key)
         response = client.messages.create(
-            model="claude-haiku-4-5-20251001",
+            model=MODEL,
             max_tokens=1024,
-            system=build_system_prompt(role, display_name),
+            system=system,
             tools=available_tools,
             messages=messages,
         )
@@ -840,25 +1029,17 @@ def generate_claude_response(conn, user_msg, role='employee', user_id=None, sess
             if response.stop_reason != 'tool_use':
                 break
 
-            # Extract text and tool calls
-            tool_results = []
-            for block in response.content:
-                if block.type == 'tool_use':
-                    result = execute_tool(block.name, block.input, role, user_id)
-                    tool_results.append({
-                        "type": "tool_result",
-                        "tool_use_id": block.id,
-                        "content": result
-                    })
+            tool_blocks = [block for block in response.content if block.type == 'tool_use']
+            tool_results = run_tools(tool_blocks, role, user_id, conn=conn)
 
             # Continue conversation with tool results
             messages.append({"role": "assistant", "content": response.content})
             messages.append({"role": "user", "content": tool_results})
 
             response = client.messages.create(
-                model="claude-haiku-4-5-20251001",
+                model=MODEL,
                 max_tokens=1024,
-                system=build_system_prompt(role, display_name),
+                system=system,
                 tools=available_tools,
                 messages=messages,
             )
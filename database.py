@@ -1,20 +1,268 @@
 import sqlite3
-import json
+import hashlib
+import inspect
 import os
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from flask import g, has_app_context
+import job_rollups
+import team_chat_unread
+import job_queue
+import plan_index
+import weather
+import schedule_notifications
+import search_index
+import invoice_lines
+import pay_app_rollups
+import photo_derivatives
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process migration lock
+    fcntl = None
 
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'jobs.db')
 
-def get_db():
+# Applied once per physical connection. WAL + synchronous=NORMAL is durable
+# against application crashes (a power loss may drop the last commits).
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('foreign_keys', 'ON'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', '-16000'),        # 16 MB page cache
+    ('mmap_size', '134217728'),      # 128 MB memory-mapped reads
+    ('temp_store', 'MEMORY'),
+)
+
+# ─── Connections ────────────────────────────────────────────────
+#
+# Inside a Flask app context get_db() returns the request's connection, kept
+# on flask.g, so every get_db() during one request shares it. Between requests
+# the connection stays warm in a per-thread slot and is reused by the next
+# request that thread serves. Outside an app context (background threads,
+# scripts, init_db) each call opens a private connection, as before.
+#
+# conn.close() keeps working: callers release their reference, and when the
+# last one is released an uncommitted transaction is rolled back, matching a
+# real close. The connection itself is returned at app-context teardown.
+#
+# Because the connection is shared, a helper that commits on it also commits
+# whatever the route has written so far. Helpers that commit their own work
+# (job queue inserts, cache writes, notifications) use connect() instead.
+#
+# Statements are counted for request_db_stats() only with DB_STATS_HEADERS=1;
+# the trace callback costs a Python call per statement.
+
+COUNT_QUERIES = os.environ.get('DB_STATS_HEADERS') == '1'
+
+_thread_local = threading.local()
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connection shared by every get_db() call within one request."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = None
+        self.refs = 0
+        self.queries = 0
+
+    def close(self):
+        self.refs = max(0, self.refs - 1)
+        if self.refs == 0 and self.in_transaction:
+            self.rollback()
+
+    def really_close(self):
+        sqlite3.Connection.close(self)
+
+
+def _apply_pragmas(conn):
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name}={value}')
+
+
+def _connect():
     conn = sqlite3.connect(DB_PATH, timeout=10)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA foreign_keys=ON")
+    _apply_pragmas(conn)
     return conn
 
+
+def _checkout():
+    """Take this thread's warm connection, or open one. Returns (conn, opened)."""
+    conn = getattr(_thread_local, 'conn', None)
+    _thread_local.conn = None
+    if conn is not None and conn.path == DB_PATH:
+        return conn, False
+    if conn is not None:
+        conn.really_close()
+    conn = sqlite3.connect(DB_PATH, timeout=10, factory=PooledConnection)
+    conn.path = DB_PATH
+    conn.row_factory = sqlite3.Row
+    _apply_pragmas(conn)
+
+    if COUNT_QUERIES:
+        def count(_sql):
+            conn.queries += 1
+        conn.set_trace_callback(count)
+    return conn, True
+
+
+def get_db():
+    if not has_app_context():
+        return _connect()
+    conn = g.get('_db_conn')
+    if conn is None:
+        conn, opened = _checkout()
+        conn.queries = 0
+        g._db_conn = conn
+        g._db_stats = {'get_db_calls': 0, 'connections_opened': int(opened)}
+    conn.refs += 1
+    g._db_stats['get_db_calls'] += 1
+    return conn
+
+
+def connect():
+    """A private connection, never the request's shared one. The caller closes it.
+
+    SQLite allows one writer: a route must commit its own writes before
+    calling a helper that writes on a private connection, or that write
+    waits on the route's lock.
+    """
+    return _connect()
+
+
+def request_db_stats():
+    """Connection/query counts for the current request, or None if it has not touched the DB.
+
+    queries is None unless DB_STATS_HEADERS=1 (see COUNT_QUERIES).
+    """
+    if not has_app_context() or g.get('_db_conn') is None:
+        return None
+    return dict(g._db_stats, queries=g._db_conn.queries if COUNT_QUERIES else None)
+
+
+def release_request_db(exc=None):
+    """App-context teardown: roll back anything uncommitted and park the connection for reuse."""
+    conn = g.pop('_db_conn', None)
+    g.pop('_db_stats', None)
+    if conn is None:
+        return
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = sqlite3.Row
+        conn.refs = 0
+    except sqlite3.Error:
+        conn.really_close()
+        return
+    old = getattr(_thread_local, 'conn', None)
+    if old is not None:
+        old.really_close()
+    _thread_local.conn = conn
+
+# ─── Schema migrations ──────────────────────────────────────────
+#
+# PRAGMA user_version holds the schema version of the database. init_db()
+# runs only the MIGRATIONS newer than it, each followed by a version bump,
+# so an up-to-date database opens without replaying the schema history.
+# Append a (version, name, function) entry to MIGRATIONS for every schema
+# change; never edit one that has shipped.
+#
+# Seed data is tracked separately in seed_runs: each SEEDS routine runs when
+# the SHA-256 of its source (plus the data modules it loads) differs from the
+# hash recorded the last time it ran. Seeds keep their "only if empty"
+# guards, so a changed seed never duplicates rows.
+
+def _content_hash(fn, sources):
+    h = hashlib.sha256(inspect.getsource(fn).encode())
+    root = os.path.dirname(os.path.abspath(__file__))
+    for name in sources:
+        try:
+            with open(os.path.join(root, name), 'rb') as f:
+                h.update(f.read())
+        except OSError:
+            h.update(f'{name}: missing'.encode())
+    return h.hexdigest()
+
+
+@contextmanager
+def _migration_lock():
+    """Serialize init_db() across processes, e.g. gunicorn workers booting together."""
+    if fcntl is None:
+        yield
+        return
+    with open(DB_PATH + '-lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _run_migrations(conn):
+    """Apply pending migrations; returns [(version, name, ms)]."""
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        started = time.perf_counter()
+        migrate(conn)
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+        conn.commit()
+        applied.append((version, name, (time.perf_counter() - started) * 1000))
+    return applied
+
+
+def _run_seeds(conn):
+    """Run seeds whose content hash changed; returns [(name, ms)]."""
+    done = {r['name']: r['content_hash'] for r in conn.execute('SELECT name, content_hash FROM seed_runs')}
+    ran = []
+    for name, seed, sources in SEEDS:
+        digest = _content_hash(seed, sources)
+        if done.get(name) == digest:
+            continue
+        started = time.perf_counter()
+        seed(conn)
+        conn.execute(
+            '''INSERT INTO seed_runs (name, content_hash, applied_at) VALUES (?, ?, datetime('now','localtime'))
+               ON CONFLICT(name) DO UPDATE SET content_hash = excluded.content_hash, applied_at = excluded.applied_at''',
+            (name, digest)
+        )
+        conn.commit()
+        ran.append((name, (time.perf_counter() - started) * 1000))
+    return ran
+
+
 def init_db():
+    """Bring the database up to SCHEMA_VERSION, run changed seeds and print the startup timings."""
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    started = time.perf_counter()
     conn = get_db()
+    try:
+        with _migration_lock():
+            applied = _run_migrations(conn)
+            seeded = _run_seeds(conn)
+    finally:
+        conn.close()
+    for version, name, ms in applied:
+        print(f"Startup: migration {version} ({name}) {ms:.1f} ms")
+    for name, ms in seeded:
+        print(f"Startup: seed {name} {ms:.1f} ms")
+    total = (time.perf_counter() - started) * 1000
+    print(f"Startup: database at schema v{SCHEMA_VERSION}, {len(applied)} migrations, "
+          f"{len(seeded)} seeds, {total:.1f} ms")
+
+
+def _migrate_baseline(conn):
+    """Schema version 1: every table, index and column added before versioning.
+
+    Each step checks for what it adds, so it is safe on databases created by
+    any earlier release; those start at user_version 0 and run it once.
+    """
     conn.executescript('''
         CREATE TABLE IF NOT EXISTS jobs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -2449,57 +2697,6 @@ def init_db():
     if 'heat_kit' not in ut_cols:
         conn.execute("ALTER TABLE bid_takeoff_unit_types ADD COLUMN heat_kit TEXT NOT NULL DEFAULT ''")
 
-    # Seed default admin user if no users exist
-    user_count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-    if user_count == 0:
-        from werkzeug.security import generate_password_hash
-        conn.execute(
-            '''INSERT INTO users (username, display_name, password_hash, role, email)
-               VALUES (?, ?, ?, ?, ?)''',
-            ('admin', 'Administrator', generate_password_hash('admin'), 'owner', '')
-        )
-
-    # Seed code books if none exist
-    book_count = conn.execute("SELECT COUNT(*) FROM code_books").fetchone()[0]
-    if book_count == 0:
-        _seed_code_books(conn)
-
-    # Seed detailed code book sections (depth > 0) if not yet populated
-    detailed_count = conn.execute("SELECT COUNT(*) FROM code_sections WHERE depth > 0").fetchone()[0]
-    if detailed_count == 0:
-        try:
-            from seed_codebooks import seed_detailed_sections
-            seed_detailed_sections(conn)
-        except ImportError:
-            pass
-
-    # Seed default BillTrust supplier configs if none exist
-    bt_count = conn.execute("SELECT COUNT(*) FROM billtrust_config").fetchone()[0]
-    if bt_count == 0:
-        conn.execute("INSERT INTO billtrust_config (supplier_name, use_mock) VALUES (?, 1)", ('Locke Supply',))
-        conn.execute("INSERT INTO billtrust_config (supplier_name, use_mock) VALUES (?, 1)", ('Plumb Supply',))
-
-    # Seed equipment manuals if none exist
-    manual_count = conn.execute("SELECT COUNT(*) FROM equipment_manuals").fetchone()[0]
-    if manual_count == 0:
-        try:
-            from seed_manuals import seed_equipment_manuals
-            seed_equipment_manuals(conn)
-        except ImportError:
-            pass
-
-    # Seed Team Chat default channels + enroll all active users
-    tc_count = conn.execute("SELECT COUNT(*) FROM tc_channels").fetchone()[0]
-    if tc_count == 0:
-        conn.execute("INSERT INTO tc_channels (name, description, is_default, created_by) VALUES ('general', 'General discussion for the team', 1, NULL)")
-        conn.execute("INSERT INTO tc_channels (name, description, is_default, created_by) VALUES ('announcements', 'Company announcements', 1, NULL)")
-    # Auto-enroll active users into default channels
-    default_channels = conn.execute("SELECT id FROM tc_channels WHERE is_default = 1").fetchall()
-    active_users = conn.execute("SELECT id FROM users WHERE is_active = 1").fetchall()
-    for ch in default_channels:
-        for u in active_users:
-            conn.execute("INSERT OR IGNORE INTO tc_channel_members (channel_id, user_id) VALUES (?, ?)", (ch['id'], u['id']))
-
     # Migration: remove CHECK constraint on bid_takeoff_items.calc_basis to allow new formula types
     try:
         tbl_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='bid_takeoff_items'").fetchone()
@@ -2944,8 +3141,43 @@ def init_db():
     if 'header_date' not in ch_cols:
         conn.execute("ALTER TABLE column_headers ADD COLUMN header_date TEXT DEFAULT ''")
 
-    conn.commit()
-    conn.close()
+    # Migration: keyframe/delta storage for versions (see job_versions.py)
+    ver_cols = [row[1] for row in conn.execute("PRAGMA table_info(versions)").fetchall()]
+    for col, typedef in [
+        ('kind', "TEXT NOT NULL DEFAULT 'full'"),
+        ('base_version_id', "INTEGER"),
+        ('chain_depth', "INTEGER NOT NULL DEFAULT 0"),
+        ('payload', "BLOB"),
+    ]:
+        if col not in ver_cols:
+            conn.execute(f"ALTER TABLE versions ADD COLUMN {col} {typedef}")
+
+    # Migration: notification de-duplication keys (see notifications.notify_many)
+    notif_cols = [r[1] for r in conn.execute("PRAGMA table_info(notifications)").fetchall()]
+    if 'dedupe_key' not in notif_cols:
+        conn.execute("ALTER TABLE notifications ADD COLUMN dedupe_key TEXT")
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_dedupe
+        ON notifications(user_id, dedupe_key) WHERE dedupe_key IS NOT NULL AND is_read = 0''')
+
+    # Materialized per-job rollups + maintenance triggers (see job_rollups.py).
+    # Runs last so triggers are re-attached to any table a migration above rebuilt.
+    job_rollups.install(conn)
+    # Team chat unread counters + last-message cache (see team_chat_unread.py)
+    team_chat_unread.install(conn)
+    # Durable background job queue (see job_queue.py)
+    job_queue.install(conn)
+    # Cached page classification for plan PDFs (see plan_index.py)
+    plan_index.install(conn)
+    # Open-Meteo response cache (see weather.py)
+    weather.install(conn)
+    # Sent-notification log for the schedule sweep (see schedule_notifications.py)
+    schedule_notifications.install(conn)
+    # Full-text indexes for code books, how-tos and manuals (see search_index.py)
+    search_index.install(conn)
+    # Normalized supplier invoice line items for price lookups (see invoice_lines.py)
+    invoice_lines.install(conn)
+    # Per-application and per-contract pay-app totals + triggers (see pay_app_rollups.py)
+    pay_app_rollups.install(conn)
 
 
 def _seed_code_books(conn):
@@ -3193,8 +3425,152 @@ def _seed_code_books(conn):
             )
 
 
-def build_snapshot(conn, job_id):
-    """Build a complete JSON snapshot of a job's current state."""
+def _migrate_seed_runs(conn):
+    """Schema version 2: seed_runs, and default-channel enrollment kept by triggers.
+
+    Active users used to be enrolled into the default Team Chat channels on
+    every startup; the triggers now enroll a user when created or reactivated
+    and everyone active when a channel becomes a default one.
+    """
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS seed_runs (
+            name TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_tc_enroll_new_user
+        AFTER INSERT ON users WHEN new.is_active = 1 BEGIN
+            INSERT OR IGNORE INTO tc_channel_members (channel_id, user_id)
+            SELECT id, new.id FROM tc_channels WHERE is_default = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_tc_enroll_reactivated_user
+        AFTER UPDATE OF is_active ON users WHEN new.is_active = 1 AND old.is_active != 1 BEGIN
+            INSERT OR IGNORE INTO tc_channel_members (channel_id, user_id)
+            SELECT id, new.id FROM tc_channels WHERE is_default = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_tc_enroll_new_default_channel
+        AFTER INSERT ON tc_channels WHEN new.is_default = 1 BEGIN
+            INSERT OR IGNORE INTO tc_channel_members (channel_id, user_id)
+            SELECT new.id, id FROM users WHERE is_active = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_tc_enroll_default_channel
+        AFTER UPDATE OF is_default ON tc_channels WHEN new.is_default = 1 AND old.is_default != 1 BEGIN
+            INSERT OR IGNORE INTO tc_channel_members (channel_id, user_id)
+            SELECT new.id, id FROM users WHERE is_active = 1;
+        END;
+    ''')
+
+
+# ─── Seeds ──────────────────────────────────────────────────────
+
+def _seed_admin_user(conn):
+    """Default admin / admin login if no users exist."""
+    if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0:
+        from werkzeug.security import generate_password_hash
+        conn.execute(
+            '''INSERT INTO users (username, display_name, password_hash, role, email)
+               VALUES (?, ?, ?, ?, ?)''',
+            ('admin', 'Administrator', generate_password_hash('admin'), 'owner', '')
+        )
+
+
+def _seed_code_book_tocs(conn):
+    """Chapter-level code books if none exist."""
+    if conn.execute("SELECT COUNT(*) FROM code_books").fetchone()[0] == 0:
+        _seed_code_books(conn)
+
+
+def _seed_code_sections(conn):
+    """Detailed code book sections (depth > 0) if not yet populated."""
+    if conn.execute("SELECT COUNT(*) FROM code_sections WHERE depth > 0").fetchone()[0] == 0:
+        try:
+            from seed_codebooks import seed_detailed_sections
+            seed_detailed_sections(conn)
+        except ImportError:
+            pass
+
+
+def _seed_billtrust_suppliers(conn):
+    """Default BillTrust supplier configs if none exist."""
+    if conn.execute("SELECT COUNT(*) FROM billtrust_config").fetchone()[0] == 0:
+        conn.execute("INSERT INTO billtrust_config (supplier_name, use_mock) VALUES (?, 1)", ('Locke Supply',))
+        conn.execute("INSERT INTO billtrust_config (supplier_name, use_mock) VALUES (?, 1)", ('Plumb Supply',))
+
+
+def _seed_equipment_manuals(conn):
+    """Equipment manuals if none exist."""
+    if conn.execute("SELECT COUNT(*) FROM equipment_manuals").fetchone()[0] == 0:
+        try:
+            from seed_manuals import seed_equipment_manuals
+            seed_equipment_manuals(conn)
+        except ImportError:
+            pass
+
+
+def _seed_team_chat_channels(conn):
+    """Default Team Chat channels, with every active user enrolled."""
+    if conn.execute("SELECT COUNT(*) FROM tc_channels").fetchone()[0] == 0:
+        conn.execute("INSERT INTO tc_channels (name, description, is_default, created_by) VALUES ('general', 'General discussion for the team', 1, NULL)")
+        conn.execute("INSERT INTO tc_channels (name, description, is_default, created_by) VALUES ('announcements', 'Company announcements', 1, NULL)")
+    conn.execute('''INSERT OR IGNORE INTO tc_channel_members (channel_id, user_id)
+                    SELECT c.id, u.id FROM tc_channels c, users u WHERE c.is_default = 1 AND u.is_active = 1''')
+
+
+def _seed_job_tax_rates(conn):
+    """Tax rates from ZIP codes for jobs that have none; re-run when tax_rates.py changes."""
+    from tax_rates import lookup_tax_many
+    jobs = conn.execute("SELECT id, zip_code FROM jobs WHERE (tax_rate IS NULL OR tax_rate = 0) AND zip_code IS NOT NULL AND zip_code != ''").fetchall()
+    infos = lookup_tax_many(job['zip_code'] for job in jobs)
+    conn.executemany('UPDATE jobs SET tax_rate = ? WHERE id = ?',
+                     [(info['tax_rate'], job['id']) for job, info in zip(jobs, infos) if info['tax_rate']])
+
+
+def _migrate_photo_derivatives(conn):
+    """Thumbnail / medium renditions of job photos (see photo_derivatives.py)."""
+    # Looked up at call time: photo_derivatives imports this module, so when it
+    # is the entry point it is still half-initialized while MIGRATIONS is built
+    photo_derivatives.install(conn)
+
+
+def _migrate_job_rollup_cents(conn):
+    """Schema version 4: job_rollups money columns as integer cents, rebuilt from the raw tables."""
+    job_rollups.reinstall(conn)
+
+
+MIGRATIONS = (
+    (1, 'baseline', _migrate_baseline),
+    (2, 'seed runs and channel enrollment triggers', _migrate_seed_runs),
+    (3, 'photo derivatives', _migrate_photo_derivatives),
+    (4, 'job rollups in cents', _migrate_job_rollup_cents),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# (name, function, data modules hashed along with the function's source)
+SEEDS = (
+    ('admin_user', _seed_admin_user, ()),
+    ('code_books', _seed_code_book_tocs, ()),
+    ('code_sections', _seed_code_sections, ('seed_codebooks.py',)),
+    ('billtrust_suppliers', _seed_billtrust_suppliers, ()),
+    ('equipment_manuals', _seed_equipment_manuals, ('seed_manuals.py',)),
+    ('team_chat_channels', _seed_team_chat_channels, ()),
+    ('job_tax_rates', _seed_job_tax_rates, ('tax_rates.py',)),
+)
+
+
+ENTRY_TABS = ('received', 'shipped', 'invoiced')
+
+
+def load_job_bundle(conn, job_id):
+    """Load a job, its line items, entries and column headers in a fixed number of queries.
+
+    Entries for all line items are fetched with one query per entry table (joined
+    through line_items on job_id) instead of three queries per line item, and are
+    grouped into their API shape in the same pass. Returns None if the job is
+    missing, otherwise a dict with 'job', 'line_items', 'entries' and
+    'column_headers', where entries[tab][line_item_id] is
+    {str(column_number): {'quantity': ..., 'entry_date': ...}} in column order.
+    """
     job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
     if not job:
         return None
@@ -3203,6 +3579,66 @@ def build_snapshot(conn, job_id):
         'SELECT * FROM line_items WHERE job_id = ? ORDER BY line_number', (job_id,)
     ).fetchall()
 
+    entries = {tab: {} for tab in ENTRY_TABS}
+    if line_items:
+        # Plain tuples here: sqlite3.Row lookups by name dominate at this row count
+        cur = conn.cursor()
+        cur.row_factory = None
+        for tab in ENTRY_TABS:
+            grouped = entries[tab]
+            cur.execute(
+                f'''SELECT e.line_item_id, e.column_number, e.quantity, e.entry_date
+                   FROM {tab}_entries e
+                   JOIN line_items li ON li.id = e.line_item_id
+                   WHERE li.job_id = ?
+                   ORDER BY e.line_item_id, e.column_number''',
+                (job_id,)
+            )
+            for li_id, col, qty, entry_date in cur:
+                cells = grouped.get(li_id)
+                if cells is None:
+                    cells = grouped[li_id] = {}
+                cells[str(col)] = {'quantity': qty, 'entry_date': entry_date}
+
+    try:
+        headers = conn.execute(
+            'SELECT tab_type, column_number, header_name, header_date FROM column_headers WHERE job_id = ?',
+            (job_id,)
+        ).fetchall()
+    except Exception:
+        headers = None  # table may not exist yet
+
+    return {
+        'job': job,
+        'line_items': line_items,
+        'entries': entries,
+        'column_headers': headers,
+    }
+
+def _group_column_headers(headers):
+    """Split column_headers rows into ({tab: {col: name}}, {tab: {col: date}})."""
+    col_headers = {}
+    col_dates = {}
+    for h in headers or []:
+        tab = h['tab_type']
+        if tab not in col_headers:
+            col_headers[tab] = {}
+        col_headers[tab][str(h['column_number'])] = h['header_name']
+        if h['header_date']:
+            if tab not in col_dates:
+                col_dates[tab] = {}
+            col_dates[tab][str(h['column_number'])] = h['header_date']
+    return col_headers, col_dates
+
+def build_snapshot(conn, job_id, bundle=None):
+    """Build a complete JSON snapshot of a job's current state."""
+    if bundle is None:
+        bundle = load_job_bundle(conn, job_id)
+    if not bundle:
+        return None
+    job = bundle['job']
+    entries = bundle['entries']
+
     snapshot = {
         'job': {
             'id': job['id'],
@@ -3217,8 +3653,9 @@ def build_snapshot(conn, job_id):
         'line_items': [],
     }
 
-    for li in line_items:
+    for li in bundle['line_items']:
         item = {
+            'id': li['id'],
             'line_number': li['line_number'],
             'stock_ns': li['stock_ns'],
             'sku': li['sku'],
@@ -3229,81 +3666,18 @@ def build_snapshot(conn, job_id):
             'total_net_price': li['total_net_price'] or 0,
             'pricing_type': li['pricing_type'] if 'pricing_type' in li.keys() else 'each',
             'notes': (li['notes'] if 'notes' in li.keys() else '') or '',
-            'received': {},
-            'shipped': {},
-            'invoiced': {},
         }
-
-        for entry in conn.execute(
-            'SELECT column_number, quantity, entry_date FROM received_entries WHERE line_item_id = ?',
-            (li['id'],)
-        ).fetchall():
-            item['received'][str(entry['column_number'])] = {
-                'quantity': entry['quantity'],
-                'entry_date': entry['entry_date'],
-            }
-
-        for entry in conn.execute(
-            'SELECT column_number, quantity, entry_date FROM shipped_entries WHERE line_item_id = ?',
-            (li['id'],)
-        ).fetchall():
-            item['shipped'][str(entry['column_number'])] = {
-                'quantity': entry['quantity'],
-                'entry_date': entry['entry_date'],
-            }
-
-        for entry in conn.execute(
-            'SELECT column_number, quantity, entry_date FROM invoiced_entries WHERE line_item_id = ?',
-            (li['id'],)
-        ).fetchall():
-            item['invoiced'][str(entry['column_number'])] = {
-                'quantity': entry['quantity'],
-                'entry_date': entry['entry_date'],
-            }
-
+        for tab in ENTRY_TABS:
+            item[tab] = entries[tab].get(li['id'], {})
         snapshot['line_items'].append(item)
 
     # Include column headers and dates in snapshot
-    try:
-        headers = conn.execute(
-            'SELECT tab_type, column_number, header_name, header_date FROM column_headers WHERE job_id = ?',
-            (job_id,)
-        ).fetchall()
-        col_headers = {}
-        col_dates = {}
-        for h in headers:
-            tab = h['tab_type']
-            if tab not in col_headers:
-                col_headers[tab] = {}
-            col_headers[tab][str(h['column_number'])] = h['header_name']
-            if h['header_date']:
-                if tab not in col_dates:
-                    col_dates[tab] = {}
-                col_dates[tab][str(h['column_number'])] = h['header_date']
-        snapshot['column_headers'] = col_headers
-        snapshot['column_dates'] = col_dates
-    except Exception:
-        snapshot['column_headers'] = {}
-        snapshot['column_dates'] = {}
+    col_headers, col_dates = _group_column_headers(bundle['column_headers'])
+    snapshot['column_headers'] = col_headers
+    snapshot['column_dates'] = col_dates
 
     return snapshot
 
-def save_snapshot(conn, job_id, description='Auto-save'):
-    """Save current state as a version snapshot, then clean up old versions."""
-    snapshot = build_snapshot(conn, job_id)
-    if snapshot is None:
-        return
-    conn.execute(
-        'INSERT INTO versions (job_id, snapshot, description) VALUES (?, ?, ?)',
-        (job_id, json.dumps(snapshot), description)
-    )
-    # Keep only the last 100 versions per job
-    conn.execute('''
-        DELETE FROM versions WHERE job_id = ? AND id NOT IN (
-            SELECT id FROM versions WHERE job_id = ? ORDER BY created_at DESC LIMIT 100
-        )
-    ''', (job_id, job_id))
-
 def restore_snapshot(conn, job_id, snapshot_data):
     """Restore a job from a snapshot dict."""
     # Update job info
@@ -3365,18 +3739,17 @@ def _calc_price(qty, price, pricing_type):
         return qty * price / 1000
     return qty * price
 
-def get_job_data(conn, job_id):
+def get_job_data(conn, job_id, bundle=None):
     """Get full job data with all computed fields for the API."""
-    job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
-    if not job:
+    if bundle is None:
+        bundle = load_job_bundle(conn, job_id)
+    if not bundle:
         return None
-
-    line_items = conn.execute(
-        'SELECT * FROM line_items WHERE job_id = ? ORDER BY line_number', (job_id,)
-    ).fetchall()
+    job = bundle['job']
+    entries = bundle['entries']
 
     items = []
-    for li in line_items:
+    for li in bundle['line_items']:
         pricing_type = li['pricing_type'] if 'pricing_type' in li.keys() else 'each'
         stored_net = li['total_net_price'] or 0
         if stored_net:
@@ -3384,22 +3757,13 @@ def get_job_data(conn, job_id):
         else:
             total_net_price = _calc_price((li['qty_ordered'] or 0), (li['price_per'] or 0), pricing_type)
 
-        received = conn.execute(
-            'SELECT column_number, quantity, entry_date FROM received_entries WHERE line_item_id = ? ORDER BY column_number',
-            (li['id'],)
-        ).fetchall()
-        shipped = conn.execute(
-            'SELECT column_number, quantity, entry_date FROM shipped_entries WHERE line_item_id = ? ORDER BY column_number',
-            (li['id'],)
-        ).fetchall()
-        invoiced = conn.execute(
-            'SELECT column_number, quantity, entry_date FROM invoiced_entries WHERE line_item_id = ? ORDER BY column_number',
-            (li['id'],)
-        ).fetchall()
+        received = entries['received'].get(li['id'], {})
+        shipped = entries['shipped'].get(li['id'], {})
+        invoiced = entries['invoiced'].get(li['id'], {})
 
-        total_received = sum(r['quantity'] or 0 for r in received)
-        total_shipped = sum(s['quantity'] or 0 for s in shipped)
-        total_invoiced = sum(i['quantity'] or 0 for i in invoiced)
+        total_received = sum(r['quantity'] or 0 for r in received.values())
+        total_shipped = sum(s['quantity'] or 0 for s in shipped.values())
+        total_invoiced = sum(i['quantity'] or 0 for i in invoiced.values())
 
         quote_total = _calc_price((li['quote_qty'] or 0), (li['price_per'] or 0), pricing_type)
 
@@ -3419,31 +3783,14 @@ def get_job_data(conn, job_id):
             'total_received': total_received,
             'total_shipped': total_shipped,
             'total_invoiced': total_invoiced,
-            'received_entries': {str(r['column_number']): {'quantity': r['quantity'], 'entry_date': r['entry_date']} for r in received},
-            'shipped_entries': {str(s['column_number']): {'quantity': s['quantity'], 'entry_date': s['entry_date']} for s in shipped},
-            'invoiced_entries': {str(i['column_number']): {'quantity': i['quantity'], 'entry_date': i['entry_date']} for i in invoiced},
+            'received_entries': received,
+            'shipped_entries': shipped,
+            'invoiced_entries': invoiced,
         }
         items.append(item)
 
     # Load custom column headers
-    column_headers = {}
-    column_dates = {}
-    try:
-        headers = conn.execute(
-            'SELECT tab_type, column_number, header_name, header_date FROM column_headers WHERE job_id = ?',
-            (job_id,)
-        ).fetchall()
-        for h in headers:
-            tab = h['tab_type']
-            if tab not in column_headers:
-                column_headers[tab] = {}
-            column_headers[tab][str(h['column_number'])] = h['header_name']
-            if h['header_date']:
-                if tab not in column_dates:
-                    column_dates[tab] = {}
-                column_dates[tab][str(h['column_number'])] = h['header_date']
-    except Exception:
-        pass  # table may not exist yet
+    column_headers, column_dates = _group_column_headers(bundle['column_headers'])
 
     return {
         'job': {
@@ -3462,3 +3809,35 @@ def get_job_data(conn, job_id):
         'column_headers': column_headers,
         'column_dates': column_dates,
     }
+
+
+if __name__ == '__main__':
+    import sys
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if cmd not in ('status', 'migrate'):
+        print('usage: python3 database.py [status|migrate]')
+        raise SystemExit(2)
+
+    if cmd == 'migrate':
+        init_db()
+    conn = _connect()
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        print(f'Schema version {version} of {SCHEMA_VERSION}.')
+        for v, name, _fn in MIGRATIONS:
+            if v > version:
+                print(f'  pending migration {v}: {name}')
+        done = {}
+        if version >= 2:
+            done = {r['name']: r for r in conn.execute('SELECT * FROM seed_runs')}
+        for name, seed, sources in SEEDS:
+            run = done.get(name)
+            if run is None:
+                print(f'  seed {name}: never run')
+            elif run['content_hash'] != _content_hash(seed, sources):
+                print(f'  seed {name}: changed since {run["applied_at"]}')
+            else:
+                print(f'  seed {name}: current ({run["applied_at"]})')
+    finally:
+        conn.close()
@@ -0,0 +1,112 @@
+"""
+In-process pub/sub feeding the Server-Sent-Events stream (/api/events/stream).
+
+Each open browser tab holds one subscription: a small queue keyed by user id.
+Write paths (create_notification, team chat sends/reads) publish events for the
+affected users and the SSE generator drains the queue, so clients learn about
+new notifications and messages without polling.
+
+The bus lives in the web process. The app runs as a single gunicorn worker,
+so every publisher and subscriber share it. Events are best-effort: a slow tab
+whose queue is full drops events. Every (re)connect begins with a 'hello'
+event carrying absolute unread counts, so a client resyncs after any gap.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+# Each stream pins a gunicorn thread for as long as the tab stays open. The
+# Dockerfile runs one worker with --threads 16; streams get at most half of
+# them so uploads, exports and job polls always find a free thread. Keep this
+# at about half of --threads when changing either; over the cap the client
+# falls back to polling
+MAX_STREAMS = int(os.environ.get('EVENT_MAX_STREAMS', 8))
+HEARTBEAT_SECONDS = 20
+# Streams are recycled periodically; EventSource reconnects on its own
+STREAM_MAX_SECONDS = 300
+_QUEUE_SIZE = 100
+
+_subscribers = {}  # user_id -> set of Subscription
+_lock = threading.Lock()
+
+
+class StreamLimitReached(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=_QUEUE_SIZE)
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+def subscribe(user_id):
+    """Register a new stream for user_id. Raises StreamLimitReached when at capacity."""
+    with _lock:
+        if sum(len(s) for s in _subscribers.values()) >= MAX_STREAMS:
+            raise StreamLimitReached()
+        sub = Subscription(user_id)
+        _subscribers.setdefault(user_id, set()).add(sub)
+    return sub
+
+
+def unsubscribe(sub):
+    """Drop a stream; safe to call more than once."""
+    with _lock:
+        subs = _subscribers.get(sub.user_id)
+        if subs:
+            subs.discard(sub)
+            if not subs:
+                del _subscribers[sub.user_id]
+
+
+def publish(user_ids, event, data=None):
+    """Queue `event` with JSON-able `data` for every stream of the given user id(s)."""
+    if isinstance(user_ids, int):
+        user_ids = (user_ids,)
+    with _lock:
+        targets = [s for uid in user_ids for s in _subscribers.get(uid, ())]
+    for sub in targets:
+        try:
+            sub.queue.put_nowait((event, data or {}))
+        except queue.Full:
+            pass  # the hello event on reconnect resyncs this client
+
+
+def stream_count():
+    with _lock:
+        return sum(len(s) for s in _subscribers.values())
+
+
+def format_sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+def iter_stream(sub, hello):
+    """Yield SSE frames for `sub`: the hello event, queued events and heartbeats.
+
+    Unsubscribes when the client disconnects or the stream reaches
+    STREAM_MAX_SECONDS. That finally only runs once iteration has started,
+    so the route also unsubscribes from the response's call_on_close;
+    unsubscribe() is idempotent.
+    """
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+    try:
+        yield 'retry: 5000\n\n'
+        yield format_sse('hello', hello)
+        while time.monotonic() < deadline:
+            item = sub.get(HEARTBEAT_SECONDS)
+            if item is None:
+                yield ': keepalive\n\n'
+                continue
+            yield format_sse(*item)
+    finally:
+        unsubscribe(sub)
@@ -0,0 +1,210 @@
+"""Write-only openpyxl export engine for job and table exports.
+
+Workbooks are built with write_only=True, so rows are serialized as they are
+appended instead of being held as a full cell object model. Styling uses
+named styles registered once per workbook: each cell references a style by
+name instead of getting its own Border/PatternFill/Font assignments. Output
+goes to an in-memory buffer that the caller hands straight to send_file, so
+nothing is written under data/.
+"""
+
+import io
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+_THIN = Side(style='thin')
+_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+
+_FILLS = {
+    'header': '4472C4',
+    'editable': 'D6E4F0',
+    'computed': 'D9D9D9',
+    'green': 'C6EFCE',
+    'amber': 'FFEB9C',
+}
+
+_FORMATS = {'': 'General', 'int': '#,##0', 'money': '#,##0.00'}
+
+def _register_styles(wb):
+    """Register every fill x number-format combination as a named style.
+
+    Style names are '<fill>' or '<fill>_<format>', with fill 'plain' meaning
+    border only, e.g. 'editable_money', 'green_int', 'plain'.
+    """
+    header = NamedStyle(name='header')
+    header.font = Font(color='FFFFFF', bold=True, size=11)
+    header.fill = PatternFill(start_color=_FILLS['header'], end_color=_FILLS['header'], fill_type='solid')
+    header.alignment = Alignment(horizontal='center')
+    header.border = _BORDER
+    wb.add_named_style(header)
+
+    for fill_name in ('plain', 'editable', 'computed', 'green', 'amber'):
+        for fmt_key, fmt in _FORMATS.items():
+            style = NamedStyle(name=f'{fill_name}_{fmt_key}' if fmt_key else fill_name)
+            style.border = _BORDER
+            style.number_format = fmt
+            if fill_name != 'plain':
+                color = _FILLS[fill_name]
+                style.fill = PatternFill(start_color=color, end_color=color, fill_type='solid')
+            wb.add_named_style(style)
+
+
+def _new_workbook():
+    wb = Workbook(write_only=True)
+    _register_styles(wb)
+    return wb
+
+
+def _cell(ws, value, style):
+    """WriteOnlyCell with a named style applied."""
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
+
+
+def _set_widths(ws, widths):
+    for i, w in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(i)].width = w
+
+
+def _to_buffer(wb):
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+    return buf
+
+
+# ---------------------------------------------------------------------------
+# Job material workbook (/api/job/<id>/export)
+# ---------------------------------------------------------------------------
+
+_ENTRY_TABS = [
+    ('Received', 'received_entries'),
+    ('Shipped to Site', 'shipped_entries'),
+    ('Invoiced', 'invoiced_entries'),
+]
+_ENTRY_COLUMNS = 15
+
+
+def build_job_workbook(data):
+    """Build the Master List + Received/Shipped/Invoiced workbook for get_job_data() output.
+
+    Returns a BytesIO positioned at 0.
+    """
+    wb = _new_workbook()
+    items = data['line_items']
+
+    ws1 = wb.create_sheet(title='Master List')
+    _set_widths(ws1, [8, 10, 15, 35, 12, 12, 12, 8, 14, 14, 12, 10, 12, 12, 20])
+    headers1 = ['Line #', 'Non-Stock', 'Product', 'Description', 'Quote QTY',
+                'Order QTY', 'Price', 'Unit', 'Quote Total', 'Order Total',
+                'QTY Received', 'Missing', 'QTY Shipped', 'QTY Invoiced', 'Notes']
+    ws1.append([_cell(ws1, h, 'header') for h in headers1])
+
+    for r, item in enumerate(items, 2):
+        pricing_type = item.get('pricing_type', 'each')
+        unit_label = 'Each' if pricing_type == 'each' else ('Per C' if pricing_type == 'per_c' else 'Per M')
+        missing = max(0, (item['qty_ordered'] or 0) - (item['total_received'] or 0))
+        ws1.append([
+            _cell(ws1, item['line_number'], 'editable'),
+            _cell(ws1, item['stock_ns'], 'editable'),
+            _cell(ws1, item['sku'], 'editable'),
+            _cell(ws1, item['description'], 'editable'),
+            _cell(ws1, item['quote_qty'], 'editable_int'),
+            _cell(ws1, item['qty_ordered'], 'editable_int'),
+            _cell(ws1, item['price_per'], 'editable_money'),
+            _cell(ws1, unit_label, 'editable'),
+            _cell(ws1, item.get('quote_total', 0), 'computed_money'),
+            _cell(ws1, item['total_net_price'], 'computed_money'),
+            _cell(ws1, f"='Received'!D{r}", 'green_int'),
+            _cell(ws1, missing, 'amber_int' if missing > 0 else 'green_int'),
+            _cell(ws1, f"='Shipped to Site'!D{r}", 'green_int'),
+            _cell(ws1, f"='Invoiced'!D{r}", 'green_int'),
+            _cell(ws1, item.get('notes', ''), 'plain'),
+        ])
+
+    for tab_name, entry_key in _ENTRY_TABS:
+        ws = wb.create_sheet(title=tab_name)
+        _set_widths(ws, [8, 35, 14, 10] + [12] * _ENTRY_COLUMNS)
+
+        date_headers = {}
+        for item in items:
+            for col_num, entry in item.get(entry_key, {}).items():
+                if entry.get('entry_date') and col_num not in date_headers:
+                    date_headers[col_num] = entry['entry_date']
+        headers = ['Line #', 'Description', 'Total Ordered', 'Total']
+        headers += [date_headers.get(str(c), f'Col {c}') for c in range(1, _ENTRY_COLUMNS + 1)]
+        ws.append([_cell(ws, h, 'header') for h in headers])
+
+        for r, item in enumerate(items, 2):
+            entries = item.get(entry_key, {})
+            qtys = [(entries.get(str(c), {}).get('quantity', 0) or 0) for c in range(1, _ENTRY_COLUMNS + 1)]
+            total_val = sum(qtys)
+            ordered_val = item['qty_ordered']
+            if ordered_val > 0 and total_val >= ordered_val:
+                total_style = 'green_int'
+            elif total_val > 0:
+                total_style = 'amber_int'
+            else:
+                total_style = 'computed_int'
+            row = [
+                _cell(ws, item['line_number'], 'computed'),
+                _cell(ws, item['description'], 'computed'),
+                _cell(ws, f"='Master List'!F{r}", 'computed'),
+                _cell(ws, f'=SUM(E{r}:S{r})', total_style),
+            ]
+            row += [_cell(ws, qty or None, 'editable') for qty in qtys]
+            ws.append(row)
+
+    return _to_buffer(wb)
+
+
+# ---------------------------------------------------------------------------
+# Generic table workbook (/api/export/excel)
+# ---------------------------------------------------------------------------
+
+def _clean_value(val):
+    """Convert '$1,234.56' strings to floats; returns (value, is_money)."""
+    if isinstance(val, str) and val.startswith('$'):
+        try:
+            return float(val.replace('$', '').replace(',', '')), True
+        except ValueError:
+            return val, False
+    return val, False
+
+
+def build_table_workbook(title, headers, rows):
+    """Build a single-sheet workbook from header/row lists. Returns a BytesIO positioned at 0.
+
+    Column widths are sized from the longest value per column in a first pass
+    over the input rows, so the sheet is never read back.
+    """
+    wb = _new_workbook()
+    ws = wb.create_sheet(title=title[:31])  # Excel sheet name limit
+
+    widths = [len(str(h)) for h in headers]
+    for row in rows:
+        for c, val in enumerate(row[:len(widths)]):
+            clean, _ = _clean_value(val)
+            if clean:
+                widths[c] = max(widths[c], len(str(clean)))
+
+    # Widths must be set before the first row is written in write-only mode
+    _set_widths(ws, [min(w + 3, 50) for w in widths])
+    ws.append([_cell(ws, h, 'header') for h in headers])
+    for row in rows:
+        out = []
+        for val in row:
+            clean, is_money = _clean_value(val)
+            out.append(_cell(ws, clean, 'plain_money' if is_money and isinstance(clean, float) else 'plain'))
+        ws.append(out)
+    return _to_buffer(wb)
+
+
+def safe_filename(name):
+    return ''.join(ch if ch.isalnum() or ch in ' -_' else '' for ch in name)
@@ -0,0 +1,175 @@
+"""
+Normalized supplier invoice line items (supplier_invoice_lines).
+
+supplier_invoices.line_items stays the JSON copy of what the supplier sent.
+Price lookups used to LIKE-scan that blob and json.loads every candidate
+invoice. They now read one row per line, with the fields every caller needs
+already normalized:
+
+  product_code       stripped product_code (or sku)
+  product_code_norm  the same, upper-cased; indexed with invoice_date
+  description_norm   upper-cased description, for "SKU in description" matches
+  uom                upper-cased uom / unit_of_measure
+  quantity           qty_shipped, else qty_ordered, else quantity
+  invoice_date       copied from the invoice; indexed on its own for
+                     most-recent-first scans
+
+billtrust._upsert_invoice (used by the BillTrust sync and invoice_import)
+calls sync() after writing an invoice. install() backfills existing invoices
+the first time the table is created.
+"""
+import json
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS supplier_invoice_lines (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    invoice_id INTEGER NOT NULL,
+    line_no INTEGER NOT NULL,
+    product_code TEXT NOT NULL DEFAULT '',
+    product_code_norm TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    description_norm TEXT NOT NULL DEFAULT '',
+    uom TEXT NOT NULL DEFAULT '',
+    quantity REAL NOT NULL DEFAULT 0,
+    unit_price REAL NOT NULL DEFAULT 0,
+    extended_price REAL NOT NULL DEFAULT 0,
+    invoice_date TEXT NOT NULL DEFAULT '',
+    FOREIGN KEY (invoice_id) REFERENCES supplier_invoices(id) ON DELETE CASCADE,
+    UNIQUE(invoice_id, line_no)
+);
+CREATE INDEX IF NOT EXISTS idx_invoice_lines_code_date ON supplier_invoice_lines(product_code_norm, invoice_date);
+CREATE INDEX IF NOT EXISTS idx_invoice_lines_date ON supplier_invoice_lines(invoice_date);
+'''
+
+_INSERT = '''INSERT INTO supplier_invoice_lines
+    (invoice_id, line_no, product_code, product_code_norm, description, description_norm,
+     uom, quantity, unit_price, extended_price, invoice_date)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?)'''
+
+
+def install(conn):
+    new = not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'supplier_invoice_lines'"
+    ).fetchone()
+    conn.executescript(_SCHEMA)
+    if new:
+        backfill(conn)
+
+
+def _num(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _rows(invoice_id, invoice_date, line_items):
+    try:
+        items = json.loads(line_items or '[]')
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(items, list):
+        return []
+    rows = []
+    for n, li in enumerate(items, 1):
+        if not isinstance(li, dict):
+            continue
+        code = str(li.get('product_code') or li.get('sku') or '').strip()
+        desc = str(li.get('description') or '')
+        rows.append((
+            invoice_id, n, code, code.upper(), desc, desc.upper(),
+            str(li.get('uom') or li.get('unit_of_measure') or '').upper(),
+            _num(li.get('qty_shipped') or li.get('qty_ordered') or li.get('quantity')),
+            _num(li.get('unit_price')), _num(li.get('extended_price')),
+            invoice_date or '',
+        ))
+    return rows
+
+
+def sync(conn, invoice_id):
+    """Rewrite the normalized lines of one invoice from its line_items JSON (caller commits)."""
+    inv = conn.execute('SELECT invoice_date, line_items FROM supplier_invoices WHERE id = ?',
+                       (invoice_id,)).fetchone()
+    conn.execute('DELETE FROM supplier_invoice_lines WHERE invoice_id = ?', (invoice_id,))
+    if inv:
+        conn.executemany(_INSERT, _rows(invoice_id, inv['invoice_date'], inv['line_items']))
+
+
+def backfill(conn):
+    """Rebuild supplier_invoice_lines for every invoice (caller commits)."""
+    conn.execute('DELETE FROM supplier_invoice_lines')
+    for inv in conn.execute(
+        "SELECT id, invoice_date, line_items FROM supplier_invoices WHERE line_items IS NOT NULL AND line_items != '[]'"
+    ).fetchall():
+        conn.executemany(_INSERT, _rows(inv['id'], inv['invoice_date'], inv['line_items']))
+
+
+# ─── Lookups ────────────────────────────────────────────────────
+
+def latest_by_code(conn):
+    """The most recent line for every product code on invoices from a configured supplier.
+
+    Returns rows (product_code, unit_price, uom, invoice_date, supplier_name).
+    """
+    return conn.execute('''
+        SELECT product_code, unit_price, uom, invoice_date, supplier_name FROM (
+            SELECT l.product_code, l.unit_price, l.uom, l.invoice_date, bc.supplier_name,
+                   ROW_NUMBER() OVER (PARTITION BY l.product_code
+                                      ORDER BY l.invoice_date DESC, l.invoice_id, l.line_no) AS rn
+            FROM supplier_invoice_lines l
+            JOIN supplier_invoices si ON si.id = l.invoice_id
+            JOIN billtrust_config bc ON bc.id = si.supplier_config_id
+            WHERE l.product_code != ''
+        ) WHERE rn = 1
+    ''').fetchall()
+
+
+def sku_history(conn, sku, recent_invoices=200):
+    """Lines on the most recent invoices that match an upper-cased SKU, newest first.
+
+    A line matches on the same product code, the same first 6 characters
+    (SKUs of 6+ characters) or the SKU appearing in its description.
+    Returns rows with quantity, unit_price, extended_price, invoice_number,
+    invoice_date, supplier_name and job_name.
+    """
+    prefix = sku[:6] if len(sku) >= 6 else None
+    return conn.execute('''
+        WITH recent AS (
+            SELECT si.id, si.invoice_number, si.invoice_date, si.job_id, si.supplier_config_id,
+                   ROW_NUMBER() OVER (ORDER BY si.invoice_date DESC, si.id) AS rn
+            FROM supplier_invoices si
+            JOIN billtrust_config bc ON bc.id = si.supplier_config_id
+            WHERE si.line_items IS NOT NULL AND si.line_items != '[]'
+            ORDER BY si.invoice_date DESC, si.id LIMIT :limit
+        )
+        SELECT l.quantity, l.unit_price, l.extended_price,
+               r.invoice_number, r.invoice_date, bc.supplier_name, j.name AS job_name
+        FROM recent r
+        JOIN supplier_invoice_lines l ON l.invoice_id = r.id
+        JOIN billtrust_config bc ON bc.id = r.supplier_config_id
+        LEFT JOIN jobs j ON j.id = r.job_id
+        WHERE l.product_code_norm = :sku
+           OR (:prefix IS NOT NULL AND l.product_code_norm >= :prefix AND l.product_code_norm < :prefix || char(1114111))
+           OR instr(l.description_norm, :sku) > 0
+        ORDER BY r.rn, l.line_no
+    ''', {'sku': sku, 'prefix': prefix, 'limit': recent_invoices}).fetchall()
+
+
+def search_prices(conn, query, limit=10):
+    """Most recent non-duplicate invoice lines whose product code or description contains query.
+
+    Walks the invoice_date index newest first and stops after `limit` matches.
+    Returns rows (product_code, description, unit_price, invoice_date, invoice_number, supplier_name).
+    """
+    q = (query or '').upper()
+    return conn.execute('''
+        SELECT l.product_code, l.description, l.unit_price, l.invoice_date,
+               si.invoice_number, bc.supplier_name
+        FROM supplier_invoice_lines l INDEXED BY idx_invoice_lines_date
+        JOIN supplier_invoices si ON si.id = l.invoice_id
+        LEFT JOIN billtrust_config bc ON bc.id = si.supplier_config_id
+        WHERE (instr(l.product_code_norm, ?) > 0 OR instr(l.description_norm, ?) > 0)
+          AND si.is_duplicate = 0
+        ORDER BY l.invoice_date DESC, l.invoice_id DESC, l.line_no
+        LIMIT ?
+    ''', (q, q, limit)).fetchall()
@@ -0,0 +1,413 @@
+"""
+Durable background job queue stored in SQLite (background_jobs table).
+
+Long-running work is queued as a row instead of being run on an ad-hoc
+thread with progress kept in a module-level dict. Worker threads in every
+web process claim queued rows, run the registered handler and write
+progress, result and errors back to the row. Any process can answer a
+status poll, and work survives restarts:
+
+  * every handler belongs to a pool (POOLS). Claiming happens inside BEGIN
+    IMMEDIATE and is skipped while the pool's limit of jobs is already
+    running in *any* process, so concurrency is bounded globally, not per
+    worker. Quick jobs (PDF renders, thumbnails) use the 'short' pool and
+    are never stuck behind a queue of plan reviews in the 'long' one;
+  * running jobs heartbeat every HEARTBEAT_SECONDS; a job whose heartbeat
+    goes stale (its process died) is requeued, or failed once its attempts
+    are used up;
+  * a handler exception retries with backoff while attempts remain;
+    raising JobFailed fails the job at once (bad input, missing file);
+  * cancel() drops a queued job, or flags a running one; the handler sees it
+    at its next job.progress() call, which raises JobCancelled.
+
+Handlers are registered with @handler(kind, pool=...) and receive a Job. They return a
+JSON-serializable result. An optional on_fail(job, error) hook runs when a
+job ends in error or is cancelled, e.g. to reset a 'Reviewing' status.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+import database
+
+# pool -> jobs of that pool allowed to run at once, across all processes
+POOLS = {
+    'long': int(os.environ.get('JOB_QUEUE_CONCURRENCY', 2)),
+    'short': int(os.environ.get('JOB_QUEUE_SHORT_CONCURRENCY', 2)),
+}
+POLL_SECONDS = 1.0
+HEARTBEAT_SECONDS = 15
+STALE_SECONDS = 90
+RETRY_BACKOFF_SECONDS = 30
+RETENTION_DAYS = 7
+_PROGRESS_MIN_INTERVAL = 0.5
+
+ACTIVE = ('queued', 'running')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS background_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    ref_id INTEGER,
+    payload TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 1,
+    run_after REAL NOT NULL DEFAULT 0,
+    progress_step INTEGER NOT NULL DEFAULT 0,
+    progress_pct INTEGER NOT NULL DEFAULT 0,
+    progress_message TEXT NOT NULL DEFAULT '',
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    heartbeat_at REAL,
+    created_by INTEGER,
+    created_at TEXT NOT NULL DEFAULT (datetime('now','localtime')),
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_background_jobs_status ON background_jobs(status, run_after);
+CREATE INDEX IF NOT EXISTS idx_background_jobs_ref ON background_jobs(kind, ref_id);
+'''
+
+_handlers = {}  # kind -> (fn, on_fail, pool)
+_wake = threading.Event()
+_running = set()  # job ids running in this process
+_running_lock = threading.Lock()
+_started = False
+_start_lock = threading.Lock()
+_worker_name = f'{os.getpid()}-{uuid.uuid4().hex[:6]}'
+
+
+class JobFailed(Exception):
+    """Raise from a handler to fail the job without retrying."""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def install(conn):
+    conn.executescript(_SCHEMA)
+
+
+def handler(kind, on_fail=None, pool='long'):
+    """Decorator registering fn(job) as the handler for `kind`, run in `pool` (a POOLS key)."""
+    if pool not in POOLS:
+        raise ValueError(f'unknown job pool {pool!r}')
+
+    def register(fn):
+        _handlers[kind] = (fn, on_fail, pool)
+        return fn
+    return register
+
+
+# ─── Producer / status API ──────────────────────────────────────
+
+def enqueue(kind, payload, ref_id=None, max_attempts=1, created_by=None, dedupe=True):
+    """Queue a job and return its id.
+
+    With dedupe, an existing queued/running job of the same kind and ref_id is
+    returned instead (check get(id)['status'] to tell the two apart).
+    """
+    conn = database.connect()  # commits on its own, so never the request's connection
+    try:
+        if dedupe and ref_id is not None:
+            row = conn.execute(
+                "SELECT id FROM background_jobs WHERE kind = ? AND ref_id = ? AND status IN ('queued','running') "
+                "ORDER BY id DESC LIMIT 1", (kind, ref_id)
+            ).fetchone()
+            if row:
+                return row['id']
+        cur = conn.execute(
+            '''INSERT INTO background_jobs (kind, ref_id, payload, max_attempts, created_by)
+               VALUES (?,?,?,?,?)''',
+            (kind, ref_id, json.dumps(payload), max_attempts, created_by)
+        )
+        conn.commit()
+        job_id = cur.lastrowid
+    finally:
+        conn.close()
+    _wake.set()
+    return job_id
+
+
+def _row_to_status(row):
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'ref_id': row['ref_id'],
+        'status': row['status'],
+        'attempts': row['attempts'],
+        'max_attempts': row['max_attempts'],
+        'step': row['progress_step'],
+        'pct': row['progress_pct'],
+        'message': row['progress_message'],
+        'result': json.loads(row['result']) if row['result'] else None,
+        'error': row['error'],
+        'cancel_requested': bool(row['cancel_requested']),
+        'created_by': row['created_by'],
+        'created_at': row['created_at'],
+        'started_at': row['started_at'],
+        'finished_at': row['finished_at'],
+        'done': row['status'] not in ACTIVE,
+    }
+
+
+def get(job_id):
+    """Status dict for a job, or None."""
+    conn = database.get_db()
+    try:
+        row = conn.execute('SELECT * FROM background_jobs WHERE id = ?', (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return _row_to_status(row) if row else None
+
+
+def latest(kind, ref_id):
+    """Status dict for the newest job of `kind` for ref_id, or None."""
+    conn = database.get_db()
+    try:
+        row = conn.execute(
+            'SELECT * FROM background_jobs WHERE kind = ? AND ref_id = ? ORDER BY id DESC LIMIT 1', (kind, ref_id)
+        ).fetchone()
+    finally:
+        conn.close()
+    return _row_to_status(row) if row else None
+
+
+def cancel(job_id):
+    """Cancel a job. Returns the new status dict, or None if the job does not exist."""
+    conn = database.connect()
+    try:
+        row = conn.execute('SELECT * FROM background_jobs WHERE id = ?', (job_id,)).fetchone()
+        if not row:
+            return None
+        if row['status'] == 'queued':
+            conn.execute(
+                "UPDATE background_jobs SET status = 'cancelled', cancel_requested = 1, "
+                "finished_at = datetime('now','localtime') WHERE id = ? AND status = 'queued'", (job_id,)
+            )
+        elif row['status'] == 'running':
+            conn.execute('UPDATE background_jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+        conn.commit()
+        row_after = conn.execute('SELECT * FROM background_jobs WHERE id = ?', (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row['status'] == 'queued' and row_after['status'] == 'cancelled':
+        _call_on_fail(row_after, 'Cancelled')
+    return _row_to_status(row_after)
+
+
+# ─── Handler-side API ───────────────────────────────────────────
+
+class Job:
+    """Handed to handlers: payload plus progress reporting and cancellation checks."""
+
+    def __init__(self, row, conn):
+        self.id = row['id']
+        self.kind = row['kind']
+        self.ref_id = row['ref_id']
+        self.payload = json.loads(row['payload'] or '{}')
+        self.attempt = row['attempts']
+        self._conn = conn
+        self._last_write = 0.0
+
+    def progress(self, step=None, message=None, pct=None, force=False):
+        """Record progress; raises JobCancelled if cancellation was requested.
+
+        Writes are throttled to one per _PROGRESS_MIN_INTERVAL unless force=True.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_write < _PROGRESS_MIN_INTERVAL:
+            return
+        self._last_write = now
+        sets, params = ['heartbeat_at = ?'], [time.time()]
+        for col, val in (('progress_step', step), ('progress_message', message), ('progress_pct', pct)):
+            if val is not None:
+                sets.append(f'{col} = ?')
+                params.append(val)
+        params.append(self.id)
+        self._conn.execute(f"UPDATE background_jobs SET {', '.join(sets)} WHERE id = ?", params)
+        self._conn.commit()
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        row = self._conn.execute('SELECT cancel_requested FROM background_jobs WHERE id = ?', (self.id,)).fetchone()
+        if row and row['cancel_requested']:
+            raise JobCancelled()
+
+
+# ─── Workers ────────────────────────────────────────────────────
+
+def start():
+    """Start this process's worker and heartbeat threads (idempotent)."""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    for pool, limit in POOLS.items():
+        for i in range(limit):
+            threading.Thread(target=_worker_loop, args=(pool,), name=f'job-worker-{pool}-{i}',
+                             daemon=True).start()
+    threading.Thread(target=_heartbeat_loop, name='job-heartbeat', daemon=True).start()
+
+
+def _claim(conn, pool):
+    kinds = [kind for kind, entry in _handlers.items() if entry[2] == pool]
+    if not kinds:
+        return None
+    marks = ','.join('?' * len(kinds))
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        running = conn.execute(
+            f"SELECT COUNT(*) FROM background_jobs WHERE status = 'running' AND kind IN ({marks})", kinds
+        ).fetchone()[0]
+        if running >= POOLS[pool]:
+            conn.rollback()
+            return None
+        row = conn.execute(
+            f"SELECT id FROM background_jobs WHERE status = 'queued' AND run_after <= ? AND kind IN ({marks}) "
+            "ORDER BY id LIMIT 1", [time.time()] + kinds
+        ).fetchone()
+        if not row:
+            conn.rollback()
+            return None
+        conn.execute(
+            '''UPDATE background_jobs SET status = 'running', attempts = attempts + 1, worker = ?,
+                   heartbeat_at = ?, started_at = datetime('now','localtime'), error = NULL
+               WHERE id = ?''',
+            (_worker_name, time.time(), row['id'])
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return conn.execute('SELECT * FROM background_jobs WHERE id = ?', (row['id'],)).fetchone()
+
+
+def _finish(conn, job_id, status, result=None, error=None, retry=False):
+    if retry:
+        conn.execute(
+            "UPDATE background_jobs SET status = 'queued', error = ?, run_after = ?, worker = NULL WHERE id = ?",
+            (error, time.time() + RETRY_BACKOFF_SECONDS, job_id)
+        )
+    else:
+        conn.execute(
+            '''UPDATE background_jobs SET status = ?, result = ?, error = ?, worker = NULL,
+                   progress_pct = CASE WHEN ? = 'done' THEN 100 ELSE progress_pct END,
+                   finished_at = datetime('now','localtime')
+               WHERE id = ?''',
+            (status, json.dumps(result) if result is not None else None, error, status, job_id)
+        )
+    conn.commit()
+
+
+def _call_on_fail(row, error):
+    entry = _handlers.get(row['kind'])
+    if not entry or not entry[1]:
+        return
+    try:
+        entry[1](Job(row, None), error)
+    except Exception as e:
+        print(f"Job queue: on_fail for {row['kind']} #{row['id']} failed: {e}")
+
+
+def _run_one(conn, row):
+    fn = _handlers[row['kind']][0]
+    job = Job(row, conn)
+    with _running_lock:
+        _running.add(row['id'])
+    try:
+        result = fn(job)
+        _finish(conn, row['id'], 'done', result=result)
+    except JobCancelled:
+        _finish(conn, row['id'], 'cancelled', error='Cancelled')
+        _call_on_fail(row, 'Cancelled')
+    except Exception as e:
+        if conn.in_transaction:
+            conn.rollback()
+        retry = not isinstance(e, JobFailed) and row['attempts'] < row['max_attempts']
+        _finish(conn, row['id'], 'error', error=str(e) or e.__class__.__name__, retry=retry)
+        if not retry:
+            _call_on_fail(row, str(e))
+    finally:
+        with _running_lock:
+            _running.discard(row['id'])
+
+
+def _worker_loop(pool):
+    conn = None
+    while True:
+        try:
+            if conn is None:
+                conn = database.get_db()
+            row = _claim(conn, pool)
+            if row is None:
+                _wake.wait(POLL_SECONDS)
+                _wake.clear()
+                continue
+            _run_one(conn, row)
+            _wake.set()  # a slot freed up; let another worker look
+        except Exception as e:
+            print(f"Job queue: worker error: {e}")
+            try:
+                conn.close()
+            except Exception:
+                pass
+            conn = None
+            time.sleep(POLL_SECONDS)
+
+
+def _heartbeat_loop():
+    last_prune = 0.0
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        conn = None
+        try:
+            conn = database.get_db()
+            now = time.time()
+            with _running_lock:
+                ids = list(_running)
+            if ids:
+                conn.execute(
+                    f"UPDATE background_jobs SET heartbeat_at = ? WHERE id IN ({','.join('?' * len(ids))})",
+                    [now] + ids
+                )
+            # Jobs whose process stopped heartbeating: retry or give up
+            stale = conn.execute(
+                "SELECT * FROM background_jobs WHERE status = 'running' AND heartbeat_at < ?",
+                (now - STALE_SECONDS,)
+            ).fetchall()
+            failed = []
+            for row in stale:
+                if row['attempts'] < row['max_attempts'] and not row['cancel_requested']:
+                    conn.execute("UPDATE background_jobs SET status = 'queued', worker = NULL WHERE id = ?",
+                                 (row['id'],))
+                else:
+                    conn.execute(
+                        '''UPDATE background_jobs SET status = ?, error = ?, worker = NULL,
+                               finished_at = datetime('now','localtime') WHERE id = ?''',
+                        ('cancelled' if row['cancel_requested'] else 'error', 'Worker stopped', row['id'])
+                    )
+                    failed.append(row)
+            if now - last_prune > 3600:
+                conn.execute(
+                    "DELETE FROM background_jobs WHERE status NOT IN ('queued','running') "
+                    "AND created_at < datetime('now','localtime', ?)", (f'-{RETENTION_DAYS} days',)
+                )
+                last_prune = now
+            conn.commit()
+            for row in failed:
+                _call_on_fail(row, 'Worker stopped')
+            if stale:
+                _wake.set()
+        except Exception as e:
+            print(f"Job queue: heartbeat error: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
@@ -0,0 +1,234 @@
+"""
+Materialized per-job rollups (job_rollups table) kept current by SQLite triggers.
+
+The dashboard, analytics and projects endpoints used to loop over every job and
+re-query line_items, expenses and a dozen child tables per job. job_rollups
+holds those figures one row per job, so the endpoints read them with a single
+JOIN.
+
+Maintenance is done with triggers rather than write-path hooks because these
+tables are written from many routes in app.py:
+  * material_cents and expense_cents are adjusted incrementally (old value
+    out, new value in) since line_items see bulk writes on every grid save.
+    They hold integer cents, each row rounded to the cent, so the running
+    sums are exact and cannot drift the way repeated float +/- would;
+  * entity counts are recomputed for the affected job on each write, which is
+    a single indexed COUNT on low-volume tables and cannot drift.
+
+Readers divide by 100 for dollars. install() is called from database.init_db().
+To check or repair the table:
+
+    python3 job_rollups.py verify
+    python3 job_rollups.py rebuild
+"""
+
+# Line item extended price in cents, matching the Python fallback used across app.py:
+# stored total_net_price when non-zero, else qty_ordered * price_per
+_MATERIAL_EXPR = ("CAST(ROUND(100 * CASE WHEN COALESCE({r}.total_net_price, 0) != 0 THEN {r}.total_net_price "
+                  "ELSE COALESCE({r}.qty_ordered, 0) * COALESCE({r}.price_per, 0) END) AS INTEGER)")
+_EXPENSE_EXPR = 'CAST(ROUND(100 * COALESCE({r}.amount, 0)) AS INTEGER)'
+
+# rollup column -> (source table, COUNT query with {job} placeholder for the job id expression)
+COUNT_COLUMNS = {
+    'open_service_calls': ('service_calls',
+                           "SELECT COUNT(*) FROM service_calls WHERE job_id = {job} AND status NOT IN ('Resolved','Closed')"),
+    'warranty_items': ('warranty_items', 'SELECT COUNT(*) FROM warranty_items WHERE job_id = {job}'),
+    'change_orders': ('change_orders', 'SELECT COUNT(*) FROM change_orders WHERE job_id = {job}'),
+    'rfis': ('rfis', 'SELECT COUNT(*) FROM rfis WHERE job_id = {job}'),
+    'submittals': ('submittals', 'SELECT COUNT(*) FROM submittals WHERE job_id = {job}'),
+    'lien_waivers': ('lien_waivers', 'SELECT COUNT(*) FROM lien_waivers WHERE job_id = {job}'),
+    'plans': ('plans', 'SELECT COUNT(*) FROM plans WHERE job_id = {job}'),
+    'contracts': ('contracts', 'SELECT COUNT(*) FROM contracts WHERE job_id = {job}'),
+    'permits': ('permits', 'SELECT COUNT(*) FROM permits WHERE job_id = {job}'),
+}
+
+_PAY_APP_COUNT = ('SELECT COUNT(*) FROM pay_applications pa JOIN pay_app_contracts pac '
+                  'ON pa.contract_id = pac.id WHERE pac.job_id = {job}')
+
+# Columns whose change can move a row in or out of a count
+_COUNT_WATCH = {'service_calls': 'job_id, status'}
+
+MONEY_COLUMNS = ('material_cents', 'expense_cents')
+ALL_COLUMNS = MONEY_COLUMNS + tuple(COUNT_COLUMNS) + ('pay_apps',)
+
+
+def _schema_sql():
+    cols = ',\n    '.join(f'{c} INTEGER NOT NULL DEFAULT 0' for c in list(COUNT_COLUMNS) + ['pay_apps'])
+    return f'''
+CREATE TABLE IF NOT EXISTS job_rollups (
+    job_id INTEGER PRIMARY KEY,
+    material_cents INTEGER NOT NULL DEFAULT 0,
+    expense_cents INTEGER NOT NULL DEFAULT 0,
+    {cols},
+    FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
+);'''
+
+
+def _ensure_row(ref):
+    return f'INSERT OR IGNORE INTO job_rollups (job_id) SELECT {ref} WHERE {ref} IS NOT NULL;'
+
+
+def _trigger_sql():
+    stmts = [
+        '''CREATE TRIGGER IF NOT EXISTS trg_rollup_jobs_ins AFTER INSERT ON jobs BEGIN
+            INSERT OR IGNORE INTO job_rollups (job_id) VALUES (NEW.id);
+        END;''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_rollup_jobs_del AFTER DELETE ON jobs BEGIN
+            DELETE FROM job_rollups WHERE job_id = OLD.id;
+        END;''',
+    ]
+
+    # Incremental money columns
+    for name, table, col, expr in (
+        ('li', 'line_items', 'material_cents', _MATERIAL_EXPR),
+        ('exp', 'expenses', 'expense_cents', _EXPENSE_EXPR),
+    ):
+        new_v, old_v = expr.format(r='NEW'), expr.format(r='OLD')
+        watch = 'job_id, total_net_price, qty_ordered, price_per' if table == 'line_items' else 'job_id, amount'
+        stmts += [
+            f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_{name}_ins AFTER INSERT ON {table} BEGIN
+                {_ensure_row('NEW.job_id')}
+                UPDATE job_rollups SET {col} = {col} + {new_v} WHERE job_id = NEW.job_id;
+            END;''',
+            f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_{name}_del AFTER DELETE ON {table} BEGIN
+                UPDATE job_rollups SET {col} = {col} - {old_v} WHERE job_id = OLD.job_id;
+            END;''',
+            f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_{name}_upd AFTER UPDATE OF {watch} ON {table} BEGIN
+                UPDATE job_rollups SET {col} = {col} - {old_v} WHERE job_id = OLD.job_id;
+                {_ensure_row('NEW.job_id')}
+                UPDATE job_rollups SET {col} = {col} + {new_v} WHERE job_id = NEW.job_id;
+            END;''',
+        ]
+
+    # Recomputed counts
+    for col, (table, count_sql) in COUNT_COLUMNS.items():
+        recount = count_sql.format(job='job_rollups.job_id')
+        watch = _COUNT_WATCH.get(table, 'job_id')
+        stmts += [
+            f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_{col}_ins AFTER INSERT ON {table} BEGIN
+                {_ensure_row('NEW.job_id')}
+                UPDATE job_rollups SET {col} = ({recount}) WHERE job_id = NEW.job_id;
+            END;''',
+            f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_{col}_del AFTER DELETE ON {table} BEGIN
+                UPDATE job_rollups SET {col} = ({recount}) WHERE job_id = OLD.job_id;
+            END;''',
+            f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_{col}_upd AFTER UPDATE OF {watch} ON {table} BEGIN
+                {_ensure_row('NEW.job_id')}
+                UPDATE job_rollups SET {col} = ({recount}) WHERE job_id IN (OLD.job_id, NEW.job_id);
+            END;''',
+        ]
+
+    # Pay apps hang off pay_app_contracts, so both tables can move the count
+    recount = _PAY_APP_COUNT.format(job='job_rollups.job_id')
+    contract_job = '(SELECT job_id FROM pay_app_contracts WHERE id = {r}.contract_id)'
+    stmts += [
+        f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_pay_apps_ins AFTER INSERT ON pay_applications BEGIN
+            UPDATE job_rollups SET pay_apps = ({recount}) WHERE job_id = {contract_job.format(r='NEW')};
+        END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_pay_apps_del AFTER DELETE ON pay_applications BEGIN
+            UPDATE job_rollups SET pay_apps = ({recount}) WHERE job_id = {contract_job.format(r='OLD')};
+        END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_pay_apps_upd AFTER UPDATE OF contract_id ON pay_applications BEGIN
+            UPDATE job_rollups SET pay_apps = ({recount})
+            WHERE job_id IN ({contract_job.format(r='OLD')}, {contract_job.format(r='NEW')});
+        END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_pac_del AFTER DELETE ON pay_app_contracts BEGIN
+            UPDATE job_rollups SET pay_apps = ({recount}) WHERE job_id = OLD.job_id;
+        END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_pac_upd AFTER UPDATE OF job_id ON pay_app_contracts BEGIN
+            UPDATE job_rollups SET pay_apps = ({recount}) WHERE job_id IN (OLD.job_id, NEW.job_id);
+        END;''',
+    ]
+    return '\n'.join(stmts)
+
+
+def _expected_select(where=''):
+    """SELECT producing the true rollup values for every job, straight from the raw tables."""
+    count_cols = ',\n'.join(f"    ({sql.format(job='j.id')}) AS {col}" for col, (_t, sql) in COUNT_COLUMNS.items())
+    return f'''SELECT j.id AS job_id,
+    (SELECT COALESCE(SUM({_MATERIAL_EXPR.format(r='li')}), 0) FROM line_items li WHERE li.job_id = j.id) AS material_cents,
+    (SELECT COALESCE(SUM({_EXPENSE_EXPR.format(r='e')}), 0) FROM expenses e WHERE e.job_id = j.id) AS expense_cents,
+{count_cols},
+    ({_PAY_APP_COUNT.format(job='j.id')}) AS pay_apps
+FROM jobs j {where}'''
+
+
+def install(conn):
+    """Create job_rollups and its triggers if missing; populate the table when first created."""
+    existed = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'job_rollups'"
+    ).fetchone()
+    conn.executescript(_schema_sql())
+    conn.executescript(_trigger_sql())
+    if not existed:
+        rebuild(conn)
+
+
+def reinstall(conn):
+    """Drop job_rollups and every trigger feeding it, then install() again from the raw tables."""
+    names = [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg\\_rollup\\_%' ESCAPE '\\'"
+    )]
+    for name in names:
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    conn.execute('DROP TABLE IF EXISTS job_rollups')
+    install(conn)
+
+
+def rebuild(conn, job_id=None):
+    """Recompute rollups from the raw tables (all jobs, or one job). Returns rows written."""
+    where, params = ('WHERE j.id = ?', (job_id,)) if job_id is not None else ('', ())
+    if job_id is None:
+        conn.execute('DELETE FROM job_rollups')
+    cols = ', '.join(ALL_COLUMNS)
+    cur = conn.execute(
+        f'INSERT OR REPLACE INTO job_rollups (job_id, {cols}) SELECT job_id, {cols} FROM ({_expected_select(where)})',
+        params
+    )
+    return cur.rowcount
+
+
+def verify(conn):
+    """Compare job_rollups against the raw tables.
+
+    Returns a list of {'job_id', 'column', 'stored', 'expected'} mismatches;
+    a job with no rollup row is reported with column '*'.
+    """
+    stored = {r['job_id']: r for r in conn.execute('SELECT * FROM job_rollups').fetchall()}
+    problems = []
+    for exp in conn.execute(_expected_select()).fetchall():
+        row = stored.get(exp['job_id'])
+        if row is None:
+            problems.append({'job_id': exp['job_id'], 'column': '*', 'stored': None, 'expected': None})
+            continue
+        for col in ALL_COLUMNS:
+            if (row[col] or 0) != (exp[col] or 0):
+                problems.append({'job_id': exp['job_id'], 'column': col,
+                                 'stored': row[col], 'expected': exp[col]})
+    return problems
+
+
+if __name__ == '__main__':
+    import sys
+    from database import get_db
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else 'verify'
+    if cmd not in ('verify', 'rebuild'):
+        print('usage: python3 job_rollups.py [verify|rebuild]')
+        raise SystemExit(2)
+
+    conn = get_db()
+    try:
+        if cmd == 'rebuild':
+            n = rebuild(conn)
+            conn.commit()
+            print(f'Rebuilt rollups for {n} jobs.')
+        problems = verify(conn)
+        for p in problems[:50]:
+            print(f"job {p['job_id']}: {p['column']} stored={p['stored']} expected={p['expected']}")
+        if problems:
+            print(f'{len(problems)} mismatches.')
+            raise SystemExit(1)
+        print('job_rollups OK.')
+    finally:
+        conn.close()
@@ -0,0 +1,317 @@
+"""
+Job version history stored as compressed keyframes plus row-level deltas.
+
+Every grid save records the job's state *before* the edit. Instead of writing
+the whole snapshot (every line item and entry cell) each time, a version row
+is either:
+
+  * 'key'   — a zlib-compressed full snapshot (build_snapshot output)
+  * 'delta' — a zlib-compressed diff against its base_version_id
+  * 'full'  — legacy rows written before this module existed; the plain JSON
+              snapshot lives in versions.snapshot and is treated as a keyframe
+
+A new keyframe is written every KEYFRAME_INTERVAL versions, or when a delta
+touches most of the rows anyway. Any version is rebuilt on demand by inflating
+its nearest keyframe and replaying at most KEYFRAME_INTERVAL - 1 deltas.
+
+Delta format (all keys optional):
+    {'job': {field: value}, 'upsert': {row_key: item}, 'delete': [row_key],
+     'order': [row_key, ...], 'column_headers': {...}, 'column_dates': {...}}
+Row keys are the line item id when the snapshot carries one, else '#<index>'.
+"""
+import hashlib
+import json
+import threading
+import zlib
+
+from database import build_snapshot
+
+KEYFRAME_INTERVAL = 20
+MAX_VERSIONS_PER_JOB = 100
+
+# A delta that rewrites more than this fraction of rows is stored as a keyframe
+_KEYFRAME_ROW_FRACTION = 0.5
+
+# job_id -> (version_id, row fingerprint, snapshot) of the most recent version
+# written, so the next save can diff against it without replaying the chain.
+# Entries are filled before the caller commits; an entry is only used while
+# the stored row still has the same fingerprint, so a rolled-back version
+# whose id is later reused (by this or another process) is never a delta base.
+_state_cache = {}
+_state_cache_lock = threading.Lock()
+_STATE_CACHE_MAX = 32
+
+
+# ─── Encoding ───────────────────────────────────────────────────
+
+def _pack(obj):
+    return zlib.compress(json.dumps(obj, separators=(',', ':')).encode('utf-8'), 6)
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+def _row_key(item, idx):
+    if item.get('id') is not None:
+        return str(item['id'])
+    return f'#{idx}'
+
+def _rows_by_key(snapshot):
+    rows = {}
+    order = []
+    for idx, item in enumerate(snapshot.get('line_items', [])):
+        key = _row_key(item, idx)
+        rows[key] = item
+        order.append(key)
+    return rows, order
+
+
+# ─── Delta compute / apply ──────────────────────────────────────
+
+def compute_delta(old, new):
+    """Return the row-level delta that turns snapshot `old` into snapshot `new`."""
+    delta = {}
+
+    job_changes = {k: v for k, v in new.get('job', {}).items() if old.get('job', {}).get(k) != v}
+    if job_changes:
+        delta['job'] = job_changes
+
+    old_rows, old_order = _rows_by_key(old)
+    new_rows, new_order = _rows_by_key(new)
+
+    upsert = {k: item for k, item in new_rows.items() if old_rows.get(k) != item}
+    if upsert:
+        delta['upsert'] = upsert
+    deleted = [k for k in old_order if k not in new_rows]
+    if deleted:
+        delta['delete'] = deleted
+    if new_order != old_order:
+        delta['order'] = new_order
+
+    for field in ('column_headers', 'column_dates'):
+        if old.get(field, {}) != new.get(field, {}):
+            delta[field] = new.get(field, {})
+    return delta
+
+def apply_delta(base, delta):
+    """Return a new snapshot: `base` with `delta` applied. `base` is not modified."""
+    job = dict(base.get('job', {}))
+    job.update(delta.get('job', {}))
+
+    rows, order = _rows_by_key(base)
+    for key in delta.get('delete', ()):
+        rows.pop(key, None)
+    rows.update(delta.get('upsert', {}))
+    if 'order' in delta:
+        order = delta['order']
+
+    result = dict(base)
+    result['job'] = job
+    result['line_items'] = [rows[k] for k in order if k in rows]
+    for field in ('column_headers', 'column_dates'):
+        if field in delta:
+            result[field] = delta[field]
+    return result
+
+
+# ─── Cache ──────────────────────────────────────────────────────
+
+def _fingerprint(kind, base_id, payload, snapshot):
+    h = hashlib.sha1(f'{kind}:{base_id}:'.encode())
+    h.update(payload if payload is not None else (snapshot or '').encode('utf-8'))
+    return h.digest()
+
+def _cache_get(job_id, row):
+    """Cached snapshot for the version in `row`, if it was cached from this exact row."""
+    with _state_cache_lock:
+        hit = _state_cache.get(job_id)
+    if hit and hit[0] == row['id'] and hit[1] == _fingerprint(
+            row['kind'], row['base_version_id'], row['payload'], row['snapshot']):
+        return hit[2]
+    return None
+
+def _cache_put(job_id, vid, fingerprint, snapshot):
+    with _state_cache_lock:
+        _state_cache.pop(job_id, None)
+        _state_cache[job_id] = (vid, fingerprint, snapshot)
+        while len(_state_cache) > _STATE_CACHE_MAX:
+            _state_cache.pop(next(iter(_state_cache)))
+
+
+# ─── Read ───────────────────────────────────────────────────────
+
+def _version_row(conn, vid, job_id=None):
+    sql = 'SELECT id, job_id, kind, base_version_id, chain_depth, payload, snapshot FROM versions WHERE id = ?'
+    params = [vid]
+    if job_id is not None:
+        sql += ' AND job_id = ?'
+        params.append(job_id)
+    return conn.execute(sql, params).fetchone()
+
+def _decode_keyframe(row):
+    if row['kind'] == 'key':
+        return _unpack(row['payload'])
+    return json.loads(row['snapshot'])
+
+def load_version(conn, job_id, vid):
+    """Reconstruct the snapshot for version `vid` of `job_id`, or None if it does not exist."""
+    row = _version_row(conn, vid, job_id)
+    if not row:
+        return None
+    cached = _cache_get(job_id, row)
+    if cached is not None:
+        return cached
+
+    # Walk base pointers back to the nearest keyframe (or a cached state)
+    chain = []
+    snapshot = None
+    while row['kind'] == 'delta':
+        chain.append(row)
+        row = _version_row(conn, row['base_version_id'])
+        if not row:
+            return None  # broken chain; pruning should never allow this
+        snapshot = _cache_get(job_id, row)
+        if snapshot is not None:
+            break
+    if snapshot is None:
+        snapshot = _decode_keyframe(row)
+
+    for delta_row in reversed(chain):
+        snapshot = apply_delta(snapshot, _unpack(delta_row['payload']))
+    return snapshot
+
+def diff_versions(conn, job_id, vid_a, vid_b):
+    """Describe what changed between two versions of a job.
+
+    When version b descends from a through deltas only, just version a is
+    inflated and the intermediate deltas are replayed over the rows they touch;
+    otherwise both versions are reconstructed and compared. Returns None if
+    either version is missing.
+    """
+    if vid_a > vid_b:
+        vid_a, vid_b = vid_b, vid_a
+    base = load_version(conn, job_id, vid_a)
+    if base is None:
+        return None
+
+    # Collect deltas from b back to a; stop if the chain leaves through a keyframe
+    deltas = []
+    row = _version_row(conn, vid_b, job_id)
+    if not row:
+        return None
+    while row and row['id'] > vid_a and row['kind'] == 'delta':
+        deltas.append(_unpack(row['payload']))
+        row = _version_row(conn, row['base_version_id'])
+
+    if row and row['id'] == vid_a:
+        job_after = dict(base.get('job', {}))
+        touched = {}
+        order = None
+        headers_changed = False
+        for delta in reversed(deltas):
+            job_after.update(delta.get('job', {}))
+            for key in delta.get('delete', ()):
+                touched[key] = None
+            touched.update(delta.get('upsert', {}))
+            if 'order' in delta:
+                order = delta['order']
+            headers_changed = headers_changed or 'column_headers' in delta or 'column_dates' in delta
+        before_rows, _ = _rows_by_key(base)
+        after_keys = set(order) if order is not None else None
+        after_rows = {}
+        for key, item in touched.items():
+            if item is not None and (after_keys is None or key in after_keys):
+                after_rows[key] = item
+        removed_keys = {k for k, item in touched.items() if item is None}
+        if after_keys is not None:
+            removed_keys |= set(before_rows) - after_keys
+        removed_keys -= set(after_rows)
+        return _describe(base.get('job', {}), job_after, before_rows, after_rows,
+                         removed_keys, headers_changed, vid_a, vid_b)
+
+    # Chain passes a keyframe after a: compare two full states
+    other = load_version(conn, job_id, vid_b)
+    before_rows, _ = _rows_by_key(base)
+    after_all, _ = _rows_by_key(other)
+    after_rows = {k: v for k, v in after_all.items() if before_rows.get(k) != v}
+    removed_keys = set(before_rows) - set(after_all)
+    headers_changed = any(base.get(f, {}) != other.get(f, {}) for f in ('column_headers', 'column_dates'))
+    return _describe(base.get('job', {}), other.get('job', {}), before_rows, after_rows,
+                     removed_keys, headers_changed, vid_a, vid_b)
+
+def _describe(job_before, job_after, before_rows, after_rows, removed_keys, headers_changed, vid_a, vid_b):
+    added, changed = [], []
+    for key, item in after_rows.items():
+        old = before_rows.get(key)
+        if old is None:
+            added.append(item)
+        elif old != item:
+            fields = sorted(f for f in set(old) | set(item) if old.get(f) != item.get(f))
+            changed.append({'line_number': item.get('line_number'), 'fields': fields,
+                            'before': old, 'after': item})
+    return {
+        'from_version': vid_a,
+        'to_version': vid_b,
+        'job': {k: {'before': job_before.get(k), 'after': v}
+                for k, v in job_after.items() if job_before.get(k) != v},
+        'added': added,
+        'removed': [before_rows[k] for k in removed_keys if k in before_rows],
+        'changed': changed,
+        'column_headers_changed': headers_changed,
+    }
+
+
+# ─── Write ──────────────────────────────────────────────────────
+
+def save_snapshot(conn, job_id, description='Auto-save', bundle=None):
+    """Record the job's current state as a new version, then prune old versions.
+
+    bundle: the caller's load_job_bundle() result for the current state, if it has one.
+    """
+    snapshot = build_snapshot(conn, job_id, bundle)
+    if snapshot is None:
+        return
+
+    parent = conn.execute(
+        'SELECT id, chain_depth FROM versions WHERE job_id = ? ORDER BY id DESC LIMIT 1', (job_id,)
+    ).fetchone()
+    parent_state = load_version(conn, job_id, parent['id']) if parent else None
+
+    kind, payload, base_id, depth = 'key', None, None, 0
+    if parent_state is not None and (parent['chain_depth'] or 0) + 1 < KEYFRAME_INTERVAL:
+        delta = compute_delta(parent_state, snapshot)
+        row_count = max(len(snapshot['line_items']), 1)
+        if len(delta.get('upsert', {})) <= row_count * _KEYFRAME_ROW_FRACTION:
+            kind, base_id, depth = 'delta', parent['id'], (parent['chain_depth'] or 0) + 1
+            payload = _pack(delta)
+    if payload is None:
+        payload = _pack(snapshot)
+
+    cursor = conn.execute(
+        '''INSERT INTO versions (job_id, snapshot, description, kind, base_version_id, chain_depth, payload)
+           VALUES (?, '', ?, ?, ?, ?, ?)''',
+        (job_id, description, kind, base_id, depth, payload)
+    )
+    _cache_put(job_id, cursor.lastrowid, _fingerprint(kind, base_id, payload, ''), snapshot)
+    _prune_versions(conn, job_id)
+
+def _prune_versions(conn, job_id):
+    """Keep the newest MAX_VERSIONS_PER_JOB versions, re-keying any delta whose base is dropped."""
+    cutoff = conn.execute(
+        'SELECT id FROM versions WHERE job_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?',
+        (job_id, MAX_VERSIONS_PER_JOB - 1)
+    ).fetchone()
+    if not cutoff:
+        return
+    cutoff_id = cutoff['id']
+    orphans = conn.execute(
+        '''SELECT id FROM versions WHERE job_id = ? AND id >= ? AND kind = 'delta' AND base_version_id < ?
+           ORDER BY id''',
+        (job_id, cutoff_id, cutoff_id)
+    ).fetchall()
+    for o in orphans:
+        state = load_version(conn, job_id, o['id'])
+        conn.execute(
+            "UPDATE versions SET kind = 'key', base_version_id = NULL, chain_depth = 0, payload = ? WHERE id = ?",
+            (_pack(state), o['id'])
+        )
+    conn.execute('DELETE FROM versions WHERE job_id = ? AND id < ?', (job_id, cutoff_id))
@@ -0,0 +1,452 @@
+"""Streaming Excel import for job material lists (/api/materials/import).
+
+Opens the workbook in openpyxl read-only mode and walks each sheet once with
+iter_rows(values_only=True), so memory stays flat regardless of row count.
+Header detection only looks at the first few buffered rows. Line items and
+Received/Shipped/Invoiced entries are staged in TEMP tables with executemany,
+committed every BATCH_SIZE rows; temp writes don't take the database write lock,
+so other writers keep going while a large sheet is parsed. A final short
+transaction swaps the staged rows into line_items and the entry tables; the
+caller commits it.
+"""
+
+from itertools import chain, islice
+
+from openpyxl import load_workbook
+
+
+class MaterialsImportError(ValueError):
+    """Raised for problems with the uploaded workbook that should be shown to the user."""
+
+
+# Map header names to DB fields
+HEADER_ALIASES = {
+    'line_number': ['line #', 'line', 'line number', 'line no', '#', 'ln', 'no', 'no.'],
+    'stock_ns': ['stock/ns', 'stock', 'stock ns', 'type', 's/ns', 'non-stock', 'nonstock', 'ns'],
+    'sku': ['sku', 'part number', 'part #', 'part no', 'product code', 'item', 'item #',
+            'item no', 'item number', 'catalog', 'catalog #', 'cat #', 'cat no', 'code',
+            'material', 'mat', 'product #', 'product no', 'product number', 'part',
+            'product'],
+    'description': ['description', 'desc', 'item description', 'product', 'product description',
+                    'material description', 'name', 'item name', 'material name',
+                    'desc.', 'descriptions', 'comments'],
+    'quote_qty': ['quote qty', 'quote quantity', 'qty quoted', 'est qty', 'estimated qty',
+                  'est quantity', 'bid qty'],
+    'qty_ordered': ['qty ordered', 'quantity ordered', 'ordered', 'qty', 'quantity',
+                    'order qty', 'order quantity', 'qty.', 'qty on order', 'ship qty',
+                    'qty to ship', 'pieces', 'pcs', 'count', 'units', 'order'],
+    'price_per': ['price per', 'unit price', 'price', 'cost', 'unit cost', 'rate',
+                  'price each', 'each', 'price/unit', 'cost/unit', 'unit', 'sell price',
+                  'sell', 'net price each', 'net each', 'per'],
+    'total_net_price': ['total net price', 'total price', 'order total', 'net price', 'extended',
+                        'ext price', 'amount', 'ext.', 'ext', 'extension', 'line total',
+                        'extended price', 'total cost', 'net total', 'net amount', 'net',
+                        'total', 'quote total'],
+    'notes': ['notes', 'note', 'remarks', 'comments', 'memo'],
+}
+
+TRACKING_SHEETS = {
+    'Received': 'received_entries',
+    'Shipped to Site': 'shipped_entries',
+    'Shipped': 'shipped_entries',
+    'Invoiced': 'invoiced_entries',
+}
+
+_TRACKING_KNOWN_HEADERS = ['description', 'desc', 'line #', 'line', 'sku', 'product',
+                           'qty', 'quantity', 'total', 'item', 'name', 'material']
+
+HEADER_SCAN_ROWS = 10
+MAX_ENTRY_COLUMNS = 200
+BATCH_SIZE = 1000
+
+
+def safe_num(val):
+    if val is None:
+        return 0
+    if isinstance(val, (int, float)):
+        return val
+    try:
+        return float(str(val).replace('$', '').replace(',', ''))
+    except (ValueError, TypeError):
+        return 0
+
+
+def _cell(row, col):
+    """1-based column access into a values_only row tuple (None when out of range)."""
+    if not col or col > len(row):
+        return None
+    return row[col - 1]
+
+
+class _Progress:
+    """Throttled progress reporter: callback(pct, message) on phase changes and every N rows."""
+
+    def __init__(self, callback, every=500):
+        self.callback = callback
+        self.every = every
+
+    def __call__(self, pct, message):
+        if self.callback:
+            self.callback(min(int(pct), 99), message)
+
+    def rows(self, done, total, lo, hi, label):
+        if self.callback and done % self.every == 0:
+            frac = done / total if total else 0
+            self(lo + (hi - lo) * min(frac, 1), f'{label}: {done:,} rows')
+
+
+# ---------------------------------------------------------------------------
+# Sheet selection & header detection
+# ---------------------------------------------------------------------------
+
+def _pick_master_sheet(wb):
+    for name in ['Master List', 'master list', 'Sheet1', 'Materials', 'Line Items']:
+        if name in wb.sheetnames:
+            return wb[name]
+    # Use first sheet that isn't a tracking sheet
+    tracking_names_lower = ['received', 'shipped', 'shipped to site', 'invoiced']
+    for name in wb.sheetnames:
+        if name.lower().strip() not in tracking_names_lower:
+            return wb[name]
+    return wb.active
+
+
+def _detect_master_header(head_rows):
+    """Return (header_index, col_map) for the first buffered row naming a description or SKU column."""
+    for idx, row in enumerate(head_rows):
+        trial_headers = {}
+        for col, val in enumerate(row, 1):
+            if val:
+                trial_headers[str(val).strip().lower()] = col
+        trial_map = {}
+        for field, aliases in HEADER_ALIASES.items():
+            for alias in aliases:
+                if alias in trial_headers:
+                    trial_map[field] = trial_headers[alias]
+                    break
+        if 'description' in trial_map or 'sku' in trial_map:
+            return idx, trial_map
+    return None, {}
+
+
+def _detect_pricing(qty_ordered, quote_qty, price_per, total_net):
+    """Detect per-C / per-M pricing by comparing total to qty * price; fill a missing total."""
+    pricing_type = 'each'
+    qty_for_calc = qty_ordered if qty_ordered > 0 else quote_qty
+    if total_net and price_per and qty_for_calc:
+        simple = qty_for_calc * price_per
+        if simple > 0:
+            ratio = total_net / simple
+            if abs(ratio - 0.01) < 0.003:
+                pricing_type = 'per_c'
+            elif abs(ratio - 0.001) < 0.0003:
+                pricing_type = 'per_m'
+
+    # Auto-calc total if missing, using detected pricing type
+    if total_net == 0 and qty_for_calc > 0 and price_per > 0:
+        if pricing_type == 'per_c':
+            total_net = qty_for_calc * price_per / 100
+        elif pricing_type == 'per_m':
+            total_net = qty_for_calc * price_per / 1000
+        else:
+            total_net = qty_for_calc * price_per
+    return pricing_type, total_net
+
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+
+def import_workbook(conn, job_id, fileobj, progress=None):
+    """Replace a job's line items (and tracking entries) with the contents of an .xlsx file.
+
+    Args:
+        conn: open DB connection with no pending writes. Staged chunks are
+            committed as they go; the caller commits the final swap (or rolls
+            back on error).
+        job_id: target job.
+        fileobj: path or seekable binary file of the workbook.
+        progress: optional callback(pct, message).
+
+    Returns:
+        Number of line items imported.
+
+    Raises:
+        MaterialsImportError: the file can't be read or has no usable header row.
+    """
+    report = _Progress(progress)
+    report(2, 'Opening workbook...')
+    try:
+        wb = load_workbook(fileobj, read_only=True, data_only=True)
+    except Exception as e:
+        raise MaterialsImportError(f'Could not read Excel file: {str(e)[:200]}')
+
+    _create_staging(conn)
+    tracking = [(n, t) for n, t in TRACKING_SHEETS.items() if n in wb.sheetnames]
+    try:
+        imported = _import_master(conn, wb, report)
+        for i, (sheet_name, table_name) in enumerate(tracking):
+            lo = 50 + 45 * i / len(tracking)
+            _import_tracking(conn, wb[sheet_name], table_name, report,
+                             lo, lo + 45 / len(tracking), sheet_name)
+    finally:
+        wb.close()
+    report(96, 'Saving line items...')
+    _swap_in(conn, job_id, {t for _, t in tracking})
+    return imported
+
+
+# ---------------------------------------------------------------------------
+# Staging
+# ---------------------------------------------------------------------------
+
+def _create_staging(conn):
+    # TEMP tables belong to this connection; a pooled one may still hold the last import's
+    conn.executescript('''
+        DROP TABLE IF EXISTS temp.import_line_items;
+        DROP TABLE IF EXISTS temp.import_entries;
+        CREATE TEMP TABLE import_line_items (
+            id INTEGER PRIMARY KEY,
+            new_id INTEGER,
+            line_number INTEGER, stock_ns TEXT, sku TEXT, description TEXT,
+            quote_qty REAL, qty_ordered REAL, price_per REAL, total_net_price REAL,
+            pricing_type TEXT, notes TEXT
+        );
+        CREATE TEMP TABLE import_entries (
+            table_name TEXT NOT NULL,
+            line_item_id INTEGER NOT NULL,
+            column_number INTEGER NOT NULL,
+            quantity REAL,
+            entry_date TEXT,
+            UNIQUE(table_name, line_item_id, column_number)
+        );
+    ''')
+
+
+def _swap_in(conn, job_id, tables):
+    """Replace the job's line items (entries cascade) with the staged rows, in one transaction."""
+    conn.execute('DELETE FROM line_items WHERE job_id = ?', (job_id,))
+    conn.execute(
+        '''INSERT INTO line_items (job_id, line_number, stock_ns, sku, description,
+           quote_qty, qty_ordered, price_per, total_net_price, pricing_type, notes)
+           SELECT ?, line_number, stock_ns, sku, description, quote_qty, qty_ordered,
+                  price_per, total_net_price, pricing_type, notes
+           FROM temp.import_line_items ORDER BY id''',
+        (job_id,)
+    )
+    # Inserted in staging order, so new ids pair up with staged ids when both are sorted
+    staged = [r[0] for r in conn.execute('SELECT id FROM temp.import_line_items ORDER BY id')]
+    new = [r[0] for r in conn.execute('SELECT id FROM line_items WHERE job_id = ? ORDER BY id', (job_id,))]
+    conn.executemany('UPDATE temp.import_line_items SET new_id = ? WHERE id = ?', zip(new, staged))
+    for table_name in sorted(tables):
+        conn.execute(
+            f'''INSERT INTO {table_name} (line_item_id, column_number, quantity, entry_date)
+                SELECT s.new_id, e.column_number, e.quantity, e.entry_date
+                FROM temp.import_entries e JOIN temp.import_line_items s ON s.id = e.line_item_id
+                WHERE e.table_name = ? ORDER BY e.rowid''',
+            (table_name,)
+        )
+
+
+def _import_master(conn, wb, report):
+    ws = _pick_master_sheet(wb)
+    rows = ws.iter_rows(values_only=True)
+    head = list(islice(rows, HEADER_SCAN_ROWS))
+
+    header_idx, col_map = _detect_master_header(head)
+    # Must have at least description or sku to be useful
+    if header_idx is None:
+        # Show what headers we found to help debug
+        row1_headers = []
+        for r, row in enumerate(head[:3], 1):
+            vals = [str(v or '') for v in row[:14]]
+            row1_headers.append(f'Row {r}: {", ".join(v for v in vals if v)}')
+        found_str = ' | '.join(row1_headers)
+        raise MaterialsImportError(
+            f'Could not find a Description or SKU column. '
+            f'Found in your file: {found_str}. '
+            f'Expected headers like: Line #, SKU, Description, Qty, Price Per, Total')
+
+    def field(row, name):
+        return _cell(row, col_map[name]) if name in col_map else None
+
+    total_rows = ws.max_row or 0  # from the <dimension> tag; may be missing
+    report(10, 'Reading line items...')
+    batch = []
+    imported = 0
+    seen = 0
+    for row in chain(head[header_idx + 1:], rows):
+        seen += 1
+        report.rows(seen, total_rows, 10, 45, 'Line items')
+        desc = field(row, 'description') if 'description' in col_map else ''
+        sku = field(row, 'sku') if 'sku' in col_map else ''
+
+        # Skip empty rows
+        if not desc and not sku:
+            continue
+
+        line_num = safe_num(field(row, 'line_number')) if 'line_number' in col_map else (imported + 1)
+        if line_num == 0:
+            line_num = imported + 1
+
+        stock_ns = str(field(row, 'stock_ns') or '')
+        quote_qty = safe_num(field(row, 'quote_qty'))
+        qty_ordered = safe_num(field(row, 'qty_ordered'))
+        price_per = safe_num(field(row, 'price_per'))
+        total_net = safe_num(field(row, 'total_net_price'))
+        notes = str(field(row, 'notes') or '')
+        pricing_type, total_net = _detect_pricing(qty_ordered, quote_qty, price_per, total_net)
+
+        batch.append((int(line_num), stock_ns, str(sku or ''), str(desc or ''),
+                      quote_qty, qty_ordered, price_per, total_net, pricing_type, notes))
+        imported += 1
+        if len(batch) >= BATCH_SIZE:
+            _insert_line_items(conn, batch)
+            batch = []
+    if batch:
+        _insert_line_items(conn, batch)
+    return imported
+
+
+def _insert_line_items(conn, batch):
+    conn.executemany(
+        '''INSERT INTO temp.import_line_items (line_number, stock_ns, sku, description,
+           quote_qty, qty_ordered, price_per, total_net_price, pricing_type, notes)
+           VALUES (?,?,?,?,?,?,?,?,?,?)''',
+        batch
+    )
+    conn.commit()
+
+
+def _line_id_map(conn):
+    """line_number -> staged id and 'desc:<description>' -> staged id for the staged rows.
+
+    Rows are read back in insertion (id) order so later duplicates win, matching
+    the old one-row-at-a-time behaviour.
+    """
+    line_id_map = {}
+    for r in conn.execute('SELECT id, line_number, description FROM temp.import_line_items ORDER BY id'):
+        line_id_map[r['line_number']] = r['id']
+        # Also map by description (normalized) for tracking sheets that don't have line numbers
+        desc_key = (r['description'] or '').strip().lower()
+        if desc_key:
+            line_id_map['desc:' + desc_key] = r['id']
+    return line_id_map
+
+
+def _import_tracking(conn, ws, table_name, report, lo, hi, label):
+    line_id_map = _line_id_map(conn)
+    rows = ws.iter_rows(values_only=True)
+    # One extra row so a dates row directly under the header can be detected
+    head = list(islice(rows, HEADER_SCAN_ROWS + 1))
+    if not head:
+        return
+
+    # Find the header row (scan first 10 rows for one with known column names)
+    t_header_idx = 0
+    for idx, row in enumerate(head[:HEADER_SCAN_ROWS]):
+        row_vals = [str(v or '').strip().lower() for v in row[:19]]
+        matches = sum(1 for v in row_vals if v in _TRACKING_KNOWN_HEADERS or
+                      any(kw in v for kw in ['description', 'qty', 'received', 'shipped', 'invoiced']))
+        if matches >= 2:
+            t_header_idx = idx
+            break
+    header = head[t_header_idx]
+    data_idx = t_header_idx + 1
+
+    # Find which column has line numbers and which has descriptions
+    t_headers = {}
+    for c, val in enumerate(header[:49], 1):
+        if val:
+            t_headers[str(val).strip().lower()] = c
+
+    line_col = None
+    desc_col = None
+    for alias in ['line #', 'line', 'line number', '#']:
+        if alias in t_headers:
+            line_col = t_headers[alias]
+            break
+    for alias in ['description', 'desc', 'item description', 'product', 'product description', 'name']:
+        if alias in t_headers:
+            desc_col = t_headers[alias]
+            break
+
+    # Find where quantity columns start (after description/totals)
+    hdr_lower = [str(v or '').strip().lower() for v in header[:49]]
+    qty_start_col = None
+    for c, hdr in enumerate(hdr_lower, 1):
+        # Skip "total" summary columns — we want the first actual entry column
+        if 'total' in hdr:
+            continue
+        if any(kw in hdr for kw in ['qty received', 'qty shipped', 'invoice', 'qty 1']):
+            qty_start_col = c
+            break
+    if qty_start_col is None:
+        # Fall back: first column after "total" columns
+        for c, hdr in enumerate(hdr_lower[2:], 3):
+            if hdr and ('1' in hdr or 'date' in hdr):
+                qty_start_col = c
+                break
+    if qty_start_col is None:
+        qty_start_col = 3  # default fallback
+
+    # Column dates: header row first, then the row above, then a dates row below
+    above = head[t_header_idx - 1] if t_header_idx > 0 else ()
+    below = head[data_idx] if data_idx < len(head) else ()
+    date_headers = {}
+    width = max(len(header), len(above), len(below))
+    for col in range(qty_start_col, min(width, qty_start_col + MAX_ENTRY_COLUMNS - 1) + 1):
+        val = _cell(header, col)
+        if above and not val:
+            val = _cell(above, col)
+        if not val:
+            check_val = _cell(below, col)
+            if hasattr(check_val, 'strftime'):
+                val = check_val
+                data_idx = t_header_idx + 2  # dates row, data starts after
+        if val:
+            if hasattr(val, 'strftime'):
+                date_headers[col] = val.strftime('%Y-%m-%d')
+            else:
+                date_headers[col] = str(val)
+
+    sql = ('INSERT OR REPLACE INTO temp.import_entries '
+           '(table_name, line_item_id, column_number, quantity, entry_date) VALUES (?,?,?,?,?)')
+    total_rows = ws.max_row or 0
+    batch = []
+    seen = 0
+    for row in chain(head[data_idx:], rows):
+        seen += 1
+        report.rows(seen, total_rows, lo, hi, label)
+
+        # Try to match by line number first, then by description
+        line_item_id = None
+        if line_col:
+            line_num_val = safe_num(_cell(row, line_col))
+            if line_num_val > 0:
+                line_item_id = line_id_map.get(int(line_num_val))
+        if not line_item_id and desc_col:
+            desc_val = str(_cell(row, desc_col) or '').strip().lower()
+            if desc_val:
+                line_item_id = line_id_map.get('desc:' + desc_val)
+        # Also try column 1 as description if no line_col/desc_col matched
+        if not line_item_id:
+            desc_val = str(_cell(row, 1) or '').strip().lower()
+            if desc_val:
+                line_item_id = line_id_map.get('desc:' + desc_val)
+        if not line_item_id:
+            continue
+
+        for offset, val in enumerate(row[qty_start_col - 1:qty_start_col - 1 + MAX_ENTRY_COLUMNS]):
+            qty = safe_num(val)
+            if qty == 0:
+                continue
+            col = qty_start_col + offset
+            batch.append((table_name, line_item_id, offset + 1, qty, date_headers.get(col, '')))
+        if len(batch) >= BATCH_SIZE:
+            conn.executemany(sql, batch)
+            conn.commit()
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+        conn.commit()
@@ -0,0 +1,152 @@
+"""
+Bulk notification fan-out.
+
+notify_many() writes one notification per recipient in a single transaction
+(notify_batch() does the same for several different notifications)
+and then publishes the live 'notification' event (event_bus) to each
+recipient that actually got a row.
+
+De-duplication: pass dedupe_key to skip recipients who already have an
+*unread* notification with the same key. A partial unique index on
+notifications(user_id, dedupe_key) WHERE is_read = 0 enforces it, so no
+LIKE scan is needed. Once the notification is read, the key can be used again.
+
+defer=True hands the batch to a background writer thread and returns at
+once. Use it for large fan-outs on the request path, like channel messages
+or team-wide delivery alerts. Deferred batches queued close together are
+written in one transaction.
+"""
+import queue
+import threading
+
+import event_bus
+from database import connect, get_db
+
+_INSERT = '''INSERT OR IGNORE INTO notifications (user_id, type, title, message, link, dedupe_key)
+             VALUES (?,?,?,?,?,?)'''
+
+_pending = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _unique_ids(user_ids):
+    seen = set()
+    out = []
+    for uid in user_ids:
+        if uid is None:
+            continue
+        uid = int(uid)
+        if uid not in seen:
+            seen.add(uid)
+            out.append(uid)
+    return out
+
+
+def _write(conn, batches):
+    """Insert every (user_ids, fields) batch on conn. Returns [(user_id, id, fields)] inserted.
+
+    Commits, unless conn already has a transaction open: the rows then join
+    it and the caller's commit (or rollback) covers them.
+    """
+    commit = not conn.in_transaction
+    created = []
+    for user_ids, fields in batches:
+        row = (fields['type'], fields['title'], fields['message'], fields['link'], fields['dedupe_key'])
+        for uid in user_ids:
+            cur = conn.execute(_INSERT, (uid,) + row)
+            if cur.rowcount:
+                created.append((uid, cur.lastrowid, fields))
+    if commit:
+        conn.commit()
+    return created
+
+
+def _publish(created):
+    for uid, nid, fields in created:
+        event_bus.publish(uid, 'notification', {
+            'id': nid, 'type': fields['type'], 'title': fields['title'],
+            'message': fields['message'], 'link': fields['link'], 'delta': 1,
+        })
+
+
+def notify_many(user_ids, ntype, title, message='', link='', dedupe_key=None, conn=None, defer=False):
+    """Create the same notification for every user in user_ids.
+
+    conn: write on the caller's connection. If the caller has uncommitted
+    writes, the notifications join that transaction and the caller commits;
+    otherwise they are committed here. By default a private connection is
+    opened for the batch. Returns the number of notifications
+    written, or None when deferred.
+    """
+    return notify_batch([(user_ids, ntype, title, message, link, dedupe_key)], conn=conn, defer=defer)
+
+
+def notify_batch(entries, conn=None, defer=False):
+    """Write several different notifications in one transaction.
+
+    entries: iterable of (user_ids, ntype, title, message, link, dedupe_key).
+    Same conn/defer semantics and return value as notify_many.
+    """
+    batches = []
+    for user_ids, ntype, title, message, link, dedupe_key in entries:
+        user_ids = _unique_ids(user_ids)
+        if user_ids:
+            batches.append((user_ids, {'type': ntype, 'title': title, 'message': message or '',
+                                       'link': link or '', 'dedupe_key': dedupe_key}))
+    if not batches:
+        return None if defer else 0
+    if defer:
+        _ensure_worker()
+        _pending.put(batches)
+        return None
+
+    own = conn is None
+    if own:
+        conn = connect()
+    try:
+        created = _write(conn, batches)
+    finally:
+        if own:
+            conn.close()
+    _publish(created)
+    return len(created)
+
+
+# ─── Background writer ──────────────────────────────────────────
+
+def _ensure_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_worker, name='notification-writer', daemon=True)
+            _worker.start()
+
+
+def _run_worker():
+    while True:
+        queued = [_pending.get()]
+        # Coalesce whatever else is already waiting into the same transaction
+        while True:
+            try:
+                queued.append(_pending.get_nowait())
+            except queue.Empty:
+                break
+        batches = [b for item in queued for b in item]
+        try:
+            conn = get_db()
+            try:
+                created = _write(conn, batches)
+            finally:
+                conn.close()
+            _publish(created)
+        except Exception as e:
+            print(f"Notifications: deferred write of {len(batches)} batch(es) failed: {e}")
+        finally:
+            for _ in queued:
+                _pending.task_done()
+
+
+def flush():
+    """Block until every deferred notification has been written."""
+    _pending.join()
@@ -0,0 +1,311 @@
+"""
+Materialized pay-application totals kept current by SQLite triggers.
+
+The billing summary, the job pay-apps tab and pay-app analytics used to walk
+jobs -> contracts -> applications and run a SUM over pay_app_line_entries for
+every application. Two tables now hold those sums:
+
+  pay_app_rollups           one row per application
+      period_total          work + stored materials on every entry
+      work, stored          the same, SOV line items only (headers excluded)
+      work_retainable,      work / stored on line items subject to retainage
+      stored_retainable     (not exempt, scheduled value > 0)
+
+  pay_app_contract_rollups  one row per contract
+      app_count, latest_app_id (highest application number)
+      co_additions, co_deductions
+      billed_to_date        SUM(period_total) over all applications
+      work_to_date          SUM(work) over all applications
+      stored_to_date        stored materials on the latest application
+      completed_to_date     work_to_date + stored_to_date
+      retainage             work and stored retainage at the contract rates
+      balance_to_finish     contract sum to date - (completed - retainage)
+
+Application rows are recomputed from their entries on every entry write (an
+indexed SUM over one application's lines), so they cannot drift. Contract rows
+are recomputed from the application rows whenever one changes, and when the
+contract's own amounts or rates change. Amounts are stored unrounded; callers
+round for display.
+
+install() is called from database.init_db(). To check or repair the tables:
+
+    python3 pay_app_rollups.py verify
+    python3 pay_app_rollups.py rebuild
+"""
+
+APP_COLUMNS = ('contract_id', 'period_total', 'work', 'stored', 'work_retainable', 'stored_retainable')
+CONTRACT_COLUMNS = ('app_count', 'latest_app_id', 'co_additions', 'co_deductions', 'billed_to_date',
+                    'work_to_date', 'stored_to_date', 'completed_to_date', 'retainage', 'balance_to_finish')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pay_app_rollups (
+    pay_app_id INTEGER PRIMARY KEY,
+    contract_id INTEGER NOT NULL,
+    period_total REAL NOT NULL DEFAULT 0,
+    work REAL NOT NULL DEFAULT 0,
+    stored REAL NOT NULL DEFAULT 0,
+    work_retainable REAL NOT NULL DEFAULT 0,
+    stored_retainable REAL NOT NULL DEFAULT 0,
+    FOREIGN KEY (pay_app_id) REFERENCES pay_applications(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_pay_app_rollups_contract ON pay_app_rollups(contract_id);
+CREATE TABLE IF NOT EXISTS pay_app_contract_rollups (
+    contract_id INTEGER PRIMARY KEY,
+    app_count INTEGER NOT NULL DEFAULT 0,
+    latest_app_id INTEGER,
+    co_additions REAL NOT NULL DEFAULT 0,
+    co_deductions REAL NOT NULL DEFAULT 0,
+    billed_to_date REAL NOT NULL DEFAULT 0,
+    work_to_date REAL NOT NULL DEFAULT 0,
+    stored_to_date REAL NOT NULL DEFAULT 0,
+    completed_to_date REAL NOT NULL DEFAULT 0,
+    retainage REAL NOT NULL DEFAULT 0,
+    balance_to_finish REAL NOT NULL DEFAULT 0,
+    FOREIGN KEY (contract_id) REFERENCES pay_app_contracts(id) ON DELETE CASCADE
+);
+'''
+
+_LINE = "s.is_header = 0"
+_RETAINABLE = "s.is_header = 0 AND s.retainage_exempt = 0 AND COALESCE(s.scheduled_value, 0) > 0"
+_WORK = 'COALESCE(e.work_this_period, 0)'
+_STORED = 'COALESCE(e.materials_stored, 0)'
+
+
+def _app_select(where):
+    """SELECT producing the true pay_app_rollups rows for the applications matching where."""
+    return f'''SELECT pa.id AS pay_app_id, pa.contract_id,
+    COALESCE(SUM({_WORK} + {_STORED}), 0) AS period_total,
+    COALESCE(SUM(CASE WHEN {_LINE} THEN {_WORK} END), 0) AS work,
+    COALESCE(SUM(CASE WHEN {_LINE} THEN {_STORED} END), 0) AS stored,
+    COALESCE(SUM(CASE WHEN {_RETAINABLE} THEN {_WORK} END), 0) AS work_retainable,
+    COALESCE(SUM(CASE WHEN {_RETAINABLE} THEN {_STORED} END), 0) AS stored_retainable
+FROM pay_applications pa
+LEFT JOIN pay_app_line_entries e ON e.pay_app_id = pa.id
+LEFT JOIN pay_app_sov_items s ON s.id = e.sov_item_id
+WHERE {where}
+GROUP BY pa.id'''
+
+
+def _contract_select(where, apps='pay_app_rollups'):
+    """SELECT producing the true pay_app_contract_rollups rows for the contracts matching where.
+
+    apps is the per-application source: the rollup table, or a subquery over
+    the raw tables when verifying.
+    """
+    latest = ('(SELECT id FROM pay_applications WHERE contract_id = c.id '
+              'ORDER BY application_number DESC, id DESC LIMIT 1)')
+    return f'''SELECT contract_id, app_count, latest_app_id, co_additions, co_deductions, billed_to_date,
+    work_to_date, stored_to_date, work_to_date + stored_to_date AS completed_to_date,
+    {{ret}} AS retainage,
+    contract_sum + co_additions - co_deductions - (work_to_date + stored_to_date - {{ret}}) AS balance_to_finish
+FROM (
+    SELECT c.id AS contract_id,
+        COALESCE(c.original_contract_sum, 0) AS contract_sum,
+        COALESCE(c.retainage_work_pct, 0) AS work_pct,
+        COALESCE(c.retainage_stored_pct, 0) AS stored_pct,
+        (SELECT COUNT(*) FROM pay_applications WHERE contract_id = c.id) AS app_count,
+        {latest} AS latest_app_id,
+        (SELECT COALESCE(SUM(co_additions), 0) FROM pay_applications WHERE contract_id = c.id) AS co_additions,
+        (SELECT COALESCE(SUM(co_deductions), 0) FROM pay_applications WHERE contract_id = c.id) AS co_deductions,
+        (SELECT COALESCE(SUM(period_total), 0) FROM {apps} r WHERE r.contract_id = c.id) AS billed_to_date,
+        (SELECT COALESCE(SUM(work), 0) FROM {apps} r WHERE r.contract_id = c.id) AS work_to_date,
+        (SELECT COALESCE(SUM(work_retainable), 0) FROM {apps} r WHERE r.contract_id = c.id) AS work_retainable,
+        COALESCE((SELECT stored FROM {apps} r WHERE r.pay_app_id = {latest}), 0) AS stored_to_date,
+        COALESCE((SELECT stored_retainable FROM {apps} r WHERE r.pay_app_id = {latest}), 0) AS stored_retainable
+    FROM pay_app_contracts c
+    WHERE {where}
+)'''.format(ret='(work_pct / 100.0 * work_retainable + stored_pct / 100.0 * stored_retainable)')
+
+
+def _refresh_apps(where):
+    cols = ', '.join(APP_COLUMNS)
+    return (f'INSERT OR REPLACE INTO pay_app_rollups (pay_app_id, {cols}) '
+            f'SELECT pay_app_id, {cols} FROM ({_app_select(where)});')
+
+
+def _refresh_contract(ref):
+    cols = ', '.join(CONTRACT_COLUMNS)
+    return (f'INSERT OR REPLACE INTO pay_app_contract_rollups (contract_id, {cols}) '
+            f'SELECT contract_id, {cols} FROM ({_contract_select(f"c.id = {ref}")});')
+
+
+def _trigger_sql():
+    apps_of_item = 'pa.id IN (SELECT pay_app_id FROM pay_app_line_entries WHERE sov_item_id = NEW.id)'
+    return '\n'.join([
+        # Entries -> application totals
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payapp_entry_ins AFTER INSERT ON pay_app_line_entries BEGIN
+            {_refresh_apps('pa.id = NEW.pay_app_id')}
+        END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payapp_entry_del AFTER DELETE ON pay_app_line_entries BEGIN
+            {_refresh_apps('pa.id = OLD.pay_app_id')}
+        END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payapp_entry_upd
+            AFTER UPDATE OF pay_app_id, sov_item_id, work_this_period, materials_stored ON pay_app_line_entries BEGIN
+            {_refresh_apps('pa.id IN (OLD.pay_app_id, NEW.pay_app_id)')}
+        END;''',
+        # A SOV item moving in or out of the line / retainable sets changes every application that bills it
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payapp_sov_upd
+            AFTER UPDATE OF is_header, retainage_exempt, scheduled_value ON pay_app_sov_items BEGIN
+            {_refresh_apps(apps_of_item)}
+        END;''',
+        # Applications
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payapp_app_ins AFTER INSERT ON pay_applications BEGIN
+            {_refresh_apps('pa.id = NEW.id')}
+        END;''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_payapp_app_del AFTER DELETE ON pay_applications BEGIN
+            DELETE FROM pay_app_rollups WHERE pay_app_id = OLD.id;
+        END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payapp_app_upd
+            AFTER UPDATE OF contract_id, application_number, co_additions, co_deductions ON pay_applications BEGIN
+            {_refresh_apps('pa.id = NEW.id')}
+            {_refresh_contract('OLD.contract_id')}
+            {_refresh_contract('NEW.contract_id')}
+        END;''',
+        # Application totals -> contract totals
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payapp_rollup_ins AFTER INSERT ON pay_app_rollups BEGIN
+            {_refresh_contract('NEW.contract_id')}
+        END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payapp_rollup_del AFTER DELETE ON pay_app_rollups BEGIN
+            {_refresh_contract('OLD.contract_id')}
+        END;''',
+        # Contracts
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payapp_contract_ins AFTER INSERT ON pay_app_contracts BEGIN
+            {_refresh_contract('NEW.id')}
+        END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payapp_contract_upd
+            AFTER UPDATE OF original_contract_sum, retainage_work_pct, retainage_stored_pct ON pay_app_contracts BEGIN
+            {_refresh_contract('NEW.id')}
+        END;''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_payapp_contract_del AFTER DELETE ON pay_app_contracts BEGIN
+            DELETE FROM pay_app_contract_rollups WHERE contract_id = OLD.id;
+        END;''',
+    ])
+
+
+def install(conn):
+    """Create the rollup tables and their triggers if missing; populate them when first created."""
+    existed = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pay_app_contract_rollups'"
+    ).fetchone()
+    conn.executescript(_SCHEMA)
+    conn.executescript(_trigger_sql())
+    if not existed:
+        rebuild(conn)
+
+
+def rebuild(conn):
+    """Recompute both rollup tables from the raw tables. Returns (applications, contracts) written."""
+    conn.execute('DELETE FROM pay_app_contract_rollups')
+    conn.execute('DELETE FROM pay_app_rollups')
+    apps = conn.execute(_refresh_apps('1').rstrip(';')).rowcount
+    cols = ', '.join(CONTRACT_COLUMNS)
+    # Contract rows are also written by the pay_app_rollups insert trigger; REPLACE leaves one per contract
+    conn.execute(f'INSERT OR REPLACE INTO pay_app_contract_rollups (contract_id, {cols}) '
+                 f'SELECT contract_id, {cols} FROM ({_contract_select("1")})')
+    contracts = conn.execute('SELECT COUNT(*) FROM pay_app_contract_rollups').fetchone()[0]
+    return apps, contracts
+
+
+def _compare(stored, expected, key, columns, tolerance):
+    problems = []
+    for exp in expected:
+        row = stored.pop(exp[key], None)
+        if row is None:
+            problems.append({key: exp[key], 'column': '*', 'stored': None, 'expected': None})
+            continue
+        for col in columns:
+            a, b = row[col], exp[col]
+            if (a is None) != (b is None) or (a is not None and abs(a - b) > tolerance):
+                problems.append({key: exp[key], 'column': col, 'stored': a, 'expected': b})
+    problems += [{key: k, 'column': '*', 'stored': 'orphan', 'expected': None} for k in stored]
+    return problems
+
+
+def verify(conn, tolerance=0.005):
+    """Compare both rollup tables against totals computed from the raw tables.
+
+    Returns a list of mismatches, each {'pay_app_id' or 'contract_id', 'column',
+    'stored', 'expected'}; a missing row is reported with column '*' and a row
+    with no source with stored='orphan'.
+    """
+    stored = {r['pay_app_id']: r for r in conn.execute('SELECT * FROM pay_app_rollups').fetchall()}
+    problems = _compare(stored, conn.execute(_app_select('1')).fetchall(),
+                        'pay_app_id', APP_COLUMNS, tolerance)
+    stored = {r['contract_id']: r for r in conn.execute('SELECT * FROM pay_app_contract_rollups').fetchall()}
+    expected = conn.execute(_contract_select('1', apps=f"({_app_select('1')})")).fetchall()
+    return problems + _compare(stored, expected, 'contract_id', CONTRACT_COLUMNS, tolerance)
+
+
+# ─── Readers ────────────────────────────────────────────────────
+
+def application_rows(conn, job_id=None):
+    """Every contract (of one job, or all) with its applications and their rolled-up totals.
+
+    One row per application, ordered by job name, contract and application
+    number; a contract with no applications gives one row with pay_app_id NULL.
+    billed_to_date is the contract's period_total summed through that application.
+    """
+    where, params = ('WHERE c.job_id = ?', (job_id,)) if job_id is not None else ('', ())
+    return conn.execute(f'''
+        SELECT j.id AS job_id, j.name AS job_name, j.status AS job_status,
+               c.id AS contract_id, c.gc_name, c.project_name, c.original_contract_sum, c.retainage_work_pct,
+               pa.id AS pay_app_id, pa.application_number, pa.period_to, pa.application_date,
+               pa.status, pa.co_additions, pa.co_deductions,
+               COALESCE(r.period_total, 0) AS period_total,
+               SUM(COALESCE(r.period_total, 0)) OVER (
+                   PARTITION BY c.id ORDER BY pa.application_number, pa.id
+               ) AS billed_to_date
+        FROM pay_app_contracts c
+        JOIN jobs j ON j.id = c.job_id
+        LEFT JOIN pay_applications pa ON pa.contract_id = c.id
+        LEFT JOIN pay_app_rollups r ON r.pay_app_id = pa.id
+        {where}
+        ORDER BY j.name, j.id, c.id, pa.application_number, pa.id
+    ''', params).fetchall()
+
+
+def contract_rows(conn):
+    """Every contract with its job name, contract rollup and latest application, newest contract first."""
+    return conn.execute('''
+        SELECT c.*, j.name AS job_name,
+               COALESCE(r.app_count, 0) AS app_count,
+               COALESCE(r.co_additions, 0) AS co_additions, COALESCE(r.co_deductions, 0) AS co_deductions,
+               COALESCE(r.billed_to_date, 0) AS billed_to_date,
+               COALESCE(r.completed_to_date, 0) AS completed_to_date,
+               COALESCE(r.retainage, 0) AS retainage,
+               r.balance_to_finish,
+               la.application_number AS latest_app_number, la.status AS latest_status,
+               la.period_to AS latest_period_to
+        FROM pay_app_contracts c
+        LEFT JOIN jobs j ON c.job_id = j.id
+        LEFT JOIN pay_app_contract_rollups r ON r.contract_id = c.id
+        LEFT JOIN pay_applications la ON la.id = r.latest_app_id
+        ORDER BY c.created_at DESC
+    ''').fetchall()
+
+
+if __name__ == '__main__':
+    import sys
+    from database import get_db
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else 'verify'
+    if cmd not in ('verify', 'rebuild'):
+        print('usage: python3 pay_app_rollups.py [verify|rebuild]')
+        raise SystemExit(2)
+
+    conn = get_db()
+    try:
+        if cmd == 'rebuild':
+            apps, contracts = rebuild(conn)
+            conn.commit()
+            print(f'Rebuilt rollups for {apps} pay applications and {contracts} contracts.')
+        problems = verify(conn)
+        for p in problems[:50]:
+            ref = f"pay app {p['pay_app_id']}" if 'pay_app_id' in p else f"contract {p['contract_id']}"
+            print(f"{ref}: {p['column']} stored={p['stored']} expected={p['expected']}")
+        if problems:
+            print(f'{len(problems)} mismatches.')
+            raise SystemExit(1)
+        print('pay_app_rollups OK.')
+    finally:
+        conn.close()
@@ -0,0 +1,376 @@
+"""
+WeasyPrint PDF rendering with a content-hash disk cache and a bounded worker pool.
+
+Routes used to call weasyprint.HTML(...).write_pdf() on the request thread;
+a long G702/G703 took seconds, and the same document was rendered again on
+every download. render() now:
+
+  * keys the output on a SHA-256 of the rendered HTML, its base URL and the
+    size/mtime of every local file it references (logo, signature, ...),
+    so an unchanged document is copied out of data/pdf_cache/ instead of
+    re-rendered;
+  * runs cold renders in at most MAX_WORKERS long-lived
+    `python pdf_render.py serve` subprocesses. Each one imports WeasyPrint
+    and loads the fonts our templates use once, then renders many
+    documents. A plain interpreter is used rather than a multiprocessing
+    pool so the web app's __main__ is not re-imported (see plan_index).
+    The templates inline their CSS, so fonts are all there is to preload;
+  * collapses concurrent requests for the same document into one render.
+
+render_or_submit() queues documents larger than ASYNC_HTML_BYTES as a
+'pdf_render' background job and returns its id, for the client to poll
+/api/background-jobs/<id>. Anything that must only be recorded once the file
+exists (a pay application's pdf_file) goes in an @on_done hook named by
+`then`, which the job runs after a successful render. Cache files unused for PDF_CACHE_DAYS and table
+exports older than EXPORT_KEEP_HOURS are pruned.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+import job_queue
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(ROOT, 'data', 'pdf_cache')
+EXPORT_DIR = os.path.join(ROOT, 'data', 'exports')
+
+MAX_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', 2))
+RENDERS_PER_WORKER = 200  # recycle workers to cap WeasyPrint's memory growth
+RENDER_TIMEOUT = 300
+ASYNC_HTML_BYTES = int(os.environ.get('PDF_ASYNC_HTML_BYTES', 100_000))
+PDF_CACHE_DAYS = 30
+EXPORT_KEEP_HOURS = 24  # table exports in EXPORT_DIR, once the client has had time to download them
+
+# src="..." / href="..." attributes and CSS url(...) references
+_ASSET_RE = re.compile(r'''(?:\b(?:src|href)\s*=\s*["']([^"']+)["'])|(?:url\(\s*["']?([^"')]+)["']?\s*\))''', re.I)
+
+_slots = threading.BoundedSemaphore(MAX_WORKERS)
+_idle = []
+_idle_lock = threading.Lock()
+_inflight = {}  # cache key -> Future for a render in progress
+_inflight_lock = threading.Lock()
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+_done_hooks = {}  # name -> fn(args, dest), run by the job after a queued render succeeds
+
+
+class RenderError(Exception):
+    """WeasyPrint failed, a worker died or a render timed out."""
+
+
+# ─── Cache ──────────────────────────────────────────────────────
+
+def _local_asset(ref, base_dir):
+    if ref.startswith('file://'):
+        return ref[len('file://'):]
+    if re.match(r'^[a-z][a-z0-9+.-]*:', ref, re.I) or ref.startswith('#'):
+        return None  # http(s), data:, mailto: ... are part of the HTML itself
+    return os.path.join(base_dir, ref.lstrip('/')) if base_dir else None
+
+
+def cache_key(html, base_url=None):
+    """SHA-256 of the HTML, its base URL and the size/mtime of each local file it references."""
+    h = hashlib.sha256()
+    h.update((base_url or '').encode())
+    h.update(b'\0')
+    h.update(html.encode())
+    base_dir = base_url[len('file://'):] if (base_url or '').startswith('file://') else base_url
+    for m in sorted({a or b for a, b in _ASSET_RE.findall(html)}):
+        path = _local_asset(m.strip(), base_dir)
+        if not path:
+            continue
+        try:
+            st = os.stat(path)
+            h.update(f'\0{path}\0{st.st_size}\0{st.st_mtime_ns}'.encode())
+        except OSError:
+            h.update(f'\0{path}\0missing'.encode())
+    return h.hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, key[:2], f'{key}.pdf')
+
+
+def _copy_out(src, dest):
+    os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+    tmp = f'{dest}.{uuid.uuid4().hex[:8]}.tmp'
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+def cached(html, base_url=None):
+    """Path of the cached PDF for this HTML, or None."""
+    path = _cache_path(cache_key(html, base_url))
+    return path if os.path.exists(path) else None
+
+
+# ─── Worker pool ────────────────────────────────────────────────
+
+class _Worker:
+    def __init__(self):
+        self.renders = 0
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'serve'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1, cwd=ROOT,
+        )
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def call(self, request, timeout):
+        watchdog = threading.Timer(timeout, self.proc.kill)
+        watchdog.start()
+        try:
+            self.proc.stdin.write(json.dumps(request) + '\n')
+            self.proc.stdin.flush()
+            line = self.proc.stdout.readline()
+        except (BrokenPipeError, OSError) as e:
+            raise RenderError(f'PDF worker failed: {e}')
+        finally:
+            watchdog.cancel()
+        if not line:
+            raise RenderError('PDF worker exited (timed out or crashed)')
+        self.renders += 1
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+
+
+def _run_in_worker(html_path, out_path, base_url, timeout):
+    with _slots:
+        with _idle_lock:
+            worker = _idle.pop() if _idle else None
+        if worker is None or not worker.alive():
+            worker = _Worker()
+        try:
+            resp = worker.call({'html': html_path, 'out': out_path, 'base_url': base_url}, timeout)
+        except Exception:
+            worker.close()
+            raise
+        if worker.renders >= RENDERS_PER_WORKER:
+            worker.close()
+        else:
+            with _idle_lock:
+                _idle.append(worker)
+    if not resp.get('ok'):
+        raise RenderError(resp.get('error') or 'PDF generation failed')
+
+
+def _render_to_cache(key, html, base_url, timeout):
+    path = _cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    stem = f'{path}.{uuid.uuid4().hex[:8]}'
+    html_path, out_path = f'{stem}.html', f'{stem}.tmp'
+    try:
+        with open(html_path, 'w', encoding='utf-8') as f:
+            f.write(html)
+        _run_in_worker(html_path, out_path, base_url, timeout)
+        os.replace(out_path, path)
+    finally:
+        for p in (html_path, out_path):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+    return path
+
+
+def _cached_or_render(html, base_url, timeout):
+    """Cache path for the document, rendering it (once across concurrent callers) on a miss.
+
+    Returns (path, from_cache).
+    """
+    key = cache_key(html, base_url)
+    path = _cache_path(key)
+    if os.path.exists(path):
+        try:
+            os.utime(path)  # mark as recently used for pruning
+        except OSError:
+            pass
+        return path, True
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        owner = fut is None
+        if owner:
+            fut = _inflight[key] = Future()
+    if not owner:
+        return fut.result(), True
+    try:
+        fut.set_result(_render_to_cache(key, html, base_url, timeout))
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+    _maybe_prune()
+    return path, False
+
+
+# ─── Public API ─────────────────────────────────────────────────
+
+def render(html, dest, base_url=None, timeout=RENDER_TIMEOUT):
+    """Write the PDF for html to dest. Returns True if it came from the cache.
+
+    Raises RenderError if WeasyPrint fails or the render times out.
+    """
+    path, from_cache = _cached_or_render(html, base_url, timeout)
+    _copy_out(path, dest)
+    return from_cache
+
+
+def on_done(name):
+    """Decorator registering fn(args, dest) as the `then` hook called `name`."""
+    def register(fn):
+        _done_hooks[name] = fn
+        return fn
+    return register
+
+
+def submit(html, dest, base_url=None, ref_id=None, created_by=None, then=None, then_args=None):
+    """Queue a background render of html to dest and return the job id.
+
+    The job's result is {'filename', 'cached'}. The HTML waits in the cache
+    directory until the job picks it up. then: name of an @on_done hook run
+    with then_args once dest is written; it is not run if the render fails.
+    """
+    _maybe_prune()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    html_path = os.path.join(CACHE_DIR, f'job-{uuid.uuid4().hex}.html')
+    with open(html_path, 'w', encoding='utf-8') as f:
+        f.write(html)
+    payload = {'html': html_path, 'dest': dest, 'base_url': base_url, 'then': then, 'then_args': then_args}
+    return job_queue.enqueue('pdf_render', payload, ref_id=ref_id, created_by=created_by, dedupe=False)
+
+
+def render_or_submit(html, dest, base_url=None, ref_id=None, created_by=None, then=None, then_args=None):
+    """Render small or cached documents now (returns None); queue large ones (returns the job id).
+
+    The `then` hook only runs for queued renders: after a synchronous render
+    the caller records the result itself.
+    """
+    if len(html) > ASYNC_HTML_BYTES and not cached(html, base_url):
+        return submit(html, dest, base_url, ref_id=ref_id, created_by=created_by,
+                      then=then, then_args=then_args)
+    render(html, dest, base_url)
+    return None
+
+
+def _remove_job_html(job, _error=None):
+    try:
+        os.remove(job.payload['html'])
+    except (OSError, KeyError, TypeError):
+        pass
+
+
+@job_queue.handler('pdf_render', on_fail=_remove_job_html, pool='short')
+def _pdf_render_job(job):
+    p = job.payload
+    try:
+        with open(p['html'], encoding='utf-8') as f:
+            html = f.read()
+    except OSError:
+        raise job_queue.JobFailed('Rendered HTML is missing')
+    job.progress(message='Rendering PDF')
+    try:
+        from_cache = render(html, p['dest'], p.get('base_url'))
+    except RenderError as e:
+        raise job_queue.JobFailed(f'PDF generation failed: {str(e)[:200]}')
+    _remove_job_html(job)
+    if p.get('then'):
+        _done_hooks[p['then']](p.get('then_args'), p['dest'])
+    return {'filename': os.path.basename(p['dest']), 'cached': from_cache}
+
+
+def _maybe_prune():
+    """Remove cached PDFs unused for PDF_CACHE_DAYS and old table exports; runs at most hourly."""
+    global _last_prune
+    now = time.time()
+    with _prune_lock:
+        if now - _last_prune < 3600:
+            return
+        _last_prune = now
+    cutoff = now - PDF_CACHE_DAYS * 86400
+    for dirpath, _dirs, files in os.walk(CACHE_DIR):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
+    try:
+        names = os.listdir(EXPORT_DIR)
+    except FileNotFoundError:
+        return
+    cutoff = now - EXPORT_KEEP_HOURS * 3600
+    for name in names:
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        except OSError:
+            continue
+
+
+# ─── Worker process ─────────────────────────────────────────────
+
+# Rendered once at worker start so fontconfig/Pango have the template fonts loaded
+_WARMUP_HTML = '''<html><body>
+<p style="font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif">Warm up <b>bold</b> <i>italic</i></p>
+<p style="font-family: Arial, Helvetica, sans-serif">Warm up 0123456789 $,.</p>
+<p style="font-family: 'Times New Roman', Times, serif">Warm up <b>bold</b></p>
+</body></html>'''
+
+
+def _serve():
+    """Read {'html', 'out', 'base_url'} requests from stdin, one JSON line each; answer {'ok'[, 'error']}."""
+    # Replies go on the real stdout; anything else a library prints lands on stderr
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'w', buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    import weasyprint
+    try:
+        from weasyprint.text.fonts import FontConfiguration
+    except ImportError:  # WeasyPrint < 53
+        from weasyprint.fonts import FontConfiguration
+    fonts = FontConfiguration()
+    try:
+        weasyprint.HTML(string=_WARMUP_HTML).write_pdf(font_config=fonts)
+    except Exception as e:
+        print(f"PDF worker: warm-up render failed: {e}", file=sys.stderr)
+
+    for line in sys.stdin:
+        try:
+            req = json.loads(line)
+            with open(req['html'], encoding='utf-8') as f:
+                html = f.read()
+            weasyprint.HTML(string=html, base_url=req.get('base_url')).write_pdf(req['out'], font_config=fonts)
+            reply = {'ok': True}
+        except Exception as e:
+            reply = {'ok': False, 'error': str(e)[:500]}
+        replies.write(json.dumps(reply) + '\n')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] != 'serve':
+        print('usage: python3 pdf_render.py serve')
+        raise SystemExit(2)
+    _serve()
@@ -0,0 +1,216 @@
+"""
+Thumbnail and medium-size renditions of job photos (photo_derivatives).
+
+Originals straight off a phone are 5-12 MB, and the /photos grid used to
+load every one of them for a 180 px tile. Each photo now gets, per SIZES
+entry, a WebP and a JPEG scaled to fit a square of that many pixels, stored
+under data/photos/derivatives/ with one row per file:
+
+  etag   SHA-256 of the file's bytes, used as its strong ETag; the ?v=
+         cache-buster in the URLs api_list_photos hands out is derived from
+         the etags of every format of a size
+  width, height, bytes
+
+Those URLs name no format: api_photo_file picks WebP or JPEG from the Accept
+header of the <img> request itself (the JSON fetch that lists the photos
+accepts */*, so it cannot choose) and answers with Vary: Accept.
+
+Uploads queue a 'photo_derivatives' background job (handler in app.py,
+which calls generate()). Existing photos are filled in with:
+
+    python3 photo_derivatives.py backfill [--force]
+
+Photos Pillow cannot open (HEIC, corrupt files) keep no derivatives and are
+served as the original.
+"""
+import hashlib
+import os
+import sys
+
+import database
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DERIVATIVE_DIR = os.path.join('data', 'photos', 'derivatives')
+
+# Longest edge in pixels, largest first: each size is scaled from the one before
+SIZES = (('medium', 1600), ('thumb', 400))
+# (format, extension, mimetype, Pillow save options)
+FORMATS = (
+    ('webp', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+    ('jpeg', 'jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+MIMETYPES = {fmt: mime for fmt, _ext, mime, _opts in FORMATS}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS photo_derivatives (
+    photo_id INTEGER NOT NULL,
+    size TEXT NOT NULL,
+    format TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    created_at TEXT NOT NULL DEFAULT (datetime('now','localtime')),
+    PRIMARY KEY (photo_id, size, format),
+    FOREIGN KEY (photo_id) REFERENCES job_photos(id) ON DELETE CASCADE
+);
+'''
+
+
+class DerivativeError(Exception):
+    """The original is missing or Pillow cannot read it."""
+
+
+def install(conn):
+    conn.executescript(_SCHEMA)
+
+
+# ─── Generation ─────────────────────────────────────────────────
+
+def _save(img, rel_path, fmt, opts):
+    """Write img to rel_path atomically; returns (etag, bytes)."""
+    path = os.path.join(ROOT, rel_path)
+    tmp = f'{path}.tmp'
+    img.save(tmp, fmt.upper(), **opts)
+    with open(tmp, 'rb') as f:
+        data = f.read()
+    os.replace(tmp, path)
+    return hashlib.sha256(data).hexdigest(), len(data)
+
+
+def generate(conn, photo_id):
+    """(Re)build every rendition of one photo (caller commits). Returns the number of files written."""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise DerivativeError('Pillow is not installed')
+
+    photo = conn.execute('SELECT file_path FROM job_photos WHERE id = ?', (photo_id,)).fetchone()
+    if not photo:
+        raise DerivativeError(f'photo {photo_id} not found')
+    src = os.path.join(ROOT, photo['file_path'])
+    os.makedirs(os.path.join(ROOT, DERIVATIVE_DIR), exist_ok=True)
+
+    rows = []
+    try:
+        with Image.open(src) as im:
+            # JPEGs decode straight at 1/2..1/8 scale when that still covers the largest size
+            im.draft('RGB', (SIZES[0][1], SIZES[0][1]))
+            img = ImageOps.exif_transpose(im).convert('RGB')
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise DerivativeError(f'cannot read {photo["file_path"]}: {e}')
+
+    for size, edge in SIZES:
+        img.thumbnail((edge, edge), Image.LANCZOS)
+        for fmt, ext, _mime, opts in FORMATS:
+            rel = os.path.join(DERIVATIVE_DIR, f'{photo_id}-{size}.{ext}')
+            etag, nbytes = _save(img, rel, fmt, opts)
+            rows.append((photo_id, size, fmt, rel, etag, img.width, img.height, nbytes))
+    conn.executemany(
+        '''INSERT OR REPLACE INTO photo_derivatives
+           (photo_id, size, format, file_path, etag, width, height, bytes) VALUES (?,?,?,?,?,?,?,?)''', rows)
+    return len(rows)
+
+
+def remove(conn, photo_id):
+    """Delete the rendition files and rows of one photo (caller commits)."""
+    for r in conn.execute('SELECT file_path FROM photo_derivatives WHERE photo_id = ?', (photo_id,)).fetchall():
+        try:
+            os.remove(os.path.join(ROOT, r['file_path']))
+        except OSError:
+            pass
+    conn.execute('DELETE FROM photo_derivatives WHERE photo_id = ?', (photo_id,))
+
+
+# ─── Serving ────────────────────────────────────────────────────
+
+def preferred_format(accept_header):
+    return 'webp' if 'image/webp' in (accept_header or '') else 'jpeg'
+
+
+def _version(etags):
+    """?v= token of one size: changes whenever any of its formats is regenerated."""
+    return hashlib.sha256(''.join(sorted(etags)).encode()).hexdigest()[:16]
+
+
+def get(conn, photo_id, size, fmt):
+    """The photo_derivatives row for one rendition, or None."""
+    return conn.execute('SELECT * FROM photo_derivatives WHERE photo_id = ? AND size = ? AND format = ?',
+                        (photo_id, size, fmt)).fetchone()
+
+
+def negotiate(conn, photo_id, size, accept_header):
+    """(row, version) of the rendition of `size` to serve for an Accept header.
+
+    WebP when accepted and present, else JPEG; (None, None) when there is
+    neither. version is the size's ?v= token, as put in the URLs by urls().
+    """
+    rows = {r['format']: r for r in conn.execute(
+        'SELECT * FROM photo_derivatives WHERE photo_id = ? AND size = ?', (photo_id, size)).fetchall()}
+    row = rows.get(preferred_format(accept_header)) or rows.get('jpeg')
+    if row is None:
+        return None, None
+    return row, _version(r['etag'] for r in rows.values())
+
+
+def urls(conn, photo_ids):
+    """{photo_id: {size: url}} for the photos that have renditions.
+
+    The URLs carry a ?v= derived from the renditions' ETags, so they can be
+    cached as immutable; the format is negotiated when the image is fetched.
+    """
+    etags = {}
+    ids = list(photo_ids)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        ph = ','.join('?' * len(chunk))
+        for r in conn.execute(
+            f'SELECT photo_id, size, etag FROM photo_derivatives WHERE photo_id IN ({ph})', chunk
+        ).fetchall():
+            etags.setdefault((r['photo_id'], r['size']), []).append(r['etag'])
+    out = {}
+    for (photo_id, size), tags in etags.items():
+        out.setdefault(photo_id, {})[size] = f'/api/photos/{photo_id}/file?size={size}&v={_version(tags)}'
+    return out
+
+
+# ─── Backfill ───────────────────────────────────────────────────
+
+def backfill(conn, force=False):
+    """Generate renditions for photos missing any (every photo with force). Returns (generated, failed)."""
+    expected = len(SIZES) * len(FORMATS)
+    if force:
+        ids = [r[0] for r in conn.execute('SELECT id FROM job_photos ORDER BY id').fetchall()]
+    else:
+        ids = [r[0] for r in conn.execute('''
+            SELECT p.id FROM job_photos p
+            LEFT JOIN photo_derivatives d ON d.photo_id = p.id
+            GROUP BY p.id HAVING COUNT(d.photo_id) < ? ORDER BY p.id''', (expected,)).fetchall()]
+    generated, failed = 0, []
+    for n, pid in enumerate(ids, 1):
+        try:
+            generate(conn, pid)
+            conn.commit()
+            generated += 1
+        except DerivativeError as e:
+            print(f"Photo derivatives: {e}")
+            failed.append(pid)
+        if n % 50 == 0:
+            print(f'{n}/{len(ids)} photos')
+    return generated, failed
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args or args[0] != 'backfill' or args[1:] not in ([], ['--force']):
+        print('usage: python3 photo_derivatives.py backfill [--force]')
+        raise SystemExit(2)
+
+    database.init_db()  # brings an older database up to the schema with photo_derivatives
+    conn = database.get_db()
+    try:
+        generated, failed = backfill(conn, force=args[1:] == ['--force'])
+        print(f'Generated renditions for {generated} photos; {len(failed)} could not be read.')
+    finally:
+        conn.close()
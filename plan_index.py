@@ -0,0 +1,261 @@
+"""
+Per-file page index for plan PDFs, shared by the review estimate, the AI
+review and the plan-index background job.
+
+Classifying a plan set means extracting the text of every page with PyMuPDF
+and running the sheet-ID regexes and HVAC keyword scan over it. On a 300-sheet
+set that used to happen once for the estimate and again for every review.
+The result now lives in plan_page_index, keyed by the MD5 of the file
+contents, so each distinct file is classified once, however many plans or
+re-reviews point at it.
+
+Per page the index keeps the text length, the candidate sheet IDs and the
+HVAC keyword flag, plus the full text of spec (non-drawing) pages, which is
+the only text the review sends on. Noise IDs (building names, "sheet X of N"
+totals) are derived per document. Large sets are scanned in parallel, in page
+ranges by a few helper processes.
+
+Bump INDEX_VERSION whenever the classification rules change; older rows are
+then recomputed on next use.
+"""
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+INDEX_VERSION = 1
+
+# Sets of PARALLEL_MIN_PAGES or more are split into MAX_PROCESSES page ranges,
+# each scanned by its own `python plan_index.py scan` process; smaller sets
+# are scanned inline, reporting progress every CHUNK_PAGES pages
+PARALLEL_MIN_PAGES = 80
+CHUNK_PAGES = 20
+MAX_PROCESSES = min(4, os.cpu_count() or 1)
+SUBPROCESS_TIMEOUT = 600
+
+DRAWING_MAX_CHARS = 2000   # fewer characters than this = a drawing, not a spec page
+NOISE_MIN_PAGES = 5        # an "ID" on this many pages is a building name or a sheet total
+
+HVAC_KEYWORDS = (
+    'hvac plan', 'hvac equipment', 'mechanical plan', 'unit hvac',
+    'condensing unit', 'fan coil', 'mini split', 'duct siz',
+    'equipment schedule', 'grille', 'register schedule', 'fire damper schedule',
+    'exhaust fan', 'hvac', 'refrigerant', 'tonnage', 'btu', 'seer', 'cfm',
+    'mep plan', 'mep', 'roof hvac', 'roof mep', 'mechanical schedule',
+    'condensing', 'unit plan',
+)
+
+_SHEET_ID = re.compile(r'^(?:ME?\d{1,2}|[PSEGAC]\d{1,3})$')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS plan_page_index (
+    file_hash TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    page_count INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    created_at TEXT NOT NULL DEFAULT (datetime('now','localtime'))
+);
+'''
+
+# (path, size, mtime_ns) -> md5, least recently used first; re-uploads and
+# edited files leave stale keys behind, so the dict is capped
+_hash_cache = {}
+_HASH_CACHE_MAX = 256
+# file hash -> Lock while an index for it is being built, so concurrent
+# requests scan a file once; dropped again once the build is over
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def install(conn):
+    conn.executescript(_SCHEMA)
+
+
+def file_hash(fpath):
+    """MD5 of the file contents, memoized on (path, size, mtime)."""
+    st = os.stat(fpath)
+    key = (fpath, st.st_size, st.st_mtime_ns)
+    with _locks_guard:
+        h = _hash_cache.pop(key, None)
+        if h is not None:
+            _hash_cache[key] = h
+            return h
+    md5 = hashlib.md5()
+    with open(fpath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            md5.update(block)
+    h = md5.hexdigest()
+    with _locks_guard:
+        _hash_cache[key] = h
+        while len(_hash_cache) > _HASH_CACHE_MAX:
+            _hash_cache.pop(next(iter(_hash_cache)))
+    return h
+
+
+# ─── Scanning ───────────────────────────────────────────────────
+
+def _scan_page(text):
+    text = (text or '').strip()
+    ids = set()
+    for line in text.split('\n'):
+        token = line.strip()
+        if 2 <= len(token) <= 5 and _SHEET_ID.match(token):
+            ids.add(token)
+    text_lower = text.lower()
+    chars = len(text)
+    return {
+        'chars': chars,
+        'ids': sorted(ids),
+        'hvac': any(kw in text_lower for kw in HVAC_KEYWORDS),
+        'text': text if chars >= DRAWING_MAX_CHARS else '',
+    }
+
+
+def _scan_range(fpath, start, stop, progress=None):
+    """Scan pages [start, stop) of fpath; opens its own document so it can run in a subprocess."""
+    import fitz
+    doc = fitz.open(fpath)
+    try:
+        pages = []
+        for i in range(start, stop):
+            if progress and i % CHUNK_PAGES == 0:
+                progress(i, stop)
+            pages.append(_scan_page(doc[i].get_text()))
+        return pages
+    finally:
+        doc.close()
+
+
+def _scan_in_subprocess(fpath, start, stop):
+    # A plain interpreter running this file: unlike a multiprocessing pool it
+    # does not re-import the web app's __main__ in every worker
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), 'scan', fpath, str(start), str(stop)],
+                         capture_output=True, check=True, timeout=SUBPROCESS_TIMEOUT)
+    # Last line only: PyMuPDF may print warnings to stdout before the result
+    return json.loads(out.stdout.decode().rstrip('\n').rsplit('\n', 1)[-1])
+
+
+def _scan(fpath, page_count, progress=None):
+    if page_count < PARALLEL_MIN_PAGES or MAX_PROCESSES < 2:
+        return _scan_range(fpath, 0, page_count, progress)
+    step = -(-page_count // MAX_PROCESSES)
+    ranges = [(s, min(s + step, page_count)) for s in range(0, page_count, step)]
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = {pool.submit(_scan_in_subprocess, fpath, s, e): s for s, e in ranges}
+            results, done = {}, 0
+            if progress:
+                progress(0, page_count)
+            for fut in as_completed(futures):
+                results[futures[fut]] = fut.result()
+                done += len(results[futures[fut]])
+                if progress and done < page_count:
+                    progress(done, page_count)
+        return [p for s, _ in ranges for p in results[s]]
+    except Exception as e:
+        print(f"Plan index: parallel scan failed, scanning inline: {e}")
+        return _scan_range(fpath, 0, page_count, progress)
+
+
+def _build(fpath, progress=None):
+    import fitz
+    doc = fitz.open(fpath)
+    page_count = len(doc)
+    doc.close()
+    pages = _scan(fpath, page_count, progress)
+    freq = Counter(sid for p in pages for sid in p['ids'])
+    noise = sorted(sid for sid, n in freq.items() if n >= NOISE_MIN_PAGES)
+    return {'page_count': page_count, 'noise_ids': noise, 'pages': pages}
+
+
+# ─── Public API ─────────────────────────────────────────────────
+
+def get_index(conn, fpath, progress=None):
+    """Page index for the PDF at fpath, from plan_page_index or built (and stored) now.
+
+    Returns {'file_hash', 'page_count', 'noise_ids', 'pages': [{chars, ids, hvac, text}]}.
+    progress(done_pages, page_count) is called while a new index is being built.
+    Raises ImportError if PyMuPDF is missing and the index is not cached.
+    """
+    fh = file_hash(fpath)
+    index = _load(conn, fh)
+    if index is not None:
+        return index
+    with _locks_guard:
+        lock = _locks.setdefault(fh, threading.Lock())
+    try:
+        with lock:
+            index = _load(conn, fh)
+            if index is not None:
+                return index
+            index = _build(fpath, progress)
+            # Stored on a private connection: committing on conn would also
+            # commit whatever the caller has not committed yet
+            import database  # database installs this module; imported lazily
+            own = database.connect()
+            try:
+                own.execute(
+                    '''INSERT OR REPLACE INTO plan_page_index (file_hash, version, page_count, data)
+                       VALUES (?,?,?,?)''',
+                    (fh, INDEX_VERSION, index['page_count'],
+                     zlib.compress(json.dumps(index, separators=(',', ':')).encode()))
+                )
+                own.commit()
+            finally:
+                own.close()
+            index['file_hash'] = fh
+            return index
+    finally:
+        # Anyone still queued on this lock re-checks plan_page_index once they get it
+        with _locks_guard:
+            if _locks.get(fh) is lock:
+                del _locks[fh]
+
+def _load(conn, fh):
+    row = conn.execute('SELECT version, data FROM plan_page_index WHERE file_hash = ?', (fh,)).fetchone()
+    if not row or row['version'] != INDEX_VERSION:
+        return None
+    index = json.loads(zlib.decompress(row['data']))
+    index['file_hash'] = fh
+    return index
+
+
+def classify(index):
+    """Per-page classification used by the estimate and the review.
+
+    Returns one dict per page: num, text (spec pages only), char_count,
+    is_drawing, sheet_ids (noise removed), is_mech_sheet, hvac_strong.
+    A mechanical sheet has M/ME IDs and no other discipline's IDs, which
+    filters out cross-reference pages.
+    """
+    noise = set(index['noise_ids'])
+    out = []
+    for i, p in enumerate(index['pages']):
+        sheet_ids = set(p['ids']) - noise
+        m_ids = [s for s in sheet_ids if s.startswith('M')]
+        non_m_ids = [s for s in sheet_ids if not s.startswith('M')]
+        out.append({
+            'num': i + 1,
+            'text': p['text'],
+            'char_count': p['chars'],
+            'is_drawing': p['chars'] < DRAWING_MAX_CHARS,
+            'sheet_ids': sheet_ids,
+            'is_mech_sheet': len(m_ids) > 0 and len(non_m_ids) == 0,
+            'hvac_strong': p['hvac'],
+        })
+    return out
+
+
+if __name__ == '__main__':
+    # Worker entry point used by _scan_in_subprocess
+    if len(sys.argv) != 5 or sys.argv[1] != 'scan':
+        print('usage: python3 plan_index.py scan <pdf> <start> <stop>')
+        raise SystemExit(2)
+    pages = _scan_range(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    sys.stdout.write('\n' + json.dumps(pages, separators=(',', ':')) + '\n')
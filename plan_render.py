@@ -0,0 +1,171 @@
+"""
+Page rasterization for plan review, with an on-disk JPEG cache.
+
+The review sends up to 25 sheets to the model as JPEGs no larger than
+MAX_PX on a side. Each page is rendered once, at a zoom computed up front
+from the page rect: BASE_ZOOM (144 DPI), reduced so the longer side fits
+MAX_PX. It used to be rendered at 2x and then again at a smaller zoom
+whenever the first render came out too large.
+
+Rendered JPEGs are cached under data/plan_renders/<file hash>/ as
+p<page>_<dpi>dpi.jpg. A re-review of the same file therefore skips rendering
+entirely. Pages not yet cached are rendered in parallel by a few
+`python plan_render.py render` subprocesses (the same approach as
+plan_index). Small batches and single-core hosts render inline. Cache
+directories unused for RENDER_CACHE_DAYS are pruned.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RENDER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'plan_renders')
+
+MAX_PX = 1999
+BASE_ZOOM = 2.0
+PARALLEL_MIN_PAGES = 4
+MAX_PROCESSES = min(4, os.cpu_count() or 1)
+SUBPROCESS_TIMEOUT = 600
+RENDER_CACHE_DAYS = 30
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+
+def page_zoom(rect, max_px=MAX_PX, base_zoom=BASE_ZOOM):
+    """Zoom for a page rect: base_zoom, lowered so neither side exceeds max_px pixels."""
+    longest = max(rect.width, rect.height, 1)
+    # A hair under the exact ratio so MuPDF's rounding cannot land on max_px + 1
+    return min(base_zoom, (max_px - 0.01) / longest)
+
+
+def _cache_path(cache_dir, page_num, zoom):
+    return os.path.join(cache_dir, f'p{page_num}_{72 * zoom:.2f}dpi.jpg')
+
+
+def _render_range(fpath, cache_dir, page_nums, max_px=MAX_PX):
+    """Render 1-based page_nums of fpath into cache_dir. Returns {page_num: path}; failed pages are skipped."""
+    import fitz
+    os.makedirs(cache_dir, exist_ok=True)
+    out = {}
+    doc = fitz.open(fpath)
+    try:
+        for num in page_nums:
+            try:
+                page = doc[num - 1]
+                zoom = page_zoom(page.rect, max_px)
+                path = _cache_path(cache_dir, num, zoom)
+                if not os.path.exists(path):
+                    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+                    tmp = f'{path}.{os.getpid()}.tmp'
+                    with open(tmp, 'wb') as f:
+                        f.write(pix.tobytes('jpeg'))
+                    os.replace(tmp, path)
+                out[num] = path
+            except Exception:
+                continue
+    finally:
+        doc.close()
+    return out
+
+
+def _render_in_subprocess(fpath, cache_dir, page_nums, max_px):
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), 'render', fpath, cache_dir, str(max_px),
+         ','.join(str(n) for n in page_nums)],
+        capture_output=True, check=True, timeout=SUBPROCESS_TIMEOUT)
+    # Last line only: PyMuPDF may print warnings to stdout before the result
+    return {int(k): v for k, v in json.loads(out.stdout.decode().rstrip('\n').rsplit('\n', 1)[-1]).items()}
+
+
+def render_pages(fpath, file_hash, page_nums, max_px=MAX_PX, progress=None):
+    """JPEG bytes for each 1-based page in page_nums: {page_num: bytes}.
+
+    Cached renders are read from disk; the rest are rendered (in parallel when
+    there are enough of them) and cached. progress(done, total) is called as
+    pages finish. Pages that fail to render are left out.
+    """
+    import fitz
+    _maybe_prune()
+    cache_dir = os.path.join(RENDER_DIR, file_hash)
+    doc = fitz.open(fpath)
+    try:
+        targets = {}
+        for num in page_nums:
+            try:
+                targets[num] = _cache_path(cache_dir, num, page_zoom(doc[num - 1].rect, max_px))
+            except Exception:
+                continue
+    finally:
+        doc.close()
+    paths = {num: p for num, p in targets.items() if os.path.exists(p)}
+    todo = [num for num in targets if num not in paths]
+    total = len(page_nums)
+    if progress:
+        progress(len(paths), total)
+    if todo:
+        if len(todo) < PARALLEL_MIN_PAGES or MAX_PROCESSES < 2:
+            for num in todo:
+                paths.update(_render_range(fpath, cache_dir, [num], max_px))
+                if progress:
+                    progress(len(paths), total)
+        else:
+            batches = [todo[i::MAX_PROCESSES] for i in range(min(MAX_PROCESSES, len(todo)))]
+            try:
+                with ThreadPoolExecutor(max_workers=len(batches)) as pool:
+                    for rendered in pool.map(lambda b: _render_in_subprocess(fpath, cache_dir, b, max_px), batches):
+                        paths.update(rendered)
+                        if progress:
+                            progress(len(paths), total)
+            except Exception as e:
+                print(f"Plan render: parallel render failed, rendering inline: {e}")
+                paths.update(_render_range(fpath, cache_dir, [n for n in todo if n not in paths], max_px))
+    try:
+        os.utime(cache_dir)  # mark as recently used for pruning
+    except OSError:
+        pass
+    images = {}
+    for num in page_nums:
+        if num in paths:
+            try:
+                with open(paths[num], 'rb') as f:
+                    images[num] = f.read()
+            except OSError:
+                continue
+    return images
+
+
+def _maybe_prune():
+    """Remove cache directories unused for RENDER_CACHE_DAYS; runs at most hourly."""
+    global _last_prune
+    now = time.time()
+    with _prune_lock:
+        if now - _last_prune < 3600:
+            return
+        _last_prune = now
+    try:
+        names = os.listdir(RENDER_DIR)
+    except FileNotFoundError:
+        return
+    cutoff = now - RENDER_CACHE_DAYS * 86400
+    for name in names:
+        path = os.path.join(RENDER_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            continue
+
+
+if __name__ == '__main__':
+    # Worker entry point used by _render_in_subprocess
+    if len(sys.argv) != 6 or sys.argv[1] != 'render':
+        print('usage: python3 plan_render.py render <pdf> <cache_dir> <max_px> <page,page,...>')
+        raise SystemExit(2)
+    result = _render_range(sys.argv[2], sys.argv[3], [int(n) for n in sys.argv[5].split(',') if n],
+                           int(sys.argv[4]))
+    sys.stdout.write('\n' + json.dumps(result) + '\n')
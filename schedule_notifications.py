@@ -0,0 +1,164 @@
+"""
+Schedule benchmark notifications: due soon, starting soon, overdue, missed start.
+
+The check used to run from /api/heartbeat, once per user per day, on the
+request thread. It ran a job-name query for every open phase and, for every
+(user, phase, kind), a LIKE scan over notifications to see whether that
+notification had already gone out today. The first heartbeat of the day could
+stall for seconds.
+
+It now runs as a sweep on a background thread, every SWEEP_SECONDS:
+
+  * one query reads the open phases that can trigger anything, joined to
+    their job names;
+  * schedule_notification_log, keyed on (user, event, kind, date), records what
+    has been sent. Claiming a key is an INSERT OR IGNORE, so overlapping sweeps
+    (e.g. two web processes) still notify each user once per day;
+  * new notifications are written through notifications.notify_batch in the
+    same transaction as their log rows, and published live.
+
+Log rows older than LOG_RETENTION_DAYS are dropped.
+"""
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database
+
+SWEEP_SECONDS = 15 * 60
+FIRST_SWEEP_DELAY = 30
+LOG_RETENTION_DAYS = 30
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS schedule_notification_log (
+    user_id INTEGER NOT NULL,
+    event_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    notify_date TEXT NOT NULL,
+    PRIMARY KEY (user_id, event_id, kind, notify_date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_schedule_notification_log_date ON schedule_notification_log(notify_date);
+'''
+
+_LEGACY_MESSAGE = re.compile(r'\(event #(\d+)\) (due_soon|start_soon|overdue|missed_start)$')
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def install(conn):
+    conn.executescript(_SCHEMA)
+    # Today's notifications from the old heartbeat check, so they are not sent twice on upgrade
+    if conn.execute('SELECT 1 FROM schedule_notification_log LIMIT 1').fetchone():
+        return
+    today = datetime.now().strftime('%Y-%m-%d')
+    rows = conn.execute(
+        "SELECT user_id, message FROM notifications WHERE type = 'schedule' AND created_at >= ?", (today,)
+    ).fetchall()
+    keys = []
+    for r in rows:
+        m = _LEGACY_MESSAGE.search(r['message'] or '')
+        if m:
+            keys.append((r['user_id'], int(m.group(1)), m.group(2), today))
+    conn.executemany('INSERT OR IGNORE INTO schedule_notification_log VALUES (?,?,?,?)', keys)
+
+
+def _parse(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (ValueError, TypeError):
+        return None
+
+
+def _candidates(events, owner_ids, now):
+    """(user_ids, kind, title, message, event) for every notification the phases call for right now."""
+    today = now.date()
+    out = []
+    for e in events:
+        assigned = e['assigned_to']
+        escalate = list(owner_ids) + ([assigned] if assigned else [])
+        name = f'{e["phase_name"]} on {e["job_name"]}'
+        end_dt = _parse(e['end_date']) if e['end_date'] else None
+        start_dt = _parse(e['start_date']) if e['start_date'] else None
+
+        if end_dt and assigned and now <= end_dt <= now + timedelta(hours=24):
+            out.append(([assigned], 'due_soon', 'Schedule: Due Soon',
+                        f'{name} due {e["end_date"]} (event #{e["id"]}) due_soon', e))
+        if start_dt and assigned and e['status'] == 'Pending' and now <= start_dt <= now + timedelta(hours=48):
+            out.append(([assigned], 'start_soon', 'Schedule: Starting Soon',
+                        f'{name} starts in 2 days (event #{e["id"]}) start_soon', e))
+        if end_dt and e['status'] == 'In Progress' and today > end_dt.date():
+            out.append((escalate, 'overdue', 'Schedule: Phase Overdue',
+                        f'{name} is overdue (was due {e["end_date"]}) (event #{e["id"]}) overdue', e))
+        if start_dt and e['status'] == 'Pending' and today > start_dt.date():
+            out.append((escalate, 'missed_start', 'Schedule: Missed Start',
+                        f'{name} was scheduled to start {e["start_date"]} but hasn\'t begun '
+                        f'(event #{e["id"]}) missed_start', e))
+    return out
+
+
+def sweep(conn=None, now=None):
+    """Send every schedule notification that is due and not yet sent today. Returns the number sent."""
+    import notifications  # imports database; loaded lazily since database installs this module
+    now = now or datetime.now()
+    today_str = now.strftime('%Y-%m-%d')
+    # Phases that start or end after this have nothing to report yet
+    horizon = (now + timedelta(days=3)).strftime('%Y-%m-%d')
+    own = conn is None
+    if own:
+        conn = database.get_db()
+    try:
+        owner_ids = [r['id'] for r in conn.execute("SELECT id FROM users WHERE role = 'owner'").fetchall()]
+        events = conn.execute(
+            '''SELECT e.id, e.job_id, e.phase_name, e.start_date, e.end_date, e.status, e.assigned_to,
+                      COALESCE(j.name, 'Job #' || e.job_id) AS job_name
+               FROM job_schedule_events e LEFT JOIN jobs j ON j.id = e.job_id
+               WHERE e.status NOT IN ('Complete','Cancelled')
+                 AND ((e.end_date IS NOT NULL AND e.end_date != '' AND e.end_date <= ?)
+                      OR (e.start_date IS NOT NULL AND e.start_date != '' AND e.start_date <= ?))''',
+            (horizon, horizon)
+        ).fetchall()
+
+        entries = []
+        for user_ids, kind, title, message, e in _candidates(events, owner_ids, now):
+            fresh = []
+            for uid in dict.fromkeys(user_ids):
+                cur = conn.execute('INSERT OR IGNORE INTO schedule_notification_log VALUES (?,?,?,?)',
+                                   (uid, e['id'], kind, today_str))
+                if cur.rowcount:
+                    fresh.append(uid)
+            if fresh:
+                entries.append((fresh, 'schedule', title, message, f'/schedule/job/{e["job_id"]}', None))
+
+        cutoff = (now - timedelta(days=LOG_RETENTION_DAYS)).strftime('%Y-%m-%d')
+        conn.execute('DELETE FROM schedule_notification_log WHERE notify_date < ?', (cutoff,))
+        sent = notifications.notify_batch(entries, conn=conn) if entries else 0
+        conn.commit()
+        return sent
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own:
+            conn.close()
+
+
+def _sweep_loop():
+    time.sleep(FIRST_SWEEP_DELAY)
+    while True:
+        try:
+            sweep()
+        except Exception as e:
+            print(f"Schedule notifications: sweep failed: {e}")
+        time.sleep(SWEEP_SECONDS)
+
+
+def start():
+    """Start this process's sweep thread (idempotent)."""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_sweep_loop, name='schedule-notifications', daemon=True).start()
@@ -0,0 +1,223 @@
+"""
+Scheduling core for backwards planning (/api/schedule/backwards-plan).
+
+  * WorkCalendar answers work-day questions (weekdays minus weather-risk
+    days) in O(log n): weekdays come from closed-form week arithmetic,
+    blocked days from bisecting a sorted list, and walking back N work days
+    is a binary search over the date range instead of a day-by-day loop.
+  * phase_graph() builds successor and predecessor maps once, so ordering
+    the phases leaf-first is linear rather than a scan of every phase for
+    every dequeued node.
+  * auto_crew() binary-searches the smallest crew whose phases fit the
+    window; days-at-crew only shrinks as the crew grows.
+  * plan_backwards() schedules each phase to end just before its
+    successors start, counting back from the deadline.
+
+Everything is pure Python over plain dicts, so benchmarks and callers can use
+it without the web app. benchmarks/bench_scheduling.py compares it with the
+previous per-day loops.
+"""
+import math
+from bisect import bisect_left, bisect_right
+from collections import deque
+from datetime import date, timedelta
+
+MAX_AUTO_CREW = 50
+
+
+def _weekdays_before(ordinal):
+    """Weekdays (Mon-Fri) in [date ordinal 1, ordinal). Ordinal 1 (0001-01-01) is a Monday."""
+    weeks, rem = divmod(ordinal - 1, 7)
+    return weeks * 5 + min(rem, 5)
+
+
+class WorkCalendar:
+    """Weekdays minus a set of blocked (weather-risk) dates."""
+
+    def __init__(self, blocked_dates=()):
+        self.blocked = sorted({d.toordinal() for d in blocked_dates if d.weekday() < 5})
+
+    def is_work_day(self, d):
+        if d.weekday() >= 5:
+            return False
+        o = d.toordinal()
+        i = bisect_left(self.blocked, o)
+        return not (i < len(self.blocked) and self.blocked[i] == o)
+
+    def business_days(self, start_d, end_d):
+        """Weekdays in [start_d, end_d], ignoring weather."""
+        if end_d < start_d:
+            return 0
+        return _weekdays_before(end_d.toordinal() + 1) - _weekdays_before(start_d.toordinal())
+
+    def blocked_days(self, start_d, end_d):
+        """Blocked weekdays in [start_d, end_d]."""
+        if end_d < start_d:
+            return 0
+        return bisect_right(self.blocked, end_d.toordinal()) - bisect_left(self.blocked, start_d.toordinal())
+
+    def work_days(self, start_d, end_d, skip_weather=True):
+        """Work days in [start_d, end_d] (inclusive)."""
+        n = self.business_days(start_d, end_d)
+        return n - self.blocked_days(start_d, end_d) if skip_weather else n
+
+    def nth_work_day_back(self, end_d, n):
+        """The date s <= end_d such that [s, end_d] holds exactly n work days and s is one of them."""
+        # Far enough back to hold n work days even if every blocked day falls in between
+        span = ((n + len(self.blocked)) // 5 + 2) * 7
+        lo, hi = end_d.toordinal() - span, end_d.toordinal()
+        # Largest s with work_days(s, end_d) >= n; work_days only falls as s moves later
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.work_days(date.fromordinal(mid), end_d) >= n:
+                lo = mid
+            else:
+                hi = mid - 1
+        return date.fromordinal(lo)
+
+    def walk_back(self, end_d, work_days_needed):
+        """(start, end) of a block of work_days_needed work days ending on or before end_d."""
+        last = self.nth_work_day_back(end_d, 1)
+        return self.nth_work_day_back(last, max(1, work_days_needed)), last
+
+
+def phase_graph(phases):
+    """(successors, predecessors) maps of phase id -> [phase ids].
+
+    Explicit depends_on links are used when any phase has one; otherwise the
+    phases are chained in list order. Predecessor lists keep list order.
+    """
+    by_id = {p['id']: p for p in phases}
+    successors = {p['id']: [] for p in phases}
+    predecessors = {p['id']: [] for p in phases}
+    if any(p.get('depends_on') and p['depends_on'] in by_id for p in phases):
+        for p in phases:
+            dep = p.get('depends_on')
+            if dep and dep in by_id:
+                successors[dep].append(p['id'])
+                predecessors[p['id']].append(dep)
+    else:
+        for a, b in zip(phases, phases[1:]):
+            successors[a['id']].append(b['id'])
+            predecessors[b['id']].append(a['id'])
+    return successors, predecessors
+
+
+def backward_order(phases, successors, predecessors):
+    """Phase ids leaf-first: a phase comes after everything that depends on it.
+
+    Phases on a cycle are appended at the end in list order.
+    """
+    remaining = {pid: len(s) for pid, s in successors.items()}
+    queue = deque(pid for pid, n in remaining.items() if n == 0)
+    order, seen = [], set()
+    while queue:
+        pid = queue.popleft()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        order.append(pid)
+        for pred in predecessors[pid]:
+            remaining[pred] -= 1
+            if remaining[pred] == 0:
+                queue.append(pred)
+    order.extend(p['id'] for p in phases if p['id'] not in seen)
+    return order
+
+
+def _days_at_crew(hours, crew, hours_per_day):
+    return sum(max(1, math.ceil(h / (crew * hours_per_day))) for h in hours)
+
+
+def auto_crew(hours, avail_days, hours_per_day, max_crew=MAX_AUTO_CREW):
+    """Smallest crew (from the man-hour lower bound, capped at max_crew) whose
+    phases, run back to back at whole days each, fit in avail_days."""
+    total = sum(hours)
+    if avail_days <= 0 or total <= 0:
+        return max(1, math.ceil(total / hours_per_day)) if total > 0 else 1
+    lo = max(1, math.ceil(total / (avail_days * hours_per_day)))
+    if lo >= max_crew or _days_at_crew(hours, lo, hours_per_day) <= avail_days:
+        return lo
+    hi = max_crew
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _days_at_crew(hours, mid, hours_per_day) <= avail_days:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def plan_backwards(phases, deadline, today, calendar, hours_per_day, crew_override=None):
+    """Schedule phases backwards from deadline.
+
+    phases: dicts with 'id', '_remaining_hours', '_total_hours' and optional
+    'depends_on', in sort order. Returns a dict with start/end (date per
+    phase id), results (per-phase work_days, crew_needed, remaining_hours,
+    total_hours, weather_risk_days, hours_per_day_needed, warning),
+    successors, order and crew.
+    """
+    successors, predecessors = phase_graph(phases)
+    order = backward_order(phases, successors, predecessors)
+    by_id = {p['id']: p for p in phases}
+
+    if crew_override:
+        crew = crew_override
+    else:
+        active = [p['_remaining_hours'] for p in phases if p['_remaining_hours'] > 0]
+        crew = auto_crew(active, calendar.work_days(today, deadline), hours_per_day)
+
+    start, end, results = {}, {}, {}
+    for pid in order:
+        p = by_id[pid]
+        remaining_hrs = p['_remaining_hours']
+
+        succ_starts = [start[s] for s in successors[pid] if s in start]
+        if succ_starts:
+            boundary_end = min(succ_starts) - timedelta(days=1)
+            while boundary_end.weekday() >= 5:
+                boundary_end -= timedelta(days=1)
+        else:
+            boundary_end = deadline
+
+        if remaining_hrs <= 0:
+            # Already done: takes no calendar time, upstream phases end at the same boundary
+            start[pid] = end[pid] = boundary_end
+            results[pid] = {
+                'work_days': 0, 'crew_needed': 0, 'remaining_hours': 0,
+                'total_hours': p['_total_hours'],
+                'weather_risk_days': 0, 'hours_per_day_needed': 0,
+                'warning': 'Complete',
+            }
+            continue
+
+        avail_work_days = calendar.work_days(today, boundary_end)
+        work_days_needed = max(1, math.ceil(remaining_hrs / (crew * hours_per_day)))
+        hrs_per_day_needed = hours_per_day
+        warning = None
+        if work_days_needed > avail_work_days:
+            # Can't fit: stretch the hours per day instead
+            if avail_work_days > 0:
+                hrs_per_day_needed = round(remaining_hrs / (crew * avail_work_days), 1)
+                work_days_needed = avail_work_days
+                if hrs_per_day_needed > 14:
+                    warning = f'Requires {hrs_per_day_needed}hr days — consider more crew or extending deadline'
+                else:
+                    warning = f'Extended to {hrs_per_day_needed}hr days to meet deadline'
+            else:
+                warning = 'No available work days before deadline'
+                work_days_needed = 1
+
+        start[pid], end[pid] = calendar.walk_back(boundary_end, work_days_needed)
+        results[pid] = {
+            'work_days': work_days_needed,
+            'crew_needed': crew,
+            'remaining_hours': remaining_hrs,
+            'total_hours': p['_total_hours'],
+            'weather_risk_days': calendar.blocked_days(start[pid], end[pid]),
+            'hours_per_day_needed': hrs_per_day_needed,
+            'warning': warning,
+        }
+
+    return {'start': start, 'end': end, 'results': results,
+            'successors': successors, 'order': order, 'crew': crew}
@@ -0,0 +1,247 @@
+"""
+FTS5 search over code book sections, how-to articles and equipment manuals.
+
+Each corpus has an external-content FTS5 table (the text lives only in the
+source table) kept in sync by AFTER INSERT/UPDATE/DELETE triggers:
+
+    code_sections_fts      section_number, title, content
+    howto_articles_fts     title, category, tags, content
+    equipment_manuals_fts  manufacturer, model_number, title, tags
+
+Searches replace the old LIKE '%q%' scans. Results are ranked by BM25 with
+per-column weights, so a hit in a section number or title outranks one deep in
+the body. Every word of the query must match, and the last word of each term
+matches as a prefix, so results show up while the user is still typing.
+snippet() gives an HTML-escaped excerpt with the matches wrapped in <mark>.
+
+The tokenizer keeps a model number such as ML180UH as one token, so "180"
+would not find it. search_manuals() therefore adds manuals whose
+manufacturer + model number contain every word of the query (LIKE, after the
+FTS hits); the table is small enough for the scan.
+
+search() merges all three corpora for /api/search/knowledge. BM25 scores are
+not comparable between FTS tables, so results are interleaved by their rank
+within their own corpus. The corpus-specific helpers keep the row shapes the
+older endpoints and chatbot handlers return.
+"""
+import html
+import re
+from collections import Counter
+
+# Column weights for bm25(), in FTS column order
+_CODE_WEIGHTS = (10.0, 5.0, 1.0)
+_HOWTO_WEIGHTS = (5.0, 2.0, 3.0, 1.0)
+_MANUAL_WEIGHTS = (3.0, 5.0, 2.0, 2.0)
+
+# Snippet markers, swapped for <mark> after the excerpt is HTML-escaped
+_OPEN, _CLOSE = '\x02', '\x03'
+SNIPPET_TOKENS = 16
+
+# A query needs a word at least this long before manuals are scanned for partial model numbers
+PARTIAL_MIN_CHARS = 3
+
+_INDEXES = {
+    # fts table: (source table, columns)
+    'code_sections_fts': ('code_sections', ('section_number', 'title', 'content')),
+    'howto_articles_fts': ('howto_articles', ('title', 'category', 'tags', 'content')),
+    'equipment_manuals_fts': ('equipment_manuals', ('manufacturer', 'model_number', 'title', 'tags')),
+}
+
+KINDS = ('code', 'howto', 'manual')
+
+
+def install(conn):
+    """Create the FTS tables and sync triggers; a newly created index is filled from its source table."""
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()}
+    for fts, (src, cols) in _INDEXES.items():
+        col_list = ', '.join(cols)
+        new = ', '.join(f'new.{c}' for c in cols)
+        old = ', '.join(f'old.{c}' for c in cols)
+        conn.executescript(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {col_list}, content='{src}', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            );
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {src} BEGIN
+                INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {src} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {col_list} ON {src} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old});
+                INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new});
+            END;
+        ''')
+        if fts not in existing:
+            conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def rebuild(conn):
+    """Re-index every corpus from its source table (e.g. after a bulk load with triggers dropped)."""
+    for fts in _INDEXES:
+        conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    conn.commit()
+
+
+def match_query(text):
+    """FTS5 MATCH expression for free text, or None if it has no searchable words.
+
+    Each whitespace-separated term becomes a quoted phrase of its word tokens
+    with a prefix match on the last one: 'R302.1 fire' -> "r302 1"* "fire"*.
+    """
+    phrases = []
+    for term in (text or '').split():
+        tokens = re.findall(r'\w+', term.lower())
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '"*')
+    return ' '.join(phrases) or None
+
+
+def _snippet_sql(fts):
+    return f"snippet({fts}, -1, '{_OPEN}', '{_CLOSE}', '…', {SNIPPET_TOKENS})"
+
+
+def _bm25_sql(fts, weights):
+    return f"bm25({fts}, {', '.join(str(w) for w in weights)})"
+
+
+def highlight(snippet):
+    """HTML-escape a raw snippet and turn its match markers into <mark> tags."""
+    return html.escape(snippet or '').replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def _rows(conn, sql, params):
+    out = []
+    for r in conn.execute(sql, params).fetchall():
+        d = dict(r)
+        d['snippet'] = highlight(d.get('snippet'))
+        out.append(d)
+    return out
+
+
+# ─── Per-corpus searches ────────────────────────────────────────
+
+def search_code(conn, q, book_id=None, limit=50):
+    """Code sections matching q, best first: code_sections columns plus book_code, book_name, snippet, score."""
+    query = match_query(q)
+    if not query:
+        return []
+    where, params = '', [query]
+    if book_id:
+        where = ' AND cs.book_id = ?'
+        params.append(book_id)
+    params.append(limit)
+    return _rows(conn, f'''
+        SELECT cs.*, cb.code AS book_code, cb.name AS book_name,
+               {_snippet_sql('code_sections_fts')} AS snippet,
+               {_bm25_sql('code_sections_fts', _CODE_WEIGHTS)} AS score
+        FROM code_sections_fts
+        JOIN code_sections cs ON cs.id = code_sections_fts.rowid
+        JOIN code_books cb ON cb.id = cs.book_id
+        WHERE code_sections_fts MATCH ?{where}
+        ORDER BY score LIMIT ?''', params)
+
+
+def search_howtos(conn, q, limit=50):
+    """How-to articles matching q, best first: id, title, category, tags, updated_at, snippet, score."""
+    query = match_query(q)
+    if not query:
+        return []
+    return _rows(conn, f'''
+        SELECT h.id, h.title, h.category, h.tags, h.updated_at,
+               {_snippet_sql('howto_articles_fts')} AS snippet,
+               {_bm25_sql('howto_articles_fts', _HOWTO_WEIGHTS)} AS score
+        FROM howto_articles_fts JOIN howto_articles h ON h.id = howto_articles_fts.rowid
+        WHERE howto_articles_fts MATCH ?
+        ORDER BY score LIMIT ?''', (query, limit))
+
+
+def search_manuals(conn, q, manufacturer=None, brand=None, equipment_type=None, limit=500):
+    """Equipment manuals matching q and the optional exact filters, best first: all columns plus snippet, score.
+
+    Partial model-number matches (score 0) follow the full-text hits.
+    """
+    query = match_query(q)
+    if not query:
+        return []
+    where, filters = '', []
+    for col, val in (('manufacturer', manufacturer), ('brand', brand), ('equipment_type', equipment_type)):
+        if val:
+            where += f' AND m.{col} = ?'
+            filters.append(val)
+    rows = _rows(conn, f'''
+        SELECT m.*, {_snippet_sql('equipment_manuals_fts')} AS snippet,
+               {_bm25_sql('equipment_manuals_fts', _MANUAL_WEIGHTS)} AS score
+        FROM equipment_manuals_fts JOIN equipment_manuals m ON m.id = equipment_manuals_fts.rowid
+        WHERE equipment_manuals_fts MATCH ?{where}
+        ORDER BY score LIMIT ?''', [query, *filters, limit])
+    if len(rows) < limit:
+        rows += _partial_model_matches(conn, q, where, filters, {r['id'] for r in rows}, limit - len(rows))
+    return rows
+
+
+def _partial_model_matches(conn, q, where, filters, seen, limit):
+    """Manuals whose manufacturer + model number contain every word of q, minus the ids in seen."""
+    words = re.findall(r'\w+', q.lower())
+    if not any(len(w) >= PARTIAL_MIN_CHARS for w in words):
+        return []
+    like = ' AND '.join(["(m.manufacturer || ' ' || m.model_number) LIKE ? ESCAPE '\\'"] * len(words))
+    params = ['%' + re.sub(r'([\\%_])', r'\\\1', w) + '%' for w in words]
+    marks = re.compile('|'.join(re.escape(w) for w in sorted(words, key=len, reverse=True)), re.IGNORECASE)
+    out = []
+    for r in conn.execute(f'''
+            SELECT m.* FROM equipment_manuals m WHERE {like}{where}
+            ORDER BY m.manufacturer, m.model_number''', [*params, *filters]).fetchall():
+        if r['id'] in seen:
+            continue
+        d = dict(r)
+        label = f"{d['manufacturer']} {d['model_number']}".strip()
+        d['snippet'] = highlight(marks.sub(lambda mo: _OPEN + mo.group(0) + _CLOSE, label))
+        d['score'] = 0.0
+        out.append(d)
+        if len(out) >= limit:
+            break
+    return out
+
+
+# ─── Unified search ─────────────────────────────────────────────
+
+def search(conn, q, kinds=KINDS, limit=30, book_id=None):
+    """Search several corpora at once.
+
+    Returns up to limit dicts {type, id, title, subtitle, snippet, link, score}.
+    Each corpus's results stay in their BM25 order and the corpora are
+    interleaved by rank: every corpus's best hit, then every second-best, and
+    so on, with the lower score first within a rank.
+    """
+    results = []
+    if 'code' in kinds:
+        for r in search_code(conn, q, book_id=book_id, limit=limit):
+            results.append({
+                'type': 'code', 'id': r['id'],
+                'title': f"{r['section_number']} {r['title']}".strip(),
+                'subtitle': f"{r['book_code']} — {r['book_name']}",
+                'snippet': r['snippet'], 'link': f"/codebooks/{r['book_id']}", 'score': r['score'],
+            })
+    if 'howto' in kinds:
+        for r in search_howtos(conn, q, limit=limit):
+            results.append({
+                'type': 'howto', 'id': r['id'], 'title': r['title'], 'subtitle': r['category'] or '',
+                'snippet': r['snippet'], 'link': f"/howtos/{r['id']}", 'score': r['score'],
+            })
+    if 'manual' in kinds:
+        for r in search_manuals(conn, q, limit=limit):
+            link = f"/api/manuals/{r['id']}/file" if r['file_path'] else (r['external_url'] or '/manuals')
+            results.append({
+                'type': 'manual', 'id': r['id'],
+                'title': f"{r['manufacturer']} {r['model_number']}".strip(),
+                'subtitle': r['title'] or r['manual_type'] or '',
+                'snippet': r['snippet'], 'link': link, 'score': r['score'],
+            })
+    rank_of, seen = {}, Counter()
+    for r in results:
+        rank_of[id(r)] = seen[r['type']]
+        seen[r['type']] += 1
+    results.sort(key=lambda r: (rank_of[id(r)], r['score']))
+    return results[:limit]
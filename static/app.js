@@ -1,53 +1,185 @@
-/* ─── Notification Polling ──────────────────────────────────── */
+/* ─── Live Events (SSE with polling fallback) ─────────────── */
+window.LiveEvents = (function() {
+    const handlers = {};
+    const fallbacks = [];
+    let source = null;
+    let live = false;
+
+    // Poll once right away, then every f.ms, so badges are not left empty until the first tick
+    function startPolling(f) {
+        f.fn();
+        f.timer = setInterval(f.fn, f.ms);
+    }
+
+    function startFallbacks() {
+        fallbacks.forEach(f => {
+            if (!f.timer) startPolling(f);
+        });
+    }
+
+    function stopFallbacks() {
+        fallbacks.forEach(f => {
+            if (f.timer) { clearInterval(f.timer); f.timer = null; }
+        });
+    }
+
+    function listen(type) {
+        source.addEventListener(type, function(e) {
+            let data = {};
+            try { data = JSON.parse(e.data); } catch(err) { /* ignore */ }
+            (handlers[type] || []).forEach(fn => fn(data));
+        });
+    }
+
+    function connect() {
+        if (!window.EventSource) { startFallbacks(); return; }
+        source = new EventSource('/api/events/stream');
+        Object.keys(handlers).forEach(listen);
+        source.onopen = function() {
+            live = true;
+            stopFallbacks();
+        };
+        source.onerror = function() {
+            live = false;
+            startFallbacks();
+            // Refused (over capacity, logged out): the browser gives up, so retry later
+            if (source.readyState === EventSource.CLOSED) {
+                source = null;
+                setTimeout(connect, 60000);
+            }
+        };
+    }
+
+    return {
+        // Subscribe to a server event type ('hello', 'notification', 'tc_message', 'tc_unread')
+        on: function(type, fn) {
+            if (!handlers[type]) {
+                handlers[type] = [];
+                if (source) listen(type);
+            }
+            handlers[type].push(fn);
+        },
+        // Poll with fn every ms while the live stream is unavailable
+        fallback: function(fn, ms) {
+            const f = { fn: fn, ms: ms, timer: null };
+            fallbacks.push(f);
+            if (source && !live) startPolling(f);
+        },
+        isLive: function() { return live; },
+        connect: function() { if (!source) connect(); }
+    };
+})();
+
+/* ─── Notification Badge ──────────────────────────────────── */
 (function() {
+    let unread = 0;
+
+    function renderBadge() {
+        const badge = document.getElementById('notifBadge');
+        if (!badge) return;
+        if (unread > 0) {
+            badge.textContent = unread > 99 ? '99+' : unread;
+            badge.style.display = 'flex';
+        } else {
+            badge.style.display = 'none';
+        }
+    }
+
     async function pollNotifications() {
         try {
             const res = await fetch('/api/notifications/unread-count');
             if (!res.ok) return;
             const data = await res.json();
-            const badge = document.getElementById('notifBadge');
-            if (badge) {
-                if (data.count > 0) {
-                    badge.textContent = data.count > 99 ? '99+' : data.count;
-                    badge.style.display = 'flex';
-                } else {
-                    badge.style.display = 'none';
-                }
-            }
+            unread = data.count;
+            renderBadge();
         } catch (e) { /* ignore */ }
     }
 
-    // Poll every 60 seconds, plus on page load
     if (document.getElementById('notifBadge')) {
-        pollNotifications();
-        setInterval(pollNotifications, 60000);
+        LiveEvents.on('hello', function(data) {
+            unread = data.notifications || 0;
+            renderBadge();
+        });
+        LiveEvents.on('notification', function(data) {
+            unread = data.count !== undefined ? data.count : Math.max(0, unread + (data.delta || 0));
+            renderBadge();
+        });
+        // Poll every 60 seconds when the live stream is unavailable
+        LiveEvents.fallback(pollNotifications, 60000);
     }
 })();
 
-/* ─── Team Chat Sidebar Badge Polling ──────────────────────── */
+/* ─── Team Chat Sidebar Badge ─────────────────────────────── */
 (function() {
+    let unread = 0;
+
+    function renderBadge() {
+        const badge = document.getElementById('tcSidebarBadge');
+        if (!badge) return;
+        if (unread > 0) {
+            badge.textContent = unread > 99 ? '99+' : unread;
+            badge.style.display = 'inline-flex';
+        } else {
+            badge.style.display = 'none';
+        }
+    }
+
     async function pollTCUnread() {
         try {
             const res = await fetch('/api/team-chat/unread-total');
             if (!res.ok) return;
             const data = await res.json();
-            const badge = document.getElementById('tcSidebarBadge');
-            if (badge) {
-                if (data.total > 0) {
-                    badge.textContent = data.total > 99 ? '99+' : data.total;
-                    badge.style.display = 'inline-flex';
-                } else {
-                    badge.style.display = 'none';
-                }
-            }
+            unread = data.total;
+            renderBadge();
         } catch(e) { /* ignore */ }
     }
+
     if (document.getElementById('tcSidebarBadge')) {
-        pollTCUnread();
-        setInterval(pollTCUnread, 30000);
+        LiveEvents.on('hello', function(data) {
+            unread = data.tc_unread || 0;
+            renderBadge();
+        });
+        LiveEvents.on('tc_message', function(data) {
+            unread += data.unread_delta || 0;
+            renderBadge();
+        });
+        LiveEvents.on('tc_unread', function(data) {
+            unread = data.total || 0;
+            renderBadge();
+        });
+        LiveEvents.fallback(pollTCUnread, 30000);
     }
 })();
 
+/* ─── Background Jobs ─────────────────────────────────────── */
+// Poll /api/background-jobs/<id> until the job finishes. Resolves with the
+// job's result, rejects with the job's error (or 'Cancelled').
+window.waitForBackgroundJob = function(jobId, onProgress, intervalMs) {
+    return new Promise(function(resolve, reject) {
+        async function tick() {
+            try {
+                const res = await fetch('/api/background-jobs/' + jobId);
+                const job = await res.json();
+                if (!res.ok) return reject(new Error(job.error || 'Job not found'));
+                if (onProgress) onProgress(job);
+                if (!job.done) return setTimeout(tick, intervalMs || 1000);
+                if (job.status === 'done') resolve(job.result);
+                else reject(new Error(job.error || 'Job ' + job.status));
+            } catch (e) {
+                reject(e);
+            }
+        }
+        tick();
+    });
+};
+
+// Connect once every script on the page has registered its handlers
+document.addEventListener('DOMContentLoaded', function() {
+    if (document.getElementById('notifBadge') || document.getElementById('tcSidebarBadge')) {
+        LiveEvents.connect();
+    }
+});
+
 async function toggleNotifPanel(e) {
     if (e) e.stopPropagation();
     const panel = document.getElementById('notifPanel');
@@ -69,6 +69,18 @@ async function exportToPDF(title, tableId, filename) {
         body: JSON.stringify({ title, headers, rows, filename })
     });
     if (!res.ok) { alert('Export failed.'); return; }
+    if (res.status === 202) {
+        // Large export rendered in the background: wait for the job, then download
+        const job = await res.json();
+        try {
+            await waitForBackgroundJob(job.job_id);
+        } catch (e) {
+            alert('Export failed: ' + e.message);
+            return;
+        }
+        window.location.href = job.path;
+        return;
+    }
     const blob = await res.blob();
     const url = URL.createObjectURL(blob);
     const a = document.createElement('a');
@@ -708,6 +708,11 @@ async function generatePayAppPDF() {
         // Generate PDF
         const res = await fetch('/api/payapps/applications/' + PA_APP_ID + '/generate-pdf', { method: 'POST' });
         const data = await res.json();
+        if (data.job_id) {
+            // Long pay apps render in the background
+            btn.textContent = 'Rendering PDF...';
+            await waitForBackgroundJob(data.job_id);
+        }
         if (data.ok && data.path) {
             window.open(data.path, '_blank');
             pageToast('PDF generated successfully');
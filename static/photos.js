@@ -110,7 +110,7 @@ function renderGallery() {
     var html = '';
     photosList.forEach(function(p, i) {
         html += '<div class="card" style="padding:0;overflow:hidden;cursor:pointer;position:relative;" onclick="openLightbox(' + i + ')">';
-        html += '<img src="/api/photos/' + p.id + '/file" style="width:100%;height:180px;object-fit:cover;" loading="lazy">';
+        html += '<img src="' + (p.thumb_url || '/api/photos/' + p.id + '/file') + '" style="width:100%;height:180px;object-fit:cover;" loading="lazy">';
         html += '<div style="padding:8px;">';
         html += '<div style="font-size:12px;font-weight:600;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;">' + (p.caption || p.job_name || '') + '</div>';
         html += '<div style="font-size:11px;color:#6B7280;">' + p.category + ' — ' + (p.taken_date || '') + '</div>';
@@ -151,7 +151,7 @@ function renderAlbums() {
         var coverStyle = 'background:#E5E7EB;display:flex;align-items:center;justify-content:center;color:#9CA3AF;font-size:32px;';
         var coverHtml = '<div style="width:100%;height:120px;' + coverStyle + '"><i class="fas fa-folder"></i></div>';
         if (a.cover_photo_id) {
-            coverHtml = '<img src="/api/photos/' + a.cover_photo_id + '/file" style="width:100%;height:120px;object-fit:cover;" loading="lazy">';
+            coverHtml = '<img src="/api/photos/' + a.cover_photo_id + '/file?size=thumb" style="width:100%;height:120px;object-fit:cover;" loading="lazy">';
         }
         html += '<div class="card" style="padding:0;overflow:hidden;cursor:pointer;position:relative;" onclick="openAlbum(' + a.id + ',\'' + a.name.replace(/'/g, "\\'") + '\')">';
         html += coverHtml;
@@ -413,7 +413,7 @@ function deletePhoto(id) {
 function openLightbox(index) {
     lightboxIndex = index;
     var p = photosList[index];
-    document.getElementById('lbImage').src = '/api/photos/' + p.id + '/file';
+    document.getElementById('lbImage').src = p.medium_url || '/api/photos/' + p.id + '/file';
     document.getElementById('lbCaption').textContent = (p.caption || '') + ' — ' + (p.job_name || '') + ' — ' + p.category;
     document.getElementById('lightbox').style.display = 'flex';
 }
@@ -820,13 +820,14 @@ async function submitTakeoffQuestions(e) {
             headers: {'Content-Type': 'application/json'},
             body: JSON.stringify(payload)
         });
-        const result = await res.json();
+        const queued = await res.json();
 
-        if (result.error) {
-            content.innerHTML = `<div style="color:#EF4444;padding:20px;"><strong>Error:</strong> ${escapeHtml(result.error)}</div>`;
+        if (queued.error) {
+            content.innerHTML = `<div style="color:#EF4444;padding:20px;"><strong>Error:</strong> ${escapeHtml(queued.error)}</div>`;
             return;
         }
 
+        const result = await waitForBackgroundJob(queued.job_id);
         currentTakeoff = result;
         renderTakeoffEditor(result);
         loadPlans();
@@ -279,13 +279,16 @@ async function parsePdf() {
     btn.textContent = 'Parsing...';
     try {
         const res = await fetch('/api/supplier-quotes/' + window.QUOTE_ID + '/parse', {method: 'POST'});
-        const data = await res.json();
-        if (data.ok) {
-            pageToast(`Parsed ${data.items_parsed} line items.`);
-            loadQuote();
-        } else {
-            alert(data.error || 'Failed to parse PDF.');
+        const queued = await res.json();
+        if (queued.error) {
+            alert(queued.error);
+            return;
         }
+        const data = await waitForBackgroundJob(queued.job_id, job => {
+            if (job.status === 'running' && job.pct) btn.textContent = `Parsing... ${job.pct}%`;
+        });
+        pageToast(`Parsed ${data.items_parsed} line items.`);
+        loadQuote();
     } catch (e) {
         alert('Error parsing PDF: ' + e.message);
     } finally {
@@ -7,7 +7,7 @@
     let tcDMConversations = [];
     let tcCurrentView = null; // { type: 'channel'|'dm', id: number }
     let tcMessages = [];
-    let tcPollingInterval = null;
+    let tcPollingRegistered = false;
     let tcLastMessageId = 0;
     let tcSelectedFile = null;
     let tcAllUsers = [];
@@ -264,19 +264,36 @@
     }
     window._tcClearFile = clearFileAttachment;
 
-    // ─── Polling ────────────────────────────────────────────
+    // ─── Live Updates ───────────────────────────────────────
+    // New messages arrive over the shared live event stream (app.js);
+    // the 5s poll only runs while that stream is unavailable.
     function startPolling() {
-        stopPolling();
-        tcPollingInterval = setInterval(pollNewMessages, 5000);
+        if (tcPollingRegistered) return;
+        tcPollingRegistered = true;
+        LiveEvents.fallback(pollNewMessages, 5000);
     }
 
-    function stopPolling() {
-        if (tcPollingInterval) {
-            clearInterval(tcPollingInterval);
-            tcPollingInterval = null;
-        }
+    function isCurrentConversation(data) {
+        if (!tcCurrentView) return false;
+        if (tcCurrentView.type === 'channel') return data.channel_id === tcCurrentView.id;
+        return data.dm_peer_id === tcCurrentView.id;
     }
 
+    LiveEvents.on('tc_message', function(data) {
+        if (isCurrentConversation(data)) {
+            pollNewMessages();
+        } else if (data.channel_id) {
+            loadChannels();
+        } else {
+            loadDMConversations();
+        }
+    });
+
+    // (Re)connected: catch up on anything missed while disconnected
+    LiveEvents.on('hello', function() {
+        if (tcCurrentView) pollNewMessages();
+    });
+
     async function pollNewMessages() {
         if (!tcCurrentView) return;
         let url;
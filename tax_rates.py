@@ -1,5 +1,6 @@
 # Tax rate lookup for OK, AR, MO, KS, TX
 # Out-of-state = not Oklahoma → adds $10,000 shipping fee (tax still applies)
+from bisect import bisect_right
 
 # ─── Oklahoma (state 4.5% + local) ────────────────────────────
 OK_RATES = {
@@ -247,13 +248,14 @@ TX_DEFAULT = 8.25
 # KS: 660xx-679xx, 66xxx, 67xxx
 # TX: 75xxx-79xxx, 73301 (Austin)
 
-ZIP_STATE_MAP = {
-    'OK': lambda z: z[:2] in ('73', '74'),
-    'AR': lambda z: z[:2] in ('71', '72'),
-    'MO': lambda z: z[:2] in ('63', '64', '65'),
-    'KS': lambda z: z[:2] in ('66', '67'),
-    'TX': lambda z: z[:2] in ('75', '76', '77', '78', '79'),
-}
+# (state, first 2-digit prefix, last 2-digit prefix), inclusive
+ZIP_STATE_RANGES = (
+    ('OK', '73', '74'),
+    ('AR', '71', '72'),
+    ('MO', '63', '65'),
+    ('KS', '66', '67'),
+    ('TX', '75', '79'),
+)
 
 STATE_RATES = {
     'OK': (OK_RATES, OK_DEFAULT),
@@ -418,6 +420,56 @@ ZIP_CITY_MAP = {
 }
 
 
+# ─── Compiled lookup table ────────────────────────────────────
+# The state ranges, per-ZIP rates and city names are compiled at import into
+# one sorted table of half-open intervals over 5-character ZIP strings:
+# _BOUNDS[i] is where interval i starts and _RESULTS[i] is its answer. A
+# state range is [first prefix, prefix after the last); a ZIP with its own
+# rate or city is the single string [zip, zip + '\0'). Neighbouring
+# intervals with the same answer are merged. lookup_tax() is one bisection.
+
+_UNKNOWN = {'state': '', 'city': '', 'tax_rate': 0, 'out_of_state': True}
+
+
+def _prefix_after(prefix):
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _compile():
+    bounds = set()
+    for _state, first, last in ZIP_STATE_RANGES:
+        bounds.update((first, _prefix_after(last)))
+    points = set(ZIP_CITY_MAP)
+    for rates, _default in STATE_RATES.values():
+        points.update(rates)
+    for z in points:
+        bounds.update((z, z + '\0'))
+
+    def state_of(z):
+        for state, first, last in ZIP_STATE_RANGES:
+            if first <= z[:len(first)] <= last:
+                return state
+        return None
+
+    starts, results = [], []
+    for b in sorted(bounds):
+        state = state_of(b)
+        if state is None:
+            result = _UNKNOWN
+        else:
+            rates, default = STATE_RATES[state]
+            result = {'state': state, 'city': ZIP_CITY_MAP.get(b, ''), 'tax_rate': rates.get(b, default),
+                      'out_of_state': state != 'OK'}
+        if results and results[-1] == result:
+            continue  # same answer as the interval before: merge
+        starts.append(b)
+        results.append(result)
+    return starts, results
+
+
+_BOUNDS, _RESULTS = _compile()
+
+
 def lookup_tax(zip_code):
     """Look up tax info for a zip code.
 
@@ -430,29 +482,20 @@ def lookup_tax(zip_code):
 
     if not zip_code or len(zip_code) < 5:
         return {'state': '', 'city': '', 'tax_rate': 0, 'out_of_state': False}
+    i = bisect_right(_BOUNDS, zip_code) - 1
+    return (_RESULTS[i] if i >= 0 else _UNKNOWN).copy()  # callers may modify the result
+
 
-    # Determine which state this zip belongs to
-    matched_state = None
-    for state_abbr, check_fn in ZIP_STATE_MAP.items():
-        if check_fn(zip_code):
-            matched_state = state_abbr
-            break
+def lookup_tax_many(zip_codes):
+    """lookup_tax() for each zip code, in order; each distinct ZIP is looked up once.
 
-    if matched_state:
-        rates_dict, default_rate = STATE_RATES[matched_state]
-        rate = rates_dict.get(zip_code, default_rate)
-        city = ZIP_CITY_MAP.get(zip_code, '')
-        return {
-            'state': matched_state,
-            'city': city,
-            'tax_rate': rate,
-            'out_of_state': matched_state != 'OK',
-        }
-    else:
-        # Unknown state — still out of state, no known tax rate
-        return {
-            'state': '',
-            'city': '',
-            'tax_rate': 0,
-            'out_of_state': True,
-        }
+    For backfills over many jobs or bids. Returns a list of separate dicts.
+    """
+    seen = {}
+    out = []
+    for zip_code in zip_codes:
+        key = (zip_code or '').strip()[:5]
+        if key not in seen:
+            seen[key] = lookup_tax(key)
+        out.append(seen[key].copy())
+    return out
@@ -0,0 +1,180 @@
+"""
+Per-user team chat unread counters and last-message cache, kept on tc_read_status.
+
+tc_read_status already holds one row per (user, channel) and (user, DM peer).
+This module adds three columns to it:
+  * unread_count     — messages in the conversation after last_read_message_id
+                       (channels count every message, DMs only the peer's)
+  * last_message_id  — newest message in the conversation
+  * last_message     — its content, for the DM conversation list
+
+Triggers keep them current in the same transaction as the write:
+  * a new tc_messages row bumps unread_count / last_message on the existing
+    rows for that conversation, then creates rows for members that have none;
+  * inserting a tc_read_status row, or moving its last_read_message_id,
+    recounts that one row — an index range scan over its unread messages only.
+
+Unread totals, the channel list and the DM list then read O(conversations)
+rows instead of scanning tc_messages. Message deletes are not tracked (the app
+never deletes single messages; deleting a channel cascades its rows away).
+
+install() is called from database.init_db(). To check or repair the counters:
+
+    python3 team_chat_unread.py verify
+    python3 team_chat_unread.py rebuild
+"""
+
+COLUMNS = (
+    ('unread_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('last_message_id', 'INTEGER NOT NULL DEFAULT 0'),
+    ('last_message', "TEXT NOT NULL DEFAULT ''"),
+)
+
+# Unread messages for tc_read_status row {r}
+_UNREAD_EXPR = '''(CASE WHEN {r}.channel_id IS NOT NULL THEN
+    (SELECT COUNT(*) FROM tc_messages m
+     WHERE m.channel_id = {r}.channel_id AND m.id > {r}.last_read_message_id)
+ELSE
+    (SELECT COUNT(*) FROM tc_messages m
+     WHERE m.channel_id IS NULL AND m.dm_recipient_id = {r}.user_id
+       AND m.sender_id = {r}.dm_peer_id AND m.id > {r}.last_read_message_id)
+END)'''
+
+# Newest message id in the conversation of row {r}
+_LAST_ID_EXPR = '''(CASE WHEN {r}.channel_id IS NOT NULL THEN
+    (SELECT MAX(m.id) FROM tc_messages m WHERE m.channel_id = {r}.channel_id)
+ELSE
+    (SELECT MAX(m.id) FROM tc_messages m WHERE m.channel_id IS NULL
+     AND ((m.sender_id = {r}.user_id AND m.dm_recipient_id = {r}.dm_peer_id)
+       OR (m.sender_id = {r}.dm_peer_id AND m.dm_recipient_id = {r}.user_id)))
+END)'''
+
+_CONTENT = "COALESCE(NEW.content, '')"
+
+
+def _trigger_sql():
+    recount = _UNREAD_EXPR.format(r='tc_read_status')
+    return f'''
+CREATE INDEX IF NOT EXISTS idx_tc_messages_dm_pair ON tc_messages(dm_recipient_id, sender_id);
+
+CREATE TRIGGER IF NOT EXISTS trg_tc_unread_rs_ins AFTER INSERT ON tc_read_status BEGIN
+    UPDATE tc_read_status SET unread_count = {recount} WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_tc_unread_rs_upd AFTER UPDATE OF last_read_message_id ON tc_read_status
+WHEN NEW.last_read_message_id IS NOT OLD.last_read_message_id BEGIN
+    UPDATE tc_read_status SET unread_count = {recount} WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_tc_unread_member_ins AFTER INSERT ON tc_channel_members BEGIN
+    INSERT OR IGNORE INTO tc_read_status (user_id, channel_id, last_read_message_id, last_message_id)
+    VALUES (NEW.user_id, NEW.channel_id, 0,
+            COALESCE((SELECT MAX(id) FROM tc_messages WHERE channel_id = NEW.channel_id), 0));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_tc_unread_msg_channel AFTER INSERT ON tc_messages
+WHEN NEW.channel_id IS NOT NULL BEGIN
+    UPDATE tc_read_status
+    SET unread_count = unread_count + 1, last_message_id = NEW.id, last_message = {_CONTENT}
+    WHERE channel_id = NEW.channel_id;
+    INSERT OR IGNORE INTO tc_read_status (user_id, channel_id, last_read_message_id, last_message_id, last_message)
+    SELECT user_id, NEW.channel_id, 0, NEW.id, {_CONTENT} FROM tc_channel_members WHERE channel_id = NEW.channel_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_tc_unread_msg_dm AFTER INSERT ON tc_messages
+WHEN NEW.channel_id IS NULL AND NEW.dm_recipient_id IS NOT NULL BEGIN
+    UPDATE tc_read_status
+    SET unread_count = unread_count + 1, last_message_id = NEW.id, last_message = {_CONTENT}
+    WHERE user_id = NEW.dm_recipient_id AND dm_peer_id = NEW.sender_id;
+    UPDATE tc_read_status SET last_message_id = NEW.id, last_message = {_CONTENT}
+    WHERE user_id = NEW.sender_id AND dm_peer_id = NEW.dm_recipient_id;
+    INSERT OR IGNORE INTO tc_read_status (user_id, dm_peer_id, last_read_message_id, last_message_id, last_message)
+    VALUES (NEW.dm_recipient_id, NEW.sender_id, 0, NEW.id, {_CONTENT}),
+           (NEW.sender_id, NEW.dm_recipient_id, 0, NEW.id, {_CONTENT});
+END;
+'''
+
+
+def install(conn):
+    """Add the counter columns and triggers if missing; backfill when the columns are first added."""
+    existing = {r[1] for r in conn.execute('PRAGMA table_info(tc_read_status)').fetchall()}
+    added = False
+    for col, typedef in COLUMNS:
+        if col not in existing:
+            conn.execute(f'ALTER TABLE tc_read_status ADD COLUMN {col} {typedef}')
+            added = True
+    conn.executescript(_trigger_sql())
+    if added:
+        rebuild(conn)
+
+
+def rebuild(conn):
+    """Create any missing rows and recompute every counter from tc_messages. Returns rows updated."""
+    conn.execute('''INSERT OR IGNORE INTO tc_read_status (user_id, channel_id, last_read_message_id)
+                    SELECT user_id, channel_id, 0 FROM tc_channel_members''')
+    conn.execute('''INSERT OR IGNORE INTO tc_read_status (user_id, dm_peer_id, last_read_message_id)
+                    SELECT DISTINCT sender_id, dm_recipient_id, 0 FROM tc_messages
+                    WHERE channel_id IS NULL AND dm_recipient_id IS NOT NULL
+                    UNION
+                    SELECT DISTINCT dm_recipient_id, sender_id, 0 FROM tc_messages
+                    WHERE channel_id IS NULL AND dm_recipient_id IS NOT NULL''')
+    last_id = _LAST_ID_EXPR.format(r='tc_read_status')
+    cur = conn.execute(f'''UPDATE tc_read_status SET
+        unread_count = {_UNREAD_EXPR.format(r='tc_read_status')},
+        last_message_id = COALESCE({last_id}, 0),
+        last_message = COALESCE((SELECT content FROM tc_messages WHERE id = {last_id}), '')''')
+    return cur.rowcount
+
+
+def verify(conn):
+    """Compare the stored counters against tc_messages.
+
+    Returns a list of {'user_id', 'channel_id', 'dm_peer_id', 'column', 'stored', 'expected'} mismatches.
+    """
+    last_id = _LAST_ID_EXPR.format(r='rs')
+    rows = conn.execute(f'''SELECT rs.user_id, rs.channel_id, rs.dm_peer_id,
+            rs.unread_count, rs.last_message_id,
+            {_UNREAD_EXPR.format(r='rs')} AS expected_unread,
+            COALESCE({last_id}, 0) AS expected_last_id
+        FROM tc_read_status rs''').fetchall()
+    problems = []
+    for r in rows:
+        for col, expected in (('unread_count', r['expected_unread']), ('last_message_id', r['expected_last_id'])):
+            if r[col] != expected:
+                problems.append({'user_id': r['user_id'], 'channel_id': r['channel_id'],
+                                 'dm_peer_id': r['dm_peer_id'], 'column': col,
+                                 'stored': r[col], 'expected': expected})
+    missing = conn.execute('''SELECT cm.user_id, cm.channel_id FROM tc_channel_members cm
+        LEFT JOIN tc_read_status rs ON rs.user_id = cm.user_id AND rs.channel_id = cm.channel_id
+        WHERE rs.id IS NULL''').fetchall()
+    for m in missing:
+        problems.append({'user_id': m['user_id'], 'channel_id': m['channel_id'], 'dm_peer_id': None,
+                         'column': '*', 'stored': None, 'expected': None})
+    return problems
+
+
+if __name__ == '__main__':
+    import sys
+    from database import get_db
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else 'verify'
+    if cmd not in ('verify', 'rebuild'):
+        print('usage: python3 team_chat_unread.py [verify|rebuild]')
+        raise SystemExit(2)
+
+    conn = get_db()
+    try:
+        if cmd == 'rebuild':
+            n = rebuild(conn)
+            conn.commit()
+            print(f'Rebuilt {n} unread counters.')
+        problems = verify(conn)
+        for p in problems[:50]:
+            where = f"channel {p['channel_id']}" if p['channel_id'] is not None else f"dm {p['dm_peer_id']}"
+            print(f"user {p['user_id']} {where}: {p['column']} stored={p['stored']} expected={p['expected']}")
+        if problems:
+            print(f'{len(problems)} mismatches.')
+            raise SystemExit(1)
+        print('Team chat unread counters OK.')
+    finally:
+        conn.close()
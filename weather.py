@@ -0,0 +1,195 @@
+"""
+Cached Open-Meteo geocoding, forecast and archive lookups.
+
+The weather forecast, geocode and backwards-planning endpoints used to call
+Open-Meteo on every request. Responses are now stored in weather_cache,
+keyed by kind, location and date range:
+
+  * forecasts expire after FORECAST_TTL;
+  * archive (historical) data is permanent once the range is older than
+    ARCHIVE_FINAL_DAYS (Open-Meteo backfills the last few days);
+  * geocodes are kept for GEOCODE_TTL, and "no match" for a day.
+
+Concurrent requests for the same key share one HTTP call: the first caller
+fetches, the others wait for its result. If a fetch fails and an expired
+copy is cached, the stale copy is returned rather than nothing.
+
+Fetching goes through a pluggable fetcher(url, timeout) -> parsed JSON, so
+tests and offline development can swap in a stub with set_fetcher().
+"""
+import json
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import date, timedelta
+
+import database
+
+FORECAST_URL = 'https://api.open-meteo.com/v1/forecast'
+ARCHIVE_URL = 'https://archive-api.open-meteo.com/v1/archive'
+GEOCODE_URL = 'https://geocoding-api.open-meteo.com/v1/search'
+
+FORECAST_TTL = 3 * 3600
+GEOCODE_TTL = 90 * 86400
+GEOCODE_MISS_TTL = 86400
+ARCHIVE_RECENT_TTL = 86400
+ARCHIVE_FINAL_DAYS = 7
+
+_UNITS = '&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch&timezone=America/Chicago'
+_FORECAST_DAILY = ('precipitation_probability_max,precipitation_sum,temperature_2m_min,'
+                   'temperature_2m_max,wind_gusts_10m_max,weather_code')
+_ARCHIVE_DAILY = 'precipitation_sum,temperature_2m_min,temperature_2m_max,wind_gusts_10m_max,weather_code'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS weather_cache (
+    cache_key TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_weather_cache_expires ON weather_cache(expires_at);
+'''
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_inflight = {}  # cache_key -> _Flight
+_inflight_lock = threading.Lock()
+_last_prune = 0.0
+
+
+def install(conn):
+    conn.executescript(_SCHEMA)
+
+
+def _http_fetch(url, timeout):
+    req = urllib.request.Request(url, headers={'User-Agent': 'JobTracker/1.0'})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read().decode())
+
+
+_fetcher = _http_fetch
+
+
+def set_fetcher(fn):
+    """Replace the HTTP fetcher (fn(url, timeout) -> parsed JSON); None restores the default. Returns the old one."""
+    global _fetcher
+    old = _fetcher
+    _fetcher = fn or _http_fetch
+    return old
+
+
+# ─── Cache core ─────────────────────────────────────────────────
+
+def _lookup(key):
+    conn = database.get_db()
+    try:
+        return conn.execute('SELECT payload, expires_at FROM weather_cache WHERE cache_key = ?', (key,)).fetchone()
+    finally:
+        conn.close()
+
+
+def _store(key, payload, ttl):
+    global _last_prune
+    now = time.time()
+    conn = database.connect()  # not the request's connection: the commit must not take its writes along
+    try:
+        conn.execute(
+            'INSERT OR REPLACE INTO weather_cache (cache_key, payload, fetched_at, expires_at) VALUES (?,?,?,?)',
+            (key, json.dumps(payload, separators=(',', ':')), now, now + ttl if ttl is not None else None)
+        )
+        if now - _last_prune > 3600:
+            # Expired entries are kept a week as a stale fallback, then dropped
+            conn.execute('DELETE FROM weather_cache WHERE expires_at < ?', (now - 7 * 86400,))
+            _last_prune = now
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _cached_fetch(key, url, ttl, timeout):
+    """Return the parsed response for url, from weather_cache when fresh.
+
+    ttl: seconds, None for permanent, or a function of the response
+    returning either. Raises the fetch error when nothing usable is cached.
+    """
+    row = _lookup(key)
+    if row and (row['expires_at'] is None or row['expires_at'] > time.time()):
+        return json.loads(row['payload'])
+
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _Flight()
+
+    if not leader:
+        flight.done.wait(timeout + 1)
+        if flight.done.is_set() and flight.error is None:
+            return flight.result
+        if row:
+            return json.loads(row['payload'])
+        raise flight.error or TimeoutError(f'weather fetch for {key} timed out')
+
+    try:
+        data = _fetcher(url, timeout)
+        _store(key, data, ttl(data) if callable(ttl) else ttl)
+        flight.result = data
+        return data
+    except Exception as e:
+        flight.error = e
+        if row:
+            return json.loads(row['payload'])
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        flight.done.set()
+
+
+# ─── Lookups ────────────────────────────────────────────────────
+
+def _coords(lat, lng):
+    # ~11 m; the request must use the same rounded values as the cache key,
+    # or a nearby point would be served another point's cached response
+    return round(float(lat), 4), round(float(lng), 4)
+
+
+def forecast_daily(lat, lng, start, end, timeout=10):
+    """Open-Meteo 'daily' forecast block for start..end (dates or YYYY-MM-DD)."""
+    lat, lng = _coords(lat, lng)
+    start, end = str(start), str(end)
+    url = (f'{FORECAST_URL}?latitude={lat}&longitude={lng}&daily={_FORECAST_DAILY}{_UNITS}'
+           f'&start_date={start}&end_date={end}')
+    return _cached_fetch(f'forecast:{lat},{lng}:{start}:{end}', url, FORECAST_TTL, timeout).get('daily', {})
+
+
+def archive_daily(lat, lng, start, end, timeout=10):
+    """Open-Meteo 'daily' archive block for start..end. Permanent once the range is final."""
+    lat, lng = _coords(lat, lng)
+    start, end = str(start), str(end)
+    url = (f'{ARCHIVE_URL}?latitude={lat}&longitude={lng}&daily={_ARCHIVE_DAILY}{_UNITS}'
+           f'&start_date={start}&end_date={end}')
+    final = date.fromisoformat(end) < date.today() - timedelta(days=ARCHIVE_FINAL_DAYS)
+    ttl = None if final else ARCHIVE_RECENT_TTL
+    return _cached_fetch(f'archive:{lat},{lng}:{start}:{end}', url, ttl, timeout).get('daily', {})
+
+
+def geocode(q, timeout=5):
+    """(lat, lng) of the best Open-Meteo match for a place name, or None."""
+    q = ' '.join((q or '').split())
+    if not q:
+        return None
+    url = f'{GEOCODE_URL}?name={urllib.parse.quote(q)}&count=1&language=en&format=json'
+    data = _cached_fetch(f'geocode:{q.lower()}', url,
+                         lambda d: GEOCODE_TTL if d.get('results') else GEOCODE_MISS_TTL, timeout)
+    results = data.get('results') or []
+    if not results:
+        return None
+    return results[0]['latitude'], results[0]['longitude']